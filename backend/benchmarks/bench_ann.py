@@ -0,0 +1,87 @@
+#!/usr/bin/env python3
+"""
+Recall and latency of IVF approximate search against the exact path.
+
+Builds a resident SearchIndex over synthetic clustered line-item vectors
+(unit-normalized, like embeddings), times exact search, trains the IVF
+quantizer, and for a range of nprobe values reports recall@k against the
+exact top-k and the median query latency.
+
+Usage (from backend/):
+    python -m benchmarks.bench_ann --products 100000 --dim 1024 --nprobe 1 4 16 64
+"""
+
+import time
+import argparse
+import numpy as np
+from routes.ann_index import IVFIndex
+from routes.vector_index import SearchIndex
+from routes.embeddings import encode_embedding
+
+
+def clustered_vectors(rng, count: int, dim: int, clusters: int, spread: float, centers=None) -> tuple:
+    if centers is None:
+        centers = rng.normal(size=(clusters, dim))
+    vectors = centers[rng.integers(len(centers), size=count)] + spread * rng.normal(size=(count, dim))
+    return (vectors / np.linalg.norm(vectors, axis=1, keepdims=True)).astype(np.float32), centers
+
+
+def build_index(vectors: np.ndarray, ann: IVFIndex, per_receipt: int = 10) -> SearchIndex:
+    index = SearchIndex(ann=ann)
+    for start in range(0, len(vectors), per_receipt):
+        names = [f"item {i}" for i in range(start, min(start + per_receipt, len(vectors)))]
+        index.add_document({
+            "_id": f"receipt {start}",
+            "structured_data": {"products": {name: {"quantity": 1} for name in names}},
+            "embedding": encode_embedding(vectors[start]),
+            "product_embeddings": [
+                {"product_name": name, "embedding": encode_embedding(vectors[start + j])}
+                for j, name in enumerate(names)
+            ],
+        })
+    return index
+
+
+def run_queries(index: SearchIndex, queries: np.ndarray, k: int):
+    latencies, names = [], []
+    for query in queries:
+        start = time.perf_counter()
+        results, _ = index.search(query, "", k, -1.0)
+        latencies.append(time.perf_counter() - start)
+        names.append({r["product_name"] for r in results})
+    return float(np.median(latencies) * 1000), names
+
+
+def main(args) -> None:
+    rng = np.random.default_rng(0)
+    vectors, centers = clustered_vectors(rng, args.products, args.dim, args.clusters, args.spread)
+    queries, _ = clustered_vectors(rng, args.queries, args.dim, args.clusters, args.spread, centers)
+
+    ann = IVFIndex(nlist=args.nlist or None, min_rows=0)
+    index = build_index(vectors, ann)
+    exact_ms, exact = run_queries(index, queries, args.k)
+    print(f"{index.product_count} products, {args.dim}-dim, {args.queries} queries, k={args.k}")
+    print(f"exact                          {exact_ms:8.2f} ms   recall@{args.k} 1.000")
+
+    start = time.perf_counter()
+    index.train_ann()
+    print(f"IVF training ({ann.list_count} lists): {time.perf_counter() - start:.1f}s\n")
+    for nprobe in args.nprobe:
+        ann.nprobe = nprobe
+        ms, approximate = run_queries(index, queries, args.k)
+        recall = np.mean([len(a & e) / len(e) for a, e in zip(approximate, exact)])
+        print(f"nprobe={nprobe:<4d} ({100 * min(nprobe, ann.list_count) / ann.list_count:5.1f}% of lists) "
+              f"{ms:8.2f} ms   recall@{args.k} {recall:.3f}   {exact_ms / ms:5.1f}x")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--products", type=int, default=100000)
+    parser.add_argument("--dim", type=int, default=1024)
+    parser.add_argument("--clusters", type=int, default=200, help="Clusters in the synthetic data")
+    parser.add_argument("--spread", type=float, default=1.5, help="Noise around cluster centers (1 = center norm)")
+    parser.add_argument("--nlist", type=int, default=0, help="IVF lists (0: sqrt(products))")
+    parser.add_argument("--nprobe", type=int, nargs="+", default=[1, 4, 8, 16, 32, 64])
+    parser.add_argument("--queries", type=int, default=100)
+    parser.add_argument("-k", type=int, default=10)
+    main(parser.parse_args())
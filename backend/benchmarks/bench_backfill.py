@@ -0,0 +1,61 @@
+#!/usr/bin/env python3
+"""
+Embedding backfill throughput: a call per receipt vs packed, concurrent calls.
+
+Fills an in-process BFB.chatbot with --receipts unembedded receipts and
+runs routes.embedding_backfill over it against an embedder that sleeps
+--embed-latency per call and a collection that sleeps --write-latency per
+write:
+- per-receipt: one receipt's texts per call, one call in flight, what
+  re-running the upload path's embedding over each document amounts to
+- batched: --inputs-per-call inputs per call, --concurrency calls in flight
+
+Usage (from backend/):
+    python -m benchmarks.bench_backfill --receipts 2000 --embed-latency 0.2
+"""
+
+import asyncio
+import argparse
+from routes.embedding_backfill import backfill
+from benchmarks.corpus import synthetic_receipts
+from benchmarks.fakes import FakeCollection, SlowEmbedder
+
+
+def unembedded(receipts: int, write_latency: float) -> FakeCollection:
+    collection = FakeCollection(write_latency=write_latency)
+    docs = []
+    for doc in synthetic_receipts(receipts * 5, seed=4):
+        if len(docs) == receipts:
+            break
+        docs.append(doc)
+    collection.insert_many(docs)
+    collection.write_calls = 0
+    return collection
+
+
+async def main(args) -> None:
+    modes = [
+        ("per-receipt", {"inputs_per_call": 1, "concurrency": 1}),
+        ("batched", {"inputs_per_call": args.inputs_per_call, "concurrency": args.concurrency}),
+    ]
+    print(f"{args.receipts:,} receipts, {args.embed_latency * 1000:.0f}ms per embeddings call")
+    print(f"{'mode':<12} {'docs/s':>10} {'seconds':>10} {'calls':>8} {'writes':>8}")
+    for label, options in modes:
+        collection = unembedded(args.receipts, args.write_latency)
+        embedder = SlowEmbedder(args.embed_latency, args.dim)
+        stats = await backfill(collection, embedder, read_batch=args.read_batch, **options)
+        assert stats["embedded"] == args.receipts
+        print(f"{label:<12} {stats['docs_per_second']:10.1f} {stats['seconds']:10.2f} "
+              f"{stats['calls']:8,} {collection.write_calls:8,}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--receipts", type=int, default=2000)
+    parser.add_argument("--embed-latency", type=float, default=0.2, help="seconds per embeddings call")
+    parser.add_argument("--write-latency", type=float, default=0.005, help="seconds per Mongo write")
+    parser.add_argument("--read-batch", type=int, default=1000)
+    parser.add_argument("--inputs-per-call", type=int, default=256)
+    parser.add_argument("--concurrency", type=int, default=4)
+    parser.add_argument("--dim", type=int, default=256)
+    asyncio.run(main(parser.parse_args()))
@@ -0,0 +1,138 @@
+#!/usr/bin/env python3
+"""
+Concurrency benchmark: /search latency while /process-image requests run.
+
+Everything runs in-process through the ASGI app with stubbed backends: a
+fake Mongo collection, an embedder and LLM that sleep like network round
+trips, and an OCR stub that blocks its thread like a tesseract subprocess.
+If the handlers keep blocking work off the event loop, /search p99 under
+ingest load should stay close to its idle p99.
+
+Usage (from backend/):
+    python -m benchmarks.bench_concurrency --searches 300 --ingest-clients 8
+"""
+
+import time
+import asyncio
+import argparse
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
+import httpx
+from fastapi import FastAPI
+import routes.ocr as ocr
+import routes.Image_detection as image_detection
+from routes.Image_detection import router as image_router
+from routes.search import router as search_router
+from routes.vector_index import SearchIndex
+from routes.index_refresh import IndexMaintainer
+from routes.embeddings import encode_embedding
+from benchmarks.fakes import FakeDatabase, SlowEmbedder, StubLLM, receipt_png
+
+QUERIES = ["brake cable", "pedal", "labor", "chain", "tire tube", "saddle", "bolt kit", "grease"]
+
+
+def build_app(documents: int, embed_latency: float, llm_latency: float, ocr_seconds: float, cpu_workers: int) -> FastAPI:
+    """Assemble the search + image routers on stubbed state."""
+    app = FastAPI()
+    app.include_router(image_router)
+    app.include_router(search_router)
+
+    database = FakeDatabase()
+    collection = database["chatbot"]
+    embedder = SlowEmbedder(latency=embed_latency)
+    rng = np.random.default_rng(0)
+    for i in range(documents):
+        names = [f"{QUERIES[j % len(QUERIES)]} {i}-{j}" for j in range(rng.integers(1, 8))]
+        vectors = embedder.inner.embed([", ".join(names)] + names)
+        collection.insert_one({
+            "user_info": {"user_id": f"u{i % 20}", "user_name": "Driver", "pick_up_location": "Dock 4"},
+            "structured_data": {"products": {n: {"quantity": 1, "price": float(j)} for j, n in enumerate(names)}},
+            "embedding": encode_embedding(vectors[0]),
+            "product_embeddings": [
+                {"product_name": n, "embedding": encode_embedding(v)} for n, v in zip(names, vectors[1:])
+            ],
+        })
+
+    index = SearchIndex.from_collection(collection)
+    app.state.db = database
+    app.state.search_index = index
+    app.state.index_maintainer = IndexMaintainer(collection, index)
+    app.state.embedder = embedder
+    app.state.query_embedder = embedder
+    app.state.async_openai = StubLLM(latency=llm_latency)
+    app.state.cpu_executor = ThreadPoolExecutor(max_workers=cpu_workers)
+
+    def fake_tesseract(image, lang="eng"):
+        time.sleep(ocr_seconds)
+        return "BRAKE CABLE 2 x 12.50"
+
+    # No OCR engine: run_ocr goes to cpu_executor, in this process, where the stub applies
+    app.state.ocr_engine = None
+    ocr.pytesseract.image_to_string = fake_tesseract
+    # Keep the benchmark from rewriting formatted_output.json in the repo
+    image_detection.write_formatted_output = lambda parsed_json: None
+    return app
+
+
+async def measure_searches(client: httpx.AsyncClient, count: int, concurrency: int) -> np.ndarray:
+    latencies = []
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def one(i):
+        async with semaphore:
+            start = time.perf_counter()
+            response = await client.get("/search", params={"q": QUERIES[i % len(QUERIES)], "limit": 10})
+            latencies.append(time.perf_counter() - start)
+            response.raise_for_status()
+
+    await asyncio.gather(*(one(i) for i in range(count)))
+    return np.array(latencies) * 1000
+
+
+async def ingest_until(client: httpx.AsyncClient, stop: asyncio.Event, image: bytes) -> int:
+    done = 0
+    while not stop.is_set():
+        response = await client.post("/process-image", files={"file": ("receipt.png", image, "image/png")})
+        response.raise_for_status()
+        done += 1
+    return done
+
+
+def summarize(label: str, latencies: np.ndarray) -> None:
+    p50, p95, p99 = np.percentile(latencies, [50, 95, 99])
+    print(f"{label:<22} n={len(latencies):<5} p50={p50:7.2f}ms  p95={p95:7.2f}ms  p99={p99:7.2f}ms")
+
+
+async def main(args) -> None:
+    app = build_app(args.documents, args.embed_latency, args.llm_latency, args.ocr_seconds, args.cpu_workers)
+    transport = httpx.ASGITransport(app=app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://bench", timeout=60) as client:
+        await measure_searches(client, 20, args.search_concurrency)      # warm-up
+        idle = await measure_searches(client, args.searches, args.search_concurrency)
+
+        stop = asyncio.Event()
+        image = receipt_png()
+        ingesters = [asyncio.create_task(ingest_until(client, stop, image)) for _ in range(args.ingest_clients)]
+        await asyncio.sleep(args.ocr_seconds)                             # let OCR jobs pile up
+        loaded = await measure_searches(client, args.searches, args.search_concurrency)
+        stop.set()
+        ingested = sum(await asyncio.gather(*ingesters))
+
+    app.state.cpu_executor.shutdown()
+    summarize("search (idle)", idle)
+    summarize("search (under ingest)", loaded)
+    print(f"p99 ratio under ingest: {np.percentile(loaded, 99) / np.percentile(idle, 99):.2f}x "
+          f"({ingested} receipts ingested meanwhile)")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--documents", type=int, default=2000)
+    parser.add_argument("--searches", type=int, default=300)
+    parser.add_argument("--search-concurrency", type=int, default=8)
+    parser.add_argument("--ingest-clients", type=int, default=8)
+    parser.add_argument("--embed-latency", type=float, default=0.02, help="seconds per embeddings call")
+    parser.add_argument("--llm-latency", type=float, default=0.3, help="seconds per chat completion")
+    parser.add_argument("--ocr-seconds", type=float, default=0.5, help="seconds each OCR call blocks")
+    parser.add_argument("--cpu-workers", type=int, default=4)
+    asyncio.run(main(parser.parse_args()))
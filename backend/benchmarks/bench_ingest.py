@@ -0,0 +1,74 @@
+#!/usr/bin/env python3
+"""
+Batch ingestion benchmark: images/minute for /process-image vs /process-images.
+
+Uses the stubbed app from bench_concurrency (fake Mongo, sleeping LLM and
+embedder, an OCR stub that blocks its thread) and uploads the same number
+of distinct receipts two ways:
+- one /process-image request after another, as the frontend does today
+- a single /process-images request, which pipelines OCR, LLM, embedding
+  and insert_many
+
+Usage (from backend/):
+    python -m benchmarks.bench_ingest --files 100 --llm-latency 0.5
+"""
+
+import time
+import asyncio
+import argparse
+import httpx
+from benchmarks.bench_concurrency import build_app
+from benchmarks.fakes import receipt_png
+
+
+def receipts(count: int):
+    # Distinct bytes per file so nothing is answered by dedup
+    image = receipt_png()
+    return [(f"receipt-{i}.png", image + i.to_bytes(4, "big"), "image/png") for i in range(count)]
+
+
+async def sequential(client: httpx.AsyncClient, files) -> float:
+    start = time.perf_counter()
+    for file in files:
+        response = await client.post("/process-image", files={"file": file})
+        response.raise_for_status()
+    return time.perf_counter() - start
+
+
+async def batched(client: httpx.AsyncClient, files) -> tuple:
+    start = time.perf_counter()
+    response = await client.post("/process-images", files=[("files", file) for file in files])
+    response.raise_for_status()
+    return time.perf_counter() - start, response.json()["stats"]
+
+
+async def main(args) -> None:
+    for label in ("sequential /process-image", "batched /process-images"):
+        app = build_app(0, args.embed_latency, args.llm_latency, args.ocr_seconds, args.cpu_workers)
+        collection = app.state.db["chatbot"]
+        collection.write_latency = args.insert_latency
+        embedder = app.state.embedder
+        files = receipts(args.files)
+        transport = httpx.ASGITransport(app=app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://bench", timeout=None) as client:
+            if label.startswith("sequential"):
+                elapsed, stats = await sequential(client, files), None
+            else:
+                elapsed, stats = await batched(client, files)
+        app.state.cpu_executor.shutdown()
+        line = (f"{label:<28} {args.files / elapsed * 60:8.1f} images/minute "
+                f"({elapsed:6.2f}s, {embedder.calls} embed calls, {collection.write_calls} Mongo writes)")
+        if stats:
+            line += f"\n{'':<28} stage busy ms: {stats['stage_busy_ms']}"
+        print(line)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--files", type=int, default=50)
+    parser.add_argument("--embed-latency", type=float, default=0.1, help="seconds per embeddings call")
+    parser.add_argument("--llm-latency", type=float, default=0.5, help="seconds per chat completion")
+    parser.add_argument("--ocr-seconds", type=float, default=0.2, help="seconds each OCR call blocks")
+    parser.add_argument("--insert-latency", type=float, default=0.03, help="seconds per Mongo write call")
+    parser.add_argument("--cpu-workers", type=int, default=4)
+    asyncio.run(main(parser.parse_args()))
@@ -0,0 +1,52 @@
+#!/usr/bin/env python3
+"""
+Lexical (BM25) search latency on the resident index.
+
+On a synthetic BFB.chatbot, reports median /search scoring time for:
+- lexical only: what /search falls back to when the embedder is down
+- hybrid, weighted fusion (the default) and reciprocal-rank fusion
+
+Usage (from backend/):
+    python -m benchmarks.bench_lexical --receipts 20000
+"""
+
+import time
+import argparse
+import numpy as np
+from routes.vector_index import SearchIndex
+from routes.embeddings import HashingEmbedder
+from benchmarks.bench_search_filters import WORDS, build_collection
+
+
+def median_ms(index: SearchIndex, vectors, queries, repeats: int) -> float:
+    latencies = []
+    for i in range(repeats):
+        start = time.perf_counter()
+        index.search(vectors[i % len(vectors)] if vectors is not None else None, queries[i % len(queries)], 10, 0.0)
+        latencies.append(time.perf_counter() - start)
+    return float(np.median(latencies) * 1000)
+
+
+def main(args) -> None:
+    collection = build_collection(args.receipts, 50, args.dim)
+    queries = [f"{WORDS[i % len(WORDS)]} {i}-1" for i in range(len(WORDS))]
+    vectors = HashingEmbedder(args.dim).embed(queries)
+
+    start = time.perf_counter()
+    weighted = SearchIndex.from_collection(collection)
+    print(f"built in {time.perf_counter() - start:.1f}s: {weighted.product_count} products, "
+          f"{weighted.lexical.term_count} terms")
+    rrf = SearchIndex.from_collection(collection, fusion="rrf")
+
+    print(f"\nmedian of {args.repeats} queries:")
+    print(f"lexical only         {median_ms(weighted, None, queries, args.repeats):7.2f} ms")
+    print(f"hybrid, weighted     {median_ms(weighted, vectors, queries, args.repeats):7.2f} ms")
+    print(f"hybrid, rrf          {median_ms(rrf, vectors, queries, args.repeats):7.2f} ms")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--receipts", type=int, default=20000)
+    parser.add_argument("--dim", type=int, default=1024)
+    parser.add_argument("--repeats", type=int, default=50)
+    main(parser.parse_args())
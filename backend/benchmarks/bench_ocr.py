@@ -0,0 +1,120 @@
+#!/usr/bin/env python3
+"""
+OCR stage benchmark on receipt images.
+
+Renders synthetic receipts at phone-camera resolution (12 MP by default,
+PNG like CameraScanner uploads, and EXIF-rotated JPEG). Pass --images to use
+real scans instead. It then reports:
+- pre-processing cost (decode, EXIF fix, grayscale, downscale, binarize)
+- tesseract time on the raw image vs the pre-processed one
+- end-to-end OCREngine throughput for each worker count
+
+Tesseract timings are skipped when the tesseract binary is not installed.
+
+Usage (from backend/):
+    python -m benchmarks.bench_ocr --count 4 --workers 1 2 4
+"""
+
+import io
+import os
+import glob
+import time
+import shutil
+import asyncio
+import argparse
+from typing import List
+import numpy as np
+from PIL import Image, ImageDraw, ImageFont
+import pytesseract
+from routes.ocr import OCREngine, preprocess_image
+
+LINES = [
+    "BIKE & BRAKE SUPPLY CO.", "Dock 4 - Receiving", "",
+    "Front brake cable      2 x 12.50", "Pedal set (alloy)      1 x 34.99",
+    "Labor - 0.5h                40.00", "Chain lube 100ml        1 x  8.75", "",
+    "SUBTOTAL                   108.74", "TAX                          9.24", "TOTAL                      117.98",
+]
+
+
+def synthetic_receipt(width: int, height: int, fmt: str, rotate_exif: bool) -> bytes:
+    """Draw a receipt onto a noisy off-white page and encode it."""
+    rng = np.random.default_rng(0)
+    noise = rng.normal(235, 12, size=(height, width)).clip(0, 255).astype(np.uint8)
+    image = Image.fromarray(noise, "L").convert("RGB")
+    draw = ImageDraw.Draw(image)
+    try:
+        font = ImageFont.load_default(size=height // 40)
+    except TypeError:
+        font = ImageFont.load_default()
+    y = height // 10
+    for line in LINES:
+        draw.text((width // 10, y), line, fill=(20, 20, 20), font=font)
+        y += height // 25
+
+    buffer = io.BytesIO()
+    if fmt == "JPEG" and rotate_exif:
+        # Stored sideways with an orientation tag, as phones do
+        image = image.transpose(Image.Transpose.ROTATE_90)
+        exif = Image.Exif()
+        exif[0x0112] = 6
+        image.save(buffer, format="JPEG", quality=90, exif=exif)
+    else:
+        image.save(buffer, format=fmt)
+    return buffer.getvalue()
+
+
+def load_images(args) -> List[bytes]:
+    if args.images:
+        paths = sorted(glob.glob(os.path.join(args.images, "*")))
+        return [open(p, "rb").read() for p in paths[:args.count]]
+    width, height = args.resolution
+    formats = [("PNG", False), ("JPEG", True)]
+    return [synthetic_receipt(width, height, *formats[i % 2]) for i in range(args.count)]
+
+
+def time_ms(fn, *args, **kwargs):
+    start = time.perf_counter()
+    result = fn(*args, **kwargs)
+    return result, (time.perf_counter() - start) * 1000
+
+
+async def engine_throughput(images: List[bytes], workers: int) -> float:
+    engine = OCREngine(workers=workers, queue_depth=len(images))
+    try:
+        await engine.recognize(images[0])                  # start the worker processes
+        start = time.perf_counter()
+        await asyncio.gather(*(engine.recognize(image) for image in images))
+        return len(images) / (time.perf_counter() - start) * 60
+    finally:
+        engine.shutdown()
+
+
+def main(args) -> None:
+    images = load_images(args)
+    has_tesseract = shutil.which("tesseract") is not None
+    print(f"{len(images)} images, mean {np.mean([len(i) for i in images]) / 1e6:.1f} MB; "
+          f"tesseract {'found' if has_tesseract else 'NOT found (OCR timings skipped)'}")
+
+    for i, contents in enumerate(images):
+        raw = Image.open(io.BytesIO(contents))
+        processed, pre_ms = time_ms(preprocess_image, contents)
+        line = f"image {i}: {raw.format} {raw.size[0]}x{raw.size[1]} -> {processed.size[0]}x{processed.size[1]}, preprocess {pre_ms:7.1f}ms"
+        if has_tesseract:
+            _, raw_ms = time_ms(pytesseract.image_to_string, raw)
+            _, ocr_ms = time_ms(pytesseract.image_to_string, processed)
+            line += f", tesseract raw {raw_ms:7.1f}ms vs pre-processed {ocr_ms:7.1f}ms"
+        print(line)
+
+    if has_tesseract:
+        for workers in args.workers:
+            rate = asyncio.run(engine_throughput(images, workers))
+            print(f"OCREngine workers={workers}: {rate:6.1f} images/minute")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--images", help="directory of receipt images to use instead of synthetic ones")
+    parser.add_argument("--count", type=int, default=4)
+    parser.add_argument("--resolution", type=int, nargs=2, default=[3024, 4032], metavar=("W", "H"))
+    parser.add_argument("--workers", type=int, nargs="+", default=[1, 2, 4])
+    main(parser.parse_args())
@@ -0,0 +1,112 @@
+#!/usr/bin/env python3
+"""
+Storage, memory, latency and recall of compact embedding representations.
+
+On a synthetic BFB.chatbot, reports:
+- stored embedding bytes per receipt and decode time for each
+  EMBEDDING_STORAGE format (float32, float16, int8), vs a BSON array of doubles
+- for the resident index at float32 / int8 / int8 + re-rank, each at full
+  and shortened dimensions: matrix memory, median query latency and
+  recall@k against the full-dimension float32 index
+
+The synthetic vectors put most of their energy in the leading dimensions, as
+models trained for shortening (text-embedding-3-*) do; on real embeddings
+measure with the migration's --dry-run first. Re-ranking reads from an
+in-process collection here, so add a Mongo round trip to its latency.
+
+Usage (from backend/):
+    python -m benchmarks.bench_quantization --receipts 20000 --dim 1024 --dimensions 256
+"""
+
+import time
+import argparse
+import numpy as np
+import bson
+from routes.vector_index import SearchIndex
+from routes.embeddings import STORAGE_FORMATS, decode_embedding, encode_embedding
+from benchmarks.fakes import FakeCollection
+
+
+def synthetic_vectors(rng, count: int, dim: int, centers: np.ndarray) -> np.ndarray:
+    # Energy decays along the dimensions, so prefixes keep most of the signal
+    decay = 1 / (1 + np.arange(dim) / 16)
+    vectors = (centers[rng.integers(len(centers), size=count)] + rng.normal(size=(count, dim))) * decay
+    return (vectors / np.linalg.norm(vectors, axis=1, keepdims=True)).astype(np.float32)
+
+
+def build_collection(vectors: np.ndarray, per_receipt: int, storage: str) -> FakeCollection:
+    collection = FakeCollection()
+    for start in range(0, len(vectors), per_receipt):
+        names = [f"item {i}" for i in range(start, min(start + per_receipt, len(vectors)))]
+        collection.insert_one({
+            "structured_data": {"products": {name: {"quantity": 1} for name in names}},
+            "embedding": encode_embedding(vectors[start:start + len(names)].mean(axis=0), storage),
+            "product_embeddings": [
+                {"product_name": name, "embedding": encode_embedding(vectors[start + j], storage)}
+                for j, name in enumerate(names)
+            ],
+        })
+    return collection
+
+
+def storage_report(vectors: np.ndarray, per_receipt: int) -> None:
+    receipt = vectors[:per_receipt]
+    baseline = len(bson.encode({"embeddings": [v.astype(float).tolist() for v in receipt]}))
+    print(f"{'BSON double arrays':<20} {baseline:9d} B/receipt")
+    for storage in STORAGE_FORMATS:
+        encoded = [encode_embedding(v, storage) for v in receipt]
+        size = len(bson.encode({"embeddings": encoded}))
+        start = time.perf_counter()
+        for _ in range(200):
+            for value in encoded:
+                decode_embedding(value)
+        decode_us = (time.perf_counter() - start) / (200 * len(encoded)) * 1e6
+        print(f"{storage:<20} {size:9d} B/receipt ({baseline / size:4.1f}x smaller), decode {decode_us:5.1f} us/vector")
+
+
+def run_queries(index: SearchIndex, queries: np.ndarray, k: int):
+    latencies, found = [], []
+    for query in queries:
+        start = time.perf_counter()
+        results, _ = index.search(query, "", k, -1.0)
+        latencies.append(time.perf_counter() - start)
+        found.append({r["product_name"] for r in results})
+    return float(np.median(latencies) * 1000), found
+
+
+def main(args) -> None:
+    rng = np.random.default_rng(0)
+    centers = rng.normal(size=(args.clusters, args.dim))
+    vectors = synthetic_vectors(rng, args.receipts * args.per_receipt, args.dim, centers)
+    queries = synthetic_vectors(rng, args.queries, args.dim, centers)
+
+    print(f"{args.receipts} receipts x {args.per_receipt} products, {args.dim}-dim\n")
+    storage_report(vectors, args.per_receipt)
+
+    collection = build_collection(vectors, args.per_receipt, "float32")
+    baseline = SearchIndex.from_collection(collection)
+    baseline_ms, expected = run_queries(baseline, queries, args.k)
+    print(f"\n{'index':<32} {'memory':>9} {'latency':>9} {'recall@' + str(args.k):>10}")
+    print(f"{'float32, ' + str(args.dim) + ' dims':<32} {baseline.matrix_bytes / 1e6:7.1f}MB {baseline_ms:7.2f}ms {1:10.3f}")
+    for dim in (None, args.dimensions):
+        for precision, rerank_depth in (("float32", 0), ("int8", 0), ("int8", args.rerank_depth)):
+            if dim is None and precision == "float32":
+                continue
+            index = SearchIndex.from_collection(collection, dim=dim, precision=precision, rerank_depth=rerank_depth)
+            ms, found = run_queries(index, queries, args.k)
+            recall = np.mean([len(f & e) / len(e) for f, e in zip(found, expected)])
+            label = f"{precision}{f' + re-rank {rerank_depth}' if rerank_depth and precision != 'float32' else ''}, {dim or args.dim} dims"
+            print(f"{label:<32} {index.matrix_bytes / 1e6:7.1f}MB {ms:7.2f}ms {recall:10.3f}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--receipts", type=int, default=20000)
+    parser.add_argument("--per-receipt", type=int, default=5)
+    parser.add_argument("--dim", type=int, default=1024)
+    parser.add_argument("--dimensions", type=int, default=256, help="shortened dimensions to compare")
+    parser.add_argument("--clusters", type=int, default=100)
+    parser.add_argument("--rerank-depth", type=int, default=100)
+    parser.add_argument("--queries", type=int, default=50)
+    parser.add_argument("-k", type=int, default=10)
+    main(parser.parse_args())
@@ -0,0 +1,84 @@
+#!/usr/bin/env python3
+"""
+Per-request setup overhead: building search/ingest objects per request vs
+reusing the per-process singletons from app.state.
+
+Before this change every /search request built an ItemSearch, which called
+load_dotenv(), created a new AsyncOpenAI client (and so a new connection
+pool, with a fresh TLS handshake on its first call) and, without a shared
+index, scanned the collection. /process-image did the same with
+ImageDetection. The benchmark times:
+- constructing those objects per request vs looking up the singletons
+- /search through the ASGI app both ways, against a fake collection
+
+No network calls are made; a dummy OPENAI_API_KEY is set so the OpenAI
+clients get constructed as they would be in production.
+
+Usage (from backend/):
+    python -m benchmarks.bench_request_setup --documents 2000 --requests 200
+"""
+
+import os
+import time
+import asyncio
+import argparse
+import numpy as np
+import httpx
+from routes.search import ItemSearch
+from routes.Image_detection import ImageDetection, detector_from_state
+from benchmarks.bench_concurrency import build_app, summarize
+
+
+def time_calls(fn, count: int) -> np.ndarray:
+    latencies = []
+    for _ in range(count):
+        start = time.perf_counter()
+        fn()
+        latencies.append(time.perf_counter() - start)
+    return np.array(latencies) * 1000
+
+
+async def search_latencies(app, count: int) -> np.ndarray:
+    latencies = []
+    transport = httpx.ASGITransport(app=app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://bench") as client:
+        for i in range(count):
+            start = time.perf_counter()
+            response = await client.get("/search", params={"q": "brake cable", "limit": 10})
+            latencies.append(time.perf_counter() - start)
+            response.raise_for_status()
+    return np.array(latencies) * 1000
+
+
+def main(args) -> None:
+    os.environ.setdefault("OPENAI_API_KEY", "sk-benchmark-not-used")
+    app = build_app(args.documents, 0.0, 0.0, 0.0, 2)
+    state = app.state
+    database = state.db
+    collection = database["chatbot"]
+    state.item_search = ItemSearch(database, state.search_index, state.query_embedder)
+    state.image_detection = detector_from_state(state)
+
+    print(f"Object setup per request ({args.documents} receipts in the collection):")
+    summarize("ItemSearch() before", time_calls(lambda: asyncio.run(ItemSearch(database).load_index()), args.constructions))
+    summarize("item_search after", time_calls(lambda: state.item_search, args.constructions))
+    summarize("ImageDetection() before", time_calls(lambda: ImageDetection(collection), args.constructions))
+    summarize("image_detection after", time_calls(lambda: detector_from_state(state), args.constructions))
+
+    print("\n/search end to end:")
+    shared_item_search, shared_index = state.item_search, state.search_index
+    state.item_search, state.search_index = None, None
+    before = asyncio.run(search_latencies(app, args.requests))
+    state.item_search, state.search_index = shared_item_search, shared_index
+    after = asyncio.run(search_latencies(app, args.requests))
+    summarize("per-request before", before)
+    summarize("singleton after", after)
+    state.cpu_executor.shutdown()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--documents", type=int, default=2000)
+    parser.add_argument("--constructions", type=int, default=50)
+    parser.add_argument("--requests", type=int, default=100)
+    main(parser.parse_args())
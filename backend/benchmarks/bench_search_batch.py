@@ -0,0 +1,96 @@
+#!/usr/bin/env python3
+"""
+Batch search benchmark: amortized cost per query of /search/batch vs N /search calls.
+
+Loads --products synthetic products into an in-process collection and
+index, and serves the search router with an embedder that sleeps
+--embed-latency per call. Per batch size N it reports, per query:
+- sequential: N /search requests one after another (N embedding round
+  trips, N passes over the matrix)
+- batch: one /search/batch request with the same N queries
+- rank-only: the ranking work alone, N SearchIndex.rank() calls vs one
+  rank_many() (N matrix-vector products vs one matrix-matrix product)
+
+The result cache is left out so every query is ranked.
+
+Usage (from backend/):
+    python -m benchmarks.bench_search_batch --products 100000 --sizes 1 10 50
+"""
+
+import time
+import asyncio
+import argparse
+import httpx
+from fastapi import FastAPI
+from routes.search import router as search_router
+from routes.vector_index import SearchIndex
+from benchmarks.corpus import load_corpus, synthetic_queries
+from benchmarks.fakes import FakeDatabase, SlowEmbedder
+
+
+def build_app(products: int, dim: int, embed_latency: float, precision: str) -> FastAPI:
+    app = FastAPI()
+    app.include_router(search_router)
+    database = FakeDatabase()
+    embedder = SlowEmbedder(embed_latency, dim)
+    load_corpus(database["chatbot"], products, embedder.inner)
+    app.state.db = database
+    app.state.search_index = SearchIndex.from_collection(database["chatbot"], precision=precision)
+    app.state.query_embedder = embedder
+    return app
+
+
+async def sequential(client: httpx.AsyncClient, queries, limit: int) -> float:
+    start = time.perf_counter()
+    for query in queries:
+        response = await client.get("/search", params={"q": query, "limit": limit})
+        response.raise_for_status()
+    return time.perf_counter() - start
+
+
+async def batched(client: httpx.AsyncClient, queries, limit: int) -> float:
+    start = time.perf_counter()
+    response = await client.post("/search/batch", json={"queries": [{"q": q, "limit": limit} for q in queries]})
+    response.raise_for_status()
+    return time.perf_counter() - start
+
+
+def rank_only(index: SearchIndex, embedder: SlowEmbedder, queries, limit: int) -> tuple:
+    vectors = embedder.inner.embed(queries)
+    start = time.perf_counter()
+    for vector, query in zip(vectors, queries):
+        index.rank(vector, query, 0.0, page_size=limit).page(limit)
+    one_by_one = time.perf_counter() - start
+    start = time.perf_counter()
+    for ranking in index.rank_many([(vector, query, 0.0, limit) for vector, query in zip(vectors, queries)]):
+        ranking.page(limit)
+    return one_by_one, time.perf_counter() - start
+
+
+async def main(args) -> None:
+    print(f"Loading {args.products:,} products ({args.dim} dims, {args.precision})...")
+    app = build_app(args.products, args.dim, args.embed_latency, args.precision)
+    index, embedder = app.state.search_index, app.state.query_embedder
+    print(f"{args.embed_latency * 1000:.0f}ms per embeddings call; milliseconds per query:")
+    print(f"{'N':>4} {'sequential':>12} {'batch':>10} {'speedup':>8} {'rank x N':>10} {'rank_many':>10} {'speedup':>8}")
+    transport = httpx.ASGITransport(app=app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://bench", timeout=None) as client:
+        for size in args.sizes:
+            queries = synthetic_queries(size, seed=size)
+            await batched(client, queries[:1], args.limit)          # warm up
+            one_by_one = await sequential(client, queries, args.limit) / size * 1000
+            together = await batched(client, queries, args.limit) / size * 1000
+            ranks, rank_many = (seconds / size * 1000 for seconds in rank_only(index, embedder, queries, args.limit))
+            print(f"{size:>4} {one_by_one:12.2f} {together:10.2f} {one_by_one / together:7.1f}x "
+                  f"{ranks:10.2f} {rank_many:10.2f} {ranks / rank_many:7.1f}x")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--products", type=int, default=100000)
+    parser.add_argument("--dim", type=int, default=256)
+    parser.add_argument("--precision", choices=("float32", "int8"), default="float32")
+    parser.add_argument("--embed-latency", type=float, default=0.15, help="seconds per embeddings call")
+    parser.add_argument("--limit", type=int, default=10)
+    parser.add_argument("--sizes", type=int, nargs="+", default=[1, 10, 50])
+    asyncio.run(main(parser.parse_args()))
@@ -0,0 +1,102 @@
+#!/usr/bin/env python3
+"""
+Projection and pre-filtering benchmark for search reads.
+
+On a synthetic BFB.chatbot (receipts with OCR text, receipt and per-product
+embeddings), reports:
+- BSON bytes and decode time per document, full vs SEARCH_PROJECTION.
+  This is what every index build and refresh pays per receipt.
+- /search scoring time on the resident index, unfiltered vs with a selective
+  user_id filter, where only candidate rows are scored
+- documents and bytes fetched when a filtered query has no resident index
+  and is pushed down to Mongo
+
+Usage (from backend/):
+    python -m benchmarks.bench_search_filters --receipts 20000 --users 50
+"""
+
+import time
+import argparse
+import numpy as np
+import bson
+from bson import ObjectId
+from routes.vector_index import SearchIndex
+from routes.search_filters import SEARCH_PROJECTION, SearchFilters
+from routes.embeddings import HashingEmbedder, encode_embedding
+from benchmarks.fakes import FakeCollection
+
+WORDS = ["brake", "cable", "pedal", "chain", "tube", "saddle", "bolt", "grease", "labor", "tire"]
+
+
+def build_collection(receipts: int, users: int, dim: int) -> FakeCollection:
+    collection = FakeCollection()
+    embedder = HashingEmbedder(dim)
+    rng = np.random.default_rng(0)
+    for i in range(receipts):
+        names = [f"{WORDS[j % len(WORDS)]} {i}-{j}" for j in range(rng.integers(1, 6))]
+        vectors = embedder.embed([", ".join(names)] + names)
+        collection.insert_one({
+            "_id": ObjectId(),
+            "user_info": {"user_id": f"u{i % users}", "user_name": "Driver", "pick_up_location": f"Dock {i % 7}"},
+            "original_filename": f"IMG_{i:06d}.jpg",
+            "structured_data": {
+                "products": {n: {"quantity": int(rng.integers(1, 5)), "price": float(rng.integers(1, 200))} for n in names},
+                "raw_ocr_text": " ".join(rng.choice(WORDS, 250)),
+            },
+            "embedding": encode_embedding(vectors[0]),
+            "product_embeddings": [{"product_name": n, "embedding": encode_embedding(v)} for n, v in zip(names, vectors[1:])],
+            "embedding_model": embedder.model,
+        })
+    return collection
+
+
+def transfer_cost(docs) -> tuple:
+    encoded = [bson.encode(doc) for doc in docs]
+    start = time.perf_counter()
+    for data in encoded:
+        bson.decode(data)
+    return sum(len(data) for data in encoded), (time.perf_counter() - start) * 1000
+
+
+def search_ms(index: SearchIndex, vectors, filters, repeats: int) -> float:
+    latencies = []
+    for i in range(repeats):
+        start = time.perf_counter()
+        index.search(vectors[i % len(vectors)], WORDS[i % len(WORDS)], 10, 0.0, filters)
+        latencies.append(time.perf_counter() - start)
+    return float(np.median(latencies) * 1000)
+
+
+def main(args) -> None:
+    collection = build_collection(args.receipts, args.users, args.dim)
+    docs = collection.docs
+    full_bytes, full_ms = transfer_cost(docs)
+    projected_bytes, projected_ms = transfer_cost([FakeCollection._project(d, SEARCH_PROJECTION) for d in docs])
+    print(f"{len(docs)} receipts, {args.dim}-dim embeddings")
+    print(f"full documents:      {full_bytes / len(docs):9.0f} B/doc, decode {full_ms / len(docs) * 1000:7.1f} us/doc")
+    print(f"SEARCH_PROJECTION:   {projected_bytes / len(docs):9.0f} B/doc, decode {projected_ms / len(docs) * 1000:7.1f} us/doc "
+          f"({100 * (1 - projected_bytes / full_bytes):.0f}% fewer bytes)")
+
+    index = SearchIndex.from_collection(collection)
+    vectors = HashingEmbedder(args.dim).embed(WORDS)
+    selective = SearchFilters(user_id="u3")
+    print(f"\nresident index, {index.product_count} products (median of {args.repeats}):")
+    print(f"unfiltered           {search_ms(index, vectors, None, args.repeats):7.2f} ms")
+    print(f"user_id filter       {search_ms(index, vectors, selective, args.repeats):7.2f} ms")
+
+    print("\nno resident index, filter pushed down to Mongo:")
+    for label, filters in (("unfiltered", None), ("user_id filter", selective)):
+        collection.docs_returned = 0
+        query = {"embedding": {"$exists": True}, **(filters.to_mongo() if filters else {})}
+        fetched = list(collection.find(query, SEARCH_PROJECTION))
+        size, _ = transfer_cost(fetched)
+        print(f"{label:<20} {len(fetched):7d} docs, {size / 1e6:8.1f} MB")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--receipts", type=int, default=20000)
+    parser.add_argument("--users", type=int, default=50)
+    parser.add_argument("--dim", type=int, default=1024)
+    parser.add_argument("--repeats", type=int, default=50)
+    main(parser.parse_args())
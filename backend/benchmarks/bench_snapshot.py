@@ -0,0 +1,123 @@
+#!/usr/bin/env python3
+"""
+Worker startup time and memory: collection scan vs a memory-mapped snapshot.
+
+Loads a synthetic BFB.chatbot into an in-process collection, saves one
+snapshot of its index and inserts --delta more receipts. Then, per mode,
+--workers fresh processes each load their own copy of the collection and
+start an index, all alive at once like uvicorn workers:
+- scan: SearchIndex.from_collection(), what every worker did before
+- snapshot: SnapshotStore.open() plus IndexMaintainer.catch_up()
+
+Each worker runs --queries searches (so the pages it needs are resident)
+and reports its startup time and how much its RSS and its private memory
+(pages no other process maps) grew. Snapshot pages mapped by every worker
+count in RSS but not as private. Reading from an in-process collection
+leaves out Mongo's transfer time, which only the scan pays in full.
+Linux only (/proc/self/smaps_rollup).
+
+Usage (from backend/):
+    python -m benchmarks.bench_snapshot --products 200000 --workers 4
+"""
+
+import os
+import time
+import pickle
+import shutil
+import argparse
+import tempfile
+import multiprocessing
+import numpy as np
+from routes.vector_index import SearchIndex
+from routes.index_refresh import IndexMaintainer
+from routes.index_snapshot import SnapshotStore
+from routes.embeddings import HashingEmbedder
+from benchmarks.corpus import load_corpus, synthetic_queries
+from benchmarks.fakes import FakeCollection
+
+
+def memory_kb() -> dict:
+    """This process's resident and private memory in kB."""
+    values = {}
+    with open("/proc/self/smaps_rollup") as f:
+        for line in f:
+            name, _, rest = line.partition(":")
+            if name in ("Rss", "Private_Clean", "Private_Dirty"):
+                values[name] = int(rest.split()[0])
+    return {"rss": values["Rss"], "private": values["Private_Clean"] + values["Private_Dirty"]}
+
+
+def worker(mode, corpus_path, store, dim, queries, barrier, results):
+    collection = FakeCollection()
+    with open(corpus_path, "rb") as f:
+        collection.docs = pickle.load(f)
+    embedder = HashingEmbedder(dim)
+    vectors = embedder.embed(queries)
+    before = memory_kb()
+    start = time.perf_counter()
+    if mode == "scan":
+        index = SearchIndex.from_collection(collection)
+    else:
+        index = store.open(collection)
+        IndexMaintainer(collection, index).catch_up()
+    startup = time.perf_counter() - start
+    for query, vector in zip(queries, vectors):
+        index.search(vector, query, 10, 0.0)
+    # Measure with every worker alive, so the pages they map together count as shared
+    barrier.wait()
+    after = memory_kb()
+    results.put((mode, startup, after["rss"] - before["rss"], after["private"] - before["private"], index.product_count))
+    barrier.wait()
+
+
+def run_mode(mode, corpus_path, store, dim, queries, workers) -> list:
+    context = multiprocessing.get_context("spawn")
+    barrier, results = context.Barrier(workers), context.Queue()
+    processes = [
+        context.Process(target=worker, args=(mode, corpus_path, store, dim, queries, barrier, results))
+        for _ in range(workers)
+    ]
+    for process in processes:
+        process.start()
+    rows = [results.get() for _ in processes]
+    for process in processes:
+        process.join()
+    return rows
+
+
+def main(args) -> None:
+    collection = FakeCollection()
+    embedder = HashingEmbedder(args.dim)
+    print(f"Loading {args.products:,} products ({args.dim} dims)...")
+    load_corpus(collection, args.products, embedder)
+    directory = tempfile.mkdtemp(prefix="bfb-snapshot-")
+    try:
+        store = SnapshotStore(directory)
+        start = time.perf_counter()
+        store.save(SearchIndex.from_collection(collection))
+        print(f"Snapshot saved in {time.perf_counter() - start:.2f}s")
+        if args.delta:
+            load_corpus(collection, args.delta, embedder, seed=1)
+        corpus_path = os.path.join(directory, "corpus.pickle")
+        with open(corpus_path, "wb") as f:
+            pickle.dump(collection.docs, f)
+        queries = synthetic_queries(args.queries)
+
+        print(f"\n{args.workers} workers, {args.delta:,} products inserted after the snapshot")
+        print(f"{'mode':<10} {'startup':>10} {'RSS/worker':>12} {'private':>12} {'products':>10}")
+        for mode in ("scan", "snapshot"):
+            rows = run_mode(mode, corpus_path, store, args.dim, queries, args.workers)
+            startup, rss, private, products = (np.mean([row[i] for row in rows]) for i in range(1, 5))
+            print(f"{mode:<10} {startup:9.2f}s {rss / 1024:10.1f}MB {private / 1024:10.1f}MB {int(products):>10,}")
+    finally:
+        shutil.rmtree(directory, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--products", type=int, default=200000)
+    parser.add_argument("--delta", type=int, default=1000, help="products inserted after the snapshot")
+    parser.add_argument("--dim", type=int, default=256)
+    parser.add_argument("--workers", type=int, default=4)
+    parser.add_argument("--queries", type=int, default=20)
+    main(parser.parse_args())
@@ -0,0 +1,97 @@
+#!/usr/bin/env python3
+"""
+Stock summary benchmark: /stock/summary latency vs number of receipts.
+
+Per --sizes receipts (uploads spread over --days days, product names
+drawn from a fixed catalog the way a real shop repeats them) it reports:
+- rollups: StockRollups.summary() over the stored rollups
+- full scan: the same numbers recomputed from every receipt, which is
+  what the dashboard would need without them
+- apply: the cost per receipt of keeping the rollups up to date on ingest,
+  timed over the last --sample uploads (the rest are rolled up in one go)
+
+The fake collection has no indexes, so summary() here reads every rollup
+document; their number depends on the catalog, users and days, not on
+the number of receipts, which is why the rollups column stays flat. Its
+upserts scan them too, where Atlas would look the _id up.
+
+Usage (from backend/):
+    python -m benchmarks.bench_stock --sizes 1000 10000 100000
+"""
+
+import re
+import time
+import argparse
+from datetime import datetime, timedelta, timezone
+from bson import ObjectId
+from routes.stock import StockRollups
+from benchmarks.corpus import synthetic_receipts
+from benchmarks.fakes import FakeCollection, FakeDatabase
+
+# The corpus numbers its product names to keep them unique; a shop's catalog repeats
+_SUFFIX = re.compile(r" \d+-\d+$")
+
+
+def load_receipts(collection: FakeCollection, receipts: int, days: int, seed: int = 0) -> None:
+    start = datetime(2025, 1, 1, tzinfo=timezone.utc)
+    docs = []
+    # synthetic_receipts averages 4.5 products per receipt
+    for i, doc in enumerate(synthetic_receipts(receipts * 9 // 2, seed=seed)):
+        products = doc["structured_data"]["products"]
+        doc["structured_data"]["products"] = {_SUFFIX.sub("", name): data for name, data in products.items()}
+        moment = start + timedelta(seconds=int(i * days * 86400 / receipts))
+        doc["_id"] = ObjectId(ObjectId.from_datetime(moment).binary[:4] + i.to_bytes(8, "big"))
+        docs.append(doc)
+    collection.insert_many(docs)
+
+
+def timed(function, repeat: int) -> float:
+    """Best of `repeat` runs, in milliseconds."""
+    best = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        function()
+        best = min(best, time.perf_counter() - start)
+    return best * 1000
+
+
+def seed(rollups: StockRollups, receipts: FakeCollection, until) -> None:
+    """Store the rollups of receipts up to `until` directly, as a recompute would."""
+    for key, (fields, counts) in StockRollups.recompute(receipts, until).items():
+        rollups.collection.docs.append({"_id": key, **fields, **counts})
+
+
+def main(args) -> None:
+    print(f"Receipts over {args.days} days; milliseconds (best of {args.repeat}):")
+    print(f"{'receipts':>9} {'rollups':>8} {'full scan':>10} {'speedup':>8} {'apply/receipt':>14} {'rollup docs':>12}")
+    for size in args.sizes:
+        database = FakeDatabase()
+        receipts = database["chatbot"]
+        load_receipts(receipts, size, args.days)
+        rollups = StockRollups(database["stock_rollups"])
+        seed(rollups, receipts, receipts.docs[-args.sample - 1]["_id"])
+        start = time.perf_counter()
+        for receipt in receipts.docs[-args.sample:]:
+            rollups.apply([receipt])
+        apply = (time.perf_counter() - start) / args.sample * 1000
+
+        def full_scan():
+            recomputed = StockRollups(FakeDatabase()["stock_rollups"])
+            seed(recomputed, receipts, None)
+            return recomputed.summary(limit=args.limit)
+
+        assert full_scan() == rollups.summary(limit=args.limit)
+        fast = timed(lambda: rollups.summary(limit=args.limit), args.repeat)
+        slow = timed(full_scan, max(1, args.repeat // 5))
+        print(f"{len(receipts.docs):>9,} {fast:8.2f} {slow:10.1f} {slow / fast:7.0f}x "
+              f"{apply:14.3f} {len(rollups.collection.docs):>12,}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sizes", type=int, nargs="+", default=[1000, 10000, 100000])
+    parser.add_argument("--days", type=int, default=90, help="days the uploads are spread over")
+    parser.add_argument("--limit", type=int, default=20)
+    parser.add_argument("--sample", type=int, default=200, help="uploads apply() is timed over")
+    parser.add_argument("--repeat", type=int, default=20)
+    main(parser.parse_args())
@@ -0,0 +1,123 @@
+"""
+Synthetic receipt corpora for benchmarks.
+
+Receipts have the shape ImageDetection stores: user_info, and
+structured_data with the LLM's products (the fields of
+formatted_output.json) and the raw OCR text. The same seed always gives
+the same corpus and queries, so runs on different commits are comparable.
+"""
+
+from typing import Dict, Iterator, List
+import numpy as np
+from routes.embeddings import Embedder, encode_embedding, document_text, product_text
+
+PARTS = [
+    "brake cable", "brake pads", "pedal arms", "chain", "inner tube", "tire", "saddle", "handlebar tape",
+    "derailleur", "cassette", "crankset", "bottom bracket", "headset", "spokes", "rim tape", "grips",
+    "bolt kit", "chain lube", "grease", "bar end plugs", "shifter cable", "disc rotor", "valve core", "bell",
+]
+QUALIFIERS = ["front", "rear", "new set of", "replacement", "heavy duty", "shimano", "sram", "tubeless", "steel", "alloy"]
+SERVICES = ["labor", "tune up", "wheel true", "brake bleed", "fitting"]
+USERS = ["John Smith", "Ana Lopez", "Wei Chen", "Sam Patel", "Maria Rossi", "Tom Berg", "Ada Okafor", "Lee Park"]
+LOCATIONS = ["Dock 1", "Dock 2", "Dock 4", "Main St", "Warehouse B", "Harbor"]
+
+
+def _product(rng: np.random.Generator, receipt: int, position: int) -> tuple:
+    """One (name, fields) line item."""
+    if rng.random() < 0.15:
+        name = f"{SERVICES[rng.integers(len(SERVICES))]} {rng.integers(1, 5)}hrs"
+    else:
+        name = f"{QUALIFIERS[rng.integers(len(QUALIFIERS))]} {PARTS[rng.integers(len(PARTS))]}"
+    # Receipt and position keep names unique within the corpus
+    name = f"{name} {receipt}-{position}".capitalize()
+    return name, {
+        "pick_up_time": None,
+        "category": None,
+        "drop_off_location": None,
+        "drop_off_time": None,
+        "pick_up_location": None,
+        "quantity": int(rng.integers(1, 5)) if rng.random() < 0.9 else None,
+        "price": round(float(rng.lognormal(3, 1)), 2),
+    }
+
+
+def synthetic_receipts(products: int, seed: int = 0, max_per_receipt: int = 8) -> Iterator[Dict]:
+    """
+    Receipts (without embeddings) totalling `products` line items.
+
+    Yields:
+        Documents with user_info and structured_data (products and raw_ocr_text)
+    """
+    rng = np.random.default_rng(seed)
+    made, receipt = 0, 0
+    while made < products:
+        count = min(int(rng.integers(1, max_per_receipt + 1)), products - made)
+        user = int(rng.integers(len(USERS)))
+        location = LOCATIONS[rng.integers(len(LOCATIONS))]
+        items = dict(_product(rng, receipt, j) for j in range(count))
+        for data in items.values():
+            data.update({"user_id": str(user), "user_name": USERS[user], "pick_up_location": location})
+        ocr_lines = [f"{name.upper()} {data['quantity'] or ''} {data['price']:.2f}" for name, data in items.items()]
+        yield {
+            "user_info": {"user_id": str(user), "user_name": USERS[user], "pick_up_location": location},
+            "original_filename": f"receipt-{receipt}.png",
+            "structured_data": {"products": items, "raw_ocr_text": "\n".join(ocr_lines)},
+        }
+        made += count
+        receipt += 1
+
+
+def load_corpus(collection, products: int, embedder: Embedder, seed: int = 0, storage: str = "float32",
+                batch: int = 1000) -> int:
+    """
+    Insert an embedded synthetic corpus into `collection`, embedding `batch` receipts per call.
+
+    Returns:
+        Number of receipts inserted
+    """
+    pending: List[Dict] = []
+    inserted = 0
+
+    def flush():
+        texts, spans = [], []
+        for doc in pending:
+            structured = doc["structured_data"]
+            names = list(structured["products"])
+            spans.append((len(texts), names))
+            texts.append(document_text(structured, structured["raw_ocr_text"]))
+            texts.extend(product_text(name, structured["products"][name]) for name in names)
+        vectors = embedder.embed(texts)
+        for doc, (start, names) in zip(pending, spans):
+            doc["embedding"] = encode_embedding(vectors[start], storage)
+            doc["product_embeddings"] = [
+                {"product_name": name, "embedding": encode_embedding(vector, storage)}
+                for name, vector in zip(names, vectors[start + 1:start + 1 + len(names)])
+            ]
+            doc["embedding_model"] = embedder.model
+        collection.insert_many(pending)
+
+    for doc in synthetic_receipts(products, seed):
+        pending.append(doc)
+        if len(pending) == batch:
+            flush()
+            inserted += len(pending)
+            pending = []
+    if pending:
+        flush()
+        inserted += len(pending)
+    return inserted
+
+
+def synthetic_queries(count: int, seed: int = 1) -> List[str]:
+    """Search queries over the corpus vocabulary: parts, qualified parts and services."""
+    rng = np.random.default_rng(seed)
+    queries = []
+    for _ in range(count):
+        roll = rng.random()
+        if roll < 0.5:
+            queries.append(PARTS[rng.integers(len(PARTS))])
+        elif roll < 0.85:
+            queries.append(f"{QUALIFIERS[rng.integers(len(QUALIFIERS))]} {PARTS[rng.integers(len(PARTS))]}")
+        else:
+            queries.append(SERVICES[rng.integers(len(SERVICES))])
+    return queries
@@ -0,0 +1,275 @@
+"""
+In-process stand-ins for MongoDB and OpenAI, for tests and benchmarks.
+
+Nothing here touches the network: FakeCollection implements just enough
+of the PyMongo collection API for the app's code paths, and the stubs
+answer LLM and embedding calls after an optional simulated latency.
+"""
+
+import io
+import re
+import json
+import time
+import asyncio
+from types import SimpleNamespace
+from typing import Dict, List, Optional
+import numpy as np
+from bson import ObjectId
+from PIL import Image
+from pymongo import DeleteOne
+from pymongo.results import InsertManyResult, InsertOneResult
+from routes.embeddings import Embedder, HashingEmbedder
+
+
+class FakeCursor:
+    def __init__(self, collection, docs: List[Dict]):
+        self.collection = collection
+        self.docs = docs
+
+    def sort(self, key, direction=1):
+        self.docs = sorted(self.docs, key=lambda d: d[key], reverse=direction < 0)
+        return self
+
+    def limit(self, n: int):
+        if n:
+            self.docs = self.docs[:n]
+        return self
+
+    def batch_size(self, n: int):
+        return self
+
+    def __iter__(self):
+        for doc in self.docs:
+            self.collection.docs_returned += 1
+            yield doc
+
+
+class FakeCollection:
+    """Just enough of a PyMongo collection for the app's code paths."""
+
+    def __init__(self, name: str = "chatbot", database=None, write_latency: float = 0.0):
+        self.name = name
+        self.database = database if database is not None else SimpleNamespace(name="BFB")
+        self.docs: List[Dict] = []
+        # Documents handed out by cursors, to check how much work a read did
+        self.docs_returned = 0
+        # Seconds each write call blocks, like a round trip to Atlas
+        self.write_latency = write_latency
+        self.write_calls = 0
+        self.indexes: Dict[str, List] = {}
+
+    def insert_one(self, doc: Dict) -> InsertOneResult:
+        self._write()
+        doc.setdefault("_id", ObjectId())
+        self.docs.append(doc)
+        return InsertOneResult(doc["_id"], acknowledged=True)
+
+    def insert_many(self, docs: List[Dict], ordered: bool = True) -> InsertManyResult:
+        self._write()
+        for doc in docs:
+            doc.setdefault("_id", ObjectId())
+            self.docs.append(doc)
+        return InsertManyResult([doc["_id"] for doc in docs], acknowledged=True)
+
+    def update_one(self, query: Dict, update: Dict) -> SimpleNamespace:
+        """Apply a top-level $set to the first matching document."""
+        self._write()
+        return SimpleNamespace(modified_count=self._update(query, update))
+
+    def bulk_write(self, requests: List, ordered: bool = True) -> SimpleNamespace:
+        """UpdateOne (upserts included) and DeleteOne requests, in one round trip."""
+        self._write()
+        modified = deleted = 0
+        for request in requests:
+            if isinstance(request, DeleteOne):
+                deleted += self._delete_one(request._filter)
+            else:
+                modified += self._update(request._filter, request._doc, request._upsert)
+        return SimpleNamespace(modified_count=modified, deleted_count=deleted)
+
+    def delete_many(self, query: Dict) -> SimpleNamespace:
+        self._write()
+        kept = [d for d in self.docs if not self._matches(d, query)]
+        deleted, self.docs = len(self.docs) - len(kept), kept
+        return SimpleNamespace(deleted_count=deleted)
+
+    def distinct(self, key: str, query: Optional[Dict] = None) -> List:
+        """Values of `key` among matching documents, computed server-side (no docs_returned)."""
+        values, seen = [], set()
+        for doc in self.docs:
+            found, value = self._get(doc, key)
+            if found and value not in seen and self._matches(doc, query or {}):
+                seen.add(value)
+                values.append(value)
+        return values
+
+    def _update(self, query: Dict, update: Dict, upsert: bool = False) -> int:
+        """Apply top-level $set and $inc to the first match; with `upsert`, insert one if none."""
+        for doc in self.docs:
+            if self._matches(doc, query):
+                doc.update(update.get("$set", {}))
+                for field, amount in update.get("$inc", {}).items():
+                    doc[field] = doc.get(field, 0) + amount
+                return 1
+        if upsert:
+            doc = {key: value for key, value in query.items() if not isinstance(value, dict)}
+            doc.update(update.get("$setOnInsert", {}))
+            doc.update(update.get("$set", {}))
+            doc.update(update.get("$inc", {}))
+            doc.setdefault("_id", ObjectId())
+            self.docs.append(doc)
+        return 0
+
+    def _delete_one(self, query: Dict) -> int:
+        for i, doc in enumerate(self.docs):
+            if self._matches(doc, query):
+                del self.docs[i]
+                return 1
+        return 0
+
+    def _write(self) -> None:
+        self.write_calls += 1
+        if self.write_latency:
+            time.sleep(self.write_latency)
+
+    def find(self, query: Optional[Dict] = None, projection: Optional[Dict] = None) -> FakeCursor:
+        ids = (query or {}).get("_id")
+        if isinstance(ids, dict) and list(ids) == ["$in"] and len(query) == 1:
+            # Served by the _id index on a real server
+            by_id = {d["_id"]: d for d in self.docs}
+            docs = [by_id[i] for i in ids["$in"] if i in by_id]
+        else:
+            docs = [d for d in self.docs if self._matches(d, query or {})]
+        if projection:
+            docs = [self._project(d, projection) for d in docs]
+        return FakeCursor(self, docs)
+
+    def find_one(self, query: Optional[Dict] = None, projection: Optional[Dict] = None) -> Optional[Dict]:
+        for doc in self.docs:
+            if self._matches(doc, query or {}):
+                return self._project(doc, projection) if projection else doc
+        return None
+
+    def count_documents(self, query: Dict) -> int:
+        return sum(1 for d in self.docs if self._matches(d, query))
+
+    def create_index(self, keys, name: Optional[str] = None, **kwargs) -> str:
+        name = name or "_".join(f"{field}_{direction}" for field, direction in keys)
+        self.indexes[name] = list(keys)
+        return name
+
+    def watch(self, *args, **kwargs):
+        raise RuntimeError("change streams need a replica set")
+
+    @staticmethod
+    def _get(doc: Dict, path: str):
+        """(found, value) for a dotted field path."""
+        value = doc
+        for part in path.split("."):
+            if not isinstance(value, dict) or part not in value:
+                return False, None
+            value = value[part]
+        return True, value
+
+    @classmethod
+    def _matches(cls, doc: Dict, query: Dict) -> bool:
+        for key, cond in query.items():
+            found, value = cls._get(doc, key)
+            if isinstance(cond, dict):
+                if "$exists" in cond and found != cond["$exists"]:
+                    return False
+                if "$in" in cond and not (found and value in cond["$in"]):
+                    return False
+                for op, test in (("$gt", lambda v, c: v > c), ("$gte", lambda v, c: v >= c),
+                                 ("$lt", lambda v, c: v < c), ("$lte", lambda v, c: v <= c)):
+                    if op in cond and not (found and test(value, cond[op])):
+                        return False
+            elif value != cond:
+                return False
+        return True
+
+    @classmethod
+    def _project(cls, doc: Dict, projection: Dict) -> Dict:
+        """Apply an inclusion projection (dotted paths allowed), like the server would."""
+        projected = {"_id": doc["_id"]} if projection.get("_id", 1) and "_id" in doc else {}
+        for path, include in projection.items():
+            if not include or path == "_id":
+                continue
+            found, value = cls._get(doc, path)
+            if not found:
+                continue
+            target = projected
+            parts = path.split(".")
+            for part in parts[:-1]:
+                target = target.setdefault(part, {})
+            target[parts[-1]] = value
+        return projected
+
+
+class FakeDatabase:
+    def __init__(self, name: str = "BFB"):
+        self.name = name
+        self.collections: Dict[str, FakeCollection] = {}
+
+    def __getitem__(self, name: str) -> FakeCollection:
+        if name not in self.collections:
+            self.collections[name] = FakeCollection(name, self)
+        return self.collections[name]
+
+
+class SlowEmbedder(Embedder):
+    """HashingEmbedder that sleeps like a network round trip in aembed()."""
+
+    def __init__(self, latency: float = 0.0, dim: int = 256):
+        self.inner = HashingEmbedder(dim)
+        self.model = self.inner.model
+        self.latency = latency
+        self.calls = 0
+
+    def embed(self, texts: List[str]) -> np.ndarray:
+        self.calls += 1
+        return self.inner.embed(texts)
+
+    async def aembed(self, texts: List[str]) -> np.ndarray:
+        self.calls += 1
+        if self.latency:
+            await asyncio.sleep(self.latency)
+        return self.inner.embed(texts)
+
+
+class StubLLM:
+    """
+    AsyncOpenAI look-alike whose chat completions return a fixed receipt.
+
+    Every call answers with `products` as fenced JSON, the way gpt-4o-mini
+    usually does, after sleeping `latency` seconds; a batched prompt gets
+    the same products for each of its receipt ids.
+    """
+
+    def __init__(self, products: Optional[Dict] = None, latency: float = 0.0):
+        self.products = products or {
+            "Brake cable": {"pick_up_time": None, "drop_off_location": None, "drop_off_time": None,
+                            "pick_up_location": "Dock 4", "quantity": 2, "price": 12.5}
+        }
+        self.latency = latency
+        self.calls = 0
+        # Receipts asked about in each call
+        self.batch_sizes: List[int] = []
+        self.chat = SimpleNamespace(completions=SimpleNamespace(create=self._create))
+
+    async def _create(self, **kwargs):
+        self.calls += 1
+        ids = [int(i) for i in re.findall(r'^\{"id": (\d+), "ocr"', kwargs["messages"][-1]["content"], re.M)]
+        self.batch_sizes.append(len(ids) or 1)
+        if self.latency:
+            await asyncio.sleep(self.latency)
+        answer = {"receipts": [{"id": i, "products": self.products} for i in ids]} if ids else {"products": self.products}
+        content = "```json\n" + json.dumps(answer) + "\n```"
+        return SimpleNamespace(choices=[SimpleNamespace(message=SimpleNamespace(content=content))])
+
+
+def receipt_png(size: int = 64) -> bytes:
+    """A small blank PNG to upload where OCR is stubbed out anyway."""
+    buffer = io.BytesIO()
+    Image.new("RGB", (size, size), "white").save(buffer, format="PNG")
+    return buffer.getvalue()
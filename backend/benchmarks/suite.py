@@ -0,0 +1,266 @@
+#!/usr/bin/env python3
+"""
+Offline benchmark suite: /search and /process-image through the ASGI app.
+
+For each corpus size, loads a synthetic receipt corpus into a fake Mongo
+collection (deterministic hashing embedder, stub LLM, stubbed OCR; no
+network or keys needed), builds the resident index, and measures through
+the app's routers:
+- search: /search over a fixed query mix
+- search_filtered: the same queries with user and price filters
+- ingest: /process-image uploads, each a distinct receipt
+
+Each scenario reports throughput and latency percentiles. Results go to a
+JSON file with the commit and environment; --compare checks them against
+an earlier file and exits non-zero if any scenario regressed by more than
+--tolerance.
+
+Usage (from backend/):
+    python -m benchmarks.suite --products 1000 100000 --out bench_results.json
+    python -m benchmarks.suite --products 1000 100000 --compare bench_results.json
+    python -m benchmarks.suite --products 1000000 --dim 64 --searches 200
+"""
+
+import sys
+import json
+import time
+import asyncio
+import argparse
+import platform
+import subprocess
+from contextlib import contextmanager
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timezone
+from typing import Dict, List
+import numpy as np
+import httpx
+from fastapi import FastAPI
+import routes.ocr as ocr
+import routes.Image_detection as image_detection
+from routes.Image_detection import router as image_router
+from routes.search import router as search_router
+from routes.vector_index import SearchIndex
+from routes.index_refresh import IndexMaintainer
+from routes.query_cache import Generation, SearchResultCache
+from benchmarks.corpus import load_corpus, synthetic_queries, USERS
+from benchmarks.fakes import FakeDatabase, SlowEmbedder, StubLLM, receipt_png
+
+# Metrics where a larger value is worse
+_LOWER_IS_BETTER = ("p50_ms", "p95_ms", "p99_ms")
+_HIGHER_IS_BETTER = ("throughput_rps",)
+
+
+@contextmanager
+def stubbed_ocr():
+    """Make OCR return a distinct receipt per call, and keep formatted_output.json untouched."""
+    counter = iter(range(sys.maxsize))
+    originals = (ocr.pytesseract.image_to_string, image_detection.write_formatted_output)
+    ocr.pytesseract.image_to_string = lambda image, lang="eng": f"BENCH RECEIPT {next(counter)}\nBRAKE CABLE 2 x 12.50"
+    image_detection.write_formatted_output = lambda parsed_json: None
+    try:
+        yield
+    finally:
+        ocr.pytesseract.image_to_string, image_detection.write_formatted_output = originals
+
+
+def build_app(products: int, args) -> tuple:
+    """
+    The search and image routers on fake state holding a corpus of `products` line items.
+
+    Returns:
+        (app, setup) where setup has corpus/index build times and sizes
+    """
+    database = FakeDatabase()
+    collection = database["chatbot"]
+    embedder = SlowEmbedder(latency=args.embed_latency, dim=args.dim)
+
+    start = time.perf_counter()
+    receipts = load_corpus(collection, products, embedder.inner, seed=args.seed)
+    corpus_seconds = time.perf_counter() - start
+    start = time.perf_counter()
+    index = SearchIndex.from_collection(collection)
+    index_seconds = time.perf_counter() - start
+
+    app = FastAPI()
+    app.include_router(image_router)
+    app.include_router(search_router)
+    app.state.db = database
+    app.state.search_index = index
+    app.state.index_maintainer = IndexMaintainer(collection, index)
+    app.state.embedder = embedder
+    app.state.query_embedder = embedder
+    app.state.async_openai = StubLLM(latency=args.llm_latency)
+    app.state.cpu_executor = ThreadPoolExecutor(max_workers=args.cpu_workers)
+    app.state.ocr_engine = None
+    if args.result_cache:
+        app.state.search_generation = Generation()
+        app.state.search_result_cache = SearchResultCache()
+    setup = {
+        "receipts": receipts,
+        "indexed_products": index.product_count,
+        "corpus_seconds": round(corpus_seconds, 3),
+        "index_build_seconds": round(index_seconds, 3),
+        "matrix_bytes": index.matrix_bytes,
+    }
+    return app, setup
+
+
+async def measure(requests: List, concurrency: int) -> Dict:
+    """
+    Run request coroutine factories with at most `concurrency` in flight.
+
+    Returns:
+        Request and error counts, throughput and latency percentiles
+    """
+    latencies, errors = [], 0
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def one(make_request):
+        nonlocal errors
+        async with semaphore:
+            start = time.perf_counter()
+            response = await make_request()
+            latencies.append(time.perf_counter() - start)
+            if response.status_code >= 400:
+                errors += 1
+
+    start = time.perf_counter()
+    await asyncio.gather(*(one(request) for request in requests))
+    elapsed = time.perf_counter() - start
+    milliseconds = np.array(latencies) * 1000
+    p50, p95, p99 = np.percentile(milliseconds, [50, 95, 99])
+    return {
+        "requests": len(requests),
+        "errors": errors,
+        "throughput_rps": round(len(requests) / elapsed, 2),
+        "mean_ms": round(float(milliseconds.mean()), 3),
+        "p50_ms": round(float(p50), 3),
+        "p95_ms": round(float(p95), 3),
+        "p99_ms": round(float(p99), 3),
+    }
+
+
+async def run_size(products: int, args) -> List[Dict]:
+    app, setup = build_app(products, args)
+    queries = synthetic_queries(args.queries, seed=args.seed + 1)
+    image = receipt_png()
+    rows = []
+    try:
+        async with httpx.AsyncClient(transport=httpx.ASGITransport(app=app), base_url="http://bench", timeout=120) as client:
+            def search(i, **filters):
+                params = {"q": queries[i % len(queries)], "limit": args.limit, **filters}
+                return lambda: client.get("/search", params=params)
+
+            def upload(i):
+                return lambda: client.post(
+                    "/process-image",
+                    files={"file": (f"bench-{i}.png", image, "image/png")},
+                    params={"user_id": str(i % len(USERS)), "pick_up_location": "Dock 4"}
+                )
+
+            scenarios = [
+                ("search", [search(i) for i in range(args.searches)]),
+                ("search_filtered", [search(i, user_id=str(i % len(USERS)), min_price=10) for i in range(args.searches)]),
+                ("ingest", [upload(i) for i in range(args.uploads)]),
+            ]
+            await measure([search(i) for i in range(min(20, args.searches))], args.concurrency)   # warm-up
+            for name, requests in scenarios:
+                if not requests:
+                    continue
+                stats = await measure(requests, args.concurrency)
+                rows.append({"products": products, "scenario": name, **stats, **setup})
+                print(f"{products:>9,} products  {name:<16} {stats['throughput_rps']:9.1f} req/s  "
+                      f"p50 {stats['p50_ms']:8.2f}ms  p95 {stats['p95_ms']:8.2f}ms  p99 {stats['p99_ms']:8.2f}ms"
+                      f"{'  (' + str(stats['errors']) + ' errors)' if stats['errors'] else ''}")
+    finally:
+        app.state.cpu_executor.shutdown()
+    return rows
+
+
+def environment() -> Dict:
+    """Commit and machine the results were measured on."""
+    try:
+        commit = subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True, timeout=10).stdout.strip()
+    except Exception:
+        commit = ""
+    return {
+        "commit": commit or None,
+        "timestamp": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+        "python": platform.python_version(),
+        "numpy": np.__version__,
+        "platform": platform.platform(),
+        "machine": platform.machine(),
+    }
+
+
+def run_suite(args) -> Dict:
+    with stubbed_ocr():
+        rows = []
+        for products in args.products:
+            rows.extend(asyncio.run(run_size(products, args)))
+    settings = {key: value for key, value in vars(args).items() if key not in ("out", "compare")}
+    return {"environment": environment(), "settings": settings, "results": rows}
+
+
+def compare(current: Dict, baseline: Dict, tolerance: float) -> List[str]:
+    """
+    Scenarios that got worse than `baseline` by more than `tolerance` (a fraction).
+
+    Returns:
+        One line per regression; rows missing from either run are skipped
+    """
+    previous = {(row["products"], row["scenario"]): row for row in baseline["results"]}
+    regressions = []
+    for row in current["results"]:
+        before = previous.get((row["products"], row["scenario"]))
+        if before is None:
+            continue
+        for metric in _LOWER_IS_BETTER + _HIGHER_IS_BETTER:
+            old, new = before.get(metric), row.get(metric)
+            if not old or new is None:
+                continue
+            change = (new - old) / old
+            worse = change > tolerance if metric in _LOWER_IS_BETTER else change < -tolerance
+            marker = "  REGRESSION" if worse else ""
+            print(f"{row['products']:>9,} {row['scenario']:<16} {metric:<15} {old:10.2f} -> {new:10.2f} ({change:+.1%}){marker}")
+            if worse:
+                regressions.append(f"{row['products']} {row['scenario']} {metric}: {old} -> {new} ({change:+.1%})")
+    return regressions
+
+
+def main(args) -> int:
+    report = run_suite(args)
+    if args.out:
+        with open(args.out, "w") as f:
+            json.dump(report, f, indent=2)
+        print(f"\nResults written to {args.out}")
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+        print(f"\nAgainst {args.compare} (commit {baseline['environment'].get('commit')}):")
+        regressions = compare(report, baseline, args.tolerance)
+        if regressions:
+            print(f"\n{len(regressions)} regression(s) beyond {args.tolerance:.0%}")
+            return 1
+        print(f"\nNo regressions beyond {args.tolerance:.0%}")
+    return 0
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--products", type=int, nargs="+", default=[1000, 100000], help="corpus sizes in line items")
+    parser.add_argument("--dim", type=int, default=128, help="embedding dimensions")
+    parser.add_argument("--searches", type=int, default=500)
+    parser.add_argument("--uploads", type=int, default=100)
+    parser.add_argument("--concurrency", type=int, default=8)
+    parser.add_argument("--queries", type=int, default=50, help="distinct queries in the mix")
+    parser.add_argument("--limit", type=int, default=10)
+    parser.add_argument("--embed-latency", type=float, default=0.0, help="seconds per embeddings call")
+    parser.add_argument("--llm-latency", type=float, default=0.0, help="seconds per chat completion")
+    parser.add_argument("--cpu-workers", type=int, default=4)
+    parser.add_argument("--result-cache", action="store_true", help="answer repeated searches from the result cache")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--out", default="bench_results.json", help="where to write results ('' to skip)")
+    parser.add_argument("--compare", help="earlier results file to check for regressions")
+    parser.add_argument("--tolerance", type=float, default=0.2, help="allowed slowdown as a fraction (0.2 = 20%%)")
+    sys.exit(main(parser.parse_args()))
@@ -0,0 +1,70 @@
+import os
+import json
+import time
+import logging
+from typing import Dict, Optional
+
+# Attributes every LogRecord has; anything else came in through `extra=`
+_RECORD_FIELDS = set(vars(logging.LogRecord("", 0, "", 0, "", (), None))) | {"message", "asctime"}
+
+
+class StructuredFormatter(logging.Formatter):
+    """
+    One line per record with the fields passed through `extra=`.
+
+    As text: "<time> <LEVEL> <logger>: <message> key=value ...";
+    with json_lines=True: a JSON object with time, level, logger, message
+    and the extra fields, for log shippers.
+    """
+
+    def __init__(self, json_lines: bool = False):
+        super().__init__()
+        self.json_lines = json_lines
+
+    def format(self, record: logging.LogRecord) -> str:
+        fields = {key: value for key, value in vars(record).items() if key not in _RECORD_FIELDS}
+        timestamp = time.strftime("%Y-%m-%dT%H:%M:%S", time.gmtime(record.created)) + f".{int(record.msecs):03d}Z"
+        message = record.getMessage()
+        if self.json_lines:
+            entry = {"time": timestamp, "level": record.levelname, "logger": record.name, "message": message, **fields}
+            if record.exc_info:
+                entry["exception"] = self.formatException(record.exc_info)
+            return json.dumps(entry, default=str)
+        line = f"{timestamp} {record.levelname} {record.name}: {message}"
+        if fields:
+            line += " " + " ".join(f"{key}={value}" for key, value in fields.items())
+        if record.exc_info:
+            line += "\n" + self.formatException(record.exc_info)
+        return line
+
+
+def parse_levels(spec: str) -> Dict[str, str]:
+    """LOG_LEVELS like "routes.search=WARNING,routes.Image_detection=DEBUG" as {logger: level}."""
+    levels = {}
+    for part in spec.split(","):
+        name, _, level = part.partition("=")
+        if name.strip() and level.strip():
+            levels[name.strip()] = level.strip().upper()
+    return levels
+
+
+def configure_logging(level: Optional[str] = None, json_lines: Optional[bool] = None, levels: Optional[str] = None) -> None:
+    """
+    Send the app's loggers to stderr, from the environment.
+
+    LOG_LEVEL sets the root level (INFO), LOG_FORMAT=json switches to JSON
+    lines, and LOG_LEVELS overrides single loggers. Per-request detail on
+    the search and ingest hot paths is logged at DEBUG, so at the default
+    level it costs one level check per call.
+    """
+    level = level or os.getenv("LOG_LEVEL", "INFO")
+    json_lines = json_lines if json_lines is not None else os.getenv("LOG_FORMAT", "text").lower() == "json"
+    handler = logging.StreamHandler()
+    handler.setFormatter(StructuredFormatter(json_lines))
+    root = logging.getLogger()
+    for existing in [h for h in root.handlers if isinstance(h.formatter, StructuredFormatter)]:
+        root.removeHandler(existing)
+    root.addHandler(handler)
+    root.setLevel(level.upper())
+    for name, logger_level in parse_levels(levels if levels is not None else os.getenv("LOG_LEVELS", "")).items():
+        logging.getLogger(name).setLevel(logger_level)
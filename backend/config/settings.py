@@ -1,9 +1,33 @@
 from fastapi import FastAPI
 import os
+import logging
 from fastapi.middleware.cors import CORSMiddleware
 from pymongo.mongo_client import MongoClient
 from pymongo.server_api import ServerApi
 from dotenv import load_dotenv
+from routes.vector_index import SearchIndex
+from routes.index_refresh import IndexMaintainer
+from routes.index_snapshot import SnapshotStore
+from routes.embeddings import get_embedder
+from routes.query_cache import QueryEmbeddingCache, CachedEmbedder, Generation, SearchResultCache
+from openai import OpenAI, AsyncOpenAI
+from concurrent.futures import ThreadPoolExecutor
+from routes.ocr import OCREngine
+from routes.ingest_cache import IngestDedupCache
+from routes.jobs import JobStore, JobQueue
+from routes.Image_detection import run_ingest_job, detector_from_state
+from routes.search import ItemSearch
+from routes.search_filters import ensure_search_indexes
+from routes.line_items import ensure_line_item_indexes
+from routes.stock import StockRollups
+from routes.ann_index import IVFIndex
+from routes.structuring import StructuringCache
+from config.logging_config import configure_logging
+from functools import partial
+from contextlib import asynccontextmanager
+import httpx
+
+logger = logging.getLogger(__name__)
 
 load_dotenv()
 
@@ -14,18 +38,59 @@ MONGO_URI = os.getenv("MONGODB_URI")
 client = None
 db = None
 
+def mongo_client_options() -> dict:
+    """Connection pool and timeout settings for the MongoClient, from the environment."""
+    return {
+        "maxPoolSize": int(os.getenv("MONGO_MAX_POOL_SIZE", "50")),
+        "minPoolSize": int(os.getenv("MONGO_MIN_POOL_SIZE", "0")),
+        "maxIdleTimeMS": int(os.getenv("MONGO_MAX_IDLE_TIME_MS", "300000")),
+        "connectTimeoutMS": int(os.getenv("MONGO_CONNECT_TIMEOUT_MS", "5000")),
+        "serverSelectionTimeoutMS": int(os.getenv("MONGO_SERVER_SELECTION_TIMEOUT_MS", "5000")),
+        "socketTimeoutMS": int(os.getenv("MONGO_SOCKET_TIMEOUT_MS", "30000")),
+        "waitQueueTimeoutMS": int(os.getenv("MONGO_WAIT_QUEUE_TIMEOUT_MS", "10000")),
+    }
+
 def get_database():
     """Get database connection, initialize if needed"""
     global client, db
     if client is None and MONGO_URI:
         try:
-            client = MongoClient(MONGO_URI, server_api=ServerApi('1'))
+            client = MongoClient(MONGO_URI, server_api=ServerApi('1'), **mongo_client_options())
             db = client["BFB"]
         except Exception as e:
-            print(f"Warning: Could not connect to MongoDB: {e}")
+            logger.warning("Could not connect to MongoDB: %s", e)
             return None
     return db
 
+def close_database():
+    """Close the shared MongoClient and its pooled connections."""
+    global client, db
+    if client is not None:
+        client.close()
+    client = None
+    db = None
+
+def make_openai_clients(api_key: str):
+    """
+    One sync and one async OpenAI client over pooled keep-alive connections.
+
+    Returns:
+        (OpenAI, AsyncOpenAI); close both when the app shuts down
+    """
+    limits = httpx.Limits(
+        max_connections=int(os.getenv("OPENAI_MAX_CONNECTIONS", "100")),
+        max_keepalive_connections=int(os.getenv("OPENAI_MAX_KEEPALIVE", "20")),
+        keepalive_expiry=float(os.getenv("OPENAI_KEEPALIVE_SECONDS", "30"))
+    )
+    timeout = httpx.Timeout(float(os.getenv("OPENAI_TIMEOUT_SECONDS", "60")), connect=5.0)
+    max_retries = int(os.getenv("OPENAI_MAX_RETRIES", "2"))
+    return (
+        OpenAI(api_key=api_key, max_retries=max_retries,
+               http_client=httpx.Client(limits=limits, timeout=timeout)),
+        AsyncOpenAI(api_key=api_key, max_retries=max_retries,
+                    http_client=httpx.AsyncClient(limits=limits, timeout=timeout)),
+    )
+
 # Allowed frontend origins
 ALLOWED_ORIGINS = [
     "http://localhost:5173",
@@ -62,15 +127,43 @@ def configure_cors(app: FastAPI):
         allow_headers=["*"],
     )
 
+def search_index_options() -> dict:
+    """
+    How /search fuses vector and BM25 scores, from the environment.
+
+    SEARCH_FUSION is "weighted" (similarity + SEARCH_LEXICAL_WEIGHT * BM25
+    scaled to the best match) or "rrf" (reciprocal-rank fusion with
+    SEARCH_RRF_K). SEARCH_ANN=ivf turns on approximate search once the index
+    has SEARCH_ANN_MIN_ROWS rows, probing SEARCH_ANN_NPROBE of
+    SEARCH_ANN_NLIST lists (default sqrt(rows)); the quantizer is kept in
+    SEARCH_ANN_PATH across restarts. SEARCH_INDEX_PRECISION=int8 keeps the
+    vectors quantized in memory and re-ranks the top SEARCH_RERANK_DEPTH
+    candidates from Mongo. EMBEDDING_DIMENSIONS shortens stored vectors that
+    are longer than new ones.
+    """
+    return {
+        "dim": int(os.getenv("EMBEDDING_DIMENSIONS", "0")) or None,
+        "precision": os.getenv("SEARCH_INDEX_PRECISION", "float32"),
+        "rerank_depth": int(os.getenv("SEARCH_RERANK_DEPTH", "100")),
+        "fusion": os.getenv("SEARCH_FUSION", "weighted"),
+        "lexical_weight": float(os.getenv("SEARCH_LEXICAL_WEIGHT", "0.15")),
+        "rrf_k": int(os.getenv("SEARCH_RRF_K", "60")),
+        "ann": IVFIndex.from_env(),
+    }
+
+
 # Function: initialize_state
 def initialize_state(app: FastAPI):
     """
     Initializes the FastAPI application state with database connections and caching structures.
     
+    Runs once per process from `lifespan`; `shutdown_state` tears it down.
     This function sets up:
     1. Database connection in app state for access across endpoints
     2. User seen map for tracking which games users have viewed
     3. MongoDB indexes for optimized query performance
+    4. The in-memory search index over embedded receipts in BFB.chatbot,
+       kept current by a background IndexMaintainer
     
     Args:
         app (FastAPI): The FastAPI application instance to initialize
@@ -78,6 +171,179 @@ def initialize_state(app: FastAPI):
     State Variables:
         - app.state.db: MongoDB database instance
         - app.state.user_seen_map: Dict mapping usernames to sets of seen game IDs
+        - app.state.search_index: SearchIndex used by /search
+        - app.state.index_snapshots: SnapshotStore the index is opened from and saved to, or None
+        - app.state.index_maintainer: IndexMaintainer feeding new receipts into the index
+        - app.state.async_openai: AsyncOpenAI client for request handlers
+        - app.state.cpu_executor: Bounded executor for CPU-bound work
+        - app.state.ocr_engine: Process-pool OCR stage for uploaded receipts
+        - app.state.ingest_cache: IngestDedupCache for repeated receipt uploads
+        - app.state.llm_cache: StructuringCache of LLM answers per OCR text
+        - app.state.embedder: Embedder shared by ingest and search
+        - app.state.query_embedding_cache: QueryEmbeddingCache for /search queries
+        - app.state.query_embedder: app.state.embedder behind the query cache
+        - app.state.job_queue: JobQueue for /process-image?background=true uploads
+        - app.state.openai: Sync OpenAI client sharing the async one's pool settings
+        - app.state.search_generation: Generation bumped by every receipt insert
+        - app.state.search_result_cache: SearchResultCache of /search responses
+        - app.state.line_items: BFB.line_items, written by every receipt insert
+        - app.state.search_line_items: The same, when LINE_ITEM_FILTERS says the
+          migration has run and searches may narrow their reads with it
+        - app.state.stock_rollups: StockRollups over BFB.stock_rollups, added
+          to by every receipt insert and read by /stock/summary
+        - app.state.item_search: ItemSearch used by every /search request
+        - app.state.image_detection: ImageDetection used by every upload
     """
+    configure_logging()
     app.state.db = get_database()        # initializing database
     app.state.seen_map = {}              # key: username, value: set of seen game IDs
+
+    # Request handlers use the async client; the sync one serves background threads
+    openai_key = os.getenv("OPENAI_API_KEY")
+    app.state.openai, app.state.async_openai = make_openai_clients(openai_key) if openai_key else (None, None)
+
+    # CPU-bound work runs here so it never blocks the event loop
+    app.state.cpu_executor = ThreadPoolExecutor(
+        max_workers=int(os.getenv("CPU_WORKERS", str(os.cpu_count() or 4))),
+        thread_name_prefix="cpu"
+    )
+
+    # OCR gets its own worker processes, pre-processing and size limits
+    app.state.ocr_engine = OCREngine.from_env()
+
+    # Re-uploads of the same receipt skip OCR, the LLM and the insert
+    app.state.ingest_cache = IngestDedupCache(
+        max_entries=int(os.getenv("INGEST_CACHE_SIZE", "2048")),
+        max_age_seconds=float(os.getenv("INGEST_CACHE_MAX_AGE_SECONDS", str(7 * 86400)))
+    )
+
+    # Receipt text the LLM has already structured isn't sent again
+    app.state.llm_cache = StructuringCache(max_entries=int(os.getenv("LLM_CACHE_SIZE", "4096")))
+
+    # One embedder for both ingest and queries so vectors share a space
+    app.state.embedder = get_embedder(app.state.openai, app.state.async_openai)
+
+    # Repeated queries are answered from memory instead of the embeddings API
+    cache = QueryEmbeddingCache(
+        max_entries=int(os.getenv("QUERY_CACHE_SIZE", "1024")),
+        ttl_seconds=float(os.getenv("QUERY_CACHE_TTL_SECONDS", "86400")),
+        path=os.getenv("QUERY_CACHE_PATH")
+    )
+    app.state.query_embedding_cache = cache
+    app.state.query_embedder = CachedEmbedder(app.state.embedder, cache) if app.state.embedder else None
+
+    # Compound indexes behind filtered search reads, and each receipt's
+    # products fanned out one per document (see routes.line_items), and the
+    # dashboard's counters kept up to date per insert (see routes.stock)
+    app.state.line_items = None
+    app.state.search_line_items = None
+    app.state.stock_rollups = None
+    if app.state.db is not None:
+        ensure_search_indexes(app.state.db["chatbot"])
+        app.state.line_items = app.state.db["line_items"]
+        ensure_line_item_indexes(app.state.line_items)
+        if os.getenv("LINE_ITEM_FILTERS", "false").lower() in ("true", "1"):
+            app.state.search_line_items = app.state.line_items
+        app.state.stock_rollups = StockRollups(app.state.db["stock_rollups"])
+        app.state.stock_rollups.ensure_indexes()
+
+    # Build the resident search index once instead of scanning per query;
+    # with SEARCH_SNAPSHOT_DIR, workers open one shared memory-mapped snapshot
+    # and only fetch what changed since it was saved
+    # The index only takes vectors from the embedding space queries are in
+    index_options = {**search_index_options(), "model": app.state.embedder.model if app.state.embedder else None}
+    app.state.index_snapshots = SnapshotStore.from_env()
+    app.state.search_index = SearchIndex(**index_options)
+    opened_snapshot = False
+    if app.state.db is not None:
+        try:
+            if app.state.index_snapshots is not None:
+                app.state.search_index = app.state.index_snapshots.open_or_build(app.state.db["chatbot"], **index_options)
+                opened_snapshot = True
+            else:
+                app.state.search_index = SearchIndex.from_collection(app.state.db["chatbot"], **index_options)
+        except Exception as e:
+            logger.warning("Could not build search index: %s", e)
+
+    # Follow new inserts into BFB.chatbot for the lifetime of the app
+    app.state.index_maintainer = None
+    if app.state.db is not None:
+        maintainer = IndexMaintainer(
+            app.state.db["chatbot"],
+            app.state.search_index,
+            poll_interval=float(os.getenv("SEARCH_INDEX_POLL_SECONDS", "2")),
+            snapshots=app.state.index_snapshots,
+            snapshot_interval=float(os.getenv("SEARCH_SNAPSHOT_INTERVAL_SECONDS", "600"))
+        )
+        app.state.index_maintainer = maintainer
+        if opened_snapshot:
+            try:
+                changes = maintainer.catch_up()
+                logger.info("Search index caught up with chatbot", extra=changes)
+            except Exception as e:
+                logger.warning("Could not catch the search index up: %s", e)
+
+    # Background uploads: persisted in SQLite, run by in-process workers
+    app.state.job_queue = JobQueue(
+        JobStore(os.getenv("JOB_DB_PATH", "jobs.sqlite3"), float(os.getenv("JOB_LEASE_SECONDS", "300"))),
+        partial(run_ingest_job, app.state),
+        workers=int(os.getenv("JOB_WORKERS", "2")),
+        max_pending=int(os.getenv("JOB_QUEUE_SIZE", "100")),
+        retention_seconds=float(os.getenv("JOB_RETENTION_SECONDS", str(7 * 86400)))
+    )
+
+    # Repeated searches are answered from memory until the next insert
+    app.state.search_generation = Generation()
+    app.state.search_result_cache = SearchResultCache(
+        max_entries=int(os.getenv("SEARCH_RESULT_CACHE_SIZE", "1024")),
+        max_rows=int(os.getenv("SEARCH_RESULT_CACHE_ROWS", "50000"))
+    )
+
+    # Per-process singletons, so requests don't rebuild clients or indexes
+    app.state.item_search = None
+    app.state.image_detection = None
+    if app.state.db is not None:
+        app.state.item_search = ItemSearch(
+            app.state.db,
+            app.state.search_index,
+            app.state.query_embedder,
+            app.state.search_result_cache,
+            app.state.search_generation,
+            app.state.search_line_items
+        )
+        app.state.image_detection = detector_from_state(app.state)
+
+# Function: shutdown_state
+async def shutdown_state(app: FastAPI):
+    """
+    Stops background work and releases everything initialize_state created,
+    in reverse order of dependency: job workers and the index follower first,
+    then pools and caches, then the OpenAI and Mongo connections.
+    """
+    state = app.state
+    await state.job_queue.stop()
+    if state.index_maintainer is not None:
+        state.index_maintainer.stop()
+    state.search_index.save_ann()
+    state.query_embedding_cache.save()
+    state.ocr_engine.shutdown()
+    state.cpu_executor.shutdown(wait=True)
+    if state.async_openai is not None:
+        await state.async_openai.close()
+    if state.openai is not None:
+        state.openai.close()
+    close_database()
+    state.db = None
+    logger.info("Shut down cleanly")
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    """App lifespan: build shared state, start background work, tear down on exit."""
+    initialize_state(app)
+    if app.state.index_maintainer is not None:
+        app.state.index_maintainer.start()
+    await app.state.job_queue.start()
+    try:
+        yield
+    finally:
+        await shutdown_state(app)
@@ -2,11 +2,14 @@ from mimetypes import init
 from fastapi import FastAPI
 from routes.home import router as home_router
 from routes.users import router as user_router 
-from config.settings import initialize_state
+from config.settings import lifespan
 from routes.Image_detection import router as image_router
 from routes.search import router as search_router
+from routes.jobs import router as jobs_router
+from routes.metrics import router as metrics_router
+from routes.stock import router as stock_router
 from fastapi.middleware.cors import CORSMiddleware
-app = FastAPI(title="My App")
+app = FastAPI(title="My App", lifespan=lifespan)
 
 app.add_middleware(
     CORSMiddleware,
@@ -16,11 +19,12 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
-initialize_state(app) 
-
 
 # mount routers
 app.include_router(home_router)
 app.include_router(image_router)
 app.include_router(user_router)
 app.include_router(search_router)
+app.include_router(jobs_router)
+app.include_router(metrics_router)
+app.include_router(stock_router)
@@ -1,26 +1,152 @@
 from fastapi import APIRouter, UploadFile, File, Request, HTTPException
+from fastapi.responses import JSONResponse
+from starlette.concurrency import run_in_threadpool
 from pathlib import Path
-from PIL import Image
-import pytesseract
 import io, os, json
+import time
+import asyncio
+import logging
+from typing import Callable, List, Optional
 from dotenv import load_dotenv
-from openai import OpenAI
+from openai import AsyncOpenAI
+from pymongo.errors import BulkWriteError
+from routes.embeddings import get_embedder, embedding_fields, receipt_texts
+from routes.ocr import run_ocr, OCRQueueFull
+from routes.ingest_cache import image_key, ocr_text_key, uploader_key
+from routes.ingest_pipeline import IngestPipeline
+from routes.jobs import JobQueueFull
+from routes.metrics import EMBEDDING_FAILURES, IN_FLIGHT, INSERT_FAILURES, STAGE_SECONDS
+from routes.structuring import ReceiptStructurer, StructuringCache
+from routes.line_items import insert_line_items
 
 router = APIRouter()
+logger = logging.getLogger(__name__)
 
 @router.get("/image-processing")
-async def root():
-    return {"message": "Image Processing API is running"}
+async def root(request: Request):
+    dedup_cache = getattr(request.app.state, "ingest_cache", None)
+    llm_cache = getattr(request.app.state, "llm_cache", None)
+    return {
+        "message": "Image Processing API is running",
+        "dedup_cache": dedup_cache.stats() if dedup_cache is not None else None,
+        "llm_cache": llm_cache.stats() if llm_cache is not None else None
+    }
+
+def write_formatted_output(parsed_json: dict) -> None:
+    with open("formatted_output.json", "w") as f:
+        json.dump(parsed_json, f, indent=2)
 
 class ImageDetection:
-    def __init__(self, collection):
+    def __init__(
+        self,
+        collection,
+        index_maintainer=None,
+        embedder=None,
+        client=None,
+        executor=None,
+        ocr_engine=None,
+        dedup_cache=None,
+        embedding_storage: Optional[str] = None,
+        generation=None,
+        llm_cache: Optional[StructuringCache] = None,
+        line_items=None,
+        stock_rollups=None
+    ):
         self.collection = collection
-        load_dotenv()
-        key = os.getenv("OPENAI_API_KEY")
-        self.client = OpenAI(api_key=key) if key else None
+        self.index_maintainer = index_maintainer
+        if client is None:
+            load_dotenv()
+            key = os.getenv("OPENAI_API_KEY")
+            client = AsyncOpenAI(api_key=key) if key else None
+        self.client = client
+        # LLM structuring, answered from llm_cache for OCR text seen before
+        self.structurer = ReceiptStructurer(client, llm_cache)
+        self.embedder = embedder if embedder is not None else get_embedder(async_client=self.client)
+        # OCR runs in the engine's process pool; without one, in `executor`
+        # (None means the loop's default pool)
+        self.ocr_engine = ocr_engine
+        self.executor = executor
+        # Repeated uploads are answered from here without OCR, LLM or insert
+        self.dedup_cache = dedup_cache
+        # float32, float16 or int8 (see routes.embeddings.encode_embedding)
+        self.embedding_storage = embedding_storage or os.getenv("EMBEDDING_STORAGE", "float32")
+        # Bumped after every insert so cached /search results are dropped
+        self.generation = generation
+        # BFB.line_items: each inserted receipt's products, one document each
+        self.line_items = line_items
+        # routes.stock.StockRollups: the dashboard's counters, bumped per insert
+        self.stock_rollups = stock_rollups
+
+    async def reorganize(self, upload_file: UploadFile, system_data: dict, progress: Optional[Callable[[str], None]] = None):
+        with IN_FLIGHT.labels("ingest").track_inprogress(), STAGE_SECONDS.labels("ingest", "total").time():
+            return await self._reorganize(upload_file, system_data, progress)
+
+    async def _reorganize(self, upload_file: UploadFile, system_data: dict, progress: Optional[Callable[[str], None]]):
+        timings = {}
+        report = progress or (lambda stage: None)
+        stage_start = time.perf_counter()
 
-    async def reorganize(self, upload_file: UploadFile, system_data: dict):
         # 0) Read bytes (works whether it's really a file or an UploadFile)
+        contents = await self.read_contents(upload_file)
+        stage_start = self._lap(timings, "read_ms", stage_start)
+
+        # 0b) Same image bytes as a recent upload by this uploader: return what it produced
+        image_hash = image_key(contents)
+        cached = self.cached_by_image(image_hash, system_data)
+        if cached is not None:
+            return {**cached, "timings": timings, "dedup": "image_hash"}
+
+        # 1) OCR (non-fatal, except when the OCR queue is full)
+        report("ocr")
+        ocr_text = await self.recognize(contents, timings)
+        stage_start = self._lap(timings, "ocr_total_ms", stage_start)
+
+        # 1b) Same receipt text as a recent upload (e.g. a re-taken photo)
+        text_hash = ocr_text_key(ocr_text)
+        cached = self.cached_by_text(text_hash, image_hash, system_data)
+        if cached is not None:
+            return {**cached, "timings": timings, "dedup": "ocr_text"}
+
+        # 2) LLM structuring (non-fatal; skipped if no key)
+        report("llm")
+        parsed_json = await self.structure(ocr_text, system_data)
+        stage_start = self._lap(timings, "llm_ms", stage_start)
+
+        # 2b) Embeddings for the receipt and each line item (non-fatal)
+        report("embed")
+        embedding_fields = await self.embed_receipt(parsed_json, ocr_text)
+        stage_start = self._lap(timings, "embed_ms", stage_start)
+
+        # 3) Optional: write local JSON (non-fatal)
+        try:
+            await run_in_threadpool(write_formatted_output, parsed_json)
+            logger.debug("Wrote formatted_output.json")
+        except Exception as e:
+            logger.warning("Could not write formatted_output.json: %s", e)
+
+        # 4) Insert into Mongo (ALWAYS attempt if collection exists)
+        report("insert")
+        inserted_id = None
+        if self.collection is not None:
+            try:
+                doc = self.build_document(system_data, upload_file.filename, parsed_json, embedding_fields)
+                with STAGE_SECONDS.labels("ingest", "insert").time():
+                    res = await run_in_threadpool(self.collection.insert_one, doc)
+                inserted_id = str(res.inserted_id)
+                logger.debug("Inserted receipt", extra={"collection": self.collection.name, "inserted_id": inserted_id})
+                self.after_insert(doc, image_hash, text_hash)
+                await self.fan_out([doc])
+            except Exception as e:
+                INSERT_FAILURES.inc()
+                logger.error("Mongo insert failed: %s", e)
+        else:
+            logger.warning("No Mongo collection provided; skipping insert")
+        self._lap(timings, "insert_ms", stage_start)
+
+        return {"inserted_id": inserted_id, "structured_data": parsed_json, "timings": timings, "dedup": None}
+
+    async def read_contents(self, upload_file: UploadFile) -> bytes:
+        """Read an upload's bytes, rejecting images over the OCR engine's limit with a 413."""
         try:
             contents = await upload_file.read()
         finally:
@@ -29,87 +155,254 @@ class ImageDetection:
                 upload_file.file.seek(0)
             except Exception:
                 pass
+        if self.ocr_engine is not None and len(contents) > self.ocr_engine.max_bytes:
+            raise HTTPException(
+                status_code=413,
+                detail=f"Image is {len(contents)} bytes; the limit is {self.ocr_engine.max_bytes}"
+            )
+        return contents
+
+    def cached_by_image(self, image_hash: str, system_data: dict):
+        """Stored result for identical image bytes from the same uploader, or None."""
+        if self.dedup_cache is None:
+            return None
+        cached = self.dedup_cache.lookup_image(image_hash, uploader_key(system_data))
+        if cached is not None:
+            logger.debug("Duplicate upload", extra={"dedup": "image_hash", "inserted_id": cached["inserted_id"]})
+        return cached
+
+    def cached_by_text(self, text_hash, image_hash: str, system_data: dict):
+        """Stored result for the same normalized OCR text from the same uploader, or None."""
+        if self.dedup_cache is None:
+            return None
+        cached = self.dedup_cache.lookup_text(text_hash, uploader_key(system_data), image_hash)
+        if cached is not None:
+            logger.debug("Duplicate upload", extra={"dedup": "ocr_text", "inserted_id": cached["inserted_id"]})
+        return cached
 
-        # 1) OCR (non-fatal)
+    async def recognize(self, contents: bytes, timings: dict) -> str:
+        """
+        OCR an image off the event loop.
+
+        Failures are logged and give empty text, except a full OCR queue,
+        which is raised as a 503 so the client can back off.
+        """
         ocr_text = ""
         try:
-            image = Image.open(io.BytesIO(contents))
-            ocr_text = pytesseract.image_to_string(image, lang="eng") or ""
-            print(f"🧾 OCR chars: {len(ocr_text)}")
+            with STAGE_SECONDS.labels("ingest", "ocr").time():
+                if self.ocr_engine is not None:
+                    ocr_text, ocr_timings = await self.ocr_engine.recognize(contents)
+                    timings.update(ocr_timings)
+                else:
+                    loop = asyncio.get_running_loop()
+                    ocr_text, preprocess_ms, ocr_ms = await loop.run_in_executor(self.executor, run_ocr, contents)
+                    timings.update({"ocr_preprocess_ms": round(preprocess_ms, 2), "ocr_ms": round(ocr_ms, 2)})
+            logger.debug("OCR done", extra={"chars": len(ocr_text)})
+        except OCRQueueFull as e:
+            raise HTTPException(status_code=503, detail=str(e))
         except Exception as e:
-            print(f"⚠️ OCR failed (continuing): {e}")
+            logger.warning("OCR failed (continuing): %s", e)
+        return ocr_text
 
-        # 2) LLM structuring (non-fatal; skipped if no key)
-        parsed_json = {"products": {}, "raw_ocr_text": ocr_text or None}
-        if self.client:
-            try:
-                prompt = f"""
-You are a data parser that extracts structured information from messy OCR text.
-
-OCR:
----
-{ocr_text}
----
-
-Return strictly JSON with this shape:
-
-{{
-  "products": {{
-    "product_name_1": {{
-      "pick_up_time": null,
-      "drop_off_location": null,
-      "drop_off_time": null,
-      "pick_up_location": "{system_data.get("pick_up_location")}",
-      "quantity": null,
-      "price": null
-    }}
-  }}
-}}
-"""
-                resp = self.client.chat.completions.create(
-                    model="gpt-4o-mini",
-                    messages=[
-                        {"role": "system", "content": "You are a structured data extraction assistant."},
-                        {"role": "user", "content": prompt}
-                    ],
-                    temperature=0.1
-                )
-                structured_data = resp.choices[0].message.content.strip()
-                if structured_data.startswith("```json"):
-                    structured_data = structured_data[7:-3].strip()
-                elif structured_data.startswith("```"):
-                    structured_data = structured_data[3:-3].strip()
-                parsed_json = json.loads(structured_data)
-                print("🤖 LLM JSON parsed OK")
-            except Exception as e:
-                print(f"⚠️ OpenAI step failed (continuing): {e}")
+    async def structure(self, ocr_text: str, system_data: dict) -> dict:
+        """Turn OCR text into the products JSON with the LLM (non-fatal; skipped without a client)."""
+        return await self.structurer.structure(ocr_text, system_data)
 
-        # 3) Optional: write local JSON (non-fatal)
+    async def structure_many(self, ocr_texts: List[str], system_data: dict) -> List[dict]:
+        """structure() for receipts picked up together, several per chat completion."""
+        return await self.structurer.structure_many(ocr_texts, system_data)
+
+    @staticmethod
+    def build_document(system_data: dict, filename: str, parsed_json: dict, embedding_fields: dict) -> dict:
+        return {
+            "user_info": system_data,
+            "original_filename": filename,
+            "structured_data": parsed_json,
+            **embedding_fields,
+        }
+
+    def after_insert(self, doc: dict, image_hash: str, text_hash) -> None:
+        """Make an inserted receipt searchable and remember it for dedup (doc must carry its _id)."""
+        if self.index_maintainer is not None:
+            self.index_maintainer.on_insert(doc)
+        if self.generation is not None:
+            self.generation.bump()
+        if self.dedup_cache is not None:
+            self.dedup_cache.store(
+                image_hash, text_hash, uploader_key(doc.get("user_info") or {}), str(doc["_id"]), doc["structured_data"]
+            )
+
+    async def insert_many(self, docs: List[dict]) -> List[Optional[str]]:
+        """
+        Insert receipts in one unordered round trip.
+
+        Documents rejected by the server (e.g. duplicate keys) are reported
+        as failed. If the call itself fails, say on a dropped connection,
+        each document that did not make it in is retried on its own.
+
+        Returns:
+            The inserted _id of each document as a string, or None where it failed
+        """
+        if not docs:
+            return []
         try:
-            with open("formatted_output.json", "w") as f:
-                json.dump(parsed_json, f, indent=2)
-            print("📝 Wrote formatted_output.json")
+            with STAGE_SECONDS.labels("ingest", "insert").time():
+                await run_in_threadpool(self.collection.insert_many, docs, ordered=False)
+            logger.debug("Inserted receipts", extra={"collection": self.collection.name, "count": len(docs)})
+        except BulkWriteError as e:
+            for error in e.details.get("writeErrors", []):
+                docs[error["index"]].pop("_id", None)
+                INSERT_FAILURES.inc()
+                logger.error("Mongo insert failed: %s", error.get("errmsg"))
         except Exception as e:
-            print(f"⚠️ Could not write formatted_output.json: {e}")
+            logger.warning("insert_many failed, retrying one by one: %s", e)
+            for doc in docs:
+                if "_id" in doc and await run_in_threadpool(self.collection.find_one, {"_id": doc["_id"]}, {"_id": 1}):
+                    continue
+                try:
+                    await run_in_threadpool(self.collection.insert_one, doc)
+                except Exception as e:
+                    doc.pop("_id", None)
+                    INSERT_FAILURES.inc()
+                    logger.error("Mongo insert failed: %s", e)
+        await self.fan_out([doc for doc in docs if "_id" in doc])
+        return [str(doc["_id"]) if "_id" in doc else None for doc in docs]
 
-        # 4) Insert into Mongo (ALWAYS attempt if collection exists)
-        inserted_id = None
-        if self.collection is not None:
+    async def fan_out(self, docs: List[dict]) -> None:
+        """
+        Write the line items of inserted receipts to line_items and add them
+        to stock_rollups, in one round trip each.
+
+        Non-fatal: the receipt is the record, and re-running the
+        routes.line_items migration (or routes.stock --repair) fills in
+        whatever is missing.
+        """
+        if not docs:
+            return
+        if self.line_items is not None:
             try:
-                doc = {
-                    "user_info": system_data,
-                    "original_filename": upload_file.filename,
-                    "structured_data": parsed_json,
-                }
-                res = self.collection.insert_one(doc)
-                inserted_id = str(res.inserted_id)
-                print(f"✅ Mongo insert into {self.collection.database.name}.{self.collection.name} _id={inserted_id}")
+                with STAGE_SECONDS.labels("ingest", "line_items").time():
+                    written = await run_in_threadpool(insert_line_items, self.line_items, docs)
+                logger.debug("Wrote line items", extra={"receipts": len(docs), "line_items": written})
             except Exception as e:
-                print(f"❌ Mongo insert failed: {e}")
-        else:
-            print("⚠️ No Mongo collection provided; skipping insert")
+                logger.warning("Line item fan-out failed: %s", e)
+        if self.stock_rollups is not None:
+            try:
+                with STAGE_SECONDS.labels("ingest", "stock_rollups").time():
+                    await run_in_threadpool(self.stock_rollups.apply, docs)
+            except Exception as e:
+                logger.warning("Stock rollup update failed: %s", e)
+
+    @staticmethod
+    def _lap(timings: dict, name: str, since: float) -> float:
+        """Record the milliseconds elapsed since `since` under `name`; return now."""
+        now = time.perf_counter()
+        timings[name] = round((now - since) * 1000, 2)
+        return now
+
+    async def embed_receipt(self, parsed_json: dict, ocr_text: str) -> dict:
+        """
+        Embed a structured receipt for search.
+
+        The receipt text and every product go to the embedder in one call.
+        Vectors are stored as float32 bytes rather than JSON float lists.
+
+        Returns:
+            Fields to merge into the Mongo document (empty if embedding failed)
+        """
+        return (await self.embed_receipts([(parsed_json, ocr_text)]))[0]
+
+    async def embed_receipts(self, receipts: List[tuple]) -> List[dict]:
+        """
+        Embed several (parsed_json, ocr_text) receipts with a single embedder call.
+
+        Returns:
+            One dict of fields to merge into each receipt's Mongo document
+        """
+        fields = [{} for _ in receipts]
+        if self.embedder is None:
+            return fields
+        texts, spans = [], []
+        for parsed_json, ocr_text in receipts:
+            receipt, names = receipt_texts(parsed_json, ocr_text)
+            spans.append((len(texts), len(receipt), names) if receipt else None)
+            texts.extend(receipt)
+        if not texts:
+            return fields
+        try:
+            with STAGE_SECONDS.labels("ingest", "embed").time():
+                vectors = await self.embedder.aembed(texts)
+            logger.debug("Embedded receipts", extra={"texts": len(texts), "model": self.embedder.model})
+        except Exception as e:
+            EMBEDDING_FAILURES.labels("ingest").inc()
+            logger.warning("Embedding step failed (continuing): %s", e)
+            return fields
+        for i, span in enumerate(spans):
+            if span is None:
+                continue
+            start, count, names = span
+            fields[i] = embedding_fields(vectors[start:start + count], names, self.embedding_storage, self.embedder.model)
+        return fields
+
+def detector_from_state(state) -> ImageDetection:
+    """ImageDetection wired to the shared clients, pools and caches in app.state."""
+    shared = getattr(state, "image_detection", None)
+    if shared is not None:
+        return shared
+
+    # Get DB from app state (must be set at startup)
+    database = state.db                 # e.g., BFB
+    collection = database["chatbot"]    # <- make sure you look at BFB.chatbot in Atlas
+
+    logger.info("Writing receipts to %s.%s", database.name, collection.name)
+
+    return ImageDetection(
+        collection,
+        index_maintainer=getattr(state, "index_maintainer", None),
+        embedder=getattr(state, "embedder", None),
+        client=getattr(state, "async_openai", None),
+        executor=getattr(state, "cpu_executor", None),
+        ocr_engine=getattr(state, "ocr_engine", None),
+        dedup_cache=getattr(state, "ingest_cache", None),
+        generation=getattr(state, "search_generation", None),
+        llm_cache=getattr(state, "llm_cache", None),
+        line_items=getattr(state, "line_items", None),
+        stock_rollups=getattr(state, "stock_rollups", None)
+    )
+
+def _processed_response(filename: str, result: dict) -> dict:
+    return {
+        "status": "success",
+        "message": "Processed",
+        "inserted_id": result.get("inserted_id"),
+        "filename": filename,
+        "data": result.get("structured_data"),
+        "timings": result.get("timings"),
+        "dedup": result.get("dedup")
+    }
 
-        return {"inserted_id": inserted_id, "structured_data": parsed_json}
+async def _enqueue(request: Request, image_processor: ImageDetection, file: UploadFile, system_data: dict):
+    job_queue = getattr(request.app.state, "job_queue", None)
+    if job_queue is None:
+        raise HTTPException(status_code=503, detail="Background processing is not configured")
+    contents = await image_processor.read_contents(file)
+    try:
+        job_id = await job_queue.submit(file.filename, contents, system_data)
+    except JobQueueFull as e:
+        raise HTTPException(status_code=429, detail=f"Job queue is full: {e}", headers={"Retry-After": "5"})
+    return JSONResponse(status_code=202, content={
+        "status": "queued",
+        "message": "Queued for processing",
+        "job_id": job_id,
+        "filename": file.filename,
+        "status_url": f"/jobs/{job_id}"
+    })
+
+async def run_ingest_job(state, filename: str, contents: bytes, system_data: dict, progress) -> dict:
+    """JobQueue worker body: the same processing as a synchronous /process-image call."""
+    upload = UploadFile(file=io.BytesIO(contents), filename=filename)
+    result = await detector_from_state(state).reorganize(upload, system_data, progress=progress)
+    return _processed_response(filename, result)
 
 @router.post("/process-image")
 async def process_image(
@@ -117,28 +410,62 @@ async def process_image(
     file: UploadFile = File(...),
     user_id: str = "default_user",
     user_name: str = "default_name",
-    pick_up_location: str = "default_location"
+    pick_up_location: str = "default_location",
+    background: bool = False
 ):
+    """
+    OCR, structure, embed and store one receipt image.
+
+    With background=true the upload is queued instead and the response
+    (202) carries a job id to poll at /jobs/{job_id}; 429 means the queue
+    is full.
+    """
     try:
-        # Get DB from app state (must be set at startup)
-        database = request.app.state.db     # e.g., BFB
-        collection = database["chatbot"]    # <- make sure you look at BFB.chatbot in Atlas
+        image_processor = detector_from_state(request.app.state)
+        system_data = {
+            "user_id": user_id,
+            "user_name": user_name,
+            "pick_up_location": pick_up_location
+        }
+        if background:
+            return await _enqueue(request, image_processor, file, system_data)
+        result = await image_processor.reorganize(file, system_data)
+        return _processed_response(file.filename, result)
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Error: {e}")
 
-        print(f"🔌 Writing to DB: {database.name}, collection: {collection.name}")
+@router.post("/process-images")
+async def process_images(
+    request: Request,
+    files: List[UploadFile] = File(...),
+    user_id: str = "default_user",
+    user_name: str = "default_name",
+    pick_up_location: str = "default_location"
+):
+    """
+    Ingest many receipt images in one request.
 
-        image_processor = ImageDetection(collection)
+    Files go through the OCR -> LLM -> embed -> insert_many pipeline
+    concurrently; a file that fails is reported in its own result and does
+    not fail the batch.
+    """
+    try:
+        pipeline = IngestPipeline(detector_from_state(request.app.state))
         system_data = {
             "user_id": user_id,
             "user_name": user_name,
             "pick_up_location": pick_up_location
         }
-        result = await image_processor.reorganize(file, system_data)
+        report = await pipeline.run(files, system_data)
         return {
             "status": "success",
-            "message": "Processed",
-            "inserted_id": result.get("inserted_id"),
-            "filename": file.filename,
-            "data": result.get("structured_data")
+            "message": f"Processed {report['stats']['succeeded']} of {report['stats']['files']} files",
+            "results": report["results"],
+            "stats": report["stats"]
         }
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Error: {e}")
@@ -0,0 +1,226 @@
+import os
+import math
+import logging
+import threading
+from typing import Dict, List, Optional
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+# Rows assigned per matrix product while training and assigning
+_BATCH = 4096
+
+
+class IVFIndex:
+    """
+    Inverted-file (IVF) coarse quantizer for approximate vector search.
+
+    Spherical k-means splits the (L2-normalized) vectors into `nlist`
+    clusters. A query is compared with the centroids first and only rows in
+    its `nprobe` closest clusters are scored, so a search touches roughly
+    nprobe / nlist of the matrix. Raising nprobe trades latency for recall;
+    nprobe == nlist is an exact search.
+
+    The quantizer only maps vectors to list ids; SearchIndex keeps the list
+    id of every row next to the matrix, so compaction and tombstones need
+    nothing from here. Rows without a list id (-1, e.g. added while
+    training) are always scored.
+    """
+
+    def __init__(
+        self,
+        nlist: Optional[int] = None,
+        nprobe: int = 16,
+        min_rows: int = 50000,
+        iterations: int = 10,
+        sample_per_list: int = 32,
+        path: Optional[str] = None,
+        seed: int = 0
+    ):
+        """
+        Args:
+            nlist: Number of clusters; None picks sqrt(rows) at training time
+            nprobe: Clusters scored per query
+            min_rows: Below this many rows searches stay exact and nothing is trained
+            iterations: k-means iterations
+            sample_per_list: Training sample size per cluster
+            path: .npz file the trained quantizer and row assignments are saved to
+            seed: Seed for sampling and centroid initialization
+        """
+        self.nlist = nlist
+        self.nprobe = nprobe
+        self.min_rows = min_rows
+        self.iterations = iterations
+        self.sample_per_list = sample_per_list
+        self.path = path
+        self.seed = seed
+        self.centroids: Optional[np.ndarray] = None
+        # Bumped by every (re)training so stale assignments can be told apart
+        self.version = 0
+        self.trained_rows = 0
+        # document_id -> row list ids, loaded from disk and consumed on re-add
+        self._saved_lists: Dict[str, np.ndarray] = {}
+        self._saved_lock = threading.Lock()
+
+    @classmethod
+    def from_env(cls) -> Optional["IVFIndex"]:
+        """The quantizer configured by SEARCH_ANN_* variables, or None when SEARCH_ANN is off."""
+        if os.getenv("SEARCH_ANN", "off").lower() not in ("ivf", "on", "true", "1"):
+            return None
+        nlist = int(os.getenv("SEARCH_ANN_NLIST", "0"))
+        ann = cls(
+            nlist=nlist or None,
+            nprobe=int(os.getenv("SEARCH_ANN_NPROBE", "16")),
+            min_rows=int(os.getenv("SEARCH_ANN_MIN_ROWS", "50000")),
+            path=os.getenv("SEARCH_ANN_PATH", "ann_index.npz")
+        )
+        if ann.path and os.path.exists(ann.path):
+            try:
+                ann.load(ann.path)
+            except Exception as e:
+                logger.warning("Could not load ANN index from %s: %s", ann.path, e)
+        return ann
+
+    @property
+    def trained(self) -> bool:
+        return self.centroids is not None
+
+    def matches(self, dim: Optional[int]) -> bool:
+        """Whether the quantizer is trained for `dim`-dimensional vectors."""
+        return self.centroids is not None and self.centroids.shape[1] == dim
+
+    @property
+    def list_count(self) -> int:
+        return 0 if self.centroids is None else len(self.centroids)
+
+    def train(self, vectors: np.ndarray) -> np.ndarray:
+        """
+        Fit centroids on `vectors` with spherical k-means.
+
+        Rows may be float32 or per-row scaled int8 codes: only their
+        directions matter, so the sample is normalized before clustering.
+
+        Returns:
+            The centroids; install them with set_centroids()
+        """
+        rng = np.random.default_rng(self.seed)
+        nlist = self.nlist or int(math.sqrt(len(vectors)))
+        nlist = max(1, min(nlist, len(vectors)))
+        sample_size = min(len(vectors), nlist * self.sample_per_list)
+        sample = vectors[np.sort(rng.choice(len(vectors), sample_size, replace=False))].astype(np.float32)
+        sample /= np.maximum(np.linalg.norm(sample, axis=1, keepdims=True), 1e-12)
+        centroids = sample[rng.choice(sample_size, nlist, replace=False)].copy()
+
+        for _ in range(self.iterations):
+            assignments = self._nearest(sample, centroids)
+            counts = np.bincount(assignments, minlength=nlist)
+            filled = np.flatnonzero(counts)
+            starts = np.concatenate([[0], np.cumsum(counts[filled])[:-1]])
+            sums = np.zeros_like(centroids)
+            sums[filled] = np.add.reduceat(sample[np.argsort(assignments, kind="stable")], starts, axis=0)
+            empty = np.flatnonzero(counts == 0)
+            # Reseed empty clusters from random sample points
+            sums[empty] = sample[rng.choice(sample_size, len(empty))]
+            norms = np.linalg.norm(sums, axis=1, keepdims=True)
+            centroids = sums / np.maximum(norms, 1e-12)
+        return centroids.astype(np.float32)
+
+    def set_centroids(self, centroids: np.ndarray, trained_rows: int) -> None:
+        """Install trained centroids; saved assignments from older ones are dropped."""
+        with self._saved_lock:
+            self._saved_lists = {}
+        self.centroids = centroids
+        self.trained_rows = trained_rows
+        self.version += 1
+
+    def assign(self, vectors: np.ndarray, centroids: Optional[np.ndarray] = None) -> np.ndarray:
+        """List id of each vector (-1 for all of them before training)."""
+        centroids = self.centroids if centroids is None else centroids
+        if centroids is None:
+            return np.full(len(vectors), -1, dtype=np.int32)
+        return self._nearest(vectors, centroids)
+
+    @staticmethod
+    def _nearest(vectors: np.ndarray, centroids: np.ndarray) -> np.ndarray:
+        # Per-row scales don't change the argmax, so int8 rows need no dequantizing
+        lists = np.empty(len(vectors), dtype=np.int32)
+        for start in range(0, len(vectors), _BATCH):
+            block = vectors[start:start + _BATCH].astype(np.float32, copy=False)
+            lists[start:start + _BATCH] = np.argmax(block @ centroids.T, axis=1)
+        return lists
+
+    def probe(
+        self,
+        query_vector: np.ndarray,
+        centroids: Optional[np.ndarray] = None,
+        nprobe: Optional[int] = None
+    ) -> np.ndarray:
+        """
+        Lists to score for a query.
+
+        Args:
+            query_vector: Normalized query
+            centroids: Centroids the caller's row assignments were made with
+                (defaults to the current ones)
+            nprobe: Overrides self.nprobe
+
+        Returns:
+            Boolean mask over list ids with one extra trailing entry (always
+            True) so rows without a list, stored as -1, index into it as probed
+        """
+        centroids = self.centroids if centroids is None else centroids
+        nprobe = min(nprobe or self.nprobe, len(centroids))
+        scores = centroids @ query_vector
+        probed = np.zeros(len(centroids) + 1, dtype=bool)
+        probed[np.argpartition(-scores, nprobe - 1)[:nprobe]] = True
+        probed[-1] = True
+        return probed
+
+    # ---------------------------------------------------------------
+    # Persistence
+    # ---------------------------------------------------------------
+
+    def save(self, path: str, document_ids: List[str], row_counts: List[int], row_lists: np.ndarray) -> None:
+        """
+        Write the centroids and each document's row list ids to `path`.
+
+        Args:
+            document_ids: Indexed documents
+            row_counts: Number of matrix rows of each document
+            row_lists: Their list ids, concatenated in document order
+        """
+        temporary = f"{path}.tmp.npz"
+        np.savez(
+            temporary,
+            centroids=self.centroids,
+            trained_rows=np.int64(self.trained_rows),
+            document_ids=np.asarray(document_ids, dtype=str),
+            row_counts=np.asarray(row_counts, dtype=np.int64),
+            row_lists=row_lists.astype(np.int32)
+        )
+        os.replace(temporary, path)
+
+    def load(self, path: str) -> None:
+        """Read a quantizer written by save(); its row assignments are reused by saved_lists()."""
+        with np.load(path) as data:
+            centroids = data["centroids"]
+            offsets = np.concatenate([[0], np.cumsum(data["row_counts"])])
+            row_lists = data["row_lists"]
+            saved = {
+                str(document_id): row_lists[offsets[i]:offsets[i + 1]]
+                for i, document_id in enumerate(data["document_ids"])
+            }
+            self.set_centroids(centroids, int(data["trained_rows"]))
+        with self._saved_lock:
+            self._saved_lists = saved
+        logger.info("ANN index loaded", extra={"lists": len(centroids), "documents": len(saved)})
+
+    def saved_lists(self, document_id: str, rows: int) -> Optional[np.ndarray]:
+        """List ids saved for a document's `rows` rows, if still valid (each is used once)."""
+        if not self._saved_lists:
+            return None
+        with self._saved_lock:
+            lists = self._saved_lists.pop(document_id, None)
+        if lists is None or len(lists) != rows:
+            return None
+        return lists
@@ -0,0 +1,254 @@
+#!/usr/bin/env python3
+"""
+Embed the receipts in BFB.chatbot that have no `embedding` yet.
+
+Documents are read in _id order, --read-batch at a time. Their texts (the
+receipt, then each line item, as on upload) are packed into embeddings
+calls of up to --inputs-per-call inputs, with at most --concurrency calls
+in flight. The vectors go back in one unordered bulk_write per batch, and
+only to documents that still lack an embedding, so a concurrent upload is
+never overwritten.
+
+After each batch the last _id done is written to --checkpoint. A crashed
+or interrupted run resumes from there when started again. If a call still
+fails after --retries attempts, the batch's other documents are written,
+the checkpoint stops just before the first failed one, and the run exits
+so a later run retries it. Receipts with nothing to embed are skipped.
+
+Running servers pick the new embeddings up from the change stream, or on
+their next snapshot catch-up (polling only follows new inserts).
+
+Usage (from backend/):
+    python -m routes.embedding_backfill --checkpoint backfill.json
+    python -m routes.embedding_backfill --checkpoint backfill.json --inputs-per-call 512 --concurrency 8
+"""
+
+import os
+import time
+import asyncio
+import logging
+import argparse
+from typing import Dict, List, Optional
+from bson import json_util
+from pymongo import UpdateOne
+from starlette.concurrency import run_in_threadpool
+from routes.embeddings import Embedder, STORAGE_FORMATS, embedding_fields, receipt_texts
+
+logger = logging.getLogger(__name__)
+
+_PROJECTION = {"structured_data": 1}
+
+# OpenAI accepts up to 2048 inputs per embeddings request
+MAX_INPUTS_PER_CALL = 2048
+
+
+class BackfillFailed(RuntimeError):
+    """An embeddings call kept failing; the checkpoint marks where to resume."""
+
+
+def load_checkpoint(path: Optional[str]) -> Dict:
+    """The progress saved at `path`, or a fresh start."""
+    if path and os.path.exists(path):
+        with open(path) as f:
+            return json_util.loads(f.read())
+    return {"last_id": None, "embedded": 0, "skipped": 0}
+
+
+def save_checkpoint(path: Optional[str], progress: Dict) -> None:
+    """Write progress atomically, so a crash mid-write keeps the previous one."""
+    if not path:
+        return
+    temporary = f"{path}.tmp"
+    with open(temporary, "w") as f:
+        f.write(json_util.dumps(progress))
+    os.replace(temporary, path)
+
+
+def _pack(texts_per_doc: List[List[str]], inputs_per_call: int) -> List[List[int]]:
+    """
+    Group documents into calls of at most `inputs_per_call` texts.
+
+    A document's texts always share a call (one with more texts than that
+    gets a call of its own).
+    """
+    calls, current, size = [], [], 0
+    for i, texts in enumerate(texts_per_doc):
+        if current and size + len(texts) > inputs_per_call:
+            calls.append(current)
+            current, size = [], 0
+        current.append(i)
+        size += len(texts)
+    if current:
+        calls.append(current)
+    return calls
+
+
+async def _embed_call(embedder: Embedder, texts: List[str], semaphore: asyncio.Semaphore, retries: int):
+    """Vectors for `texts`, or None after `retries` failed attempts."""
+    async with semaphore:
+        for attempt in range(retries):
+            try:
+                return await embedder.aembed(texts)
+            except Exception as e:
+                logger.warning("Embeddings call failed (attempt %d/%d): %s", attempt + 1, retries, e,
+                               extra={"inputs": len(texts)})
+                if attempt + 1 < retries:
+                    await asyncio.sleep(min(2 ** attempt, 30))
+    return None
+
+
+async def backfill(
+    collection,
+    embedder: Embedder,
+    storage: str = "float32",
+    read_batch: int = 1000,
+    inputs_per_call: int = 256,
+    concurrency: int = 4,
+    retries: int = 3,
+    checkpoint: Optional[str] = None,
+    limit: Optional[int] = None
+) -> Dict:
+    """
+    Embed the documents in `collection` that have no embedding.
+
+    Args:
+        collection: BFB.chatbot
+        embedder: Embedder to use (the one the app searches with)
+        storage: Stored format, one of STORAGE_FORMATS
+        read_batch: Documents read, embedded and written per round
+        inputs_per_call: Most texts per embeddings call
+        concurrency: Most embeddings calls in flight
+        retries: Attempts per call before giving up
+        checkpoint: JSON file progress is saved to and resumed from
+        limit: Stop after this many documents have been read
+
+    Returns:
+        Progress: last_id done and the counts of embedded and skipped
+        documents (totals across resumed runs), plus this run's read count,
+        calls, seconds and docs_per_second
+
+    Raises:
+        BackfillFailed if a call kept failing (progress is saved first)
+    """
+    if storage not in STORAGE_FORMATS:
+        raise ValueError(f"storage must be one of {STORAGE_FORMATS}, not {storage!r}")
+    inputs_per_call = max(1, min(inputs_per_call, MAX_INPUTS_PER_CALL))
+    semaphore = asyncio.Semaphore(max(1, concurrency))
+    progress = load_checkpoint(checkpoint)
+    run = {"read": 0, "calls": 0}
+    started = time.perf_counter()
+
+    def report() -> Dict:
+        seconds = time.perf_counter() - started
+        return {**progress, **run, "seconds": round(seconds, 3),
+                "docs_per_second": round(run["read"] / seconds, 1) if seconds else 0.0}
+
+    while limit is None or run["read"] < limit:
+        query = {"embedding": {"$exists": False}}
+        if progress["last_id"] is not None:
+            query["_id"] = {"$gt": progress["last_id"]}
+        size = read_batch if limit is None else min(read_batch, limit - run["read"])
+        batch = await run_in_threadpool(lambda: list(collection.find(query, _PROJECTION).sort("_id", 1).limit(size)))
+        if not batch:
+            break
+
+        texts_per_doc, names_per_doc = [], []
+        for doc in batch:
+            structured = doc.get("structured_data")
+            texts, names = [], []
+            if isinstance(structured, dict):
+                texts, names = receipt_texts(structured, structured.get("raw_ocr_text"))
+            texts_per_doc.append(texts)
+            names_per_doc.append(names)
+        embeddable = [i for i, texts in enumerate(texts_per_doc) if texts]
+        calls = [[embeddable[j] for j in call] for call in _pack([texts_per_doc[i] for i in embeddable], inputs_per_call)]
+        answers = await asyncio.gather(*(
+            _embed_call(embedder, [text for i in call for text in texts_per_doc[i]], semaphore, retries)
+            for call in calls
+        ))
+        run["calls"] += len(calls)
+
+        # Documents after the first failure wait for the next run
+        failed = min((call[0] for call, vectors in zip(calls, answers) if vectors is None), default=len(batch))
+        updates = []
+        for call, vectors in zip(calls, answers):
+            if vectors is None:
+                continue
+            offset = 0
+            for i in call:
+                count = len(texts_per_doc[i])
+                if i < failed:
+                    fields = embedding_fields(vectors[offset:offset + count], names_per_doc[i], storage, embedder.model)
+                    updates.append(UpdateOne({"_id": batch[i]["_id"], "embedding": {"$exists": False}}, {"$set": fields}))
+                offset += count
+        embedded = 0
+        if updates:
+            result = await run_in_threadpool(collection.bulk_write, updates, ordered=False)
+            # Documents an upload embedded in the meantime aren't modified
+            embedded = result.modified_count
+
+        run["read"] += failed
+        progress["embedded"] += embedded
+        progress["skipped"] += sum(1 for i in range(failed) if not texts_per_doc[i])
+        if failed:
+            progress["last_id"] = batch[failed - 1]["_id"]
+        save_checkpoint(checkpoint, progress)
+        stats = report()
+        logger.info("Backfill progress", extra={
+            "embedded": progress["embedded"], "skipped": progress["skipped"],
+            "docs_per_second": round(stats["docs_per_second"]), "last_id": progress["last_id"]
+        })
+        if failed < len(batch):
+            raise BackfillFailed(f"embeddings kept failing at _id {batch[failed]['_id']}; run again to resume")
+        if len(batch) < size:
+            break
+    return report()
+
+
+async def _main(args) -> Dict:
+    from config.logging_config import configure_logging
+    from config.settings import get_database, close_database, make_openai_clients
+    from routes.embeddings import get_embedder
+    configure_logging()
+
+    key = os.getenv("OPENAI_API_KEY")
+    sync_client, async_client = make_openai_clients(key) if key else (None, None)
+    embedder = get_embedder(sync_client, async_client)
+    if embedder is None:
+        raise SystemExit("No embedder configured: set OPENAI_API_KEY, or EMBEDDER=hashing")
+    try:
+        return await backfill(
+            get_database()["chatbot"],
+            embedder,
+            storage=args.storage,
+            read_batch=args.read_batch,
+            inputs_per_call=args.inputs_per_call,
+            concurrency=args.concurrency,
+            retries=args.retries,
+            checkpoint=args.checkpoint,
+            limit=args.limit
+        )
+    finally:
+        if async_client is not None:
+            await async_client.close()
+            sync_client.close()
+        close_database()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--checkpoint", default="embedding_backfill.json", help="progress file ('' to disable)")
+    parser.add_argument("--storage", choices=STORAGE_FORMATS, default=os.getenv("EMBEDDING_STORAGE", "float32"))
+    parser.add_argument("--read-batch", type=int, default=1000, help="documents per read and bulk_write")
+    parser.add_argument("--inputs-per-call", type=int, default=256, help=f"texts per embeddings call (max {MAX_INPUTS_PER_CALL})")
+    parser.add_argument("--concurrency", type=int, default=4, help="embeddings calls in flight")
+    parser.add_argument("--retries", type=int, default=3, help="attempts per embeddings call")
+    parser.add_argument("--limit", type=int, default=None, help="read at most this many documents")
+    args = parser.parse_args()
+    try:
+        stats = asyncio.run(_main(args))
+    except BackfillFailed as e:
+        raise SystemExit(f"❌ {e}")
+    print(f"✅ {stats['embedded']} documents embedded, {stats['skipped']} skipped; this run read "
+          f"{stats['read']} in {stats['calls']} calls at {stats['docs_per_second']:.0f} docs/s; "
+          f"last _id {stats['last_id']}")
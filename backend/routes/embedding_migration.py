@@ -0,0 +1,161 @@
+#!/usr/bin/env python3
+"""
+Re-encode the embeddings stored in BFB.chatbot in a compact format.
+
+Rewrites `embedding` and `product_embeddings` of every embedded receipt
+with encode_embedding(), optionally shortened to --dimensions (only valid
+for models that support shortening, like text-embedding-3-*; the
+embedding_model field gets the same "@<dimensions>" suffix OpenAIEmbedder
+uses). Documents already in the target format are skipped, and batches
+go in _id order, so an interrupted run can simply be started again (or
+resumed with --after).
+
+Set EMBEDDING_STORAGE / EMBEDDING_DIMENSIONS to the same values so new
+uploads match.
+
+Usage (from backend/):
+    python -m routes.embedding_migration --storage float16 --dry-run
+    python -m routes.embedding_migration --storage int8 --dimensions 1024
+"""
+
+import time
+import logging
+import argparse
+from typing import Dict, Optional
+from bson import ObjectId
+from pymongo import UpdateOne
+from routes.embeddings import STORAGE_FORMATS, decode_embedding, encode_embedding, storage_format
+
+logger = logging.getLogger(__name__)
+
+_PROJECTION = {"embedding": 1, "product_embeddings": 1, "embedding_model": 1}
+
+
+def _needs_rewrite(value, storage: str, dimensions: Optional[int]) -> bool:
+    if storage_format(value) != storage:
+        return True
+    return dimensions is not None and len(decode_embedding(value)) > dimensions
+
+
+def migrated_fields(doc: Dict, storage: str, dimensions: Optional[int] = None) -> Optional[Dict]:
+    """
+    The $set that brings one document to the target format.
+
+    Returns:
+        The fields to set, or None if the document is already migrated
+    """
+    values = [doc.get("embedding")] + [entry.get("embedding") for entry in doc.get("product_embeddings") or []]
+    if not any(value is not None and _needs_rewrite(value, storage, dimensions) for value in values):
+        return None
+    fields = {"embedding": encode_embedding(decode_embedding(doc["embedding"]), storage, dimensions)}
+    if "product_embeddings" in doc:
+        fields["product_embeddings"] = [
+            {**entry, "embedding": encode_embedding(decode_embedding(entry["embedding"]), storage, dimensions)}
+            if entry.get("embedding") is not None else entry
+            for entry in doc["product_embeddings"] or []
+        ]
+    model = doc.get("embedding_model")
+    if dimensions is not None and isinstance(model, str):
+        fields["embedding_model"] = f"{model.split('@')[0]}@{dimensions}"
+    return fields
+
+
+def migrate(
+    collection,
+    storage: str,
+    dimensions: Optional[int] = None,
+    batch_size: int = 500,
+    after=None,
+    limit: Optional[int] = None,
+    dry_run: bool = False
+) -> Dict:
+    """
+    Re-encode embedded documents in `collection`, one bulk_write per batch.
+
+    Args:
+        collection: BFB.chatbot
+        storage: Target format, one of STORAGE_FORMATS
+        dimensions: Shorten vectors to this many dimensions
+        batch_size: Documents read and written per round trip
+        after: Start after this _id
+        limit: Stop after this many documents have been examined
+        dry_run: Count what would change without writing
+
+    Returns:
+        Counts of examined/rewritten documents, bytes before/after for the
+        rewritten ones, and the last _id examined (for --after)
+    """
+    if storage not in STORAGE_FORMATS:
+        raise ValueError(f"storage must be one of {STORAGE_FORMATS}, not {storage!r}")
+    stats = {"examined": 0, "rewritten": 0, "bytes_before": 0, "bytes_after": 0, "last_id": after}
+    started = time.perf_counter()
+    while limit is None or stats["examined"] < limit:
+        query = {"embedding": {"$exists": True}}
+        if stats["last_id"] is not None:
+            query["_id"] = {"$gt": stats["last_id"]}
+        size = batch_size if limit is None else min(batch_size, limit - stats["examined"])
+        batch = list(collection.find(query, _PROJECTION).sort("_id", 1).limit(size))
+        if not batch:
+            break
+        updates = []
+        for doc in batch:
+            fields = migrated_fields(doc, storage, dimensions)
+            if fields is None:
+                continue
+            stats["bytes_before"] += _embedding_bytes(doc)
+            stats["bytes_after"] += _embedding_bytes(fields)
+            updates.append(UpdateOne({"_id": doc["_id"]}, {"$set": fields}))
+        if updates and not dry_run:
+            collection.bulk_write(updates, ordered=False)
+        stats["examined"] += len(batch)
+        stats["rewritten"] += len(updates)
+        stats["last_id"] = batch[-1]["_id"]
+        logger.info("Embeddings rewritten", extra={
+            "examined": stats["examined"], "rewritten": stats["rewritten"],
+            "seconds": round(time.perf_counter() - started), "last_id": stats["last_id"]
+        })
+        if len(batch) < size:
+            break
+    return stats
+
+
+def _embedding_bytes(fields: Dict) -> int:
+    """Approximate BSON size of the embedding fields (8 bytes per double for legacy arrays)."""
+    def size(value) -> int:
+        return len(value) if isinstance(value, (bytes, bytearray)) else 8 * len(value or [])
+    return size(fields.get("embedding")) + sum(size(e.get("embedding")) for e in fields.get("product_embeddings") or [])
+
+
+def _main(args) -> Dict:
+    from config.logging_config import configure_logging
+    from config.settings import get_database, close_database
+    configure_logging()
+
+    after = ObjectId(args.after) if args.after and ObjectId.is_valid(args.after) else args.after
+    try:
+        return migrate(
+            get_database()["chatbot"],
+            args.storage,
+            args.dimensions,
+            batch_size=args.batch_size,
+            after=after,
+            limit=args.limit,
+            dry_run=args.dry_run
+        )
+    finally:
+        close_database()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--storage", choices=STORAGE_FORMATS, required=True)
+    parser.add_argument("--dimensions", type=int, default=None, help="shorten vectors to this many dimensions")
+    parser.add_argument("--batch-size", type=int, default=500)
+    parser.add_argument("--after", help="resume after this _id")
+    parser.add_argument("--limit", type=int, default=None, help="examine at most this many documents")
+    parser.add_argument("--dry-run", action="store_true", help="report what would change without writing")
+    args = parser.parse_args()
+    stats = _main(args)
+    saved = stats["bytes_before"] - stats["bytes_after"]
+    print(f"✅ {stats['rewritten']} of {stats['examined']} documents {'would be ' if args.dry_run else ''}"
+          f"rewritten, {saved / 1e6:.1f} MB of embeddings saved; last _id {stats['last_id']}")
@@ -0,0 +1,279 @@
+import os
+import re
+import hashlib
+import logging
+from typing import Dict, List, Optional, Tuple
+import numpy as np
+from bson.binary import Binary
+from starlette.concurrency import run_in_threadpool
+
+# Embeddings are persisted as little-endian float32 bytes (generic binary),
+# or in a compact format tagged by a user-defined binary subtype and a
+# one-byte header: float16, or int8 with a float32 scale
+STORAGE_FORMATS = ("float32", "float16", "int8")
+_STORAGE_DTYPE = np.dtype("<f4")
+_COMPACT_SUBTYPE = 0x80
+_FLOAT16_TAG = 1
+_INT8_TAG = 2
+
+_TOKEN_PATTERN = re.compile(r"[a-z0-9]+(?:[.\-/][a-z0-9]+)*")
+
+logger = logging.getLogger(__name__)
+
+
+class Embedder:
+    """
+    Turns text into embedding vectors.
+
+    Implementations return one L2-comparable float32 row per input text, in
+    input order. `model` names the embedding space; it is stored with every
+    document's vectors (embedding_model) and SearchIndex skips documents
+    embedded in another space (see same_embedding_space).
+    """
+
+    model: str = ""
+
+    def embed(self, texts: List[str]) -> np.ndarray:
+        raise NotImplementedError
+
+    async def aembed(self, texts: List[str]) -> np.ndarray:
+        """Async embed; by default runs embed() in the threadpool."""
+        return await run_in_threadpool(self.embed, texts)
+
+
+class OpenAIEmbedder(Embedder):
+    """
+    Embeddings from the OpenAI API (text-embedding-3-large by default).
+
+    `client` serves embed() and `async_client` (an AsyncOpenAI) serves
+    aembed(); either may be omitted. With `dimensions` the API returns
+    shortened embeddings, and `model` becomes "<model>@<dimensions>" so they
+    are never mixed with full-length ones.
+    """
+
+    def __init__(
+        self,
+        client=None,
+        model: str = "text-embedding-3-large",
+        async_client=None,
+        dimensions: Optional[int] = None
+    ):
+        self.client = client
+        self.async_client = async_client
+        self.api_model = model
+        self.dimensions = dimensions
+        self.model = model if dimensions is None else f"{model}@{dimensions}"
+
+    def _request(self, texts: List[str]) -> Dict:
+        request = {"model": self.api_model, "input": texts}
+        if self.dimensions is not None:
+            request["dimensions"] = self.dimensions
+        return request
+
+    def embed(self, texts: List[str]) -> np.ndarray:
+        response = self.client.embeddings.create(**self._request(texts))
+        return self._to_matrix(response)
+
+    async def aembed(self, texts: List[str]) -> np.ndarray:
+        if self.async_client is None:
+            return await super().aembed(texts)
+        response = await self.async_client.embeddings.create(**self._request(texts))
+        return self._to_matrix(response)
+
+    @staticmethod
+    def _to_matrix(response) -> np.ndarray:
+        data = sorted(response.data, key=lambda item: item.index)
+        return np.asarray([item.embedding for item in data], dtype=np.float32)
+
+
+class HashingEmbedder(Embedder):
+    """
+    Deterministic local embedder for offline use and tests.
+
+    Hashes word unigrams and bigrams into a fixed number of signed buckets.
+    No network, no model files, and the same text always maps to the same
+    vector across processes.
+    """
+
+    def __init__(self, dim: int = 256):
+        self.dim = dim
+        self.model = f"hashing-{dim}"
+
+    def embed(self, texts: List[str]) -> np.ndarray:
+        vectors = np.zeros((len(texts), self.dim), dtype=np.float32)
+        for row, text in enumerate(texts):
+            tokens = _TOKEN_PATTERN.findall((text or "").lower())
+            features = [(token, 1.0) for token in tokens]
+            features += [(f"{a} {b}", 0.5) for a, b in zip(tokens, tokens[1:])]
+            for feature, weight in features:
+                digest = hashlib.blake2b(feature.encode("utf-8"), digest_size=8).digest()
+                value = int.from_bytes(digest, "little")
+                sign = 1.0 if value & 1 else -1.0
+                vectors[row, (value >> 1) % self.dim] += sign * weight
+        norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+        np.divide(vectors, norms, out=vectors, where=norms > 0)
+        return vectors
+
+    async def aembed(self, texts: List[str]) -> np.ndarray:
+        # Pure local CPU work, cheap enough to run inline
+        return self.embed(texts)
+
+
+def get_embedder(client=None, async_client=None) -> Optional[Embedder]:
+    """
+    Pick the embedder configured by the EMBEDDER env var.
+
+    - "openai" (the default): OpenAIEmbedder on `client`/`async_client`,
+      shortened to EMBEDDING_DIMENSIONS when set; None without a client, so
+      receipts aren't embedded and search is lexical only
+    - "hashing": HashingEmbedder, dimension from HASHING_EMBEDDER_DIM, for
+      offline runs; it never replaces a missing OpenAI key on its own, since
+      its vectors can't be compared with OpenAI ones
+    """
+    has_client = client is not None or async_client is not None
+    name = os.getenv("EMBEDDER", "openai").lower()
+    if name == "hashing":
+        embedder = HashingEmbedder(int(os.getenv("HASHING_EMBEDDER_DIM", "256")))
+        logger.warning("EMBEDDER=hashing: using local %s embeddings, not comparable with OpenAI ones", embedder.model)
+        return embedder
+    if not has_client:
+        logger.warning("No OpenAI client: receipts won't be embedded and search is lexical only "
+                       "(set EMBEDDER=hashing for local embeddings)")
+        return None
+    dimensions = int(os.getenv("EMBEDDING_DIMENSIONS", "0")) or None
+    return OpenAIEmbedder(client, os.getenv("EMBEDDING_MODEL", "text-embedding-3-large"), async_client, dimensions)
+
+
+def same_embedding_space(model: str, other: str) -> bool:
+    """
+    Whether vectors embedded by `model` and `other` can be scored against
+    each other: the same model, whatever "@<dimensions>" it was shortened to
+    (SearchIndex shortens longer vectors to its dim).
+    """
+    return model.split("@")[0] == other.split("@")[0]
+
+
+# ---------------------------------------------------------------
+# Storage format
+# ---------------------------------------------------------------
+
+def truncate_embedding(vector, dimensions: Optional[int]) -> np.ndarray:
+    """
+    Keep the first `dimensions` components and re-normalize.
+
+    Valid for models trained to support shortening (text-embedding-3-*);
+    vectors already that short are returned as they are.
+    """
+    vector = np.asarray(vector, dtype=np.float32)
+    if dimensions is None or len(vector) <= dimensions:
+        return vector
+    vector = vector[:dimensions]
+    norm = np.linalg.norm(vector)
+    return vector / norm if norm > 0 else vector
+
+
+def quantize_int8(vectors: np.ndarray):
+    """
+    Symmetric per-row int8 quantization.
+
+    Returns:
+        (codes, scales) with vectors ~= codes * scales[:, None]
+    """
+    vectors = np.asarray(vectors, dtype=np.float32)
+    scales = np.abs(vectors).max(axis=-1) / 127
+    scales = np.where(scales > 0, scales, 1.0).astype(np.float32)
+    codes = np.rint(vectors / scales[..., None]).astype(np.int8)
+    return codes, scales
+
+
+def encode_embedding(vector, storage: str = "float32", dimensions: Optional[int] = None) -> Binary:
+    """
+    Pack a vector for storage in Mongo.
+
+    Args:
+        vector: The embedding
+        storage: "float32" (4 bytes per dimension), "float16" (2) or "int8" (1, plus a scale)
+        dimensions: Shorten to this many dimensions first (see truncate_embedding)
+    """
+    vector = truncate_embedding(vector, dimensions)
+    if storage == "float32":
+        return Binary(vector.astype(_STORAGE_DTYPE).tobytes())
+    if storage == "float16":
+        return Binary(bytes([_FLOAT16_TAG]) + vector.astype("<f2").tobytes(), _COMPACT_SUBTYPE)
+    if storage == "int8":
+        codes, scale = quantize_int8(vector)
+        return Binary(bytes([_INT8_TAG]) + scale.astype(_STORAGE_DTYPE).tobytes() + codes.tobytes(), _COMPACT_SUBTYPE)
+    raise ValueError(f"storage must be one of {STORAGE_FORMATS}, not {storage!r}")
+
+
+def decode_embedding(value) -> np.ndarray:
+    """Unpack a stored embedding in any STORAGE_FORMATS, or a legacy JSON list of floats."""
+    if isinstance(value, Binary) and value.subtype == _COMPACT_SUBTYPE:
+        if value[0] == _FLOAT16_TAG:
+            return np.frombuffer(value, dtype="<f2", offset=1).astype(np.float32)
+        if value[0] == _INT8_TAG:
+            scale = np.frombuffer(value, dtype=_STORAGE_DTYPE, count=1, offset=1)[0]
+            return np.frombuffer(value, dtype=np.int8, offset=5).astype(np.float32) * scale
+        raise ValueError(f"Unknown embedding format tag {value[0]}")
+    if isinstance(value, (bytes, bytearray)):
+        return np.frombuffer(value, dtype=_STORAGE_DTYPE)
+    return np.asarray(value, dtype=np.float32)
+
+
+def storage_format(value) -> str:
+    """Which of STORAGE_FORMATS a stored embedding uses ("list" for legacy arrays)."""
+    if isinstance(value, Binary) and value.subtype == _COMPACT_SUBTYPE:
+        return "float16" if value[0] == _FLOAT16_TAG else "int8"
+    if isinstance(value, (bytes, bytearray)):
+        return "float32"
+    return "list"
+
+
+# ---------------------------------------------------------------
+# Text to embed
+# ---------------------------------------------------------------
+
+def product_text(product_name: str, product_data: Dict) -> str:
+    """Text embedded for one line item: its name plus its non-empty fields."""
+    parts = [product_name]
+    for key, val in product_data.items():
+        if val is not None:
+            parts.append(f"{key.replace('_', ' ')}: {val}")
+    return " | ".join(parts)
+
+
+def document_text(structured_data: Dict, ocr_text: Optional[str] = None) -> str:
+    """Text embedded for a whole receipt: product names followed by the OCR text."""
+    products = structured_data.get("products") or {}
+    names = [name for name in products if isinstance(name, str)]
+    return "\n".join(filter(None, [", ".join(names), (ocr_text or "").strip()]))
+
+
+def receipt_texts(structured_data: Dict, ocr_text: Optional[str] = None) -> Tuple[List[str], List[str]]:
+    """
+    Texts embedded for one receipt: the whole receipt, then each line item.
+
+    Returns:
+        (texts, product names in the order of texts[1:]); both empty if
+        there is nothing to embed
+    """
+    products = structured_data.get("products")
+    if not isinstance(products, dict):
+        products = {}
+    items = [(name, data) for name, data in products.items() if isinstance(data, dict)]
+    receipt_text = document_text(structured_data, ocr_text)
+    if not receipt_text:
+        return [], []
+    return [receipt_text] + [product_text(name, data) for name, data in items], [name for name, _ in items]
+
+
+def embedding_fields(vectors: np.ndarray, product_names: List[str], storage: str, model: str) -> Dict:
+    """The Mongo fields for a receipt's vectors, in receipt_texts() order."""
+    return {
+        "embedding": encode_embedding(vectors[0], storage),
+        "product_embeddings": [
+            {"product_name": name, "embedding": encode_embedding(vector, storage)}
+            for name, vector in zip(product_names, vectors[1:])
+        ],
+        "embedding_model": model,
+    }
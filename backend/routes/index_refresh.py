@@ -0,0 +1,295 @@
+import time
+import logging
+import threading
+from datetime import timedelta
+from typing import Dict, Optional
+from bson import ObjectId
+from routes.vector_index import SearchIndex
+from routes.search_filters import SEARCH_PROJECTION
+
+logger = logging.getLogger(__name__)
+
+# Change events carry only the fields the index reads (plus _id, the resume token)
+_CHANGE_PIPELINE = [
+    {"$match": {"operationType": {"$in": ["insert", "update", "replace", "delete"]}}},
+    {"$project": {
+        "operationType": 1,
+        "documentKey": 1,
+        **{f"fullDocument.{field}": 1 for field in SEARCH_PROJECTION},
+    }},
+]
+
+
+class IndexMaintainer:
+    """
+    Keeps a SearchIndex in step with BFB.chatbot as receipts are ingested.
+
+    New documents reach the index three ways, all idempotent:
+    - on_insert() hooks called directly by ImageDetection after insert_one
+    - a Mongo change stream, when the deployment supports one
+    - polling for _id values above the index's high-water mark otherwise
+      (or while the stream is down, until it is retried)
+
+    Polls and change stream inserts (delivered in commit order) move the
+    high-water mark; direct hooks don't. Each poll also reaches
+    `poll_overlap` seconds behind the mark, since ObjectIds from other
+    workers' processes are only ordered to the second and an insert can
+    land below _ids already read. That window is read _id-only, and only
+    documents neither indexed nor fetched before are read in full, so a
+    quiet poll transfers no documents.
+
+    Each refresh only touches the documents it is handed, so the cost is
+    O(new docs) rather than a collection rescan. Deletes (change stream only)
+    tombstone rows, and a background pass compacts them once they pile up
+    and (re)trains the index's ANN quantizer when it is configured. With a
+    SnapshotStore, the same pass saves a fresh snapshot every
+    `snapshot_interval` seconds (one worker at a time).
+    """
+
+    def __init__(
+        self,
+        collection,
+        index: SearchIndex,
+        poll_interval: float = 2.0,
+        batch_size: int = 500,
+        compact_ratio: float = 0.2,
+        compact_interval: float = 30.0,
+        snapshots=None,
+        snapshot_interval: float = 600.0,
+        poll_overlap: float = 5.0,
+        max_backoff: float = 300.0
+    ):
+        self.collection = collection
+        self.index = index
+        self.poll_interval = poll_interval
+        self.batch_size = batch_size
+        self.compact_ratio = compact_ratio
+        self.compact_interval = compact_interval
+        self.snapshots = snapshots
+        self.snapshot_interval = snapshot_interval
+        self.poll_overlap = poll_overlap
+        # Longest wait between change stream retries (doubling from poll_interval)
+        self.max_backoff = max_backoff
+        # Where a dropped change stream resumes from
+        self._resume_token = None
+        # _ids fetched in full within the overlap window, so re-polls skip
+        # them even when the index didn't take them (no embedding, other model)
+        self._fetched = set()
+        # Index generation as of the last snapshot this process opened or saved
+        self._snapshot_generation = index.generation
+        self.mode: Optional[str] = None     # "change_stream" or "polling" once started
+
+        self._stop = threading.Event()
+        self._threads = []
+
+    # ---------------------------------------------------------------
+    # Direct hooks
+    # ---------------------------------------------------------------
+
+    def on_insert(self, doc: Dict) -> bool:
+        """Index a freshly inserted document (must already carry its _id)."""
+        try:
+            return self.index.add_document(doc)
+        except Exception as e:
+            logger.warning("Could not index document: %s", e, extra={"document_id": str(doc.get("_id"))})
+            return False
+
+    def on_delete(self, document_id) -> bool:
+        """Tombstone a deleted document."""
+        return self.index.remove_document(document_id)
+
+    # ---------------------------------------------------------------
+    # Refresh cycles
+    # ---------------------------------------------------------------
+
+    def _poll_from(self):
+        """Where a poll starts: poll_overlap seconds before the high-water mark."""
+        mark = self.index.high_water_mark
+        if isinstance(mark, ObjectId) and self.poll_overlap > 0:
+            return ObjectId.from_datetime(mark.generation_time - timedelta(seconds=self.poll_overlap))
+        return mark
+
+    def _fetch(self, docs) -> int:
+        count = 0
+        for doc in docs:
+            self.on_insert(doc)
+            self.index.note_seen(doc["_id"])
+            self._fetched.add(doc["_id"])
+            count += 1
+        return count
+
+    def refresh_once(self) -> int:
+        """
+        Pull documents inserted since the high-water mark (less poll_overlap) into the index.
+
+        Returns:
+            Number of documents fetched (in full) from the collection
+        """
+        start, mark = self._poll_from(), self.index.high_water_mark
+        self._fetched = {_id for _id in self._fetched if start is None or _id > start}
+
+        fetched = 0
+        if start is not None and start != mark:
+            missing = [
+                doc["_id"]
+                for doc in self.collection.find({"_id": {"$gt": start, "$lte": mark}}, {"_id": 1})
+                if doc["_id"] not in self._fetched and doc["_id"] not in self.index
+            ]
+            for first in range(0, len(missing), self.batch_size):
+                batch = missing[first:first + self.batch_size]
+                fetched += self._fetch(self.collection.find({"_id": {"$in": batch}}, SEARCH_PROJECTION))
+
+        query = {"_id": {"$gt": mark}} if mark is not None else {}
+        while True:
+            batch = list(self.collection.find(query, SEARCH_PROJECTION).sort("_id", 1).limit(self.batch_size))
+            fetched += self._fetch(batch)
+            if len(batch) < self.batch_size:
+                break
+            query = {"_id": {"$gt": batch[-1]["_id"]}}
+        return fetched
+
+    def catch_up(self) -> Dict[str, int]:
+        """
+        Bring an index opened from a snapshot level with the collection.
+
+        Documents inserted since the snapshot come from refresh_once(). An
+        _id-only read of the embedded documents then finds those deleted
+        since (tombstoned) and older ones that gained an embedding (fetched).
+
+        Returns:
+            Documents fetched and removed
+        """
+        fetched = self.refresh_once()
+        embedded = {
+            str(doc["_id"]): doc["_id"]
+            for doc in self.collection.find({"embedding": {"$exists": True}}, {"_id": 1})
+        }
+        removed = sum(
+            1 for document_id in self.index.document_ids()
+            if document_id not in embedded and self.on_delete(document_id)
+        )
+        missing = [_id for document_id, _id in embedded.items() if document_id not in self.index]
+        for start in range(0, len(missing), self.batch_size):
+            batch = missing[start:start + self.batch_size]
+            for doc in self.collection.find({"_id": {"$in": batch}}, SEARCH_PROJECTION):
+                self.on_insert(doc)
+            fetched += len(batch)
+        return {"fetched": fetched, "removed": removed}
+
+    def apply_change(self, change: Dict) -> None:
+        """Apply one change stream event to the index."""
+        operation = change.get("operationType")
+        if operation == "insert":
+            self.on_insert(change["fullDocument"])
+            # The stream delivers inserts in commit order, so the mark (saved
+            # with snapshots) follows it without polling
+            self.index.note_seen(change["documentKey"]["_id"])
+        elif operation == "delete":
+            self.on_delete(change["documentKey"]["_id"])
+        elif operation in ("update", "replace"):
+            # Re-index with the post-image (e.g. an embedding was backfilled)
+            self.on_delete(change["documentKey"]["_id"])
+            if change.get("fullDocument") is not None:
+                self.on_insert(change["fullDocument"])
+
+    def maybe_snapshot(self) -> bool:
+        """Save a snapshot if the newest one is older than snapshot_interval."""
+        generation = self.index.generation
+        if self.snapshots is None or generation == self._snapshot_generation:
+            return False
+        if self.snapshots.save_if_stale(self.index, self.snapshot_interval) is None:
+            return False
+        self._snapshot_generation = generation
+        return True
+
+    def maybe_compact(self) -> int:
+        """Compact the index if enough of it is tombstoned."""
+        total = self.index.product_count + self.index.tombstone_count
+        if total and self.index.tombstone_count / total >= self.compact_ratio:
+            return self.index.compact()
+        return 0
+
+    # ---------------------------------------------------------------
+    # Background threads
+    # ---------------------------------------------------------------
+
+    def start(self) -> None:
+        """Start following the collection and compacting in the background."""
+        if self._threads:
+            return
+        self._stop.clear()
+        self._threads = [
+            threading.Thread(target=self._follow, name="index-follow", daemon=True),
+            threading.Thread(target=self._compact_loop, name="index-compact", daemon=True)
+        ]
+        for thread in self._threads:
+            thread.start()
+
+    def stop(self) -> None:
+        """Stop the background threads."""
+        self._stop.set()
+        for thread in self._threads:
+            thread.join(timeout=5)
+        self._threads = []
+
+    def _follow(self) -> None:
+        """
+        Follow the change stream, polling whenever it is unavailable.
+
+        A stream that fails to open or drops is retried after a backoff
+        doubling from poll_interval up to max_backoff, resuming after the
+        last change applied; polls keep the index current in between.
+        """
+        backoff = self.poll_interval
+        while not self._stop.is_set():
+            opened = False
+            try:
+                with self.collection.watch(
+                    _CHANGE_PIPELINE, full_document="updateLookup", max_await_time_ms=1000,
+                    resume_after=self._resume_token
+                ) as stream:
+                    opened = True
+                    self.mode = "change_stream"
+                    logger.info("Search index following chatbot change stream")
+                    # Catch up on anything inserted between the build (or the drop) and the watch
+                    self.refresh_once()
+                    while not self._stop.is_set():
+                        change = stream.try_next()
+                        backoff = self.poll_interval
+                        if change is not None:
+                            self.apply_change(change)
+                            self._resume_token = change.get("_id")
+                return
+            except Exception as e:
+                if self._stop.is_set():
+                    return
+                if not opened:
+                    # The token may be what failed (e.g. rolled off the oplog)
+                    self._resume_token = None
+                if self.mode != "polling":
+                    logger.warning("Change stream unavailable (%s); polling every %ss and retrying it", e, self.poll_interval)
+
+            self.mode = "polling"
+            retry_at = time.monotonic() + backoff
+            while not self._stop.is_set() and time.monotonic() < retry_at:
+                try:
+                    self.refresh_once()
+                except Exception as e:
+                    logger.warning("Search index refresh failed: %s", e)
+                self._stop.wait(min(self.poll_interval, max(0.0, retry_at - time.monotonic())))
+            backoff = min(backoff * 2, self.max_backoff)
+
+    def _compact_loop(self) -> None:
+        while not self._stop.wait(self.compact_interval):
+            try:
+                self.maybe_compact()
+            except Exception as e:
+                logger.warning("Search index compaction failed: %s", e)
+            try:
+                self.index.maybe_train_ann()
+            except Exception as e:
+                logger.warning("ANN index training failed: %s", e)
+            try:
+                self.maybe_snapshot()
+            except Exception as e:
+                logger.warning("Search index snapshot failed: %s", e)
@@ -0,0 +1,186 @@
+"""
+Versioned on-disk snapshots of the search index, shared by uvicorn workers.
+
+Instead of every worker scanning BFB.chatbot at boot, one worker builds the
+index and saves it; the others (and later restarts) open that snapshot with
+memory-mapped arrays, sharing its pages through the OS page cache, and only
+fetch what changed since its high-water mark.
+
+Layout of the snapshot directory:
+    CURRENT     name of the newest complete snapshot
+    v000012/    files written by SearchIndex.save_snapshot()
+    .lock       held (flock) while a worker builds or writes a snapshot
+
+Older versions are pruned after a save; workers still mapping them keep
+reading the unlinked files until they reopen.
+"""
+
+import os
+import re
+import time
+import shutil
+import logging
+from contextlib import contextmanager
+from typing import Optional
+from routes.vector_index import SearchIndex, SNAPSHOT_HEADROOM
+
+logger = logging.getLogger(__name__)
+
+try:
+    import fcntl
+except ImportError:     # Windows: one worker per snapshot directory
+    fcntl = None
+
+_VERSION = re.compile(r"^v(\d+)$")
+
+
+class SnapshotStore:
+    """
+    Snapshots of one SearchIndex configuration in `directory`.
+
+    Args:
+        directory: Where snapshots live (created if missing)
+        keep: Snapshots kept after each save, newest first
+        headroom: Spare rows per array as a fraction of the used ones
+    """
+
+    def __init__(self, directory: str, keep: int = 2, headroom: float = SNAPSHOT_HEADROOM):
+        self.directory = directory
+        self.keep = max(1, keep)
+        self.headroom = headroom
+        os.makedirs(directory, exist_ok=True)
+
+    @classmethod
+    def from_env(cls) -> Optional["SnapshotStore"]:
+        """The store in SEARCH_SNAPSHOT_DIR, or None when it isn't set."""
+        directory = os.getenv("SEARCH_SNAPSHOT_DIR")
+        if not directory:
+            return None
+        return cls(directory, keep=int(os.getenv("SEARCH_SNAPSHOT_KEEP", "2")))
+
+    def current(self) -> Optional[str]:
+        """Path of the newest complete snapshot, if any."""
+        try:
+            with open(os.path.join(self.directory, "CURRENT")) as f:
+                name = f.read().strip()
+        except FileNotFoundError:
+            return None
+        path = os.path.join(self.directory, name)
+        return path if name and os.path.isdir(path) else None
+
+    def age(self) -> Optional[float]:
+        """Seconds since the newest snapshot was written."""
+        path = self.current()
+        return time.time() - os.path.getmtime(os.path.join(path, "meta.json")) if path else None
+
+    @contextmanager
+    def lock(self, blocking: bool = True):
+        """
+        Hold the store's lock across processes.
+
+        Yields:
+            True if the lock is held, False if `blocking` is off and another process has it
+        """
+        if fcntl is None:
+            yield True
+            return
+        with open(os.path.join(self.directory, ".lock"), "a") as f:
+            try:
+                fcntl.flock(f, fcntl.LOCK_EX if blocking else fcntl.LOCK_EX | fcntl.LOCK_NB)
+                locked = True
+            except BlockingIOError:
+                locked = False
+            try:
+                yield locked
+            finally:
+                if locked:
+                    fcntl.flock(f, fcntl.LOCK_UN)
+
+    def open(self, collection=None, **options) -> Optional[SearchIndex]:
+        """
+        The newest snapshot as an index, or None if there is none that fits `options`.
+
+        `collection` becomes the index's vector_source for re-ranking.
+        """
+        path = self.current()
+        if path is None:
+            return None
+        try:
+            index = SearchIndex.open_snapshot(path, **options)
+        except (OSError, ValueError, KeyError) as e:
+            logger.warning("Search index snapshot %s not used: %s", path, e)
+            return None
+        index.vector_source = collection
+        return index
+
+    def open_or_build(self, collection, **options) -> SearchIndex:
+        """
+        Open the newest snapshot, or build the index from `collection` and save it.
+
+        Workers starting together take turns on the lock, so only the first
+        scans the collection; the rest open what it saved.
+        """
+        index = self.open(collection, **options)
+        if index is not None:
+            return index
+        with self.lock():
+            index = self.open(collection, **options)
+            if index is None:
+                index = SearchIndex.from_collection(collection, **options)
+                self._save(index)
+        return index
+
+    def save(self, index: SearchIndex) -> Optional[str]:
+        """Write a new snapshot of `index` and make it current (None if the index is empty)."""
+        with self.lock():
+            return self._save(index)
+
+    def save_if_stale(self, index: SearchIndex, max_age: float) -> Optional[str]:
+        """
+        Save `index` unless the newest snapshot is younger than `max_age` seconds.
+
+        Never waits: if another worker holds the lock, it is saving already.
+        """
+        with self.lock(blocking=False) as locked:
+            if not locked:
+                return None
+            age = self.age()
+            if age is not None and age < max_age:
+                return None
+            return self._save(index)
+
+    def _save(self, index: SearchIndex) -> Optional[str]:
+        """Write and publish a snapshot (lock held)."""
+        if index.product_count == 0:
+            return None
+        versions = self._versions()
+        name = f"v{(versions[-1][0] + 1 if versions else 1):06d}"
+        path = os.path.join(self.directory, name)
+        temporary = os.path.join(self.directory, f".{name}.tmp")
+        shutil.rmtree(temporary, ignore_errors=True)
+        started = time.perf_counter()
+        try:
+            meta = index.save_snapshot(temporary, self.headroom)
+        except Exception:
+            shutil.rmtree(temporary, ignore_errors=True)
+            raise
+        os.replace(temporary, path)
+        pointer = os.path.join(self.directory, ".CURRENT.tmp")
+        with open(pointer, "w") as f:
+            f.write(name)
+        os.replace(pointer, os.path.join(self.directory, "CURRENT"))
+        logger.info("Search index snapshot saved", extra={
+            "snapshot": name, "documents": meta["documents"], "seconds": round(time.perf_counter() - started, 1)
+        })
+        for _, old in self._versions()[:-self.keep]:
+            shutil.rmtree(os.path.join(self.directory, old), ignore_errors=True)
+        return path
+
+    def _versions(self):
+        """(number, name) of the snapshots on disk, oldest first."""
+        versions = []
+        for name in os.listdir(self.directory):
+            match = _VERSION.match(name)
+            if match:
+                versions.append((int(match.group(1)), name))
+        return sorted(versions)
@@ -0,0 +1,109 @@
+import time
+import json
+import hashlib
+import threading
+from collections import OrderedDict
+from typing import Dict, Optional
+
+
+def image_key(contents: bytes) -> str:
+    """Content address of an uploaded image."""
+    return hashlib.sha256(contents).hexdigest()
+
+
+def ocr_text_key(ocr_text: str) -> Optional[str]:
+    """Key for OCR output that ignores case and whitespace; None for blank text."""
+    normalized = " ".join((ocr_text or "").lower().split())
+    if not normalized:
+        return None
+    return hashlib.sha256(normalized.encode("utf-8")).hexdigest()
+
+
+def uploader_key(system_data: Dict) -> str:
+    """Who a receipt is recorded for: its user_id and pick_up_location."""
+    return json.dumps([system_data.get("user_id"), system_data.get("pick_up_location")], default=str)
+
+
+class IngestDedupCache:
+    """
+    Remembers what each recently ingested receipt produced.
+
+    Entries are found by the SHA-256 of the image bytes, or failing that by
+    the normalized OCR text (the same receipt photographed twice), so a
+    repeated upload can return the stored structured_data and inserted_id
+    without OCR, an LLM call or a duplicate insert. Both are scoped to the
+    uploader (see uploader_key): the same receipt uploaded by another user,
+    or for another pick-up location, is a new record. Bounded by entry
+    count (least-recently-used first) and by age.
+    """
+
+    def __init__(self, max_entries: int = 2048, max_age_seconds: float = 7 * 86400.0):
+        self.max_entries = max_entries
+        self.max_age_seconds = max_age_seconds
+        self.image_hits = 0
+        self.text_hits = 0
+        self.misses = 0
+        # key -> (entry, stored_at); image and text keys share one LRU
+        self._entries: "OrderedDict[str, tuple]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def _get(self, key: str) -> Optional[Dict]:
+        found = self._entries.get(key)
+        if found is None:
+            return None
+        entry, stored_at = found
+        if time.time() - stored_at > self.max_age_seconds:
+            del self._entries[key]
+            return None
+        self._entries.move_to_end(key)
+        return entry
+
+    def _put(self, key: str, entry: Dict) -> None:
+        self._entries[key] = (entry, time.time())
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+    def lookup_image(self, image_hash: str, uploader: str) -> Optional[Dict]:
+        with self._lock:
+            entry = self._get(f"image:{uploader}:{image_hash}")
+            if entry is not None:
+                self.image_hits += 1
+            return entry
+
+    def lookup_text(self, text_hash: Optional[str], uploader: str, image_hash: Optional[str] = None) -> Optional[Dict]:
+        """Look up by OCR text; on a hit, also remember `image_hash` for next time."""
+        with self._lock:
+            entry = self._get(f"text:{uploader}:{text_hash}") if text_hash else None
+            if entry is None:
+                self.misses += 1
+                return None
+            self.text_hits += 1
+            if image_hash:
+                self._put(f"image:{uploader}:{image_hash}", entry)
+            return entry
+
+    def store(
+        self,
+        image_hash: str,
+        text_hash: Optional[str],
+        uploader: str,
+        inserted_id: str,
+        structured_data: Dict
+    ) -> None:
+        entry = {"inserted_id": inserted_id, "structured_data": structured_data}
+        with self._lock:
+            self._put(f"image:{uploader}:{image_hash}", entry)
+            if text_hash:
+                self._put(f"text:{uploader}:{text_hash}", entry)
+
+    def stats(self) -> Dict:
+        lookups = self.image_hits + self.text_hits + self.misses
+        return {
+            "entries": len(self._entries),
+            "max_entries": self.max_entries,
+            "image_hits": self.image_hits,
+            "text_hits": self.text_hits,
+            "misses": self.misses,
+            "hit_ratio": round((self.image_hits + self.text_hits) / lookups, 4) if lookups else 0.0
+        }
@@ -0,0 +1,361 @@
+#!/usr/bin/env python3
+"""
+Batch receipt ingestion: OCR -> LLM -> embed -> insert_many, pipelined.
+
+Each stage runs in its own asyncio tasks and hands receipts to the next
+through a bounded queue, so OCR of one scan overlaps the chat completion
+of another, embeddings are requested for many receipts per call and
+Mongo gets one insert_many per batch. Memory stays bounded because a
+stage that falls behind fills its queue and the stages before it wait.
+
+Usage (from backend/), for a folder of month-end scans:
+    python -m routes.ingest_pipeline --user-id u1 --pick-up-location "Dock 4" scans/*.jpg
+"""
+
+import os
+import sys
+import json
+import time
+import asyncio
+import logging
+import argparse
+from typing import Dict, Iterable, List, Optional
+from fastapi import HTTPException
+from starlette.datastructures import UploadFile
+from routes.ingest_cache import image_key, ocr_text_key
+
+logger = logging.getLogger(__name__)
+
+# Marks the end of a stage's input
+_DONE = object()
+
+
+class _Receipt:
+    """One file's state as it moves through the pipeline."""
+
+    __slots__ = ("index", "upload", "image_hash", "text_hash", "ocr_text", "parsed_json", "timings")
+
+    def __init__(self, index: int, upload):
+        self.index = index
+        self.upload = upload
+        self.image_hash = None
+        self.text_hash = None
+        self.ocr_text = ""
+        self.parsed_json = None
+        self.timings = {}
+
+
+class IngestPipeline:
+    """
+    Streams many uploads through an ImageDetection's stages concurrently.
+
+    Args:
+        detector: ImageDetection whose OCR, LLM, embedder, collection,
+            index hook and dedup cache are used
+        ocr_workers: Concurrent OCR jobs (default: twice the OCR engine's workers)
+        llm_workers: Concurrent chat completions
+        llm_batch: Most receipts structured per chat completion
+        embed_batch: Most receipts per embeddings call
+        insert_batch: Most documents per insert_many
+        queue_size: Capacity of each queue between stages
+    """
+
+    def __init__(
+        self,
+        detector,
+        ocr_workers: Optional[int] = None,
+        llm_workers: int = 8,
+        llm_batch: int = 8,
+        embed_batch: int = 32,
+        insert_batch: int = 50,
+        queue_size: int = 16
+    ):
+        self.detector = detector
+        if ocr_workers is None:
+            # Twice the engine's processes, so one job's bytes are read and
+            # hashed while the others run; a full OCR queue just makes us wait
+            engine = detector.ocr_engine
+            ocr_workers = 2 * engine.workers if engine is not None else 4
+        self.ocr_workers = max(1, ocr_workers)
+        self.llm_workers = max(1, llm_workers)
+        self.llm_batch = max(1, llm_batch)
+        self.embed_batch = max(1, embed_batch)
+        self.insert_batch = max(1, insert_batch)
+        self.queue_size = queue_size
+
+    async def run(self, uploads: Iterable, system_data: dict) -> Dict:
+        """
+        Ingest every upload and report on each.
+
+        Args:
+            uploads: UploadFile-like objects (filename, async read()); may be
+                a generator, which is consumed as the pipeline has room
+            system_data: user_info stored with every receipt
+
+        Returns:
+            {"results": one dict per upload in input order, "stats": throughput figures}
+        """
+        start = time.perf_counter()
+        results: List[Dict] = []
+        # First index seen for each image hash, to collapse duplicates within the batch
+        first_by_image: Dict[str, int] = {}
+        batch_duplicates: Dict[int, int] = {}
+        stage_ms = {"ocr": 0.0, "llm": 0.0, "embed": 0.0, "insert": 0.0}
+        calls = {"llm": 0, "embed": 0, "insert_many": 0}
+
+        ocr_q: asyncio.Queue = asyncio.Queue(self.queue_size)
+        llm_q: asyncio.Queue = asyncio.Queue(self.queue_size)
+        embed_q: asyncio.Queue = asyncio.Queue(self.queue_size)
+        write_q: asyncio.Queue = asyncio.Queue(self.queue_size)
+
+        def finish(receipt: _Receipt, **fields) -> None:
+            results[receipt.index].update(fields)
+
+        def fail(receipt: _Receipt, error: Exception) -> None:
+            message = error.detail if isinstance(error, HTTPException) else str(error)
+            logger.warning("Receipt failed: %s", message, extra={"upload": results[receipt.index]["filename"]})
+            finish(receipt, status="error", error=message)
+
+        async def feed():
+            for upload in uploads:
+                results.append({
+                    "filename": getattr(upload, "filename", None),
+                    "status": "pending",
+                    "inserted_id": None,
+                    "data": None,
+                    "dedup": None,
+                    "error": None
+                })
+                await ocr_q.put(_Receipt(len(results) - 1, upload))
+            for _ in range(self.ocr_workers):
+                await ocr_q.put(_DONE)
+
+        async def ocr_stage():
+            while (receipt := await ocr_q.get()) is not _DONE:
+                started = time.perf_counter()
+                try:
+                    contents = await self.detector.read_contents(receipt.upload)
+                    try:
+                        await receipt.upload.close()
+                    except Exception:
+                        pass
+                    receipt.image_hash = image_key(contents)
+                    cached = self.detector.cached_by_image(receipt.image_hash, system_data)
+                    if cached is not None:
+                        finish(receipt, status="success", inserted_id=cached["inserted_id"],
+                               data=cached["structured_data"], dedup="image_hash")
+                        continue
+                    if receipt.image_hash in first_by_image:
+                        batch_duplicates[receipt.index] = first_by_image[receipt.image_hash]
+                        continue
+                    first_by_image[receipt.image_hash] = receipt.index
+                    receipt.ocr_text = await self._recognize(contents, receipt.timings)
+                    receipt.text_hash = ocr_text_key(receipt.ocr_text)
+                    cached = self.detector.cached_by_text(receipt.text_hash, receipt.image_hash, system_data)
+                    if cached is not None:
+                        finish(receipt, status="success", inserted_id=cached["inserted_id"],
+                               data=cached["structured_data"], dedup="ocr_text")
+                        continue
+                except Exception as e:
+                    fail(receipt, e)
+                    continue
+                finally:
+                    stage_ms["ocr"] += (time.perf_counter() - started) * 1000
+                await llm_q.put(receipt)
+
+        async def llm_stage():
+            done = False
+            while not done:
+                # Whatever OCR has finished meanwhile shares one chat completion
+                batch, done = await self._take_batch(llm_q, self.llm_batch)
+                if not batch:
+                    continue
+                started = time.perf_counter()
+                try:
+                    parsed = await self.detector.structure_many([r.ocr_text for r in batch], system_data)
+                except Exception as e:
+                    for receipt in batch:
+                        fail(receipt, e)
+                    continue
+                finally:
+                    stage_ms["llm"] += (time.perf_counter() - started) * 1000
+                    calls["llm"] += 1
+                for receipt, parsed_json in zip(batch, parsed):
+                    receipt.parsed_json = parsed_json
+                    await embed_q.put(receipt)
+
+        async def embed_stage():
+            done = False
+            while not done:
+                batch, done = await self._take_batch(embed_q, self.embed_batch)
+                if not batch:
+                    continue
+                started = time.perf_counter()
+                fields = await self.detector.embed_receipts([(r.parsed_json, r.ocr_text) for r in batch])
+                calls["embed"] += 1
+                stage_ms["embed"] += (time.perf_counter() - started) * 1000
+                for receipt, embedding_fields in zip(batch, fields):
+                    doc = self.detector.build_document(
+                        system_data, results[receipt.index]["filename"], receipt.parsed_json, embedding_fields
+                    )
+                    await write_q.put((receipt, doc))
+            await write_q.put(_DONE)
+
+        async def write_stage():
+            done = False
+            while not done:
+                batch, done = await self._take_batch(write_q, self.insert_batch)
+                if not batch:
+                    continue
+                started = time.perf_counter()
+                if self.detector.collection is None:
+                    # Dry run: nothing to insert, but the batch still passes through the stage
+                    for receipt, doc in batch:
+                        finish(receipt, status="success", data=receipt.parsed_json)
+                else:
+                    inserted_ids = await self.detector.insert_many([doc for _, doc in batch])
+                    calls["insert_many"] += 1
+                    for (receipt, doc), inserted_id in zip(batch, inserted_ids):
+                        if inserted_id is None:
+                            finish(receipt, status="error", data=receipt.parsed_json, error="Mongo insert failed")
+                            continue
+                        self.detector.after_insert(doc, receipt.image_hash, receipt.text_hash)
+                        finish(receipt, status="success", inserted_id=inserted_id, data=receipt.parsed_json)
+                stage_ms["insert"] += (time.perf_counter() - started) * 1000
+
+        async def close_stage(workers: List[asyncio.Task], queue: asyncio.Queue, downstream: int):
+            await asyncio.gather(*workers)
+            for _ in range(downstream):
+                await queue.put(_DONE)
+
+        ocr_tasks = [asyncio.create_task(ocr_stage()) for _ in range(self.ocr_workers)]
+        llm_tasks = [asyncio.create_task(llm_stage()) for _ in range(self.llm_workers)]
+        tasks = [
+            asyncio.create_task(feed()),
+            asyncio.create_task(close_stage(ocr_tasks, llm_q, self.llm_workers)),
+            asyncio.create_task(close_stage(llm_tasks, embed_q, 1)),
+            asyncio.create_task(embed_stage()),
+            asyncio.create_task(write_stage()),
+        ]
+        try:
+            await asyncio.gather(*tasks)
+        finally:
+            for task in tasks + ocr_tasks + llm_tasks:
+                task.cancel()
+
+        for index, first in batch_duplicates.items():
+            original = results[first]
+            results[index].update(
+                status=original["status"], inserted_id=original["inserted_id"],
+                data=original["data"], error=original["error"], dedup="batch"
+            )
+
+        elapsed = time.perf_counter() - start
+        succeeded = sum(1 for r in results if r["status"] == "success")
+        stats = {
+            "files": len(results),
+            "succeeded": succeeded,
+            "failed": len(results) - succeeded,
+            "elapsed_ms": round(elapsed * 1000, 2),
+            "images_per_minute": round(len(results) / elapsed * 60, 2) if elapsed > 0 else 0.0,
+            "stage_busy_ms": {name: round(ms, 2) for name, ms in stage_ms.items()},
+            "llm_calls": calls["llm"],
+            "embed_calls": calls["embed"],
+            "insert_many_calls": calls["insert_many"]
+        }
+        logger.info("Batch ingested", extra={
+            "files": stats["files"], "succeeded": succeeded, "elapsed_ms": stats["elapsed_ms"],
+            "images_per_minute": stats["images_per_minute"]
+        })
+        return {"results": results, "stats": stats}
+
+    async def _recognize(self, contents: bytes, timings: dict) -> str:
+        """OCR that waits out a full OCR queue instead of failing the file."""
+        delay = 0.05
+        while True:
+            try:
+                return await self.detector.recognize(contents, timings)
+            except HTTPException as e:
+                if e.status_code != 503:
+                    raise
+            await asyncio.sleep(delay)
+            delay = min(delay * 2, 1.0)
+
+    @staticmethod
+    async def _take_batch(queue: asyncio.Queue, size: int):
+        """Wait for one item, then take whatever else is ready, up to `size`."""
+        batch = []
+        item = await queue.get()
+        while item is not _DONE:
+            batch.append(item)
+            if len(batch) >= size or queue.empty():
+                return batch, False
+            item = queue.get_nowait()
+        return batch, True
+
+
+def _open_uploads(paths: List[str]):
+    for path in paths:
+        yield UploadFile(file=open(path, "rb"), filename=os.path.basename(path))
+
+
+async def _main(args) -> Dict:
+    from config.logging_config import configure_logging
+    from config.settings import get_database, close_database, make_openai_clients
+    from routes.Image_detection import ImageDetection
+    from routes.embeddings import get_embedder
+    from routes.ocr import OCREngine
+    from routes.stock import StockRollups
+    configure_logging()
+
+    key = os.getenv("OPENAI_API_KEY")
+    sync_client, async_client = make_openai_clients(key) if key else (None, None)
+    database = None if args.dry_run else get_database()
+    engine = OCREngine.from_env()
+    detector = ImageDetection(
+        database["chatbot"] if database is not None else None,
+        embedder=get_embedder(sync_client, async_client),
+        client=async_client,
+        ocr_engine=engine,
+        line_items=database["line_items"] if database is not None else None,
+        stock_rollups=StockRollups(database["stock_rollups"]) if database is not None else None
+    )
+    pipeline = IngestPipeline(
+        detector,
+        ocr_workers=args.ocr_workers,
+        llm_workers=args.llm_workers,
+        llm_batch=args.llm_batch,
+        embed_batch=args.embed_batch,
+        insert_batch=args.insert_batch
+    )
+    system_data = {"user_id": args.user_id, "user_name": args.user_name, "pick_up_location": args.pick_up_location}
+    try:
+        return await pipeline.run(_open_uploads(args.files), system_data)
+    finally:
+        engine.shutdown()
+        if async_client is not None:
+            await async_client.close()
+            sync_client.close()
+        close_database()
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("files", nargs="+", help="receipt images to ingest")
+    parser.add_argument("--user-id", default="default_user")
+    parser.add_argument("--user-name", default="default_name")
+    parser.add_argument("--pick-up-location", default="default_location")
+    parser.add_argument("--ocr-workers", type=int, default=None)
+    parser.add_argument("--llm-workers", type=int, default=8)
+    parser.add_argument("--llm-batch", type=int, default=8, help="receipts per chat completion")
+    parser.add_argument("--embed-batch", type=int, default=32)
+    parser.add_argument("--insert-batch", type=int, default=50)
+    parser.add_argument("--dry-run", action="store_true", help="process the files without writing to Mongo")
+    parser.add_argument("--output", help="write the per-file results as JSON here instead of stdout")
+    args = parser.parse_args()
+    report = asyncio.run(_main(args))
+    text = json.dumps(report, indent=2, default=str)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(text)
+    else:
+        sys.stdout.write(text + "\n")
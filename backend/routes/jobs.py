@@ -0,0 +1,375 @@
+import json
+import time
+import uuid
+import logging
+import sqlite3
+import asyncio
+import threading
+from typing import Awaitable, Callable, Dict, List, Optional
+from fastapi import APIRouter, Request, HTTPException
+from starlette.concurrency import run_in_threadpool
+
+logger = logging.getLogger(__name__)
+
+router = APIRouter()
+
+# Job lifecycle; "stage" narrows down where a running job is
+QUEUED, RUNNING, SUCCEEDED, FAILED = "queued", "running", "succeeded", "failed"
+
+
+class JobQueueFull(Exception):
+    """Raised when a job is submitted while the queue is at capacity."""
+
+
+class JobStore:
+    """
+    SQLite table of ingest jobs, so queued work survives a restart.
+
+    The uploaded bytes are kept with each job until it finishes and are
+    then dropped; results stay until `purge` removes old finished jobs.
+    Safe to share between threads, and between the processes of one host
+    (every uvicorn worker opens the same file): a job only runs once
+    claim() has moved it from queued to running under this store's
+    `owner`, with a lease its runner renews. Running jobs whose lease ran
+    out (their worker died) are queued again by requeue_expired().
+    """
+
+    def __init__(self, path: str = "jobs.sqlite3", lease_seconds: float = 300.0):
+        self.path = path
+        self.owner = uuid.uuid4().hex
+        self.lease_seconds = lease_seconds
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.row_factory = sqlite3.Row
+        with self._lock, self._conn:
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute(
+                """
+                CREATE TABLE IF NOT EXISTS jobs (
+                    id TEXT PRIMARY KEY,
+                    status TEXT NOT NULL,
+                    stage TEXT,
+                    filename TEXT,
+                    system_data TEXT,
+                    payload BLOB,
+                    result TEXT,
+                    error TEXT,
+                    created_at REAL NOT NULL,
+                    updated_at REAL NOT NULL
+                )
+                """
+            )
+            # Tables created before leases existed
+            columns = {row["name"] for row in self._conn.execute("PRAGMA table_info(jobs)")}
+            for column, kind in (("owner", "TEXT"), ("lease_until", "REAL")):
+                if column not in columns:
+                    self._conn.execute(f"ALTER TABLE jobs ADD COLUMN {column} {kind}")
+            self._conn.execute("CREATE INDEX IF NOT EXISTS jobs_status_created ON jobs (status, created_at)")
+
+    def create(self, filename: str, contents: bytes, system_data: Dict) -> str:
+        job_id = uuid.uuid4().hex
+        now = time.time()
+        with self._lock, self._conn:
+            self._conn.execute(
+                "INSERT INTO jobs (id, status, stage, filename, system_data, payload, created_at, updated_at) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                (job_id, QUEUED, QUEUED, filename, json.dumps(system_data), sqlite3.Binary(contents), now, now)
+            )
+        return job_id
+
+    def get(self, job_id: str) -> Optional[Dict]:
+        """A job's status and outcome (without its payload), or None."""
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT id, status, stage, filename, result, error, created_at, updated_at FROM jobs WHERE id = ?",
+                (job_id,)
+            ).fetchone()
+        if row is None:
+            return None
+        job = dict(row)
+        job["result"] = json.loads(job["result"]) if job["result"] else None
+        return job
+
+    def load(self, job_id: str) -> Optional[Dict]:
+        """Everything needed to run a job: filename, system_data and the uploaded bytes."""
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT filename, system_data, payload FROM jobs WHERE id = ?", (job_id,)
+            ).fetchone()
+        if row is None or row["payload"] is None:
+            return None
+        return {
+            "filename": row["filename"],
+            "system_data": json.loads(row["system_data"] or "{}"),
+            "contents": bytes(row["payload"])
+        }
+
+    def claim(self, job_id: str) -> bool:
+        """
+        Take a queued job for this owner, leased for lease_seconds.
+
+        Returns:
+            False if it isn't queued (another worker claimed it, or it finished)
+        """
+        now = time.time()
+        with self._lock, self._conn:
+            cursor = self._conn.execute(
+                "UPDATE jobs SET status = ?, stage = ?, owner = ?, lease_until = ?, updated_at = ? "
+                "WHERE id = ? AND status = ?",
+                (RUNNING, RUNNING, self.owner, now + self.lease_seconds, now, job_id, QUEUED)
+            )
+        return cursor.rowcount == 1
+
+    def renew(self, job_id: str) -> bool:
+        """Extend this owner's lease on a running job; False if it has lost it."""
+        with self._lock, self._conn:
+            cursor = self._conn.execute(
+                "UPDATE jobs SET lease_until = ? WHERE id = ? AND status = ? AND owner = ?",
+                (time.time() + self.lease_seconds, job_id, RUNNING, self.owner)
+            )
+        return cursor.rowcount == 1
+
+    def release(self) -> int:
+        """Queue this owner's running jobs again (on shutdown, so they needn't wait out the lease)."""
+        with self._lock, self._conn:
+            cursor = self._conn.execute(
+                "UPDATE jobs SET status = ?, stage = ?, owner = NULL, lease_until = NULL, updated_at = ? "
+                "WHERE status = ? AND owner = ?",
+                (QUEUED, QUEUED, time.time(), RUNNING, self.owner)
+            )
+        return cursor.rowcount
+
+    def requeue_expired(self) -> int:
+        """Queue running jobs whose lease ran out (or that predate leases) again."""
+        now = time.time()
+        with self._lock, self._conn:
+            cursor = self._conn.execute(
+                "UPDATE jobs SET status = ?, stage = ?, owner = NULL, lease_until = NULL, updated_at = ? "
+                "WHERE status = ? AND (lease_until IS NULL OR lease_until < ?)",
+                (QUEUED, QUEUED, now, RUNNING, now)
+            )
+        return cursor.rowcount
+
+    def mark_succeeded(self, job_id: str, result: Dict) -> bool:
+        """Record a job's result; False if this owner no longer holds its lease (see _finish)."""
+        return self._finish(job_id, status=SUCCEEDED, stage=SUCCEEDED, result=json.dumps(result, default=str), payload=None)
+
+    def mark_failed(self, job_id: str, error: str) -> bool:
+        """Record why a job failed; False if this owner no longer holds its lease (see _finish)."""
+        return self._finish(job_id, status=FAILED, stage=FAILED, error=error, payload=None)
+
+    def unfinished(self) -> List[str]:
+        """Ids of queued jobs (interrupted ones included once requeued), oldest first."""
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT id FROM jobs WHERE status = ? ORDER BY created_at", (QUEUED,)
+            ).fetchall()
+        return [row["id"] for row in rows]
+
+    def purge(self, older_than_seconds: float) -> int:
+        """Delete finished jobs last updated more than `older_than_seconds` ago."""
+        cutoff = time.time() - older_than_seconds
+        with self._lock, self._conn:
+            cursor = self._conn.execute(
+                "DELETE FROM jobs WHERE status IN (?, ?) AND updated_at < ?", (SUCCEEDED, FAILED, cutoff)
+            )
+        return cursor.rowcount
+
+    def close(self) -> None:
+        with self._lock:
+            self._conn.close()
+
+    def _finish(self, job_id: str, **fields) -> bool:
+        """
+        Finish a running job this owner holds an unexpired lease on.
+
+        A job whose lease ran out may already be queued again or running
+        elsewhere, so its outcome is left to whichever worker holds it now.
+        """
+        now = time.time()
+        fields.update(owner=None, lease_until=None, updated_at=now)
+        assignments = ", ".join(f"{name} = ?" for name in fields)
+        with self._lock, self._conn:
+            cursor = self._conn.execute(
+                f"UPDATE jobs SET {assignments} WHERE id = ? AND status = ? AND owner = ? AND lease_until >= ?",
+                (*fields.values(), job_id, RUNNING, self.owner, now)
+            )
+        return cursor.rowcount == 1
+
+
+class JobQueue:
+    """
+    In-process queue that runs ingest jobs on a pool of asyncio workers.
+
+    Jobs are written to the store before they are acknowledged, and on
+    start() (then every lease period) queued jobs, and running ones whose
+    worker's lease ran out, are picked up again. Every worker process
+    sharing the store does this, so a job only runs where the store's
+    claim() succeeds, renewing its lease while it runs. When `max_pending`
+    jobs are already waiting, submit() raises JobQueueFull so the endpoint
+    can answer 429.
+
+    Args:
+        store: JobStore for jobs and their uploads
+        process: async (filename, contents, system_data, progress) -> result
+            dict; `progress(stage)` reports which step is running
+        workers: Jobs run concurrently
+        max_pending: Most jobs waiting to start
+        retention_seconds: How long finished jobs are kept
+    """
+
+    def __init__(
+        self,
+        store: JobStore,
+        process: Callable[..., Awaitable[Dict]],
+        workers: int = 2,
+        max_pending: int = 100,
+        retention_seconds: float = 7 * 86400.0
+    ):
+        self.store = store
+        self.process = process
+        self.workers = max(1, workers)
+        self.max_pending = max_pending
+        self.retention_seconds = retention_seconds
+        self.completed = 0
+        self.failed = 0
+        self.rejected = 0
+        self._queue: Optional[asyncio.Queue] = None
+        # Ids in _queue, so sweeps don't queue a job twice
+        self._queued = set()
+        self._tasks: List[asyncio.Task] = []
+        # Finer-grained stage of running jobs, kept in memory only
+        self._stages: Dict[str, str] = {}
+
+    async def start(self) -> None:
+        if self._tasks:
+            return
+        self._queue = asyncio.Queue()
+        purged = await run_in_threadpool(self.store.purge, self.retention_seconds)
+        resumed = await self.sweep()
+        self._tasks = [asyncio.create_task(self._work()) for _ in range(self.workers)]
+        self._tasks.append(asyncio.create_task(self._sweep_loop()))
+        logger.info("Job queue started", extra={"workers": self.workers, "resumed": resumed, "purged": purged})
+
+    async def stop(self) -> None:
+        """Stop the workers; their interrupted jobs are queued again for whichever worker claims them."""
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+        self._stages.clear()
+        await run_in_threadpool(self.store.release)
+        await run_in_threadpool(self.store.close)
+
+    async def sweep(self) -> int:
+        """
+        Requeue running jobs with an expired lease, then queue every queued
+        job not already waiting here.
+
+        Returns:
+            Number of jobs added to this process's queue
+        """
+        await run_in_threadpool(self.store.requeue_expired)
+        added = 0
+        for job_id in await run_in_threadpool(self.store.unfinished):
+            if job_id not in self._queued:
+                self._enqueue(job_id)
+                added += 1
+        return added
+
+    def _enqueue(self, job_id: str) -> None:
+        self._queued.add(job_id)
+        self._queue.put_nowait(job_id)
+
+    def pending(self) -> int:
+        return self._queue.qsize() if self._queue is not None else 0
+
+    async def submit(self, filename: str, contents: bytes, system_data: Dict) -> str:
+        if self._queue is None:
+            await self.start()
+        if self.pending() >= self.max_pending:
+            self.rejected += 1
+            raise JobQueueFull(f"{self.pending()} jobs are already waiting")
+        job_id = await run_in_threadpool(self.store.create, filename, contents, system_data)
+        self._enqueue(job_id)
+        return job_id
+
+    async def get(self, job_id: str) -> Optional[Dict]:
+        job = await run_in_threadpool(self.store.get, job_id)
+        if job is not None and job["status"] == RUNNING:
+            job["stage"] = self._stages.get(job_id, job["stage"])
+        return job
+
+    def stats(self) -> Dict:
+        return {
+            "workers": self.workers,
+            "pending": self.pending(),
+            "running": len(self._stages),
+            "max_pending": self.max_pending,
+            "completed": self.completed,
+            "failed": self.failed,
+            "rejected": self.rejected
+        }
+
+    async def _sweep_loop(self) -> None:
+        while True:
+            await asyncio.sleep(self.store.lease_seconds)
+            try:
+                await self.sweep()
+            except Exception as e:
+                logger.warning("Job sweep failed: %s", e)
+
+    async def _renew_loop(self, job_id: str) -> None:
+        while True:
+            await asyncio.sleep(self.store.lease_seconds / 3)
+            if not await run_in_threadpool(self.store.renew, job_id):
+                logger.warning("Lost the lease on a job", extra={"job_id": job_id})
+                return
+
+    async def _work(self) -> None:
+        while True:
+            job_id = await self._queue.get()
+            self._queued.discard(job_id)
+            # Another worker (or process) may have taken it already
+            if not await run_in_threadpool(self.store.claim, job_id):
+                continue
+            job = await run_in_threadpool(self.store.load, job_id)
+            if job is None:
+                continue
+            self._stages[job_id] = RUNNING
+            renewing = asyncio.create_task(self._renew_loop(job_id))
+
+            def progress(stage: str, job_id=job_id) -> None:
+                self._stages[job_id] = stage
+
+            try:
+                result = await self.process(job["filename"], job["contents"], job["system_data"], progress)
+                if await run_in_threadpool(self.store.mark_succeeded, job_id, result):
+                    self.completed += 1
+                    logger.debug("Job done", extra={"job_id": job_id})
+                else:
+                    logger.warning("Lost the lease on a job before finishing it", extra={"job_id": job_id})
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                message = e.detail if isinstance(e, HTTPException) else str(e)
+                if await run_in_threadpool(self.store.mark_failed, job_id, message):
+                    self.failed += 1
+                    logger.warning("Job failed: %s", message, extra={"job_id": job_id})
+                else:
+                    logger.warning("Lost the lease on a job before finishing it", extra={"job_id": job_id})
+            finally:
+                renewing.cancel()
+                self._stages.pop(job_id, None)
+
+
+@router.get("/jobs/{job_id}")
+async def get_job(job_id: str, request: Request):
+    """Status, current stage and (once finished) the result of an ingest job."""
+    job_queue = getattr(request.app.state, "job_queue", None)
+    if job_queue is None:
+        raise HTTPException(status_code=503, detail="Job queue is not configured")
+    job = await job_queue.get(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail=f"No job with id {job_id}")
+    return job
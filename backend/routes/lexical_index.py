@@ -0,0 +1,263 @@
+import re
+import math
+import threading
+from typing import Dict, Iterable, List, Optional, Tuple
+import numpy as np
+
+# Receipt tokens: words, numbers, and SKU-like runs joined by . - / #
+_TOKEN = re.compile(r"[a-z0-9]+(?:[.\-/#][a-z0-9]+)*")
+_THOUSANDS = re.compile(r"(?<=\d),(?=\d{3}\b)")
+_JOINERS = re.compile(r"[.\-/#]")
+_DECIMAL = re.compile(r"^\d+\.\d+$")
+_NUMBER_UNIT = re.compile(r"^(\d+(?:\.\d+)?)([a-z]+)$")
+
+
+def _normalize_number(token: str) -> str:
+    """12.50 -> 12.5 and 12.00 -> 12, so prices match however they were written."""
+    if _DECIMAL.match(token):
+        token = token.rstrip("0").rstrip(".")
+    return token
+
+
+def tokenize(text: str) -> List[str]:
+    """
+    Split receipt text into search terms.
+
+    Besides plain words it keeps what receipts are made of:
+    - prices: "$1,299.50" -> "1299.5"
+    - units: "100ml" -> "100ml", "100", "ml"
+    - SKUs: "AB-1234" -> "ab-1234", "ab", "1234", "ab1234"
+    """
+    tokens = []
+    for match in _TOKEN.finditer(_THOUSANDS.sub("", text.lower())):
+        token = _normalize_number(match.group())
+        tokens.append(token)
+        if not _DECIMAL.match(token) and _JOINERS.search(token):
+            parts = [part for part in _JOINERS.split(token) if part]
+            tokens.extend(parts)
+            tokens.append("".join(parts))
+        unit = _NUMBER_UNIT.match(token)
+        if unit:
+            tokens.extend((_normalize_number(unit.group(1)), unit.group(2)))
+    return tokens
+
+
+def term_weights(fields: Iterable[Tuple[str, float]]) -> Dict[str, float]:
+    """Weighted term frequencies over (text, weight) fields."""
+    weights: Dict[str, float] = {}
+    for text, weight in fields:
+        if not text:
+            continue
+        for token in tokenize(text):
+            weights[token] = weights.get(token, 0.0) + weight
+    return weights
+
+
+class LexicalIndex:
+    """
+    Inverted index with BM25 scoring, maintained incrementally.
+
+    Entries are identified by a uid that never changes (SearchIndex hands
+    them out in increasing order), so postings survive compaction of the
+    vector index untouched. Each term's postings are append-only arrays of
+    uids and weighted term frequencies. discard() takes removed entries
+    out of the length statistics right away; prune() drops their postings later.
+    """
+
+    def __init__(self, k1: float = 1.2, b: float = 0.75):
+        self.k1 = k1
+        self.b = b
+        self._lock = threading.Lock()
+        # term -> [uids, term frequencies, count]
+        self._postings: Dict[str, list] = {}
+        # Weighted length of each entry, indexed by uid
+        self._lengths = np.zeros(0, dtype=np.float32)
+        self._entries = 0
+        self._total_length = 0.0
+        # Postings opened from a snapshot (see from_arrays), for terms not in _postings
+        self._frozen: Optional[Tuple[np.ndarray, np.ndarray, np.ndarray, np.ndarray]] = None
+        self._frozen_terms = 0
+
+    @property
+    def term_count(self) -> int:
+        return len(self._postings) + self._frozen_terms
+
+    def add(self, uid: int, weights: Dict[str, float]) -> None:
+        """Index one entry from its term_weights()."""
+        with self._lock:
+            if uid >= len(self._lengths):
+                grown = np.zeros(max(uid + 1, 2 * len(self._lengths), 64), dtype=np.float32)
+                grown[:len(self._lengths)] = self._lengths
+                self._lengths = grown
+            length = sum(weights.values())
+            self._lengths[uid] = length
+            self._entries += 1
+            self._total_length += length
+            for term, weight in weights.items():
+                posting = self._postings.get(term)
+                if posting is None:
+                    posting = self._postings[term] = self._new_posting(term)
+                uids, frequencies, count = posting
+                if count == len(uids):
+                    posting[0] = uids = np.concatenate([uids, np.empty(count, dtype=np.int64)])
+                    posting[1] = frequencies = np.concatenate([frequencies, np.empty(count, dtype=np.float32)])
+                uids[count] = uid
+                frequencies[count] = weight
+                posting[2] = count + 1
+
+    def discard(self, uids: np.ndarray) -> None:
+        """Remove entries from the corpus statistics (their postings stay until prune)."""
+        with self._lock:
+            uids = uids[uids < len(self._lengths)]
+            self._entries -= len(uids)
+            self._total_length -= float(self._lengths[uids].sum())
+            self._lengths[uids] = 0
+
+    def prune(self, live_uids: np.ndarray, new_from: int) -> None:
+        """
+        Drop postings of entries that are gone.
+
+        Args:
+            live_uids: Sorted uids still in the index as of some snapshot
+            new_from: First uid handed out after that snapshot; those are kept
+        """
+        with self._lock:
+            if self._frozen is not None:
+                # Pruning rewrites postings, so frozen ones move into _postings first
+                for term in self._frozen[0].tolist():
+                    if term not in self._postings:
+                        uids, frequencies = self._frozen_posting(term)
+                        self._postings[term] = [uids, frequencies, len(uids)]
+                self._frozen = None
+                self._frozen_terms = 0
+            terms = list(self._postings.items())
+        for term, posting in terms:
+            with self._lock:
+                uids, frequencies, count = posting
+                keep = (uids[:count] >= new_from) | np.isin(uids[:count], live_uids, assume_unique=True)
+                if keep.all():
+                    continue
+                if not keep.any():
+                    del self._postings[term]
+                    continue
+                kept = int(keep.sum())
+                posting[0] = np.concatenate([uids[:count][keep], np.empty(kept, dtype=np.int64)])
+                posting[1] = np.concatenate([frequencies[:count][keep], np.empty(kept, dtype=np.float32)])
+                posting[2] = kept
+
+    def to_arrays(self) -> Dict[str, np.ndarray]:
+        """
+        The postings as flat arrays, for SearchIndex snapshots.
+
+        Returns:
+            terms (sorted), offsets into the concatenated uids and
+            frequencies (term i owns [offsets[i], offsets[i + 1])), lengths,
+            and stats holding the entry count and total length
+        """
+        with self._lock:
+            terms = set(self._postings)
+            if self._frozen is not None:
+                terms.update(self._frozen[0].tolist())
+            terms = sorted(terms)
+            uids, frequencies = [], []
+            for term in terms:
+                posting = self._postings.get(term)
+                if posting is not None:
+                    uids.append(posting[0][:posting[2]])
+                    frequencies.append(posting[1][:posting[2]])
+                else:
+                    frozen_uids, frozen_frequencies = self._frozen_posting(term)
+                    uids.append(frozen_uids)
+                    frequencies.append(frozen_frequencies)
+            counts = np.fromiter((len(u) for u in uids), dtype=np.int64, count=len(uids))
+            return {
+                "terms": np.asarray(terms, dtype=str),
+                "offsets": np.concatenate([[0], np.cumsum(counts)]).astype(np.int64),
+                "uids": np.concatenate(uids) if uids else np.empty(0, dtype=np.int64),
+                "frequencies": np.concatenate(frequencies) if frequencies else np.empty(0, dtype=np.float32),
+                "lengths": self._lengths.copy(),
+                "stats": np.array([self._entries, self._total_length], dtype=np.float64),
+            }
+
+    @classmethod
+    def from_arrays(cls, arrays: Dict[str, np.ndarray], k1: float = 1.2, b: float = 0.75) -> "LexicalIndex":
+        """
+        An index over the postings from to_arrays().
+
+        The postings stay in the given arrays (memory-mapped ones stay
+        shared between processes) and are looked up by binary search on the
+        sorted terms; a term is copied out only when add() extends it.
+        """
+        index = cls(k1, b)
+        index._frozen = (arrays["terms"], arrays["offsets"], arrays["uids"], arrays["frequencies"])
+        index._frozen_terms = len(arrays["terms"])
+        index._lengths = arrays["lengths"]
+        index._entries = int(arrays["stats"][0])
+        index._total_length = float(arrays["stats"][1])
+        return index
+
+    def _frozen_posting(self, term: str) -> Optional[Tuple[np.ndarray, np.ndarray]]:
+        """A term's (uids, frequencies) in the arrays from from_arrays(), if it's there."""
+        if self._frozen is None:
+            return None
+        terms, offsets, uids, frequencies = self._frozen
+        i = int(np.searchsorted(terms, term))
+        if i == len(terms) or terms[i] != term:
+            return None
+        return uids[offsets[i]:offsets[i + 1]], frequencies[offsets[i]:offsets[i + 1]]
+
+    def _new_posting(self, term: str) -> list:
+        """A posting for a term not in _postings yet, starting from its frozen one (lock held)."""
+        frozen = self._frozen_posting(term)
+        if frozen is None:
+            return [np.empty(4, dtype=np.int64), np.empty(4, dtype=np.float32), 0]
+        self._frozen_terms -= 1
+        uids, frequencies = frozen
+        count = len(uids)
+        return [
+            np.concatenate([uids, np.empty(max(count, 4), dtype=np.int64)]),
+            np.concatenate([frequencies, np.empty(max(count, 4), dtype=np.float32)]),
+            count
+        ]
+
+    def scores(self, terms: List[str], entry_uids: np.ndarray) -> np.ndarray:
+        """
+        BM25 score of every entry for a query.
+
+        Args:
+            terms: Query terms (from tokenize)
+            entry_uids: Sorted uids of the entries to score, in entry order
+
+        Returns:
+            Scores aligned with `entry_uids` (0 where no term matched)
+        """
+        scores = np.zeros(len(entry_uids), dtype=np.float64)
+        if not terms or len(entry_uids) == 0:
+            return scores
+        with self._lock:
+            entries, total_length, lengths = self._entries, self._total_length, self._lengths
+            postings = []
+            for term in set(terms):
+                posting = self._postings.get(term)
+                if posting is not None:
+                    postings.append((posting[0][:posting[2]], posting[1][:posting[2]]))
+                else:
+                    frozen = self._frozen_posting(term)
+                    if frozen is not None:
+                        postings.append(frozen)
+        if entries <= 0:
+            return scores
+        average_length = max(total_length / entries, 1e-9)
+
+        for uids, frequencies in postings:
+            positions = np.searchsorted(entry_uids, uids)
+            found = positions < len(entry_uids)
+            found[found] = entry_uids[positions[found]] == uids[found]
+            if not found.any():
+                continue
+            document_frequency = len(uids)
+            idf = math.log(1 + (entries - document_frequency + 0.5) / (document_frequency + 0.5))
+            frequencies = frequencies[found].astype(np.float64)
+            norms = 1 - self.b + self.b * lengths[uids[found]] / average_length
+            scores[positions[found]] += idf * frequencies * (self.k1 + 1) / (frequencies + self.k1 * norms)
+        return scores
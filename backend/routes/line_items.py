@@ -0,0 +1,211 @@
+#!/usr/bin/env python3
+"""
+Line items of BFB.chatbot receipts, one document each in BFB.line_items.
+
+Receipts keep their products in structured_data.products, a dict keyed by
+the product name the LLM read, which Mongo can neither index nor
+range-query. Each receipt is also fanned out here, one document per
+product, typed by ReceiptData:
+
+    {receipt_id, line, name, name_key, user_id, user_name, quantity,
+     has_quantity, price, pick_up_location, drop_off_location,
+     pick_up_time, drop_off_time}
+
+so price, quantity and location filters and aggregations run server-side
+on LINE_ITEM_INDEXES. `line` is the product's position on its receipt and
+(receipt_id, line) is unique, so fanning a receipt out twice is harmless.
+The receipt's _id (receipt_id) also gives the upload time.
+
+Uploads are fanned out as they are inserted (ImageDetection.fan_out). This
+command migrates the receipts stored before that. It replaces each
+receipt's line items with fresh ones, so it can be re-run at any time (or
+resumed with --after). Once it has run, set LINE_ITEM_FILTERS=true so
+filtered searches that build their own index only fetch receipts with a
+matching line item. Line items of deleted receipts are not removed.
+
+Usage (from backend/):
+    python -m routes.line_items --dry-run
+    python -m routes.line_items --batch-size 1000
+"""
+
+import time
+import logging
+import argparse
+from typing import Dict, List, Optional, Tuple
+from bson import ObjectId
+from pymongo.errors import BulkWriteError
+from routes.model import typed_product
+
+logger = logging.getLogger(__name__)
+
+_PROJECTION = {"user_info": 1, "structured_data.products": 1}
+
+# Compound indexes on BFB.line_items: one per receipt line, then the
+# filters and rollups that used to walk every receipt's products dict
+LINE_ITEM_INDEXES: List[Tuple[str, List[Tuple[str, int]], Dict]] = [
+    ("receipt_line", [("receipt_id", 1), ("line", 1)], {"unique": True}),
+    ("user_recent", [("user_id", 1), ("receipt_id", -1)], {}),
+    ("pickup_price", [("pick_up_location", 1), ("price", 1)], {}),
+    ("price", [("price", 1)], {}),
+    ("product_pickup", [("name_key", 1), ("pick_up_location", 1)], {}),
+]
+
+# Mongo's duplicate key error
+_DUPLICATE_KEY = 11000
+
+
+def ensure_line_item_indexes(collection) -> None:
+    """Create LINE_ITEM_INDEXES on `collection` (a no-op for ones that exist)."""
+    for name, keys, options in LINE_ITEM_INDEXES:
+        try:
+            collection.create_index(keys, name=name, **options)
+        except Exception as e:
+            logger.warning("Could not create index %s: %s", name, e)
+
+
+def name_key(name: str) -> str:
+    """Case- and whitespace-insensitive product name, what rollups group on."""
+    return " ".join(name.lower().split())
+
+
+def line_item(receipt_id, line: int, name: str, fields: Dict, user_info: Dict) -> Dict:
+    """
+    One product of a receipt as a line_items document.
+
+    Fields are typed by typed_product (so "$12.50" is 12.5 and a
+    pick-up time of "tomorrow" is null). A product without its own
+    pick_up_location gets the receipt's.
+    """
+    if fields.get("pick_up_location") in (None, ""):
+        fields = {**fields, "pick_up_location": user_info.get("pick_up_location")}
+    item = typed_product(name, fields, str(user_info.get("user_id") or ""), str(user_info.get("user_name") or ""))
+    return {
+        "receipt_id": receipt_id,
+        "line": line,
+        **item.model_dump(),
+        "name_key": name_key(name),
+        # As the search index's has_quantity filter sees it, even when untyped
+        "has_quantity": fields.get("quantity") not in (None, "")
+    }
+
+
+def line_item_documents(receipt: Dict) -> List[Dict]:
+    """The line_items documents of a stored receipt (which must carry its _id)."""
+    products = (receipt.get("structured_data") or {}).get("products")
+    if not isinstance(products, dict):
+        return []
+    user_info = receipt.get("user_info") or {}
+    return [
+        line_item(receipt["_id"], line, str(name), fields if isinstance(fields, dict) else {}, user_info)
+        for line, (name, fields) in enumerate(products.items())
+    ]
+
+
+def insert_line_items(collection, receipts: List[Dict]) -> int:
+    """
+    Fan freshly inserted receipts out into `collection`, in one round trip.
+
+    Returns:
+        Number of line items written; ones already there are left alone
+
+    Raises:
+        BulkWriteError for anything but duplicate (receipt_id, line) keys
+    """
+    docs = [doc for receipt in receipts for doc in line_item_documents(receipt)]
+    if not docs:
+        return 0
+    try:
+        collection.insert_many(docs, ordered=False)
+    except BulkWriteError as e:
+        errors = e.details.get("writeErrors", [])
+        if any(error.get("code") != _DUPLICATE_KEY for error in errors):
+            raise
+        return len(docs) - len(errors)
+    return len(docs)
+
+
+def migrate(
+    receipts,
+    line_items,
+    batch_size: int = 500,
+    after=None,
+    limit: Optional[int] = None,
+    dry_run: bool = False
+) -> Dict:
+    """
+    Rewrite the line items of every receipt in `receipts`, a batch at a time.
+
+    Each batch's old line items are deleted and the new ones inserted, two
+    round trips per batch.
+
+    Args:
+        receipts: BFB.chatbot
+        line_items: BFB.line_items
+        batch_size: Receipts read and written per round
+        after: Start after this _id
+        limit: Stop after this many receipts have been examined
+        dry_run: Count what would be written without writing
+
+    Returns:
+        Counts of examined receipts and line items written, and the last
+        _id examined (for --after)
+    """
+    stats = {"examined": 0, "line_items": 0, "last_id": after}
+    started = time.perf_counter()
+    while limit is None or stats["examined"] < limit:
+        query = {}
+        if stats["last_id"] is not None:
+            query["_id"] = {"$gt": stats["last_id"]}
+        size = batch_size if limit is None else min(batch_size, limit - stats["examined"])
+        batch = list(receipts.find(query, _PROJECTION).sort("_id", 1).limit(size))
+        if not batch:
+            break
+        docs = [doc for receipt in batch for doc in line_item_documents(receipt)]
+        if not dry_run:
+            line_items.delete_many({"receipt_id": {"$in": [receipt["_id"] for receipt in batch]}})
+            if docs:
+                line_items.insert_many(docs, ordered=False)
+        stats["examined"] += len(batch)
+        stats["line_items"] += len(docs)
+        stats["last_id"] = batch[-1]["_id"]
+        logger.info("Line items written", extra={
+            "examined": stats["examined"], "line_items": stats["line_items"],
+            "seconds": round(time.perf_counter() - started), "last_id": stats["last_id"]
+        })
+        if len(batch) < size:
+            break
+    return stats
+
+
+def _main(args) -> Dict:
+    from config.logging_config import configure_logging
+    from config.settings import get_database, close_database
+    configure_logging()
+
+    after = ObjectId(args.after) if args.after and ObjectId.is_valid(args.after) else args.after
+    try:
+        database = get_database()
+        if not args.dry_run:
+            ensure_line_item_indexes(database["line_items"])
+        return migrate(
+            database["chatbot"],
+            database["line_items"],
+            batch_size=args.batch_size,
+            after=after,
+            limit=args.limit,
+            dry_run=args.dry_run
+        )
+    finally:
+        close_database()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--batch-size", type=int, default=500)
+    parser.add_argument("--after", help="resume after this _id")
+    parser.add_argument("--limit", type=int, default=None, help="examine at most this many receipts")
+    parser.add_argument("--dry-run", action="store_true", help="report what would be written without writing")
+    args = parser.parse_args()
+    stats = _main(args)
+    print(f"✅ {stats['line_items']} line items {'would be ' if args.dry_run else ''}written for "
+          f"{stats['examined']} receipts; last _id {stats['last_id']}")
@@ -0,0 +1,243 @@
+"""
+In-process metrics, served in the Prometheus text format at /metrics.
+
+Counters, gauges and histograms follow the prometheus_client API
+(`.labels(...).inc()`, `.observe()`, `.time()`) without the dependency;
+updates are a dict lookup and a locked add, cheap enough for every request.
+"""
+
+import math
+import time
+import threading
+from bisect import bisect_left
+from contextlib import contextmanager
+from typing import Dict, Iterable, List, Optional, Tuple
+from fastapi import APIRouter, Request
+from fastapi.responses import PlainTextResponse
+
+router = APIRouter()
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+# Stage latency buckets in seconds: sub-millisecond index scans up to LLM calls
+LATENCY_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+
+def _escape(value: str) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _label_text(names: Iterable[str], values: Iterable[str]) -> str:
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+def _number(value: float) -> str:
+    if math.isinf(value):
+        return "+Inf" if value > 0 else "-Inf"
+    return repr(float(value)) if not float(value).is_integer() else str(int(value))
+
+
+def render_family(name: str, kind: str, documentation: str, samples: List[Tuple[Dict[str, str], float]]) -> str:
+    """Text for one metric family from (labels, value) samples."""
+    lines = [f"# HELP {name} {documentation}", f"# TYPE {name} {kind}"]
+    for labels, value in samples:
+        lines.append(f"{name}{_label_text(labels.keys(), labels.values())} {_number(value)}")
+    return "\n".join(lines) + "\n"
+
+
+class Registry:
+    """The metrics to render at /metrics, in registration order."""
+
+    def __init__(self):
+        self._metrics: List["_Metric"] = []
+        self._lock = threading.Lock()
+
+    def register(self, metric: "_Metric") -> None:
+        with self._lock:
+            self._metrics.append(metric)
+
+    def render(self) -> str:
+        with self._lock:
+            metrics = list(self._metrics)
+        return "".join(metric.render() for metric in metrics)
+
+
+REGISTRY = Registry()
+
+
+class _Metric:
+    kind = ""
+
+    def __init__(self, name: str, documentation: str, labelnames: Tuple[str, ...] = (), registry: Optional[Registry] = REGISTRY):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._children: Dict[Tuple[str, ...], "_Metric"] = {}
+        self._lock = threading.Lock()
+        if registry is not None:
+            registry.register(self)
+
+    def labels(self, *values) -> "_Metric":
+        """The child for one combination of label values."""
+        key = tuple(str(value) for value in values)
+        child = self._children.get(key)
+        if child is None:
+            if len(key) != len(self.labelnames):
+                raise ValueError(f"{self.name} takes labels {self.labelnames}, got {key}")
+            with self._lock:
+                child = self._children.setdefault(key, self._new_child())
+        return child
+
+    def _new_child(self) -> "_Metric":
+        return type(self)(self.name, self.documentation, registry=None)
+
+    def _series(self):
+        """(label values, child) pairs; the metric itself when it has no labels."""
+        if not self.labelnames:
+            return [((), self)]
+        with self._lock:
+            return sorted(self._children.items())
+
+    def render(self) -> str:
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.kind}"]
+        for values, child in self._series():
+            lines.extend(child._sample_lines(self.name, self.labelnames, values))
+        return "\n".join(lines) + "\n"
+
+
+class Counter(_Metric):
+    kind = "counter"
+
+    def __init__(self, *args, **kwargs):
+        self.value = 0.0
+        super().__init__(*args, **kwargs)
+
+    def inc(self, amount: float = 1.0) -> None:
+        with self._lock:
+            self.value += amount
+
+    def _sample_lines(self, name, labelnames, values):
+        return [f"{name}{_label_text(labelnames, values)} {_number(self.value)}"]
+
+
+class Gauge(Counter):
+    kind = "gauge"
+
+    def dec(self, amount: float = 1.0) -> None:
+        self.inc(-amount)
+
+    def set(self, value: float) -> None:
+        with self._lock:
+            self.value = value
+
+    @contextmanager
+    def track_inprogress(self):
+        """Count the block as in flight while it runs."""
+        self.inc()
+        try:
+            yield
+        finally:
+            self.dec()
+
+
+class Histogram(_Metric):
+    kind = "histogram"
+
+    def __init__(self, name: str, documentation: str, labelnames: Tuple[str, ...] = (),
+                 buckets: Tuple[float, ...] = LATENCY_BUCKETS, registry: Optional[Registry] = REGISTRY):
+        self.buckets = tuple(buckets)
+        self.counts = [0] * (len(self.buckets) + 1)
+        self.sum = 0.0
+        super().__init__(name, documentation, labelnames, registry)
+
+    def _new_child(self) -> "Histogram":
+        return Histogram(self.name, self.documentation, buckets=self.buckets, registry=None)
+
+    def observe(self, value: float) -> None:
+        slot = bisect_left(self.buckets, value)
+        with self._lock:
+            self.counts[slot] += 1
+            self.sum += value
+
+    @contextmanager
+    def time(self):
+        """Observe the block's duration in seconds (also when it raises)."""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start)
+
+    def _sample_lines(self, name, labelnames, values):
+        with self._lock:
+            counts, total = list(self.counts), self.sum
+        lines, cumulative = [], 0
+        for bound, count in zip(self.buckets + (math.inf,), counts):
+            cumulative += count
+            lines.append(f"{name}_bucket{_label_text(labelnames + ('le',), values + (_number(bound),))} {cumulative}")
+        lines.append(f"{name}_sum{_label_text(labelnames, values)} {_number(total)}")
+        lines.append(f"{name}_count{_label_text(labelnames, values)} {cumulative}")
+        return lines
+
+
+# ---------------------------------------------------------------
+# Application metrics
+# ---------------------------------------------------------------
+
+STAGE_SECONDS = Histogram(
+    "bfb_stage_duration_seconds",
+    "Time spent in each stage of search and ingest",
+    ("pipeline", "stage")
+)
+IN_FLIGHT = Gauge("bfb_in_flight", "Searches and uploads being processed right now", ("operation",))
+SEARCHES = Counter("bfb_searches_total", "Search requests answered, by ranking mode and result cache use", ("mode", "cached"))
+PRODUCTS_SCORED = Counter("bfb_search_products_scored_total", "Product entries scored by the resident or pushed-down index")
+DOCUMENTS_FETCHED = Counter(
+    "bfb_documents_fetched_total",
+    "Receipts read from Mongo to build or re-rank a search index",
+    ("source",)
+)
+LLM_FAILURES = Counter("bfb_llm_failures_total", "LLM structuring calls that failed or returned unusable JSON", ("reason",))
+EMBEDDING_FAILURES = Counter("bfb_embedding_failures_total", "Embedder calls that failed", ("pipeline",))
+INSERT_FAILURES = Counter("bfb_mongo_insert_failures_total", "Receipts that could not be inserted")
+
+
+def cache_families(caches: Dict[str, Dict]) -> str:
+    """Hit, miss and size families from the caches' stats() (read at scrape time)."""
+    hits, misses, entries = [], [], []
+    for cache, stats in caches.items():
+        if stats is None:
+            continue
+        labels = {"cache": cache}
+        hits.append((labels, stats.get("hits", stats.get("image_hits", 0) + stats.get("text_hits", 0))))
+        misses.append((labels, stats.get("misses", 0)))
+        entries.append((labels, stats.get("entries", 0)))
+    return (
+        render_family("bfb_cache_hits_total", "counter", "Cache lookups answered from the cache", hits)
+        + render_family("bfb_cache_misses_total", "counter", "Cache lookups that missed", misses)
+        + render_family("bfb_cache_entries", "gauge", "Entries currently held", entries)
+    )
+
+
+@router.get("/metrics", response_class=PlainTextResponse)
+async def metrics(request: Request):
+    """Prometheus scrape endpoint."""
+    state = request.app.state
+    caches = {
+        name: cache.stats() if cache is not None else None
+        for name, cache in (
+            ("query_embedding", getattr(state, "query_embedding_cache", None)),
+            ("search_result", getattr(state, "search_result_cache", None)),
+            ("ingest_dedup", getattr(state, "ingest_cache", None)),
+            ("llm_structuring", getattr(state, "llm_cache", None)),
+        )
+    }
+    body = REGISTRY.render() + cache_families(caches)
+    index = getattr(state, "search_index", None)
+    if index is not None:
+        body += render_family("bfb_index_products", "gauge", "Product entries in the resident search index",
+                              [({}, index.product_count)])
+        body += render_family("bfb_index_matrix_bytes", "gauge", "Memory held by the resident vector matrix",
+                              [({}, index.matrix_bytes)])
+    return PlainTextResponse(body, media_type=CONTENT_TYPE)
@@ -1,15 +1,47 @@
-from pydantic import BaseModel
+from pydantic import BaseModel, ValidationError
 from datetime import datetime 
-from typing import Optional
+from typing import Dict, Optional
+from routes.search_filters import parse_number
 
 class ReceiptData(BaseModel):
+    """One line item of a structured receipt, with the uploader it belongs to."""
     user_id: str
     user_name: str  
     name: str 
-    quantity: int
-    price: float 
-    drop_off_location: str 
-    pick_up_location: str 
+    # The LLM leaves these null when the receipt doesn't say
+    quantity: Optional[int] = None
+    price: Optional[float] = None
+    drop_off_location: Optional[str] = None
+    pick_up_location: Optional[str] = None
     pick_up_time: Optional[datetime] = None
     drop_off_time: Optional[datetime] = None 
-    
\ No newline at end of file
+
+# Fields stored per product under structured_data.products
+PRODUCT_FIELDS = ("pick_up_time", "drop_off_location", "drop_off_time", "pick_up_location", "quantity", "price")
+
+
+def _number(value) -> Optional[float]:
+    number = parse_number(value)
+    return None if number != number else number
+
+
+def typed_product(name: str, fields: Dict, user_id: str, user_name: str) -> ReceiptData:
+    """
+    One product as ReceiptData, field by field.
+
+    Prices and quantities are read like the search index reads them
+    ("$12.50" is 12.5, "2 pcs" is 2; a quantity must be a whole number).
+    Fields ReceiptData can't type, like a pick-up time of "10:30 AM", are
+    null rather than losing the rest of the product.
+    """
+    values = {field: fields.get(field) for field in PRODUCT_FIELDS}
+    values["price"] = _number(values["price"])
+    quantity = _number(values["quantity"])
+    values["quantity"] = int(quantity) if quantity is not None and quantity.is_integer() else None
+    try:
+        return ReceiptData(user_id=user_id, user_name=user_name, name=name, **values)
+    except ValidationError as e:
+        for error in e.errors():
+            if error["loc"] and error["loc"][0] in PRODUCT_FIELDS:
+                values[error["loc"][0]] = None
+        return ReceiptData(user_id=user_id, user_name=user_name, name=name, **values)
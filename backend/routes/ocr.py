@@ -0,0 +1,210 @@
+import io
+import os
+import time
+import asyncio
+import threading
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from typing import Dict, Optional, Tuple
+from PIL import Image, ImageOps
+import pytesseract
+
+# Images with more pixels than this are refused before decoding (decompression bombs)
+MAX_PIXELS = 50_000_000
+
+
+class OCRQueueFull(Exception):
+    """Raised when the OCR engine already has as much work as it may queue."""
+
+
+def _otsu_threshold(image: Image.Image) -> int:
+    """Pick the grayscale threshold that best separates ink from paper."""
+    histogram = image.histogram()[:256]
+    total = sum(histogram)
+    weighted_total = sum(i * count for i, count in enumerate(histogram))
+    background_weight = 0
+    background_sum = 0
+    best_threshold, best_variance = 127, -1.0
+    for threshold, count in enumerate(histogram):
+        background_weight += count
+        if background_weight == 0:
+            continue
+        foreground_weight = total - background_weight
+        if foreground_weight == 0:
+            break
+        background_sum += threshold * count
+        background_mean = background_sum / background_weight
+        foreground_mean = (weighted_total - background_sum) / foreground_weight
+        variance = background_weight * foreground_weight * (background_mean - foreground_mean) ** 2
+        if variance > best_variance:
+            best_threshold, best_variance = threshold, variance
+    return best_threshold
+
+
+def preprocess_image(
+    contents: bytes,
+    target_dpi: int = 300,
+    max_side: int = 2400,
+    binarize: bool = True,
+    max_pixels: int = MAX_PIXELS
+) -> Image.Image:
+    """
+    Prepare an uploaded photo for tesseract.
+
+    - Applies the EXIF orientation so phone photos aren't sideways
+    - Converts to grayscale
+    - Downscales to `target_dpi` when the file records a higher DPI, and in
+      any case so the longest side is at most `max_side` pixels
+    - Optionally binarizes with an Otsu threshold
+
+    Args:
+        contents: Raw image bytes as uploaded
+        target_dpi: DPI tesseract works best at
+        max_side: Upper bound on the longest side after resizing
+        binarize: Whether to reduce the image to black and white
+        max_pixels: Largest width * height accepted, checked from the header
+
+    Returns:
+        Grayscale PIL image ready for OCR
+
+    Raises:
+        ValueError: the image has more than `max_pixels` pixels
+    """
+    image = Image.open(io.BytesIO(contents))
+    if image.width * image.height > max_pixels:
+        raise ValueError(f"Image is {image.width}x{image.height} pixels; the limit is {max_pixels}")
+    original_width = image.width
+    # Let JPEG decoding skip straight to a reduced, grayscale image
+    image.draft("L", (max_side, max_side))
+    dpi = (image.info.get("dpi") or (0,))[0] * image.width / original_width
+    image = ImageOps.exif_transpose(image)
+    image = image.convert("L")
+
+    scale = 1.0
+    if dpi > target_dpi:
+        scale = target_dpi / float(dpi)
+    longest = max(image.size)
+    if longest * scale > max_side:
+        scale = max_side / float(longest)
+    if scale < 1.0:
+        size = (max(1, round(image.width * scale)), max(1, round(image.height * scale)))
+        image = image.resize(size, Image.Resampling.LANCZOS)
+
+    if binarize:
+        threshold = _otsu_threshold(image)
+        image = image.point(lambda p: 255 if p > threshold else 0)
+    return image
+
+
+def run_ocr(contents: bytes, options: Optional[Dict] = None) -> Tuple[str, float, float]:
+    """
+    Pre-process and OCR one image. Runs inside OCR worker processes.
+
+    Returns:
+        (text, preprocess_ms, ocr_ms)
+    """
+    options = options or {}
+    start = time.perf_counter()
+    image = preprocess_image(
+        contents,
+        target_dpi=options.get("target_dpi", 300),
+        max_side=options.get("max_side", 2400),
+        binarize=options.get("binarize", True),
+        max_pixels=options.get("max_pixels", MAX_PIXELS)
+    )
+    preprocessed = time.perf_counter()
+    try:
+        text = pytesseract.image_to_string(image, lang=options.get("lang", "eng")) or ""
+    except Exception as e:
+        # Some pytesseract errors can't be pickled back out of a worker process
+        raise RuntimeError(f"{type(e).__name__}: {e}") from None
+    done = time.perf_counter()
+    return text, (preprocessed - start) * 1000, (done - preprocessed) * 1000
+
+
+class OCREngine:
+    """
+    Process-pool OCR stage shared by every /process-image request.
+
+    OCR is CPU-bound, so it runs in `workers` separate processes instead of
+    threads of the API process. At most `workers + queue_depth` images are
+    accepted at once; beyond that recognize() raises OCRQueueFull so callers
+    can shed load instead of queueing unboundedly.
+    """
+
+    def __init__(
+        self,
+        workers: int = 2,
+        queue_depth: int = 8,
+        max_bytes: int = 20 * 1024 * 1024,
+        target_dpi: int = 300,
+        max_side: int = 2400,
+        binarize: bool = True,
+        max_pixels: int = MAX_PIXELS
+    ):
+        self.workers = workers
+        self.queue_depth = queue_depth
+        self.max_bytes = max_bytes
+        self.options = {"target_dpi": target_dpi, "max_side": max_side, "binarize": binarize, "max_pixels": max_pixels}
+        self._slots = threading.BoundedSemaphore(workers + queue_depth)
+        self._executor: Optional[ProcessPoolExecutor] = None
+        self._executor_lock = threading.Lock()
+
+    @classmethod
+    def from_env(cls) -> "OCREngine":
+        return cls(
+            workers=int(os.getenv("OCR_WORKERS", "2")),
+            queue_depth=int(os.getenv("OCR_QUEUE_DEPTH", "8")),
+            max_bytes=int(os.getenv("OCR_MAX_BYTES", str(20 * 1024 * 1024))),
+            target_dpi=int(os.getenv("OCR_TARGET_DPI", "300")),
+            max_side=int(os.getenv("OCR_MAX_SIDE", "2400")),
+            binarize=os.getenv("OCR_BINARIZE", "1") not in ("0", "false", "False"),
+            max_pixels=int(os.getenv("OCR_MAX_PIXELS", str(MAX_PIXELS)))
+        )
+
+    def _get_executor(self) -> ProcessPoolExecutor:
+        with self._executor_lock:
+            if self._executor is None:
+                # spawn: the API process runs background threads, which fork doesn't mix with
+                self._executor = ProcessPoolExecutor(
+                    max_workers=self.workers,
+                    mp_context=multiprocessing.get_context("spawn")
+                )
+            return self._executor
+
+    async def recognize(self, contents: bytes) -> Tuple[str, Dict[str, float]]:
+        """
+        OCR one image in the worker pool.
+
+        Returns:
+            (text, timings) with timings in milliseconds for queue wait,
+            pre-processing and tesseract
+
+        Raises:
+            ValueError: the image exceeds max_bytes
+            OCRQueueFull: too many images are already queued
+        """
+        if len(contents) > self.max_bytes:
+            raise ValueError(f"Image is {len(contents)} bytes; the limit is {self.max_bytes}")
+        if not self._slots.acquire(blocking=False):
+            raise OCRQueueFull(f"OCR queue is full ({self.workers} workers, depth {self.queue_depth})")
+        try:
+            submitted = time.perf_counter()
+            loop = asyncio.get_running_loop()
+            text, preprocess_ms, ocr_ms = await loop.run_in_executor(
+                self._get_executor(), run_ocr, contents, self.options
+            )
+            total_ms = (time.perf_counter() - submitted) * 1000
+            return text, {
+                "ocr_queue_ms": round(max(0.0, total_ms - preprocess_ms - ocr_ms), 2),
+                "ocr_preprocess_ms": round(preprocess_ms, 2),
+                "ocr_ms": round(ocr_ms, 2)
+            }
+        finally:
+            self._slots.release()
+
+    def shutdown(self) -> None:
+        with self._executor_lock:
+            if self._executor is not None:
+                self._executor.shutdown(wait=False, cancel_futures=True)
+                self._executor = None
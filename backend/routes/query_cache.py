@@ -0,0 +1,241 @@
+import os
+import json
+import time
+import logging
+import threading
+from collections import OrderedDict
+from typing import Dict, List, Optional, Tuple
+import numpy as np
+from routes.embeddings import Embedder
+
+logger = logging.getLogger(__name__)
+
+
+def normalize_query(query: str) -> str:
+    """Case- and whitespace-insensitive form of a query used as a cache key."""
+    return " ".join(query.lower().split())
+
+
+class QueryEmbeddingCache:
+    """
+    Bounded cache of query embeddings keyed on (model, normalized query).
+
+    Entries are evicted least-recently-used once `max_entries` is reached and
+    expire `ttl_seconds` after they were embedded. Timestamps are wall-clock,
+    so an entry loaded from the persistence file keeps its original age.
+    """
+
+    def __init__(self, max_entries: int = 1024, ttl_seconds: float = 86400.0, path: Optional[str] = None):
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self.path = path
+        self.hits = 0
+        self.misses = 0
+        self._entries: "OrderedDict[Tuple[str, str], Tuple[np.ndarray, float]]" = OrderedDict()
+        self._lock = threading.Lock()
+        if path:
+            self.load()
+
+    def get(self, query: str, model: str) -> Optional[np.ndarray]:
+        key = (model, normalize_query(query))
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and time.time() - entry[1] > self.ttl_seconds:
+                del self._entries[key]
+                entry = None
+            if entry is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry[0]
+
+    def put(self, query: str, model: str, vector: np.ndarray, created_at: Optional[float] = None) -> None:
+        key = (model, normalize_query(query))
+        vector = np.array(vector, dtype=np.float32)
+        vector.setflags(write=False)
+        with self._lock:
+            self._entries[key] = (vector, created_at if created_at is not None else time.time())
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def stats(self) -> Dict:
+        lookups = self.hits + self.misses
+        return {
+            "entries": len(self._entries),
+            "max_entries": self.max_entries,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_ratio": round(self.hits / lookups, 4) if lookups else 0.0
+        }
+
+    # ---------------------------------------------------------------
+    # Persistence
+    # ---------------------------------------------------------------
+
+    def save(self) -> None:
+        """Write the live entries to `path` (atomically, via a temp file)."""
+        if not self.path:
+            return
+        with self._lock:
+            now = time.time()
+            entries = [(k, v, t) for k, (v, t) in self._entries.items() if now - t <= self.ttl_seconds]
+        try:
+            keys = np.array([json.dumps(k) for k, _, _ in entries], dtype=str)
+            lengths = np.array([len(v) for _, v, _ in entries], dtype=np.int64)
+            created = np.array([t for _, _, t in entries], dtype=np.float64)
+            data = np.concatenate([v for _, v, _ in entries]) if entries else np.empty(0, dtype=np.float32)
+            tmp_path = f"{self.path}.tmp"
+            with open(tmp_path, "wb") as f:
+                np.savez(f, keys=keys, lengths=lengths, created=created, data=data)
+            os.replace(tmp_path, self.path)
+            logger.info("Saved query embeddings", extra={"entries": len(entries), "path": self.path})
+        except Exception as e:
+            logger.warning("Could not save query embedding cache: %s", e)
+
+    def load(self) -> None:
+        """Load entries saved by save(); a missing or corrupt file is ignored."""
+        if not self.path or not os.path.exists(self.path):
+            return
+        try:
+            with np.load(self.path, allow_pickle=False) as saved:
+                offsets = np.concatenate(([0], np.cumsum(saved["lengths"])))
+                data = saved["data"]
+                for i, (key, created) in enumerate(zip(saved["keys"], saved["created"])):
+                    model, query = json.loads(str(key))
+                    self.put(query, model, data[offsets[i]:offsets[i + 1]], float(created))
+            logger.info("Loaded query embeddings", extra={"entries": len(self._entries), "path": self.path})
+        except Exception as e:
+            logger.warning("Could not load query embedding cache: %s", e)
+
+
+class CachedEmbedder(Embedder):
+    """
+    Embedder wrapper that answers repeated queries from a QueryEmbeddingCache.
+
+    Only the texts missing from the cache are sent to the wrapped embedder, in
+    one call; a batch of cache hits never touches the network.
+    """
+
+    def __init__(self, embedder: Embedder, cache: QueryEmbeddingCache):
+        self.embedder = embedder
+        self.cache = cache
+        self.model = embedder.model
+
+    def embed(self, texts: List[str]) -> np.ndarray:
+        cached, missing = self._lookup(texts)
+        if missing:
+            self._fill(texts, cached, missing, self.embedder.embed([texts[i] for i in missing]))
+        return np.asarray(cached, dtype=np.float32)
+
+    async def aembed(self, texts: List[str]) -> np.ndarray:
+        cached, missing = self._lookup(texts)
+        if missing:
+            self._fill(texts, cached, missing, await self.embedder.aembed([texts[i] for i in missing]))
+        return np.asarray(cached, dtype=np.float32)
+
+    def _lookup(self, texts: List[str]):
+        cached = [self.cache.get(text, self.model) for text in texts]
+        return cached, [i for i, vector in enumerate(cached) if vector is None]
+
+    def _fill(self, texts: List[str], cached: list, missing: List[int], fresh: np.ndarray) -> None:
+        for i, vector in zip(missing, fresh):
+            self.cache.put(texts[i], self.model, vector)
+            cached[i] = vector
+
+
+class Generation:
+    """
+    Counter of changes to BFB.chatbot that can alter /search results.
+
+    ImageDetection bumps it after every insert; cached results computed at
+    an older value are discarded.
+    """
+
+    def __init__(self):
+        self._value = 0
+        self._lock = threading.Lock()
+
+    @property
+    def value(self) -> int:
+        return self._value
+
+    def bump(self) -> int:
+        with self._lock:
+            self._value += 1
+            return self._value
+
+
+class SearchResultCache:
+    """
+    Bounded LRU cache of /search responses.
+
+    Keyed on (normalized query, limit, min_score, filters). Each entry keeps
+    the generation it was computed at, and a lookup at any other generation
+    is a miss that drops the entry, so a hit is never older than the latest
+    insert. Size is bounded both in entries and in result rows held.
+    """
+
+    def __init__(self, max_entries: int = 1024, max_rows: int = 50000):
+        self.max_entries = max_entries
+        self.max_rows = max_rows
+        self.hits = 0
+        self.misses = 0
+        self.invalidations = 0
+        self._rows = 0
+        self._entries: "OrderedDict[Tuple, Tuple[object, Dict]]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def key(query: str, limit: int, min_score: float, filters: Optional[Dict] = None, cursor: Optional[str] = None) -> Tuple:
+        """Cache key for a search; `filters` is SearchFilters.as_dict() or None, `cursor` the page's."""
+        return (normalize_query(query), limit, float(min_score), tuple(sorted((filters or {}).items())), cursor)
+
+    def get(self, key: Tuple, generation) -> Optional[Dict]:
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry[0] != generation:
+                self._evict(key)
+                self.invalidations += 1
+                entry = None
+            if entry is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry[1]
+
+    def put(self, key: Tuple, generation, response: Dict) -> None:
+        rows = len(response.get("results", ())) + 1
+        if rows > self.max_rows:
+            return
+        with self._lock:
+            if key in self._entries:
+                self._evict(key)
+            self._entries[key] = (generation, response)
+            self._rows += rows
+            while len(self._entries) > self.max_entries or self._rows > self.max_rows:
+                self._evict(next(iter(self._entries)))
+
+    def _evict(self, key: Tuple) -> None:
+        _, response = self._entries.pop(key)
+        self._rows -= len(response.get("results", ())) + 1
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+            self._rows = 0
+
+    def stats(self) -> Dict:
+        lookups = self.hits + self.misses
+        return {
+            "entries": len(self._entries),
+            "max_entries": self.max_entries,
+            "rows": self._rows,
+            "max_rows": self.max_rows,
+            "hits": self.hits,
+            "misses": self.misses,
+            "invalidations": self.invalidations,
+            "hit_ratio": round(self.hits / lookups, 4) if lookups else 0.0
+        }
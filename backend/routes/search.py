@@ -1,256 +1,614 @@
 from fastapi import APIRouter, Request, HTTPException, Query
-from typing import Dict, List, Optional
+from fastapi.responses import StreamingResponse
+from pydantic import BaseModel, Field
+from typing import AsyncIterator, Dict, List, Optional, Tuple
 import os
 import json
-import numpy as np
-from openai import OpenAI
+import base64
+import hashlib
+import logging
+from openai import AsyncOpenAI
+from starlette.concurrency import run_in_threadpool
 from dotenv import load_dotenv
 import traceback
+import numpy as np
+from routes.vector_index import Ranking, SearchIndex
+from routes.embeddings import Embedder, get_embedder
+from routes.search_filters import SearchFilters
+from routes.query_cache import Generation, SearchResultCache, normalize_query
+from routes.metrics import (
+    DOCUMENTS_FETCHED, EMBEDDING_FAILURES, IN_FLIGHT, PRODUCTS_SCORED, SEARCHES, STAGE_SECONDS
+)
+from datetime import datetime
 
 # Initialize router
 router = APIRouter()
+logger = logging.getLogger(__name__)
+
+# Results per page of /search/stream, and the most it returns per request
+STREAM_PAGE_SIZE = 20
+STREAM_MAX_RESULTS = 1000
+# Most queries one /search/batch request may carry
+BATCH_MAX_QUERIES = 100
+# Cursor slot of /search/batch entries in the result cache: batch pages carry
+# no cursor, so they are kept apart from /search's first pages
+_BATCH_CACHE_SLOT = "batch"
+
+
+def _fingerprint(query: str, min_score: float, filters: Optional[SearchFilters]) -> str:
+    """Short hash of what a cursor's positions are relative to."""
+    key = repr((normalize_query(query), float(min_score), sorted((filters.as_dict() if filters else {}).items())))
+    return hashlib.sha1(key.encode()).hexdigest()[:12]
+
+
+def encode_cursor(position: Tuple[float, int], mode: str, fingerprint: str) -> str:
+    """Opaque cursor for the page after `position` (score, uid) of a ranking."""
+    payload = json.dumps({"s": position[0], "u": position[1], "m": mode, "f": fingerprint}, separators=(",", ":"))
+    return base64.urlsafe_b64encode(payload.encode()).decode().rstrip("=")
+
+
+def decode_cursor(cursor: str, fingerprint: str) -> Tuple[Tuple[float, int], str]:
+    """
+    The (score, uid) position and mode in a cursor.
+
+    Raises:
+        HTTPException 400 if it's malformed or was issued for another query
+    """
+    try:
+        payload = json.loads(base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4)))
+        position, mode, issued_for = (float(payload["s"]), int(payload["u"])), payload["m"], payload["f"]
+    except Exception:
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+    if issued_for != fingerprint:
+        raise HTTPException(status_code=400, detail="Cursor belongs to a different query, min_score or filters")
+    return position, mode
+
+
+def _empty_response(query: str) -> Dict:
+    return {
+        "query": query,
+        "results": [],
+        "total_found": 0,
+        "returned": 0,
+        "mode": "hybrid",
+        "next_cursor": None,
+        "cached": False,
+        "message": "No documents found in database"
+    }
+
+
+def _page_response(
+    query: str,
+    ranking: Ranking,
+    mode: str,
+    results: List[Dict],
+    after: Optional[Tuple[float, int]] = None,
+    fingerprint: Optional[str] = None
+) -> Dict:
+    return {
+        "query": query,
+        "results": results,
+        "total_found": ranking.total_found,
+        "returned": len(results),
+        "mode": mode,
+        "next_cursor": encode_cursor(after, mode, fingerprint) if after is not None else None,
+        "cached": False
+    }
 
 class ItemSearch:
-    def __init__(self, database):
+    def __init__(
+        self,
+        database,
+        index: Optional[SearchIndex] = None,
+        embedder: Optional[Embedder] = None,
+        result_cache: Optional[SearchResultCache] = None,
+        generation: Optional[Generation] = None,
+        line_items=None
+    ):
         self.database = database
-        load_dotenv()
-        self.client = OpenAI(api_key=os.getenv("OPENAI_API_KEY"))
+        if embedder is None:
+            load_dotenv()
+            key = os.getenv("OPENAI_API_KEY")
+            embedder = get_embedder(async_client=AsyncOpenAI(api_key=key) if key else None)
+        self.embedder = embedder
         self.collection = database["chatbot"] if database is not None else None
+        # Without an index from startup, the first unfiltered query builds a
+        # private one; filtered queries fetch just their candidates from Mongo
+        self.index = index
+        # Repeated searches are answered from here until the next insert
+        self.result_cache = result_cache
+        self.generation = generation
+        # BFB.line_items, once migrated: lets a private index fetch only
+        # receipts with a product passing the price/quantity filters
+        self.line_items = line_items
+
+    def current_generation(self):
+        """What cached results must match: the insert counter and the resident index's version."""
+        return (
+            self.generation.value if self.generation is not None else 0,
+            self.index.generation if self.index is not None else None
+        )
+
+    async def load_index(self, filters: Optional[SearchFilters] = None) -> SearchIndex:
+        """The index to answer a query from, building one if none was set up at startup."""
+        if self.index is not None:
+            return self.index
+        pushdown = filters is not None and not filters.is_empty()
+        with STAGE_SECONDS.labels("search", "index_load").time():
+            index = await run_in_threadpool(
+                SearchIndex.from_collection, self.collection, filters if pushdown else None, self.line_items,
+                model=self.embedder.model if self.embedder is not None else None
+            )
+        DOCUMENTS_FETCHED.labels("pushdown" if pushdown else "index_build").inc(index.document_count)
+        if not pushdown:
+            self.index = index
+        return index
+
+    async def embed_query(self, query: str) -> Optional[List[float]]:
+        """Embed the query, or None when no embedder is configured or it fails."""
+        if self.embedder is None:
+            logger.warning("No embedder configured, falling back to lexical search")
+            return None
+        try:
+            with STAGE_SECONDS.labels("search", "embed").time():
+                query_embedding = (await self.embedder.aembed([query]))[0]
+            logger.debug("Embedded query", extra={"query": query, "dimensions": len(query_embedding)})
+            return query_embedding
+        except Exception as e:
+            EMBEDDING_FAILURES.labels("search").inc()
+            logger.warning("Query embedding failed, falling back to lexical search: %s", e)
+            return None
+
+    async def embed_queries(self, queries: List[str]) -> Optional[np.ndarray]:
+        """Embed several queries in one call (repeats once), or None when no embedder is configured or it fails."""
+        if self.embedder is None:
+            logger.warning("No embedder configured, falling back to lexical search")
+            return None
+        unique = list(dict.fromkeys(queries))
+        try:
+            with STAGE_SECONDS.labels("search", "embed").time():
+                vectors = await self.embedder.aembed(unique)
+        except Exception as e:
+            EMBEDDING_FAILURES.labels("search").inc()
+            logger.warning("Batch query embedding failed, falling back to lexical search: %s", e)
+            return None
+        position = {query: i for i, query in enumerate(unique)}
+        return np.asarray(vectors, dtype=np.float32)[[position[query] for query in queries]]
 
-    async def search(self, query: str, limit: int = 5, min_score: float = 0.0) -> Dict:
+    async def rank(
+        self,
+        query: str,
+        min_score: float,
+        filters: Optional[SearchFilters],
+        page_size: int
+    ) -> Tuple[Optional[Ranking], str]:
         """
-        Perform semantic + keyword search on documents stored by ImageDetection.
+        Rank every product for `query`, embedding it first.
+
+        Returns:
+            (ranking, mode) where mode is "hybrid", or "lexical" when the
+            query couldn't be embedded; ranking is None if nothing is indexed
+        """
+        index = await self.load_index(filters)
+        if index.product_count == 0:
+            return None, "hybrid"
+
+        # Step 1: Generate embedding for search query
+        query_embedding = await self.embed_query(query)
+        mode = "hybrid" if query_embedding is not None else "lexical"
+
+        # Step 2: Score every indexed product in one pass (vector + BM25),
+        # off the event loop so large indexes don't stall other requests
+        with STAGE_SECONDS.labels("search", "rank").time():
+            ranking = await run_in_threadpool(index.rank, query_embedding, query, min_score, filters, page_size)
+        PRODUCTS_SCORED.inc(len(ranking.payloads))
+        logger.debug("Ranked products", extra={"query": query, "total_found": ranking.total_found, "mode": mode})
+        return ranking, mode
+
+    @staticmethod
+    def check_mode(cursor_mode: Optional[str], mode: str) -> None:
+        """Scores of hybrid and lexical rankings aren't comparable, so neither are their cursors."""
+        if cursor_mode is not None and cursor_mode != mode:
+            raise HTTPException(
+                status_code=409,
+                detail=f"Search switched from {cursor_mode} to {mode} ranking; restart from the first page"
+            )
+
+    async def search(
+        self,
+        query: str,
+        limit: int = 5,
+        min_score: float = 0.0,
+        filters: Optional[SearchFilters] = None,
+        cursor: Optional[str] = None
+    ) -> Dict:
+        """
+        Perform hybrid (vector + BM25) search on documents stored by ImageDetection.
+        
+        If there is no embedder or embedding the query fails, results are
+        ranked by BM25 alone instead of failing the request.
         
         Args:
             query: Search query string
             limit: Maximum number of results to return
             min_score: Minimum similarity score threshold (0.0 to 1.0)
+            filters: Structured filters (user, pick-up location, price, date, quantity)
+            cursor: next_cursor of the previous page, to continue from there
         
         Returns:
-            Dictionary with query, results, and metadata
+            Dictionary with query, results, mode ("hybrid" or "lexical"),
+            next_cursor (None on the last page), cached (answered from the
+            result cache) and metadata
         """
-        if self.collection is None:
+        with IN_FLIGHT.labels("search").track_inprogress(), STAGE_SECONDS.labels("search", "total").time():
+            response = await self._search(query, limit, min_score, filters, cursor)
+        SEARCHES.labels(response["mode"], "true" if response["cached"] else "false").inc()
+        return response
+
+    async def _search(
+        self,
+        query: str,
+        limit: int,
+        min_score: float,
+        filters: Optional[SearchFilters],
+        cursor: Optional[str]
+    ) -> Dict:
+        if self.collection is None and self.index is None:
             raise HTTPException(status_code=500, detail="Database collection not available")
+        fingerprint = _fingerprint(query, min_score, filters)
+        position, cursor_mode = decode_cursor(cursor, fingerprint) if cursor else (None, None)
+
+        # Read the generation before ranking, so an insert landing meanwhile
+        # invalidates what we are about to cache
+        cache_key = None
+        if self.result_cache is not None:
+            generation = self.current_generation()
+            cache_key = SearchResultCache.key(query, limit, min_score, filters.as_dict() if filters else None, cursor)
+            cached = self.result_cache.get(cache_key, generation)
+            if cached is not None:
+                return {**cached, "query": query, "cached": True}
 
         try:
-            # Step 1: Generate embedding for search query
-            print(f"🔍 Generating embedding for query: {query}")
-            embedding_response = self.client.embeddings.create(
-                model="text-embedding-3-large",
-                input=query
-            )
-            query_embedding = embedding_response.data[0].embedding
-            print(f"✅ Generated embedding with dimension: {len(query_embedding)}")
+            ranking, mode = await self.rank(query, min_score, filters, limit)
+            if ranking is None:
+                return _empty_response(query)
+            self.check_mode(cursor_mode, mode)
 
-            # Step 2: Fetch all documents with embeddings from MongoDB
-            print("📥 Fetching documents from MongoDB...")
-            documents = list(self.collection.find({"embedding": {"$exists": True}}))
-            print(f"📊 Found {len(documents)} documents with embeddings")
-            
-            if not documents:
-                return {
-                    "query": query,
-                    "results": [],
-                    "total_found": 0,
-                    "returned": 0,
-                    "message": "No documents found in database"
-                }
-
-            # Step 3: Calculate similarity scores and rank results
-            ranked_results = []
-            query_vector = np.array(query_embedding)
-            
-            for idx, doc in enumerate(documents):
-                try:
-                    # Validate document structure
-                    if not self._validate_document(doc):
-                        print(f"⚠️  Document {idx} failed validation, skipping")
-                        continue
-
-                    doc_vector = np.array(doc["embedding"])
-                    
-                    # Calculate cosine similarity
-                    similarity = self._cosine_similarity(doc_vector, query_vector)
-                    
-                    if similarity is None:
-                        print(f"⚠️  Could not calculate similarity for document {idx}")
-                        continue
-
-                    # Process each product in the document
-                    products = doc.get("structured_data", {}).get("products", {})
-                    print(f"📦 Processing {len(products)} products from document {idx}")
-                    
-                    for product_name, product_data in products.items():
-                        # Check for keyword match boost
-                        keyword_match = self._matches_query(query, product_name, product_data)
-                        
-                        # Calculate final score (semantic + keyword boost)
-                        final_score = similarity + (0.15 if keyword_match else 0)
-                        
-                        # Apply minimum score filter
-                        if final_score < min_score:
-                            continue
-                        
-                        # Build result entry
-                        result_entry = {
-                            "product_name": product_name,
-                            "details": {
-                                "pick_up_time": product_data.get("pick_up_time"),
-                                "drop_off_location": product_data.get("drop_off_location"),
-                                "drop_off_time": product_data.get("drop_off_time"),
-                                "pick_up_location": product_data.get("pick_up_location"),
-                                "quantity": product_data.get("quantity"),
-                                "price": product_data.get("price")
-                            },
-                            "user_info": {
-                                "user_id": doc.get("user_info", {}).get("user_id"),
-                                "user_name": doc.get("user_info", {}).get("user_name"),
-                                "pick_up_location": doc.get("user_info", {}).get("pick_up_location")
-                            },
-                            "similarity_score": round(final_score, 4),
-                            "keyword_match": keyword_match,
-                            "document_id": str(doc["_id"])
-                        }
-                        
-                        ranked_results.append(result_entry)
-                
-                except Exception as doc_error:
-                    print(f"⚠️  Error processing document {idx}: {str(doc_error)}")
+            # Step 3: Turn just the requested page into results
+            with STAGE_SECONDS.labels("search", "page").time():
+                ranked_results, after = await run_in_threadpool(ranking.page, limit, position)
+            response = _page_response(query, ranking, mode, ranked_results, after, fingerprint)
+            # Lexical fallbacks aren't cached, so hybrid results come back
+            # as soon as the embedder does
+            if cache_key is not None and mode == "hybrid":
+                self.result_cache.put(cache_key, generation, response)
+            return response
+
+        except HTTPException:
+            raise
+        except Exception as e:
+            logger.exception("Search failed", extra={"query": query})
+            raise HTTPException(status_code=500, detail=f"Search failed: {str(e)}")
+
+    async def search_many(self, queries: List[Dict], filters: Optional[SearchFilters] = None) -> List[Dict]:
+        """
+        Answer several searches together, as search() would one by one.
+
+        The queries that aren't in the result cache are embedded in a single
+        call and ranked with one matrix-matrix product over the index (see
+        SearchIndex.rank_many), so a batch costs about one search's
+        embedding round trip and pass over the products. If embedding
+        fails, the whole batch is ranked by BM25.
+
+        Only first pages are returned, without a next_cursor: scores from
+        the batched product can differ from a lone query's in the last bit,
+        so a position taken from one isn't safe to resume the other from.
+        Page further with search().
+
+        Args:
+            queries: Searches, each a dict with q, limit and min_score
+            filters: Structured filters applied to every query
+
+        Returns:
+            A response per query, in order, shaped like search()'s
+        """
+        with IN_FLIGHT.labels("search_batch").track_inprogress(), STAGE_SECONDS.labels("search", "batch").time():
+            responses = await self._search_many(queries, filters)
+        for response in responses:
+            SEARCHES.labels(response["mode"], "true" if response["cached"] else "false").inc()
+        return responses
+
+    async def _search_many(self, queries: List[Dict], filters: Optional[SearchFilters]) -> List[Dict]:
+        if self.collection is None and self.index is None:
+            raise HTTPException(status_code=500, detail="Database collection not available")
+        responses: List[Optional[Dict]] = [None] * len(queries)
+        pending, keys = [], {}
+        if self.result_cache is not None:
+            generation = self.current_generation()
+        for i, item in enumerate(queries):
+            if self.result_cache is not None:
+                keys[i] = SearchResultCache.key(
+                    item["q"], item["limit"], item["min_score"], filters.as_dict() if filters else None,
+                    _BATCH_CACHE_SLOT
+                )
+                cached = self.result_cache.get(keys[i], generation)
+                if cached is not None:
+                    responses[i] = {**cached, "query": item["q"], "cached": True}
                     continue
+            pending.append(i)
+        if not pending:
+            return responses
 
-            # Step 4: Sort by similarity score (highest first)
-            ranked_results.sort(key=lambda x: x["similarity_score"], reverse=True)
-            print(f"✅ Found {len(ranked_results)} matching products")
+        try:
+            index = await self.load_index(filters)
+            if index.product_count == 0:
+                for i in pending:
+                    responses[i] = _empty_response(queries[i]["q"])
+                return responses
 
-            # Step 5: Return top results
-            return {
-                "query": query,
-                "results": ranked_results[:limit],
-                "total_found": len(ranked_results),
-                "returned": min(limit, len(ranked_results))
-            }
+            vectors = await self.embed_queries([queries[i]["q"] for i in pending])
+            mode = "hybrid" if vectors is not None else "lexical"
+            requests = [
+                (vectors[j] if vectors is not None else None, queries[i]["q"], queries[i]["min_score"], queries[i]["limit"])
+                for j, i in enumerate(pending)
+            ]
+            with STAGE_SECONDS.labels("search", "rank").time():
+                rankings = await run_in_threadpool(index.rank_many, requests, filters)
+            PRODUCTS_SCORED.inc(sum(len(ranking.payloads) for ranking in rankings))
+            with STAGE_SECONDS.labels("search", "page").time():
+                pages = await run_in_threadpool(
+                    lambda: [ranking.page(queries[i]["limit"]) for i, ranking in zip(pending, rankings)]
+                )
+
+            for i, ranking, (results, _) in zip(pending, rankings, pages):
+                responses[i] = _page_response(queries[i]["q"], ranking, mode, results)
+                if i in keys and mode == "hybrid":
+                    self.result_cache.put(keys[i], generation, responses[i])
+            logger.debug("Ranked batch", extra={"queries": len(queries), "ranked": len(pending), "mode": mode})
+            return responses
 
+        except HTTPException:
+            raise
         except Exception as e:
-            print(f"❌ Search error: {str(e)}")
-            print(f"Traceback: {traceback.format_exc()}")
+            logger.exception("Batch search failed", extra={"queries": len(queries)})
             raise HTTPException(status_code=500, detail=f"Search failed: {str(e)}")
 
-    def _validate_document(self, doc: Dict) -> bool:
-        """Validate that document has required structure."""
-        try:
-            if "embedding" not in doc:
-                return False
-            if not isinstance(doc["embedding"], list):
-                return False
-            if len(doc["embedding"]) == 0:
-                return False
-            if "structured_data" not in doc:
-                return False
-            if not isinstance(doc.get("structured_data"), dict):
-                return False
-            if "products" not in doc.get("structured_data", {}):
-                return False
-            if not isinstance(doc["structured_data"].get("products"), dict):
-                return False
-            return True
-        except Exception as e:
-            print(f"Validation error: {str(e)}")
-            return False
+    async def stream(
+        self,
+        query: str,
+        limit: int = STREAM_MAX_RESULTS,
+        min_score: float = 0.0,
+        filters: Optional[SearchFilters] = None,
+        cursor: Optional[str] = None,
+        page_size: int = STREAM_PAGE_SIZE
+    ) -> AsyncIterator[Dict]:
+        """
+        Rank like search(), then return records to stream a page at a time.
 
-    def _cosine_similarity(self, vec1: np.ndarray, vec2: np.ndarray) -> Optional[float]:
-        """Calculate cosine similarity between two vectors."""
+        Ranking (and cursor validation) happens before this returns, so
+        errors still surface as HTTP errors. The records are a "meta" record
+        (query, mode, total_found), one "result" record per product
+        best-first, and an "end" record with the count returned and
+        next_cursor; an "error" record replaces the rest if reading fails.
+        """
+        if self.collection is None and self.index is None:
+            raise HTTPException(status_code=500, detail="Database collection not available")
+        fingerprint = _fingerprint(query, min_score, filters)
+        position, cursor_mode = decode_cursor(cursor, fingerprint) if cursor else (None, None)
         try:
-            # Ensure vectors are same dimension
-            if len(vec1) != len(vec2):
-                print(f"⚠️  Vector dimension mismatch: {len(vec1)} vs {len(vec2)}")
-                return None
-                
-            norm1 = np.linalg.norm(vec1)
-            norm2 = np.linalg.norm(vec2)
-            
-            if norm1 == 0 or norm2 == 0:
-                return None
-                
-            similarity = float(np.dot(vec1, vec2) / (norm1 * norm2))
-            return similarity
+            ranking, mode = await self.rank(query, min_score, filters, page_size)
         except Exception as e:
-            print(f"Cosine similarity error: {str(e)}")
-            return None
+            logger.exception("Search failed", extra={"query": query})
+            raise HTTPException(status_code=500, detail=f"Search failed: {str(e)}")
+        if ranking is None:
+            ranking = Ranking.empty()
+        else:
+            self.check_mode(cursor_mode, mode)
+        SEARCHES.labels(mode, "false").inc()
+        return self._records(query, ranking, mode, fingerprint, limit, page_size, position)
 
-    def _matches_query(self, query: str, product_name: str, product_data: Dict) -> bool:
-        """
-        Check if query keywords appear in product name or product fields.
-        Case-insensitive matching.
-        """
+    async def _records(
+        self,
+        query: str,
+        ranking: Ranking,
+        mode: str,
+        fingerprint: str,
+        limit: int,
+        page_size: int,
+        position: Optional[Tuple[float, int]]
+    ) -> AsyncIterator[Dict]:
+        yield {"type": "meta", "query": query, "mode": mode, "total_found": ranking.total_found}
+        returned = 0
         try:
-            query_lower = query.lower()
-            
-            # Check product name
-            if query_lower in product_name.lower():
-                return True
-            
-            # Check all product data fields
-            for key, val in product_data.items():
-                if val is None:
-                    continue
-                if isinstance(val, str) and query_lower in val.lower():
-                    return True
-                if isinstance(val, (int, float)) and query_lower in str(val):
-                    return True
-            
-            return False
+            with IN_FLIGHT.labels("search_stream").track_inprogress():
+                pages = ranking.pages(page_size, limit, position)
+                while True:
+                    # Select each page off the event loop, and send it before the next
+                    with STAGE_SECONDS.labels("search", "page").time():
+                        page = await run_in_threadpool(next, pages, None)
+                    if page is None:
+                        break
+                    results, position = page
+                    for result in results:
+                        yield {"type": "result", **result}
+                    returned += len(results)
         except Exception as e:
-            print(f"Keyword match error: {str(e)}")
-            return False
+            logger.exception("Search stream failed", extra={"query": query})
+            yield {"type": "error", "detail": f"Search failed: {str(e)}"}
+            return
+        yield {
+            "type": "end",
+            "returned": returned,
+            "next_cursor": encode_cursor(position, mode, fingerprint) if position is not None else None
+        }
 
 
 # ---------------------------------------------------------------
 # API Endpoints
 # ---------------------------------------------------------------
 
+def search_engine_from_state(request: Request) -> ItemSearch:
+    """The shared engine from startup; build one only when the app was wired without it."""
+    # Check if database is available
+    if not hasattr(request.app.state, 'db'):
+        raise HTTPException(status_code=500, detail="Database not initialized")
+
+    db = request.app.state.db
+    if db is None:
+        raise HTTPException(status_code=500, detail="Database connection is None")
+
+    return getattr(request.app.state, "item_search", None) or ItemSearch(
+        db,
+        getattr(request.app.state, "search_index", None),
+        getattr(request.app.state, "query_embedder", None),
+        getattr(request.app.state, "search_result_cache", None),
+        getattr(request.app.state, "search_generation", None),
+        getattr(request.app.state, "search_line_items", None)
+    )
+
+
 @router.get("/search")
 async def search_endpoint(
     request: Request,
     q: str = Query(..., description="Search query"),
     limit: int = Query(5, ge=1, le=100, description="Max number of results (1-100)"),
-    min_score: float = Query(0.0, ge=0.0, le=1.0, description="Minimum similarity score (0.0-1.0)")
+    min_score: float = Query(0.0, ge=0.0, le=1.0, description="Minimum similarity score (0.0-1.0)"),
+    cursor: Optional[str] = Query(None, description="next_cursor of the previous page"),
+    user_id: Optional[str] = Query(None, description="Only receipts uploaded by this user"),
+    pick_up_location: Optional[str] = Query(None, description="Only receipts picked up here"),
+    min_price: Optional[float] = Query(None, description="Lowest product price"),
+    max_price: Optional[float] = Query(None, description="Highest product price"),
+    date_from: Optional[datetime] = Query(None, description="Uploaded at or after (ISO 8601, UTC if no offset)"),
+    date_to: Optional[datetime] = Query(None, description="Uploaded before (ISO 8601, UTC if no offset)"),
+    has_quantity: Optional[bool] = Query(None, description="Only products with (true) or without (false) a quantity")
 ):
     """
-    Search through embedded OCR data using semantic similarity.
+    Search through embedded OCR data, fusing semantic similarity with BM25
+    keyword scores (BM25 alone when the query can't be embedded).
     
     - **q**: Search query (required)
     - **limit**: Maximum number of results to return (default: 5, max: 100)
     - **min_score**: Minimum similarity score threshold (default: 0.0)
+    - **cursor**: Continue after the previous page (its next_cursor), with
+      the same q, min_score and filters
+    - **user_id**, **pick_up_location**, **min_price**/**max_price**,
+      **date_from**/**date_to**, **has_quantity**: optional filters
     """
     try:
-        print(f"\n🔍 Search request: q='{q}', limit={limit}, min_score={min_score}")
+        logger.debug("Search request", extra={"query": q, "limit": limit, "min_score": min_score})
         
-        # Check if database is available
-        if not hasattr(request.app.state, 'db'):
-            raise HTTPException(status_code=500, detail="Database not initialized")
+        search_engine = search_engine_from_state(request)
+        filters = SearchFilters(user_id, pick_up_location, min_price, max_price, date_from, date_to, has_quantity)
+        results = await search_engine.search(q, limit, min_score, filters, cursor)
         
-        db = request.app.state.db
-        if db is None:
-            raise HTTPException(status_code=500, detail="Database connection is None")
-        
-        # Initialize search engine and perform search
-        search_engine = ItemSearch(db)
-        results = await search_engine.search(q, limit, min_score)
-        
-        print(f"✅ Search completed: {results['returned']} results returned")
+        logger.debug("Search completed", extra={"query": q, "returned": results["returned"], "cached": results["cached"]})
         
         return {
             "status": "success",
             "query": results["query"],
             "results": results["results"],
             "total_found": results["total_found"],
-            "returned": results["returned"]
+            "returned": results["returned"],
+            "mode": results["mode"],
+            "next_cursor": results["next_cursor"],
+            "cached": results["cached"],
+            "filters": filters.as_dict()
+        }
+    except HTTPException:
+        raise
+    except Exception as e:
+        logger.exception("Search endpoint failed", extra={"query": q})
+        raise HTTPException(status_code=500, detail=f"Internal server error: {str(e)}")
+
+
+@router.get("/search/stream")
+async def search_stream_endpoint(
+    request: Request,
+    q: str = Query(..., description="Search query"),
+    limit: int = Query(100, ge=1, le=STREAM_MAX_RESULTS, description=f"Max number of results (1-{STREAM_MAX_RESULTS})"),
+    min_score: float = Query(0.0, ge=0.0, le=1.0, description="Minimum similarity score (0.0-1.0)"),
+    cursor: Optional[str] = Query(None, description="next_cursor of a previous page or stream"),
+    user_id: Optional[str] = Query(None, description="Only receipts uploaded by this user"),
+    pick_up_location: Optional[str] = Query(None, description="Only receipts picked up here"),
+    min_price: Optional[float] = Query(None, description="Lowest product price"),
+    max_price: Optional[float] = Query(None, description="Highest product price"),
+    date_from: Optional[datetime] = Query(None, description="Uploaded at or after (ISO 8601, UTC if no offset)"),
+    date_to: Optional[datetime] = Query(None, description="Uploaded before (ISO 8601, UTC if no offset)"),
+    has_quantity: Optional[bool] = Query(None, description="Only products with (true) or without (false) a quantity")
+):
+    """
+    Same search as /search, streamed as NDJSON (one JSON object per line).
+
+    Lines are a "meta" record (query, mode, total_found), then a "result"
+    record per product best-first, sent a page at a time as they are
+    selected, then an "end" record with returned and next_cursor (or an
+    "error" record if the search fails part-way). Cursors work across
+    /search and /search/stream.
+    """
+    logger.debug("Search stream request", extra={"query": q, "limit": limit, "min_score": min_score})
+    search_engine = search_engine_from_state(request)
+    filters = SearchFilters(user_id, pick_up_location, min_price, max_price, date_from, date_to, has_quantity)
+    records = await search_engine.stream(q, limit, min_score, filters, cursor)
+
+    async def ndjson():
+        async for record in records:
+            yield json.dumps(record, default=str) + "\n"
+
+    return StreamingResponse(ndjson(), media_type="application/x-ndjson")
+
+
+class BatchQuery(BaseModel):
+    q: str = Field(..., min_length=1, description="Search query")
+    limit: int = Field(5, ge=1, le=100, description="Max number of results (1-100)")
+    min_score: float = Field(0.0, ge=0.0, le=1.0, description="Minimum similarity score (0.0-1.0)")
+
+
+class BatchSearchRequest(BaseModel):
+    queries: List[BatchQuery] = Field(..., min_length=1, max_length=BATCH_MAX_QUERIES)
+    # Filters, applied to every query
+    user_id: Optional[str] = None
+    pick_up_location: Optional[str] = None
+    min_price: Optional[float] = None
+    max_price: Optional[float] = None
+    date_from: Optional[datetime] = None
+    date_to: Optional[datetime] = None
+    has_quantity: Optional[bool] = None
+
+
+@router.post("/search/batch")
+async def search_batch_endpoint(request: Request, batch: BatchSearchRequest):
+    """
+    Run several searches in one request: one embedding call and one pass
+    over the index for all of them, instead of one each.
+
+    - **queries**: up to 100 of {q, limit, min_score}, as for /search
+    - **user_id**, **pick_up_location**, **min_price**/**max_price**,
+      **date_from**/**date_to**, **has_quantity**: optional filters shared
+      by every query
+
+    Returns one entry per query, in order, with the fields /search returns
+    for a first page except next_cursor; use /search to page further.
+    """
+    try:
+        logger.debug("Batch search request", extra={"queries": len(batch.queries)})
+        search_engine = search_engine_from_state(request)
+        filters = SearchFilters(
+            batch.user_id, batch.pick_up_location, batch.min_price, batch.max_price,
+            batch.date_from, batch.date_to, batch.has_quantity
+        )
+        responses = await search_engine.search_many([query.model_dump() for query in batch.queries], filters)
+        return {
+            "status": "success",
+            "searches": [
+                {key: response[key] for key in ("query", "results", "total_found", "returned", "mode", "cached")}
+                for response in responses
+            ],
+            "filters": filters.as_dict()
         }
     except HTTPException:
         raise
     except Exception as e:
-        print(f"❌ Endpoint error: {str(e)}")
-        print(f"Traceback: {traceback.format_exc()}")
+        logger.exception("Batch search endpoint failed", extra={"queries": len(batch.queries)})
         raise HTTPException(status_code=500, detail=f"Internal server error: {str(e)}")
 
 
@@ -272,18 +630,40 @@ async def health_check(request: Request):
             }
             
         collection = db["chatbot"]
-        doc_count = collection.count_documents({})
-        embedded_count = collection.count_documents({"embedding": {"$exists": True}})
+        doc_count = await run_in_threadpool(collection.count_documents, {})
+        embedded_count = await run_in_threadpool(collection.count_documents, {"embedding": {"$exists": True}})
+        index = getattr(request.app.state, "search_index", None)
+        query_cache = getattr(request.app.state, "query_embedding_cache", None)
+        result_cache = getattr(request.app.state, "search_result_cache", None)
         
         return {
             "status": "healthy",
             "service": "search",
             "total_documents": doc_count,
-            "documents_with_embeddings": embedded_count
+            "documents_with_embeddings": embedded_count,
+            "indexed_documents": index.document_count if index is not None else 0,
+            "indexed_products": index.product_count if index is not None else 0,
+            "embedding_model": index.model if index is not None else None,
+            # Documents left out of the index for being embedded by another model
+            "skipped_embedding_models": index.model_mismatches() if index is not None else {},
+            "query_embedding_cache": query_cache.stats() if query_cache is not None else None,
+            "search_result_cache": result_cache.stats() if result_cache is not None else None
         }
     except Exception as e:
         return {
             "status": "unhealthy",
             "error": str(e),
             "traceback": traceback.format_exc()
-        }
\ No newline at end of file
+        }
+
+@router.get("/search/cache")
+async def cache_stats(request: Request):
+    """Hit ratios of the search result and query embedding caches."""
+    result_cache = getattr(request.app.state, "search_result_cache", None)
+    query_cache = getattr(request.app.state, "query_embedding_cache", None)
+    generation = getattr(request.app.state, "search_generation", None)
+    return {
+        "search_result_cache": result_cache.stats() if result_cache is not None else None,
+        "query_embedding_cache": query_cache.stats() if query_cache is not None else None,
+        "generation": generation.value if generation is not None else None
+    }
@@ -0,0 +1,162 @@
+import re
+import math
+import logging
+from datetime import datetime, timezone
+from typing import Dict, List, Optional, Tuple
+from bson import ObjectId
+
+logger = logging.getLogger(__name__)
+
+# Only what scoring and search results need (raw_ocr_text feeds the BM25
+# index); leaves original_filename and other fields on the server
+SEARCH_PROJECTION = {
+    "_id": 1,
+    "user_info.user_id": 1,
+    "user_info.user_name": 1,
+    "user_info.pick_up_location": 1,
+    "structured_data.products": 1,
+    "structured_data.raw_ocr_text": 1,
+    "embedding": 1,
+    "product_embeddings": 1,
+    "embedding_model": 1,
+}
+
+# Compound indexes on BFB.chatbot behind filtered reads; _id orders by
+# insert time and also serves the date range
+SEARCH_INDEXES: List[Tuple[str, List[Tuple[str, int]]]] = [
+    ("user_recent", [("user_info.user_id", 1), ("_id", -1)]),
+    ("pickup_recent", [("user_info.pick_up_location", 1), ("_id", -1)]),
+    ("user_pickup_recent", [("user_info.user_id", 1), ("user_info.pick_up_location", 1), ("_id", -1)]),
+]
+
+def ensure_search_indexes(collection) -> None:
+    """Create SEARCH_INDEXES on `collection` (a no-op for ones that exist)."""
+    for name, keys in SEARCH_INDEXES:
+        try:
+            collection.create_index(keys, name=name)
+        except Exception as e:
+            logger.warning("Could not create index %s: %s", name, e)
+
+
+_NUMBER = re.compile(r"-?\d+(?:\.\d+)?")
+
+
+def parse_number(value) -> float:
+    """
+    Read a price or quantity the LLM produced: 12.5, "12.50", "$1,299.00".
+
+    Returns:
+        The number, or NaN if there isn't one
+    """
+    if isinstance(value, bool) or value is None:
+        return math.nan
+    if isinstance(value, (int, float)):
+        return float(value)
+    if isinstance(value, str):
+        match = _NUMBER.search(value.replace(",", ""))
+        if match:
+            return float(match.group())
+    return math.nan
+
+
+def _utc(moment: datetime) -> datetime:
+    # Naive datetimes from query strings are taken as UTC
+    return moment if moment.tzinfo else moment.replace(tzinfo=timezone.utc)
+
+
+class SearchFilters:
+    """
+    Structured filters for /search.
+
+    Receipt-level filters (user_id, pick_up_location, the upload date range
+    taken from the ObjectId) are pushed into Mongo queries by to_mongo().
+    Product-level ones (price range, has_quantity) live inside the products
+    dict, which Mongo can't index, so they are applied to the columns the
+    SearchIndex keeps for each product.
+    """
+
+    def __init__(
+        self,
+        user_id: Optional[str] = None,
+        pick_up_location: Optional[str] = None,
+        min_price: Optional[float] = None,
+        max_price: Optional[float] = None,
+        date_from: Optional[datetime] = None,
+        date_to: Optional[datetime] = None,
+        has_quantity: Optional[bool] = None
+    ):
+        self.user_id = user_id
+        self.pick_up_location = pick_up_location
+        self.min_price = min_price
+        self.max_price = max_price
+        self.date_from = _utc(date_from) if date_from else None
+        self.date_to = _utc(date_to) if date_to else None
+        self.has_quantity = has_quantity
+
+    def is_empty(self) -> bool:
+        return all(value is None for value in self.as_dict().values())
+
+    def as_dict(self) -> Dict:
+        return {
+            "user_id": self.user_id,
+            "pick_up_location": self.pick_up_location,
+            "min_price": self.min_price,
+            "max_price": self.max_price,
+            "date_from": self.date_from.isoformat() if self.date_from else None,
+            "date_to": self.date_to.isoformat() if self.date_to else None,
+            "has_quantity": self.has_quantity
+        }
+
+    def to_mongo(self) -> Dict:
+        """Receipt-level conditions as a Mongo query (served by SEARCH_INDEXES)."""
+        query = {}
+        if self.user_id is not None:
+            query["user_info.user_id"] = self.user_id
+        if self.pick_up_location is not None:
+            query["user_info.pick_up_location"] = self.pick_up_location
+        id_range = {}
+        if self.date_from is not None:
+            id_range["$gte"] = ObjectId.from_datetime(self.date_from)
+        if self.date_to is not None:
+            id_range["$lt"] = ObjectId.from_datetime(self.date_to)
+        if id_range:
+            query["_id"] = id_range
+        return query
+
+    def has_product_conditions(self) -> bool:
+        return self.min_price is not None or self.max_price is not None or self.has_quantity is not None
+
+    def to_line_items(self) -> Dict:
+        """
+        The filters as a query on BFB.line_items (see routes.line_items).
+
+        Matches the line items of every product the search index would let
+        through, and possibly more: pick_up_location is left to to_mongo(),
+        since a line item's own location can differ from its receipt's.
+        """
+        query = {}
+        if self.user_id is not None:
+            query["user_id"] = self.user_id
+        price = {}
+        if self.min_price is not None:
+            price["$gte"] = self.min_price
+        if self.max_price is not None:
+            price["$lte"] = self.max_price
+        if price:
+            query["price"] = price
+        if self.has_quantity is not None:
+            query["has_quantity"] = self.has_quantity
+        receipt_range = self.to_mongo().get("_id")
+        if receipt_range:
+            query["receipt_id"] = receipt_range
+        return query
+
+    def created_range(self) -> Tuple[float, float]:
+        """
+        Upload time bounds as epoch seconds, [from, to).
+
+        Truncated to whole seconds like the ObjectId bounds in to_mongo().
+        """
+        low = math.floor(self.date_from.timestamp()) if self.date_from else -math.inf
+        high = math.floor(self.date_to.timestamp()) if self.date_to else math.inf
+        return low, high
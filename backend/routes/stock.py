@@ -0,0 +1,308 @@
+#!/usr/bin/env python3
+"""
+Materialized stock rollups for the dashboard, in BFB.stock_rollups.
+
+One document per rollup, each keeping counters of receipts, line_items,
+quantity and spend:
+- "product": per product (name_key, see routes.line_items) and pick-up
+  location (receipts aren't counted, a product can be on one twice)
+- "user": per uploader
+- "day": per upload day (UTC, from the receipt's _id)
+- "total": everything
+
+A line item's spend is its price times its quantity (times 1 without a
+quantity, 0 without a price). Every inserted receipt adds to its rollups
+with one bulk_write of $inc upserts (ImageDetection.fan_out), and
+/stock/summary reads the top of each rollup through an index, so it
+answers in the same time whatever the size of BFB.chatbot.
+
+This command recomputes every rollup from BFB.chatbot and reports how far
+the stored ones have drifted (an ingest that failed part-way, a receipt
+deleted or edited by hand). --repair adds the differences back, as $inc
+deltas, but only while uploads are quiet: an upload landing during the
+check, or one whose rollup update may still be in flight (the newest
+receipt is under --settle seconds old), would look like drift and be
+"repaired" away or counted twice. Otherwise the check only reports.
+--every repeats it, for running it from one process (not in every web
+worker).
+
+Usage (from backend/):
+    python -m routes.stock
+    python -m routes.stock --repair --every 3600
+"""
+
+import time
+import logging
+import argparse
+from datetime import datetime, timezone
+from typing import Dict, List, Optional, Tuple
+from bson import ObjectId
+from fastapi import APIRouter, HTTPException, Query, Request
+from pymongo import DeleteOne, UpdateOne
+from starlette.concurrency import run_in_threadpool
+from routes.line_items import line_item_documents
+
+logger = logging.getLogger(__name__)
+
+router = APIRouter()
+
+_PROJECTION = {"user_info": 1, "structured_data.products": 1}
+COUNTERS = ("receipts", "line_items", "quantity", "spend")
+
+# Indexes on BFB.stock_rollups behind every /stock/summary read
+STOCK_INDEXES: List[Tuple[str, List[Tuple[str, int]]]] = [
+    ("kind_spend", [("kind", 1), ("spend", -1)]),
+    ("kind_pickup_spend", [("kind", 1), ("pick_up_location", 1), ("spend", -1)]),
+    ("kind_receipts", [("kind", 1), ("receipts", -1)]),
+    ("kind_day", [("kind", 1), ("day", -1)]),
+]
+
+# Differences smaller than this (relative to the value) are float rounding, not drift
+_TOLERANCE = 1e-6
+# How old the newest receipt must be before a repair trusts that every
+# receipt's rollup update has landed
+SETTLE_SECONDS = 60.0
+
+Rollups = Dict[str, Tuple[Dict, Dict]]
+
+
+def _spend(item: Dict) -> float:
+    if item["price"] is None:
+        return 0.0
+    return item["price"] * (item["quantity"] if item["quantity"] is not None else 1)
+
+
+def _add(rollups: Rollups, key: str, fields: Dict, counts: Dict) -> None:
+    if key not in rollups:
+        rollups[key] = (fields, dict.fromkeys(counts, 0))
+    totals = rollups[key][1]
+    for name, value in counts.items():
+        totals[name] += value
+
+
+def receipt_rollups(receipt: Dict, rollups: Optional[Rollups] = None) -> Rollups:
+    """
+    Add one stored receipt (with its _id) to `rollups`.
+
+    Returns:
+        rollups (a new dict if none was given): rollup _id -> (identifying
+        fields, counters)
+    """
+    rollups = {} if rollups is None else rollups
+    items = line_item_documents(receipt)
+    user_info = receipt.get("user_info") or {}
+    counts = {
+        "receipts": 1,
+        "line_items": len(items),
+        "quantity": sum(item["quantity"] or 0 for item in items),
+        "spend": sum(_spend(item) for item in items)
+    }
+    _add(rollups, "total", {"kind": "total"}, counts)
+    user_id = str(user_info.get("user_id") or "")
+    _add(rollups, f"user|{user_id}", {"kind": "user", "user_id": user_id, "user_name": user_info.get("user_name")}, counts)
+    if isinstance(receipt.get("_id"), ObjectId):
+        day = receipt["_id"].generation_time.strftime("%Y-%m-%d")
+        _add(rollups, f"day|{day}", {"kind": "day", "day": day}, counts)
+    for item in items:
+        location = item["pick_up_location"]
+        _add(
+            rollups,
+            f"product|{item['name_key']}|{location or ''}",
+            {"kind": "product", "name": item["name"], "name_key": item["name_key"], "pick_up_location": location},
+            {"line_items": 1, "quantity": item["quantity"] or 0, "spend": _spend(item)}
+        )
+    return rollups
+
+
+def _public(doc: Optional[Dict]) -> Dict:
+    return {key: value for key, value in (doc or {}).items() if key not in ("_id", "kind")}
+
+
+class StockRollups:
+    """Reads and writes BFB.stock_rollups (see the module docstring)."""
+
+    def __init__(self, collection):
+        self.collection = collection
+
+    def ensure_indexes(self) -> None:
+        """Create STOCK_INDEXES (a no-op for ones that exist)."""
+        for name, keys in STOCK_INDEXES:
+            try:
+                self.collection.create_index(keys, name=name)
+            except Exception as e:
+                logger.warning("Could not create index %s: %s", name, e)
+
+    def apply(self, receipts: List[Dict]) -> int:
+        """
+        Add freshly inserted receipts to their rollups, in one round trip.
+
+        Returns:
+            Number of rollups updated
+        """
+        rollups: Rollups = {}
+        for receipt in receipts:
+            receipt_rollups(receipt, rollups)
+        if not rollups:
+            return 0
+        self.collection.bulk_write([
+            UpdateOne({"_id": key}, {"$inc": counts, "$setOnInsert": fields}, upsert=True)
+            for key, (fields, counts) in rollups.items()
+        ], ordered=False)
+        return len(rollups)
+
+    def totals(self) -> Dict:
+        """The "total" rollup's counters."""
+        return {**dict.fromkeys(COUNTERS, 0), **_public(self.collection.find_one({"_id": "total"}))}
+
+    def summary(self, pick_up_location: Optional[str] = None, limit: int = 20, days: int = 30) -> Dict:
+        """
+        What the Stock and Home views show, from the stored rollups alone.
+
+        Args:
+            pick_up_location: Only products picked up here
+            limit: Most products (by spend) and users (by receipts) returned
+            days: Most recent days returned
+
+        Returns:
+            totals, products, users and days (most recent first)
+        """
+        product_query = {"kind": "product"}
+        if pick_up_location is not None:
+            product_query["pick_up_location"] = pick_up_location
+        return {
+            "totals": self.totals(),
+            "products": [_public(doc) for doc in self.collection.find(product_query).sort("spend", -1).limit(limit)],
+            "users": [_public(doc) for doc in self.collection.find({"kind": "user"}).sort("receipts", -1).limit(limit)],
+            "days": [_public(doc) for doc in self.collection.find({"kind": "day"}).sort("day", -1).limit(days)]
+        }
+
+    @staticmethod
+    def recompute(receipts, until=None, batch_size: int = 1000) -> Rollups:
+        """Every rollup from scratch, over the receipts up to `until` (an _id)."""
+        query = {"_id": {"$lte": until}} if until is not None else {}
+        rollups: Rollups = {}
+        for receipt in receipts.find(query, _PROJECTION).batch_size(batch_size):
+            receipt_rollups(receipt, rollups)
+        return rollups
+
+    @staticmethod
+    def _latest_id(receipts):
+        latest = next(iter(receipts.find({}, {"_id": 1}).sort("_id", -1).limit(1)), None)
+        return latest["_id"] if latest is not None else None
+
+    def check(self, receipts, repair: bool = False, settle_seconds: float = SETTLE_SECONDS) -> Dict:
+        """
+        Compare the stored rollups with ones recomputed from `receipts`.
+
+        Reads the newest receipt _id, then the stored rollups, then
+        recomputes the receipts up to that _id. The rollups are aggregates,
+        so an upload landing between those reads, or a receipt whose $inc
+        (applied after its insert) hasn't arrived yet, shows up as drift.
+        `repair` is therefore only carried out when uploads are quiet: the
+        newest receipt is at least `settle_seconds` old and is still the
+        newest once the recompute is done. Repairs are $inc deltas (and
+        deletes of rollups no receipt backs, if unchanged since read).
+
+        Returns:
+            Counts of recomputed, stored and drifted rollups, whether
+            uploads were quiet and the drift was repaired, and up to 10
+            drifted rollups with their deltas
+        """
+        latest = self._latest_id(receipts)
+        stored = {doc["_id"]: doc for doc in self.collection.find({})}
+        expected = self.recompute(receipts, latest) if latest is not None else {}
+        settled = not isinstance(latest, ObjectId) or (
+            (datetime.now(timezone.utc) - latest.generation_time).total_seconds() >= settle_seconds
+        )
+        quiet = settled and self._latest_id(receipts) == latest
+
+        drift: Rollups = {}
+        for key in expected.keys() | stored.keys():
+            fields, counts = expected.get(key, ({}, {}))
+            doc = stored.get(key, {})
+            delta = {}
+            for name in set(counts) | (set(COUNTERS) & set(doc)):
+                difference = counts.get(name, 0) - doc.get(name, 0)
+                if abs(difference) > _TOLERANCE * max(1.0, abs(counts.get(name, 0))):
+                    delta[name] = difference
+            if delta:
+                drift[key] = (fields, delta)
+
+        repaired = bool(repair and drift and quiet)
+        if repaired:
+            requests = []
+            for key, (fields, delta) in drift.items():
+                if key in expected:
+                    requests.append(UpdateOne({"_id": key}, {"$inc": delta, "$setOnInsert": fields}, upsert=True))
+                else:
+                    unchanged = {name: stored[key][name] for name in COUNTERS if name in stored[key]}
+                    requests.append(DeleteOne({"_id": key, **unchanged}))
+            self.collection.bulk_write(requests, ordered=False)
+        return {
+            "recomputed": len(expected),
+            "stored": len(stored),
+            "drifted": len(drift),
+            "quiet": quiet,
+            "repaired": repaired,
+            "examples": {key: delta for key, (_, delta) in list(drift.items())[:10]}
+        }
+
+
+# ---------------------------------------------------------------
+# API Endpoints
+# ---------------------------------------------------------------
+
+@router.get("/stock/summary")
+async def stock_summary(
+    request: Request,
+    pick_up_location: Optional[str] = Query(None, description="Only products picked up here"),
+    limit: int = Query(20, ge=1, le=100, description="Most products and users returned (1-100)"),
+    days: int = Query(30, ge=1, le=366, description="Most recent days returned (1-366)")
+):
+    """
+    Inventory rollups for the Stock and Home views, kept up to date on
+    every upload: totals, then the top products by spend (per pick-up
+    location), users by receipts and the most recent days.
+    """
+    rollups = getattr(request.app.state, "stock_rollups", None)
+    if rollups is None:
+        raise HTTPException(status_code=500, detail="Stock rollups not initialized")
+    try:
+        summary = await run_in_threadpool(rollups.summary, pick_up_location, limit, days)
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Stock summary failed: {str(e)}")
+    return {"status": "success", "pick_up_location": pick_up_location, **summary}
+
+
+def _main(args) -> Dict:
+    from config.logging_config import configure_logging
+    from config.settings import get_database, close_database
+    configure_logging()
+
+    try:
+        database = get_database()
+        rollups = StockRollups(database["stock_rollups"])
+        while True:
+            started = time.perf_counter()
+            report = rollups.check(database["chatbot"], repair=args.repair, settle_seconds=args.settle)
+            print(f"📦 {report['drifted']} of {report['recomputed']} rollups drifted"
+                  f"{' (repaired)' if report['repaired'] else ''} in {time.perf_counter() - started:.1f}s")
+            if args.repair and report["drifted"] and not report["quiet"]:
+                print(f"⚠️ Not repaired: uploads landed within {args.settle:.0f}s or during the check; "
+                      f"differences may be in-flight updates{'; retrying next round' if args.every else ''}")
+            for key, delta in report["examples"].items():
+                print(f"   {key}: {delta}")
+            if not args.every:
+                return report
+            time.sleep(args.every)
+    finally:
+        close_database()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--repair", action="store_true", help="add the differences back to the stored rollups")
+    parser.add_argument("--every", type=float, default=None, help="repeat every this many seconds")
+    parser.add_argument("--settle", type=float, default=SETTLE_SECONDS,
+                        help="only repair once the newest receipt is this many seconds old")
+    _main(parser.parse_args())
@@ -0,0 +1,305 @@
+"""
+LLM structuring of receipts: OCR text -> products typed by ReceiptData.
+
+Answers are cached on (normalized OCR text, pick-up location), several
+receipts can share one chat completion, and an answer that isn't valid
+JSON in the expected shape is re-asked once with the error before the
+receipt falls back to no products. A field that won't type (a price of
+"a lot", a pick-up time of "10:30 AM") is only nulled, the rest of the
+product is kept.
+"""
+
+import re
+import json
+import logging
+import threading
+from collections import OrderedDict
+from typing import Dict, List, Optional, Tuple
+from routes.model import PRODUCT_FIELDS, typed_product
+from routes.ingest_cache import ocr_text_key
+from routes.metrics import LLM_FAILURES, STAGE_SECONDS
+
+logger = logging.getLogger(__name__)
+
+STRUCTURING_MODEL = "gpt-4o-mini"
+# Bump when the prompts change, so cached answers to the old ones are not reused
+PROMPT_VERSION = 2
+# Most receipts per chat completion
+LLM_BATCH_SIZE = 8
+
+_SYSTEM_MESSAGE = "You are a structured data extraction assistant."
+_FENCE = re.compile(r"^```(?:json)?\s*(.*?)\s*```$", re.DOTALL)
+
+# Each field's type is spelled out so answers coerce; null when the receipt doesn't say
+_PRODUCT_SHAPE = """{
+      "pick_up_time": null or an ISO 8601 date-time like "2025-03-01T10:30:00",
+      "drop_off_location": null or a string,
+      "drop_off_time": null or an ISO 8601 date-time like "2025-03-01T10:30:00",
+      "pick_up_location": %s,
+      "quantity": null or a whole number like 2,
+      "price": null or a number without currency symbols like 12.5
+    }"""
+
+_SINGLE_PROMPT = """
+You are a data parser that extracts structured information from messy OCR text.
+
+OCR:
+---
+%(ocr)s
+---
+
+Return strictly JSON with this shape:
+
+{
+  "products": {
+    "product_name_1": %(product)s
+  }
+}
+"""
+
+_BATCH_PROMPT = """
+You are a data parser that extracts structured information from messy OCR text.
+
+Below are %(count)d receipts, each a JSON object with an "id" and its "ocr" text.
+Parse each one on its own.
+
+Receipts:
+%(receipts)s
+
+Return strictly JSON with one entry per receipt, with the same ids:
+
+{
+  "receipts": [
+    {
+      "id": 0,
+      "products": {
+        "product_name_1": %(product)s
+      }
+    }
+  ]
+}
+"""
+
+_RETRY_NOTE = """
+Your previous answer was rejected: %s
+Answer again with JSON in exactly the shape above and nothing else.
+"""
+
+
+def validate_products(payload, system_data: dict) -> Dict[str, Dict]:
+    """
+    Type one receipt's {"products": {...}} with ReceiptData, field by field.
+
+    A field that won't coerce is null (see routes.model.typed_product);
+    the product and its other fields are kept.
+
+    Returns:
+        The products keyed by name, with exactly the PRODUCT_FIELDS
+
+    Raises:
+        ValueError if the shape is wrong (no products object, a product that isn't an object)
+    """
+    products = payload.get("products") if isinstance(payload, dict) else None
+    if not isinstance(products, dict):
+        raise ValueError('expected an object with a "products" object')
+    validated = {}
+    for name, fields in products.items():
+        if not isinstance(fields, dict):
+            raise ValueError(f"product {name!r} is not an object")
+        item = typed_product(
+            str(name), fields, str(system_data.get("user_id") or ""), str(system_data.get("user_name") or "")
+        )
+        validated[item.name] = item.model_dump(mode="json", include=set(PRODUCT_FIELDS))
+    return validated
+
+
+class StructuringCache:
+    """
+    LRU of validated products keyed on (prompt version, normalized OCR text, pick-up location).
+
+    The same receipt text picked up elsewhere gets its own entry, since
+    the location is part of what the LLM is asked to fill in.
+    """
+
+    def __init__(self, max_entries: int = 4096):
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self._entries: "OrderedDict[Tuple, str]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def key(ocr_text: str, pick_up_location) -> Optional[Tuple]:
+        text_key = ocr_text_key(ocr_text)
+        return (PROMPT_VERSION, text_key, pick_up_location) if text_key is not None else None
+
+    def get(self, key: Tuple) -> Optional[Dict]:
+        with self._lock:
+            products = self._entries.get(key)
+            if products is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return json.loads(products)
+
+    def put(self, key: Tuple, products: Dict) -> None:
+        # Stored serialized, so callers can't mutate a cached answer
+        with self._lock:
+            self._entries[key] = json.dumps(products)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def stats(self) -> Dict:
+        lookups = self.hits + self.misses
+        return {
+            "entries": len(self._entries),
+            "max_entries": self.max_entries,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_ratio": round(self.hits / lookups, 4) if lookups else 0.0
+        }
+
+
+class ReceiptStructurer:
+    """
+    Turns OCR text into structured_data with chat completions.
+
+    Args:
+        client: AsyncOpenAI (or None, giving every receipt no products)
+        cache: StructuringCache shared across requests, or None
+        batch_size: Most receipts per chat completion
+        retries: Extra attempts for receipts whose answer didn't validate
+    """
+
+    def __init__(self, client, cache: Optional[StructuringCache] = None, batch_size: int = LLM_BATCH_SIZE, retries: int = 1):
+        self.client = client
+        self.cache = cache
+        self.batch_size = max(1, batch_size)
+        self.retries = retries
+
+    async def structure_many(self, ocr_texts: List[str], system_data: dict) -> List[Dict]:
+        """
+        Structure receipts picked up together, batching the ones not cached.
+
+        Never raises: a receipt the LLM can't structure gets no products.
+
+        Returns:
+            One {"products": ..., "raw_ocr_text": ...} per OCR text, in order
+        """
+        location = system_data.get("pick_up_location")
+        products: List[Optional[Dict]] = [None] * len(ocr_texts)
+        # Receipts still to ask for, one per distinct OCR text
+        pending: "OrderedDict[Optional[Tuple], List[int]]" = OrderedDict()
+        for i, ocr_text in enumerate(ocr_texts):
+            key = StructuringCache.key(ocr_text, location)
+            if key is None or self.client is None:
+                products[i] = {}
+                continue
+            cached = self.cache.get(key) if self.cache is not None else None
+            if cached is not None:
+                products[i] = cached
+                continue
+            pending.setdefault(key, []).append(i)
+
+        keys = list(pending)
+        for start in range(0, len(keys), self.batch_size):
+            chunk = keys[start:start + self.batch_size]
+            answers = await self._structure_chunk([ocr_texts[pending[key][0]] for key in chunk], system_data)
+            for key, answer in zip(chunk, answers):
+                if answer is not None and self.cache is not None:
+                    self.cache.put(key, answer)
+                for i in pending[key]:
+                    products[i] = json.loads(json.dumps(answer)) if answer is not None else {}
+
+        return [{"products": p, "raw_ocr_text": ocr_text or None} for p, ocr_text in zip(products, ocr_texts)]
+
+    async def structure(self, ocr_text: str, system_data: dict) -> Dict:
+        return (await self.structure_many([ocr_text], system_data))[0]
+
+    async def _structure_chunk(self, ocr_texts: List[str], system_data: dict) -> List[Optional[Dict]]:
+        """Validated products per OCR text from one completion (plus one retry of the failures)."""
+        answers: List[Optional[Dict]] = [None] * len(ocr_texts)
+        remaining, error = list(range(len(ocr_texts))), None
+        for attempt in range(1 + self.retries):
+            prompt = self._prompt([ocr_texts[i] for i in remaining], system_data.get("pick_up_location"), error)
+            try:
+                content = await self._complete(prompt)
+            except Exception as e:
+                LLM_FAILURES.labels("request").inc(len(remaining))
+                logger.warning("OpenAI step failed (continuing): %s", e)
+                return answers
+            parsed, errors = self._parse(content, len(remaining), system_data)
+            for i, products in zip(remaining, parsed):
+                answers[i] = products
+            remaining = [i for i, products in zip(remaining, parsed) if products is None]
+            if not remaining:
+                break
+            error = "; ".join(errors)[:1000]
+            logger.info("LLM answer rejected", extra={"attempt": attempt + 1, "receipts": len(remaining), "error": error})
+        if remaining:
+            LLM_FAILURES.labels("invalid_response").inc(len(remaining))
+            logger.warning("LLM could not structure %d receipt(s) (continuing): %s", len(remaining), error)
+        return answers
+
+    @staticmethod
+    def _prompt(ocr_texts: List[str], pick_up_location, error: Optional[str] = None) -> str:
+        product = _PRODUCT_SHAPE % json.dumps(pick_up_location)
+        if len(ocr_texts) == 1:
+            prompt = _SINGLE_PROMPT % {"ocr": ocr_texts[0], "product": product}
+        else:
+            receipts = "\n".join(json.dumps({"id": i, "ocr": text}) for i, text in enumerate(ocr_texts))
+            prompt = _BATCH_PROMPT % {"count": len(ocr_texts), "receipts": receipts, "product": product}
+        return prompt + (_RETRY_NOTE % error if error else "")
+
+    async def _complete(self, prompt: str) -> str:
+        with STAGE_SECONDS.labels("ingest", "llm").time():
+            resp = await self.client.chat.completions.create(
+                model=STRUCTURING_MODEL,
+                messages=[
+                    {"role": "system", "content": _SYSTEM_MESSAGE},
+                    {"role": "user", "content": prompt}
+                ],
+                temperature=0.1,
+                response_format={"type": "json_object"}
+            )
+        return resp.choices[0].message.content or ""
+
+    @staticmethod
+    def _parse(content: str, count: int, system_data: dict) -> Tuple[List[Optional[Dict]], List[str]]:
+        """
+        Validated products for each of `count` receipts in an answer.
+
+        Returns:
+            (products or None per receipt, the errors that made them None)
+        """
+        content = content.strip()
+        fenced = _FENCE.match(content)
+        if fenced:
+            content = fenced.group(1)
+        try:
+            payload = json.loads(content)
+        except json.JSONDecodeError as e:
+            return [None] * count, [f"not valid JSON ({e})"]
+
+        if count == 1 and not (isinstance(payload, dict) and "receipts" in payload):
+            entries = {0: payload}
+        else:
+            receipts = payload.get("receipts") if isinstance(payload, dict) else None
+            if not isinstance(receipts, list):
+                return [None] * count, ['expected an object with a "receipts" list']
+            entries = {entry.get("id"): entry for entry in receipts if isinstance(entry, dict)}
+
+        parsed, errors = [], []
+        for i in range(count):
+            if i not in entries:
+                parsed.append(None)
+                errors.append(f"receipt {i} is missing")
+                continue
+            try:
+                parsed.append(validate_products(entries[i], system_data))
+            except ValueError as e:
+                parsed.append(None)
+                errors.append(f"receipt {i}: {e}".replace("\n", " "))
+        return parsed, errors
@@ -1,5 +1,6 @@
 from fastapi import APIRouter, HTTPException, Request
 from pydantic import BaseModel
+from starlette.concurrency import run_in_threadpool
 
 router = APIRouter()
 
@@ -12,7 +13,7 @@ async def login(credentials: LoginRequest, request: Request):
     user_collection = request.app.state.db["users"]
     
     # Find user in MongoDB
-    user = user_collection.find_one({
+    user = await run_in_threadpool(user_collection.find_one, {
         "username": credentials.username,
         "password": credentials.password
     })
@@ -0,0 +1,1297 @@
+import os
+import json
+import math
+import time
+import logging
+import threading
+from collections import Counter
+from typing import Dict, List, Optional, Tuple
+import numpy as np
+from bson import ObjectId, json_util
+from routes.embeddings import decode_embedding, quantize_int8, same_embedding_space, truncate_embedding
+from routes.search_filters import SEARCH_PROJECTION, SearchFilters, parse_number
+from routes.lexical_index import LexicalIndex, term_weights, tokenize
+from routes.ann_index import IVFIndex
+from routes.metrics import DOCUMENTS_FETCHED
+
+logger = logging.getLogger(__name__)
+
+# How lexical (BM25) and vector scores are combined:
+# - "weighted": similarity + LEXICAL_WEIGHT * BM25 scaled to the query's best match
+# - "rrf": reciprocal-rank fusion, 1 / (RRF_K + rank) summed over both rankings
+FUSION_MODES = ("weighted", "rrf")
+LEXICAL_WEIGHT = 0.15
+RRF_K = 60
+# How deep each ranking goes into reciprocal-rank fusion
+_RRF_DEPTH = 1000
+
+# Term weights per field: a product's own name counts most; its receipt's
+# OCR text contributes a little to every product on that receipt
+_NAME_WEIGHT = 3.0
+_DETAIL_WEIGHT = 1.0
+_OCR_WEIGHT = 0.25
+
+# Per-product columns with their dtypes: the uid keying lexical postings,
+# and the columns structured filters run against (user and location hold
+# codes into SearchIndex._codes)
+_PRODUCT_COLUMNS = {
+    "uid": np.int64,
+    "price": np.float64,
+    "has_quantity": bool,
+    "user": np.int32,
+    "location": np.int32,
+    "created": np.float64,
+}
+
+# Below this fraction of products passing the filters, only their rows are scored
+_PREFILTER_FRACTION = 0.25
+
+# Resident matrix precisions: float32, or int8 codes with a float32 scale per
+# row (a quarter of the memory, re-ranked at full precision)
+PRECISIONS = {"float32": np.float32, "int8": np.int8}
+RERANK_DEPTH = 100
+# int8 rows are widened to float32 this many at a time while scoring
+_SCORE_BLOCK = 1024
+# Products scanned at a time when selecting a page of results
+_TOP_K_BLOCK = 8192
+
+# On-disk snapshot layout version; snapshots written by other versions are rebuilt
+SNAPSHOT_FORMAT = 1
+# Spare rows written after the used ones, so a worker's appends after opening
+# a snapshot fill mapped pages (privately) instead of copying the arrays
+SNAPSHOT_HEADROOM = 0.125
+
+
+def validate_document(doc: Dict) -> bool:
+    """Validate that document has the structure the index needs."""
+    try:
+        if "embedding" not in doc:
+            return False
+        if not isinstance(doc["embedding"], (list, bytes, bytearray)):
+            return False
+        if len(doc["embedding"]) == 0:
+            return False
+        if not isinstance(doc.get("structured_data"), dict):
+            return False
+        if not isinstance(doc["structured_data"].get("products"), dict):
+            return False
+        return True
+    except Exception as e:
+        logger.warning("Validation error: %s", e)
+        return False
+
+
+def _grow(array: np.ndarray, needed: int) -> np.ndarray:
+    """Return a copy of `array` with room for at least `needed` rows."""
+    capacity = max(needed, 2 * len(array), 64)
+    grown = np.empty((capacity,) + array.shape[1:], dtype=array.dtype)
+    grown[:len(array)] = array
+    return grown
+
+
+def _write_array(path: str, array: np.ndarray, capacity: int) -> None:
+    """Save `array` as .npy with room for `capacity` rows; the unused tail stays a hole in the file."""
+    out = np.lib.format.open_memmap(path, mode="w+", dtype=array.dtype, shape=(capacity,) + array.shape[1:])
+    out[:len(array)] = array
+    out.flush()
+    del out
+
+
+class _SnapshotPayloads:
+    """
+    Product payloads opened from a snapshot: JSON documents in a shared
+    buffer, decoded when read, then those appended since in a list.
+
+    Supports what SearchIndex does with its payload list: len(), indexing,
+    slicing, append() and extend().
+    """
+
+    def __init__(self, data: np.ndarray, offsets: np.ndarray):
+        self._data = data
+        self._offsets = offsets
+        self._count = len(offsets) - 1
+        self._tail: List[Dict] = []
+
+    def __len__(self) -> int:
+        return self._count + len(self._tail)
+
+    def __getitem__(self, i):
+        if isinstance(i, slice):
+            return [self[j] for j in range(*i.indices(len(self)))]
+        if i < 0:
+            i += len(self)
+        if i >= self._count:
+            return self._tail[i - self._count]
+        return json.loads(self.encoded(i))
+
+    def encoded(self, i: int) -> bytes:
+        """Payload `i` as JSON, without decoding it when it came from the snapshot."""
+        if i >= self._count:
+            return json.dumps(self._tail[i - self._count], default=str).encode()
+        return self._data[self._offsets[i]:self._offsets[i + 1]].tobytes()
+
+    def append(self, payload: Dict) -> None:
+        self._tail.append(payload)
+
+    def extend(self, payloads) -> None:
+        self._tail.extend(payloads)
+
+
+def _similarities(matrix: np.ndarray, scales: np.ndarray, query_vector: np.ndarray, rows=None) -> np.ndarray:
+    """
+    Dot products of `query_vector` with matrix rows (all, or `rows`), undoing int8 quantization.
+
+    A (dim, n) `query_vector` scores n queries in one matrix product,
+    giving a (rows, n) result.
+    """
+    if matrix.dtype == np.float32:
+        return matrix @ query_vector if rows is None else matrix[rows] @ query_vector
+    count = len(matrix) if rows is None else len(rows)
+    dots = np.empty((count,) + query_vector.shape[1:], dtype=np.float32)
+    for start in range(0, count, _SCORE_BLOCK):
+        block = matrix[start:start + _SCORE_BLOCK] if rows is None else matrix[rows[start:start + _SCORE_BLOCK]]
+        dots[start:start + _SCORE_BLOCK] = block.astype(np.float32) @ query_vector
+    scales = scales if rows is None else scales[rows]
+    return dots * (scales if dots.ndim == 1 else scales[:, None])
+
+
+def _top_k(eligible: np.ndarray, scores: np.ndarray, uids: np.ndarray, k: int) -> Tuple[np.ndarray, int]:
+    """
+    The `k` best eligible entries, best score first and lowest uid first among ties.
+
+    Scans `eligible` a block at a time keeping a running top k, so at most
+    k + _TOP_K_BLOCK entry indices are held however many products match.
+
+    Returns:
+        (entries, number of eligible entries)
+    """
+    best = np.empty(0, dtype=np.int64)
+    count = 0
+    for start in range(0, len(eligible), _TOP_K_BLOCK):
+        block = np.flatnonzero(eligible[start:start + _TOP_K_BLOCK]) + start
+        count += len(block)
+        if k <= 0 or len(block) == 0:
+            continue
+        pool = np.concatenate((best, block))
+        if len(pool) > k:
+            # Everything above the k-th best score, then ties by uid
+            pool_scores = scores[pool]
+            kth = np.partition(pool_scores, len(pool) - k)[len(pool) - k]
+            above = pool[pool_scores > kth]
+            ties = pool[pool_scores == kth]
+            pool = np.concatenate((above, ties[np.argsort(uids[ties], kind="stable")[:k - len(above)]]))
+        best = pool
+    return best[np.lexsort((uids[best], -scores[best]))], count
+
+
+class Ranking:
+    """
+    One query's scores over an index snapshot, read out a page at a time.
+
+    Results are ordered by score, then product uid (insertion order), and a
+    page can start after a position (score, uid) taken from the previous
+    one, so pages never overlap. Only the page being returned is turned
+    into result dicts.
+    """
+
+    def __init__(
+        self,
+        eligible: np.ndarray,
+        scores: np.ndarray,
+        similarities: Optional[np.ndarray],
+        lexical: np.ndarray,
+        uids: np.ndarray,
+        payloads: List[Dict],
+        total_found: Optional[int] = None
+    ):
+        self.eligible = eligible
+        self.scores = scores
+        self.similarities = similarities
+        self.lexical = lexical
+        self.uids = uids
+        self.payloads = payloads
+        self.total_found = int(np.count_nonzero(eligible)) if total_found is None else total_found
+
+    @classmethod
+    def empty(cls) -> "Ranking":
+        return cls(np.zeros(0, dtype=bool), np.zeros(0), None, np.zeros(0), np.zeros(0, dtype=np.int64), [])
+
+    def page(self, limit: int, after: Optional[Tuple[float, int]] = None) -> Tuple[List[Dict], Optional[Tuple[float, int]]]:
+        """
+        Up to `limit` results following `after`.
+
+        Returns:
+            (results, position of the last result, or None when nothing follows)
+        """
+        eligible = self.eligible
+        if after is not None:
+            score, uid = after
+            eligible = eligible & ((self.scores < score) | ((self.scores == score) & (self.uids > uid)))
+        entries, remaining = _top_k(eligible, self.scores, self.uids, limit)
+        next_after = None
+        if 0 < len(entries) < remaining:
+            last = entries[-1]
+            next_after = (float(self.scores[last]), int(self.uids[last]))
+        return [self._result(i) for i in entries], next_after
+
+    def pages(self, page_size: int, limit: int, after: Optional[Tuple[float, int]] = None):
+        """Yield (results, next_after) a page at a time until `limit` results or the end."""
+        while limit > 0:
+            results, after = self.page(min(page_size, limit), after)
+            limit -= len(results)
+            yield results, after
+            if after is None:
+                break
+
+    def _result(self, i: int) -> Dict:
+        payload = self.payloads[i]
+        return {
+            "product_name": payload["product_name"],
+            "details": payload["details"],
+            "user_info": payload["user_info"],
+            "similarity_score": round(float(self.scores[i]), 4),
+            "vector_score": round(float(self.similarities[i]), 4) if self.similarities is not None else None,
+            "lexical_score": round(float(self.lexical[i]), 4),
+            "keyword_match": bool(self.lexical[i] > 0),
+            "document_id": payload["document_id"]
+        }
+
+
+def _as_document_id(document_id: str):
+    """Mongo _id for a document_id string."""
+    return ObjectId(document_id) if ObjectId.is_valid(document_id) else document_id
+
+
+def _detail_text(product_data: Dict) -> str:
+    """The product's string and number fields, as searchable text."""
+    return " ".join(
+        str(value) for value in product_data.values()
+        if isinstance(value, (str, int, float)) and not isinstance(value, bool)
+    )
+
+
+class SearchIndex:
+    """
+    Resident vector index over the embedded documents in BFB.chatbot.
+
+    Embeddings live in one contiguous float32 matrix of L2-normalized rows,
+    so a query is scored with a single matrix-vector product instead of a
+    collection scan. Product entries are kept in parallel arrays: each entry
+    points at the matrix row holding its vector and carries the payload
+    returned in search results.
+
+    Line items with their own vector (product_embeddings) get their own row
+    and are ranked independently; items without one share a row holding the
+    receipt-level embedding.
+
+    Alongside the vectors, a LexicalIndex scores product names, fields and
+    the receipt's OCR text with BM25; the two are fused per `fusion`, and
+    queries without a vector (embedder down) are answered lexically.
+
+    The index is append-only between compactions: removing a document only
+    tombstones its rows, and compact() drops them later without blocking
+    searches or new appends.
+
+    With `dim`, longer vectors (stored before EMBEDDING_DIMENSIONS was set,
+    or queries) are shortened to their first `dim` components. With
+    precision="int8" the matrix holds quantized rows. Either way the top
+    `rerank_depth` candidates of each query are then re-scored against the
+    stored embeddings, at full length and precision, fetched from
+    `vector_source` (set by from_collection).
+
+    With `model` (the query embedder's), documents whose embedding_model is
+    another embedding space are skipped rather than scored against queries
+    they can't be compared with; model_mismatches() counts them. Documents
+    without an embedding_model (stored before it was recorded) are indexed.
+    """
+
+    def __init__(
+        self,
+        dim: Optional[int] = None,
+        fusion: str = "weighted",
+        lexical_weight: float = LEXICAL_WEIGHT,
+        rrf_k: int = RRF_K,
+        ann: Optional[IVFIndex] = None,
+        precision: str = "float32",
+        rerank_depth: int = RERANK_DEPTH,
+        model: Optional[str] = None
+    ):
+        if fusion not in FUSION_MODES:
+            raise ValueError(f"fusion must be one of {FUSION_MODES}, not {fusion!r}")
+        if precision not in PRECISIONS:
+            raise ValueError(f"precision must be one of {tuple(PRECISIONS)}, not {precision!r}")
+        self._lock = threading.RLock()
+        self.dim = dim
+        self.fusion = fusion
+        self.lexical_weight = lexical_weight
+        self.rrf_k = rrf_k
+        self.precision = precision
+        self.rerank_depth = rerank_depth
+        self.model = model
+        # document_id -> embedding_model of documents skipped for their model
+        self._model_mismatches: Dict[str, str] = {}
+        # Collection to fetch stored embeddings from when re-ranking
+        self.vector_source = None
+
+        # Vector rows, and each row's dequantization scale (1 for float32)
+        self._matrix = np.empty((0, dim or 0), dtype=PRECISIONS[precision])
+        self._row_scales = np.empty(0, dtype=np.float32)
+        self._row_alive = np.empty(0, dtype=bool)
+        self._row_doc_ids: List[str] = []
+        # IVF list of each row (-1: not assigned, always scored)
+        self._row_lists = np.empty(0, dtype=np.int32)
+        self._rows = 0
+
+        # Product entries (parallel arrays)
+        self._product_rows = np.empty(0, dtype=np.int64)
+        self._product_alive = np.empty(0, dtype=bool)
+        self._product_payloads: List[Dict] = []
+        self._products = 0
+
+        # Product columns (parallel to the product arrays) and their value codes
+        self._columns = {name: np.empty(0, dtype=dtype) for name, dtype in _PRODUCT_COLUMNS.items()}
+        self._codes: Dict[str, Dict[str, int]] = {"user": {}, "location": {}}
+
+        # BM25 over product text, keyed by product uid
+        self.lexical = LexicalIndex()
+        self._next_uid = 0
+
+        # Optional approximate search; trained in the background by maybe_train_ann()
+        self.ann = ann
+        # Serializes compaction and ANN training, which both rewrite row state
+        self._maintenance = threading.Lock()
+
+        # document_id -> (row_start, row_end, product_start, product_end)
+        self._doc_spans: Dict[str, Tuple[int, int, int, int]] = {}
+        self._tombstones = 0
+
+        # Spans removed while a compaction is copying the arrays
+        self._compacting = False
+        self._pending_removals: List[Tuple[int, int, int, int]] = []
+
+        # Largest _id read from the collection by a scan, poll or change
+        # stream (not by direct inserts, which can overtake other processes'),
+        # and a counter bumped on every change
+        self.high_water_mark = None
+        self.generation = 0
+
+    @classmethod
+    def from_collection(
+        cls,
+        collection,
+        filters: Optional[SearchFilters] = None,
+        line_items=None,
+        batch_size: int = 1000,
+        **options
+    ) -> "SearchIndex":
+        """
+        Build an index from the embedded documents in `collection`.
+
+        Only SEARCH_PROJECTION is fetched. With `filters`, their receipt-level
+        part is applied by Mongo, so only candidate documents are transferred;
+        given the `line_items` collection (see routes.line_items), so are
+        price and quantity conditions, by fetching only receipts with a
+        matching line item (their _ids sent `batch_size` at a time).
+        `options` go to the constructor (fusion, lexical_weight, rrf_k, ann,
+        dim, precision, rerank_depth, model).
+        """
+        index = cls(**options)
+        index.vector_source = collection
+        # Record the high-water mark before scanning so nothing inserted
+        # during the scan is missed by incremental refreshes
+        for doc in collection.find({}, {"_id": 1}).sort("_id", -1).limit(1):
+            index.note_seen(doc["_id"])
+
+        query = {"embedding": {"$exists": True}}
+        queries = [query]
+        if filters is not None:
+            query.update(filters.to_mongo())
+            if line_items is not None and filters.has_product_conditions():
+                # Paged so no one $in comes near Mongo's 16 MB command limit
+                receipt_ids = line_items.distinct("receipt_id", filters.to_line_items())
+                queries = [
+                    {**query, "_id": {**query.get("_id", {}), "$in": receipt_ids[start:start + batch_size]}}
+                    for start in range(0, len(receipt_ids), batch_size)
+                ]
+        count = 0
+        for batch_query in queries:
+            for doc in collection.find(batch_query, SEARCH_PROJECTION):
+                if index.add_document(doc):
+                    count += 1
+        logger.info("Search index built", extra={"documents": count, "products": index.product_count})
+        return index
+
+    @property
+    def document_count(self) -> int:
+        return len(self._doc_spans)
+
+    @property
+    def product_count(self) -> int:
+        return self._products - self._tombstones
+
+    @property
+    def tombstone_count(self) -> int:
+        return self._tombstones
+
+    @property
+    def matrix_bytes(self) -> int:
+        """Memory held by the vector rows in use."""
+        return self._rows * (self._matrix.shape[1] * self._matrix.itemsize + self._row_scales.itemsize)
+
+    def model_mismatches(self) -> Dict[str, int]:
+        """Documents skipped for being embedded by another model, counted per model."""
+        with self._lock:
+            return dict(Counter(self._model_mismatches.values()))
+
+    def note_seen(self, document_id) -> None:
+        """Advance the high-water mark past `document_id`."""
+        with self._lock:
+            if self.high_water_mark is None or document_id > self.high_water_mark:
+                self.high_water_mark = document_id
+
+    def __contains__(self, document_id) -> bool:
+        return str(document_id) in self._doc_spans
+
+    def document_ids(self) -> List[str]:
+        """Ids of the indexed documents."""
+        with self._lock:
+            return list(self._doc_spans)
+
+    def add_document(self, doc: Dict) -> bool:
+        """
+        Add one document (and all its products) to the index.
+
+        Adding a document that is already indexed is a no-op, so the same
+        insert may safely arrive from several sources. The high-water mark is
+        left to the caller (see IndexMaintainer.refresh_once).
+
+        Returns:
+            True if the document was indexed, False if it was skipped
+        """
+        if not validate_document(doc):
+            return False
+        doc_model = doc.get("embedding_model")
+        if self.model and doc_model and not same_embedding_space(doc_model, self.model):
+            with self._lock:
+                self._model_mismatches[str(doc["_id"])] = doc_model
+            return False
+
+        vector = truncate_embedding(decode_embedding(doc["embedding"]), self.dim)
+        norm = np.linalg.norm(vector)
+        if norm == 0:
+            return False
+        vector = vector / norm
+
+        document_id = str(doc["_id"])
+        user_info = doc.get("user_info") or {}
+        user_info = {
+            "user_id": user_info.get("user_id"),
+            "user_name": user_info.get("user_name"),
+            "pick_up_location": user_info.get("pick_up_location")
+        }
+        products = [
+            (name, data)
+            for name, data in doc["structured_data"]["products"].items()
+            if isinstance(data, dict)
+        ]
+        product_vectors = {}
+        for entry in doc.get("product_embeddings") or []:
+            try:
+                product_vector = truncate_embedding(decode_embedding(entry["embedding"]), self.dim)
+                product_norm = np.linalg.norm(product_vector)
+                if len(product_vector) == len(vector) and product_norm > 0:
+                    product_vectors[entry["product_name"]] = product_vector / product_norm
+            except Exception:
+                continue
+
+        # One row per product vector; products without one share the receipt row
+        vectors = []
+        vector_of_product = []
+        receipt_row = None
+        for product_name, _ in products:
+            if product_name in product_vectors:
+                vector_of_product.append(len(vectors))
+                vectors.append(product_vectors[product_name])
+            else:
+                if receipt_row is None:
+                    receipt_row = len(vectors)
+                    vectors.append(vector)
+                vector_of_product.append(receipt_row)
+        if not vectors:
+            vectors.append(vector)
+        vectors = np.asarray(vectors, dtype=np.float32)
+        if self.precision == "int8":
+            stored, scales = quantize_int8(vectors)
+        else:
+            stored, scales = vectors, np.ones(len(vectors), dtype=np.float32)
+
+        # Assign IVF lists outside the lock too; a retrain in the meantime
+        # (version change) leaves the rows unassigned instead of stale
+        ann, row_lists, ann_version = self.ann, None, None
+        if ann is not None and ann.matches(len(vector)):
+            ann_version = ann.version
+            row_lists = ann.saved_lists(document_id, len(vectors))
+            if row_lists is None:
+                row_lists = ann.assign(vectors)
+
+        # Tokenize outside the lock; the OCR text is shared by every product
+        structured_data = doc["structured_data"]
+        ocr_text = structured_data.get("raw_ocr_text")
+        ocr_weights = term_weights([(ocr_text if isinstance(ocr_text, str) else "", _OCR_WEIGHT)])
+        lexical_weights = []
+        for product_name, product_data in products:
+            weights = term_weights([(product_name, _NAME_WEIGHT), (_detail_text(product_data), _DETAIL_WEIGHT)])
+            for term, weight in ocr_weights.items():
+                weights[term] = weights.get(term, 0.0) + weight
+            lexical_weights.append(weights)
+
+        with self._lock:
+            if document_id in self._doc_spans:
+                return False
+            # Re-embedded since it was skipped
+            self._model_mismatches.pop(document_id, None)
+            if self.dim is None:
+                self.dim = len(vector)
+                self._matrix = np.empty((0, self.dim), dtype=self._matrix.dtype)
+            if len(vector) != self.dim:
+                logger.warning("Vector dimension mismatch, skipping document",
+                               extra={"dimensions": len(vector), "index_dimensions": self.dim, "document_id": document_id})
+                return False
+
+            row = self._rows
+            row_end = row + len(vectors)
+            if row_end > len(self._matrix):
+                self._matrix = _grow(self._matrix, row_end)
+                self._row_alive = _grow(self._row_alive, row_end)
+                self._row_lists = _grow(self._row_lists, row_end)
+                self._row_scales = _grow(self._row_scales, row_end)
+            self._matrix[row:row_end] = stored
+            self._row_scales[row:row_end] = scales
+            self._row_alive[row:row_end] = True
+            self._row_lists[row:row_end] = row_lists if row_lists is not None and ann.version == ann_version else -1
+            self._row_doc_ids.extend([document_id] * len(vectors))
+            self._rows = row_end
+
+            start = self._products
+            end = start + len(products)
+            if end > len(self._product_rows):
+                self._product_rows = _grow(self._product_rows, end)
+                self._product_alive = _grow(self._product_alive, end)
+            self._product_rows[start:end] = np.asarray(vector_of_product, dtype=np.int64) + row
+            self._product_alive[start:end] = True
+            self._set_filter_columns(start, end, doc, user_info, products)
+            uids = np.arange(self._next_uid, self._next_uid + len(products))
+            self._columns["uid"][start:end] = uids
+            self._next_uid += len(products)
+            for uid, weights in zip(uids, lexical_weights):
+                self.lexical.add(int(uid), weights)
+            for product_name, product_data in products:
+                self._product_payloads.append({
+                    "product_name": product_name,
+                    "details": {
+                        "pick_up_time": product_data.get("pick_up_time"),
+                        "drop_off_location": product_data.get("drop_off_location"),
+                        "drop_off_time": product_data.get("drop_off_time"),
+                        "pick_up_location": product_data.get("pick_up_location"),
+                        "quantity": product_data.get("quantity"),
+                        "price": product_data.get("price")
+                    },
+                    "user_info": user_info,
+                    "document_id": document_id
+                })
+            self._products = end
+
+            self._doc_spans[document_id] = (row, row_end, start, end)
+            self.generation += 1
+        return True
+
+    def _code(self, column: str, value) -> int:
+        """Code for a user/location value, assigning the next one if new; -1 for missing."""
+        if value is None:
+            return -1
+        codes = self._codes[column]
+        return codes.setdefault(str(value), len(codes))
+
+    def _set_filter_columns(self, start: int, end: int, doc: Dict, user_info: Dict, products: List) -> None:
+        """Fill the product columns for entries [start, end) (lock held); the caller sets uids."""
+        for name, column in self._columns.items():
+            if end > len(column):
+                self._columns[name] = _grow(column, end)
+        columns = self._columns
+        created = doc["_id"].generation_time.timestamp() if isinstance(doc.get("_id"), ObjectId) else math.nan
+        columns["user"][start:end] = self._code("user", user_info["user_id"])
+        columns["location"][start:end] = self._code("location", user_info["pick_up_location"])
+        columns["created"][start:end] = created
+        columns["price"][start:end] = [parse_number(data.get("price")) for _, data in products]
+        columns["has_quantity"][start:end] = [data.get("quantity") not in (None, "") for _, data in products]
+
+    def _filter_mask(self, filters: SearchFilters, columns: Dict[str, np.ndarray], codes: Dict) -> np.ndarray:
+        """Products passing `filters`, from a snapshot of the filter columns."""
+        mask = np.ones(len(columns["price"]), dtype=bool)
+        for name, value in (("user", filters.user_id), ("location", filters.pick_up_location)):
+            if value is not None:
+                code = codes[name].get(str(value))
+                if code is None:
+                    return np.zeros_like(mask)
+                mask &= columns[name] == code
+        if filters.min_price is not None:
+            mask &= columns["price"] >= filters.min_price
+        if filters.max_price is not None:
+            mask &= columns["price"] <= filters.max_price
+        if filters.date_from is not None or filters.date_to is not None:
+            low, high = filters.created_range()
+            mask &= (columns["created"] >= low) & (columns["created"] < high)
+        if filters.has_quantity is not None:
+            mask &= columns["has_quantity"] == filters.has_quantity
+        return mask
+
+    def remove_document(self, document_id) -> bool:
+        """
+        Tombstone a document so it no longer appears in results.
+
+        Returns:
+            True if the document was indexed, False otherwise
+        """
+        document_id = str(document_id)
+        with self._lock:
+            self._model_mismatches.pop(document_id, None)
+            span = self._doc_spans.pop(document_id, None)
+            if span is None:
+                return False
+            row_start, row_end, product_start, product_end = span
+            self._row_alive[row_start:row_end] = False
+            self._product_alive[product_start:product_end] = False
+            self._tombstones += product_end - product_start
+            self.lexical.discard(self._columns["uid"][product_start:product_end])
+            if self._compacting:
+                self._pending_removals.append(span)
+            self.generation += 1
+        return True
+
+    def compact(self) -> int:
+        """
+        Drop tombstoned rows and product entries.
+
+        The copy runs outside the lock, so searches and appends carry on while
+        it works; entries appended or removed in the meantime are reconciled
+        when the compacted arrays are swapped in.
+
+        Returns:
+            Number of product entries reclaimed
+        """
+        with self._maintenance:
+            return self._compact()
+
+    def _compact(self) -> int:
+        with self._lock:
+            if self._compacting or self._tombstones == 0:
+                return 0
+            self._compacting = True
+            self._pending_removals = []
+            rows, products = self._rows, self._products
+            matrix = self._matrix
+            row_alive = self._row_alive[:rows].copy()
+            row_lists = self._row_lists[:rows]
+            row_scales = self._row_scales[:rows]
+            product_rows = self._product_rows[:products]
+            product_alive = self._product_alive[:products].copy()
+            row_doc_ids = self._row_doc_ids[:rows]
+            # Read (and decoded, if opened from a snapshot) outside the lock
+            payloads = self._product_payloads
+            columns = {name: column[:products] for name, column in self._columns.items()}
+            doc_spans = dict(self._doc_spans)
+
+        try:
+            keep_rows = np.flatnonzero(row_alive)
+            keep_products = np.flatnonzero(product_alive)
+            row_map = np.full(rows, -1, dtype=np.int64)
+            row_map[keep_rows] = np.arange(len(keep_rows))
+
+            new_matrix = np.empty((max(len(keep_rows), 64), matrix.shape[1]), dtype=matrix.dtype)
+            new_matrix[:len(keep_rows)] = matrix[keep_rows]
+            new_row_alive = np.ones(len(new_matrix), dtype=bool)
+            new_row_lists = np.full(len(new_matrix), -1, dtype=np.int32)
+            new_row_lists[:len(keep_rows)] = row_lists[keep_rows]
+            new_row_scales = np.ones(len(new_matrix), dtype=np.float32)
+            new_row_scales[:len(keep_rows)] = row_scales[keep_rows]
+            new_product_rows = row_map[product_rows[keep_products]]
+            new_product_alive = np.ones(len(keep_products), dtype=bool)
+            new_row_doc_ids = [row_doc_ids[i] for i in keep_rows]
+            new_payloads = [payloads[i] for i in keep_products]
+            new_columns = {name: column[keep_products] for name, column in columns.items()}
+
+            def remap(span):
+                # Spans are contiguous, so only their starts need translating
+                row_start, row_end, product_start, product_end = span
+                new_row = int(row_map[row_start])
+                new_product = int(np.searchsorted(keep_products, product_start))
+                return (
+                    new_row,
+                    new_row + (row_end - row_start),
+                    new_product,
+                    new_product + (product_end - product_start)
+                )
+
+            new_spans = {
+                doc_id: remap(span)
+                for doc_id, span in doc_spans.items()
+                if span[0] < rows
+            }
+        except Exception:
+            with self._lock:
+                self._compacting = False
+            raise
+
+        with self._lock:
+            # Carry over everything appended while we were copying
+            kept_rows, kept_products = len(keep_rows), len(keep_products)
+            tail_rows = self._rows - rows
+            tail_products = self._products - products
+            row_shift = kept_rows - rows
+            product_shift = kept_products - products
+
+            if kept_rows + tail_rows > len(new_matrix):
+                new_matrix = _grow(new_matrix[:kept_rows], kept_rows + tail_rows)
+                new_row_alive = _grow(new_row_alive[:kept_rows], kept_rows + tail_rows)
+                new_row_lists = _grow(new_row_lists[:kept_rows], kept_rows + tail_rows)
+                new_row_scales = _grow(new_row_scales[:kept_rows], kept_rows + tail_rows)
+            new_matrix[kept_rows:kept_rows + tail_rows] = self._matrix[rows:self._rows]
+            new_row_alive[kept_rows:kept_rows + tail_rows] = self._row_alive[rows:self._rows]
+            new_row_lists[kept_rows:kept_rows + tail_rows] = self._row_lists[rows:self._rows]
+            new_row_scales[kept_rows:kept_rows + tail_rows] = self._row_scales[rows:self._rows]
+            new_row_doc_ids.extend(self._row_doc_ids[rows:self._rows])
+
+            new_product_rows = np.concatenate([
+                new_product_rows,
+                self._product_rows[products:self._products] + row_shift
+            ])
+            new_product_alive = np.concatenate([
+                new_product_alive,
+                self._product_alive[products:self._products]
+            ])
+            new_payloads.extend(self._product_payloads[products:self._products])
+            new_columns = {
+                name: np.concatenate([column, self._columns[name][products:self._products]])
+                for name, column in new_columns.items()
+            }
+
+            # Re-apply removals of old entries that happened mid-compaction
+            tombstones = int(tail_products - np.count_nonzero(new_product_alive[kept_products:]))
+            for old_span in self._pending_removals:
+                if old_span[0] >= rows:
+                    continue
+                span = remap(old_span)
+                new_row_alive[span[0]:span[1]] = False
+                new_product_alive[span[2]:span[3]] = False
+                tombstones += span[3] - span[2]
+                doc_id = self._row_doc_ids[old_span[0]]
+                if new_spans.get(doc_id) == span:
+                    del new_spans[doc_id]
+            for doc_id, span in self._doc_spans.items():
+                if span[0] >= rows:
+                    new_spans[doc_id] = (
+                        span[0] + row_shift,
+                        span[1] + row_shift,
+                        span[2] + product_shift,
+                        span[3] + product_shift
+                    )
+
+            reclaimed = products - kept_products
+            self._matrix = new_matrix
+            self._row_alive = new_row_alive
+            self._row_lists = new_row_lists
+            self._row_scales = new_row_scales
+            self._row_doc_ids = new_row_doc_ids
+            self._rows = kept_rows + tail_rows
+            self._product_rows = new_product_rows
+            self._product_alive = new_product_alive
+            self._product_payloads = new_payloads
+            self._columns = new_columns
+            self._products = kept_products + tail_products
+            self._doc_spans = new_spans
+            self._tombstones = tombstones
+            self._pending_removals = []
+            self._compacting = False
+            self.generation += 1
+            live_uids = self._columns["uid"][:self._products].copy()
+            new_from = self._next_uid
+
+        # Postings of reclaimed entries can go now (uids stay sorted)
+        self.lexical.prune(live_uids, new_from)
+        logger.info("Search index compacted", extra={"reclaimed": reclaimed})
+        return reclaimed
+
+    def maybe_train_ann(self) -> bool:
+        """Train the ANN quantizer once there are enough rows, and retrain when they double."""
+        ann = self.ann
+        if ann is None:
+            return False
+        rows = self._rows
+        if rows < ann.min_rows or (ann.matches(self.dim) and rows < 2 * ann.trained_rows):
+            return False
+        return self.train_ann()
+
+    def train_ann(self) -> bool:
+        """
+        (Re)train the ANN quantizer on the live rows and assign every row to a list.
+
+        k-means and the assignment run outside the lock; only rows appended
+        meanwhile are assigned under it. Saves to ann.path when set.
+
+        Returns:
+            True if a quantizer was installed
+        """
+        ann = self.ann
+        if ann is None:
+            return False
+        with self._maintenance:
+            with self._lock:
+                rows = self._rows
+                # Rows below `rows` aren't rewritten while we hold _maintenance
+                matrix = self._matrix[:rows]
+                row_alive = self._row_alive[:rows].copy()
+            if not row_alive.any():
+                return False
+            started = time.perf_counter()
+            centroids = ann.train(matrix[row_alive])
+            row_lists = ann.assign(matrix, centroids)
+            with self._lock:
+                # A new array, so searches holding the old one keep matching the old centroids
+                new_row_lists = self._row_lists.copy()
+                new_row_lists[:rows] = row_lists
+                new_row_lists[rows:self._rows] = ann.assign(self._matrix[rows:self._rows], centroids)
+                self._row_lists = new_row_lists
+                ann.set_centroids(centroids, int(np.count_nonzero(row_alive)))
+                self.generation += 1
+            logger.info("ANN index trained", extra={
+                "lists": len(centroids), "rows": rows, "seconds": round(time.perf_counter() - started, 1)
+            })
+        if ann.path:
+            self.save_ann()
+        return True
+
+    def save_ann(self) -> bool:
+        """Write the ANN quantizer and row assignments to ann.path, if there is one to save."""
+        ann = self.ann
+        if ann is None or not ann.trained or not ann.path:
+            return False
+        with self._maintenance:
+            with self._lock:
+                spans = list(self._doc_spans.items())
+                row_lists = self._row_lists[:self._rows].copy()
+            document_ids = [document_id for document_id, _ in spans]
+            row_counts = [row_end - row_start for _, (row_start, row_end, _, _) in spans]
+            lists = [row_lists[row_start:row_end] for _, (row_start, row_end, _, _) in spans]
+            ann.save(ann.path, document_ids, row_counts, np.concatenate(lists) if lists else row_lists[:0])
+        return True
+
+    def save_snapshot(self, directory: str, headroom: float = SNAPSHOT_HEADROOM) -> Dict:
+        """
+        Write the index to `directory` for open_snapshot().
+
+        Row and product arrays go to .npy files (with `headroom` spare rows),
+        payloads to a buffer of JSON documents, spans and codes to
+        objects.json, the rest to meta.json. The state is read under the
+        lock, but written outside it; compaction and ANN training wait until
+        the write is done.
+
+        Returns:
+            The snapshot's meta data
+
+        Raises:
+            ValueError if the index holds no vectors yet
+        """
+        with self._maintenance:
+            with self._lock:
+                rows, products = self._rows, self._products
+                if rows == 0 or self.dim is None:
+                    raise ValueError("nothing to snapshot: the index holds no vectors")
+                # Rows below `rows` aren't rewritten while we hold _maintenance
+                arrays = {
+                    "matrix": self._matrix[:rows],
+                    "row_scales": self._row_scales[:rows],
+                    "row_alive": self._row_alive[:rows].copy(),
+                    "row_lists": self._row_lists[:rows],
+                    "product_rows": self._product_rows[:products],
+                    "product_alive": self._product_alive[:products].copy(),
+                    **{f"column_{name}": column[:products] for name, column in self._columns.items()},
+                }
+                # Entries below `products` are never replaced outside compaction
+                payloads = self._product_payloads
+                objects = {
+                    "row_doc_ids": self._row_doc_ids[:rows],
+                    "doc_spans": dict(self._doc_spans),
+                    "codes": {name: dict(codes) for name, codes in self._codes.items()},
+                    "model_mismatches": dict(self._model_mismatches),
+                }
+                lexical = self.lexical.to_arrays()
+                ann = self.ann if self.ann is not None and self.ann.matches(self.dim) else None
+                meta = {
+                    "format": SNAPSHOT_FORMAT,
+                    "dim": self.dim,
+                    "precision": self.precision,
+                    "model": self.model,
+                    "rows": rows,
+                    "products": products,
+                    "documents": len(self._doc_spans),
+                    "tombstones": self._tombstones,
+                    "next_uid": self._next_uid,
+                    "high_water_mark": json_util.dumps(self.high_water_mark),
+                    "ann_trained_rows": ann.trained_rows if ann is not None else None,
+                    "created": time.time(),
+                }
+                centroids = ann.centroids if ann is not None else None
+
+            os.makedirs(directory, exist_ok=True)
+            for name, array in arrays.items():
+                capacity = len(array) + max(64, int(len(array) * headroom))
+                _write_array(os.path.join(directory, f"{name}.npy"), array, capacity)
+            for name, array in lexical.items():
+                np.save(os.path.join(directory, f"lexical_{name}.npy"), array)
+            if centroids is not None:
+                np.save(os.path.join(directory, "ann_centroids.npy"), centroids)
+            offsets = np.zeros(products + 1, dtype=np.int64)
+            with open(os.path.join(directory, "payloads.json"), "wb") as f:
+                for i in range(products):
+                    if isinstance(payloads, _SnapshotPayloads):
+                        encoded = payloads.encoded(i)
+                    else:
+                        encoded = json.dumps(payloads[i], default=str).encode()
+                    f.write(encoded)
+                    offsets[i + 1] = offsets[i] + len(encoded)
+            np.save(os.path.join(directory, "payload_offsets.npy"), offsets)
+            with open(os.path.join(directory, "objects.json"), "w") as f:
+                json.dump(objects, f, default=str)
+            # Written last: a directory without meta.json is incomplete
+            with open(os.path.join(directory, "meta.json"), "w") as f:
+                json.dump(meta, f)
+        return meta
+
+    @classmethod
+    def open_snapshot(cls, directory: str, **options) -> "SearchIndex":
+        """
+        An index over a snapshot written by save_snapshot().
+
+        The arrays are memory-mapped copy-on-write, so processes opening the
+        same snapshot share its pages through the OS page cache; appends,
+        removals and compaction afterwards only change this process's view.
+        `options` go to the constructor; precision, dim and model must match
+        the snapshot's. A trained ANN quantizer in the snapshot replaces the one
+        in `ann`, since the saved row lists refer to its centroids (without
+        one, the rows have no list and are always scored).
+
+        Raises:
+            ValueError if the snapshot is incomplete or doesn't fit `options`
+        """
+        meta_path = os.path.join(directory, "meta.json")
+        if not os.path.exists(meta_path):
+            raise ValueError(f"{directory} is not a complete snapshot")
+        with open(meta_path) as f:
+            meta = json.load(f)
+        if meta.get("format") != SNAPSHOT_FORMAT:
+            raise ValueError(f"snapshot format {meta.get('format')} is not {SNAPSHOT_FORMAT}")
+        index = cls(**options)
+        if meta["precision"] != index.precision:
+            raise ValueError(f"snapshot precision {meta['precision']} is not {index.precision}")
+        if index.dim is not None and meta["dim"] != index.dim:
+            raise ValueError(f"snapshot has {meta['dim']} dimensions, not {index.dim}")
+        if index.model and meta.get("model") and not same_embedding_space(meta["model"], index.model):
+            raise ValueError(f"snapshot was built for {meta['model']}, not {index.model}")
+
+        def load(name: str) -> np.ndarray:
+            # Plain views of the maps: slicing np.memmap objects is slow
+            return np.load(os.path.join(directory, f"{name}.npy"), mmap_mode="c").view(np.ndarray)
+
+        with open(os.path.join(directory, "objects.json")) as f:
+            objects = json.load(f)
+        index.dim = meta["dim"]
+        index._matrix = load("matrix")
+        index._row_scales = load("row_scales")
+        index._row_alive = load("row_alive")
+        index._row_lists = load("row_lists")
+        index._row_doc_ids = objects["row_doc_ids"]
+        index._rows = meta["rows"]
+        index._product_rows = load("product_rows")
+        index._product_alive = load("product_alive")
+        index._product_payloads = _SnapshotPayloads(
+            np.memmap(os.path.join(directory, "payloads.json"), dtype=np.uint8, mode="r").view(np.ndarray)
+            if os.path.getsize(os.path.join(directory, "payloads.json")) else np.empty(0, dtype=np.uint8),
+            load("payload_offsets")
+        )
+        index._products = meta["products"]
+        index._columns = {name: load(f"column_{name}") for name in _PRODUCT_COLUMNS}
+        index._codes = objects["codes"]
+        index._model_mismatches = objects.get("model_mismatches", {})
+        index._doc_spans = {document_id: tuple(span) for document_id, span in objects["doc_spans"].items()}
+        index._tombstones = meta["tombstones"]
+        index._next_uid = meta["next_uid"]
+        index.lexical = LexicalIndex.from_arrays({
+            name: load(f"lexical_{name}") for name in ("terms", "offsets", "uids", "frequencies", "lengths", "stats")
+        })
+        index.high_water_mark = json_util.loads(meta["high_water_mark"])
+        if index.ann is not None and meta["ann_trained_rows"] is not None:
+            index.ann.set_centroids(np.load(os.path.join(directory, "ann_centroids.npy")), meta["ann_trained_rows"])
+        logger.info("Search index opened from snapshot",
+                    extra={"documents": index.document_count, "products": index.product_count})
+        return index
+
+    def _fuse(self, similarities: np.ndarray, lexical: np.ndarray, allowed: np.ndarray) -> np.ndarray:
+        """Combine vector similarities and BM25 scores per the index's fusion mode."""
+        if self.fusion == "weighted":
+            best = lexical[allowed].max(initial=0.0)
+            if best <= 0:
+                return similarities
+            return similarities + self.lexical_weight * lexical / best
+
+        # Reciprocal-rank fusion over the top of each ranking
+        fused = np.zeros(len(similarities))
+        for ranking_scores, eligible in ((similarities, allowed), (lexical, allowed & (lexical > 0))):
+            entries = np.flatnonzero(eligible)
+            if len(entries) > _RRF_DEPTH:
+                entries = entries[np.argpartition(-ranking_scores[entries], _RRF_DEPTH - 1)[:_RRF_DEPTH]]
+            entries = entries[np.lexsort((entries, -ranking_scores[entries]))]
+            fused[entries] += 1.0 / (self.rrf_k + np.arange(1, len(entries) + 1))
+        return fused
+
+    def _rerank(
+        self,
+        eligible: np.ndarray,
+        similarities: np.ndarray,
+        scores: np.ndarray,
+        threshold: np.ndarray,
+        uids: np.ndarray,
+        payloads: List[Dict],
+        query_vector: np.ndarray,
+        depth: int,
+        min_score: float
+    ) -> None:
+        """
+        Re-score the best `depth` quantized or shortened candidates from their stored embeddings, in place.
+
+        Under "rrf" only the vector scores change; the fused ranks are kept.
+        Candidates that fall below `min_score` drop out of `eligible`.
+        """
+        candidates, _ = _top_k(eligible, scores, uids, depth)
+        exact = self._stored_similarities(payloads, candidates, query_vector)
+        if exact is None:
+            return
+        coarse = similarities[candidates]
+        exact = np.where(np.isnan(exact), coarse, exact)
+        if self.fusion == "weighted" and scores is not similarities:
+            scores[candidates] += exact - coarse
+        similarities[candidates] = exact
+        eligible[candidates] = threshold[candidates] >= min_score
+
+    def _stored_similarities(self, payloads: List[Dict], entries: np.ndarray, query_vector: np.ndarray) -> Optional[np.ndarray]:
+        """
+        Similarity of `entries` from their embeddings in vector_source, or None if unreachable.
+
+        Stored vectors as long as the (full-length) query are compared whole,
+        others at the index's `dim`; NaN where an entry has no usable vector.
+        """
+        document_ids = {payloads[i]["document_id"] for i in entries}
+        try:
+            docs = list(self.vector_source.find(
+                {"_id": {"$in": [_as_document_id(document_id) for document_id in document_ids]}},
+                {"embedding": 1, "product_embeddings": 1}
+            ))
+        except Exception as e:
+            logger.warning("Re-rank fetch failed, keeping quantized scores: %s", e)
+            return None
+        DOCUMENTS_FETCHED.labels("rerank").inc(len(docs))
+        stored = {}
+        for doc in docs:
+            document_id = str(doc["_id"])
+            stored[(document_id, None)] = doc.get("embedding")
+            for entry in doc.get("product_embeddings") or []:
+                stored[(document_id, entry.get("product_name"))] = entry.get("embedding")
+
+        exact = np.full(len(entries), np.nan)
+        for k, i in enumerate(entries):
+            payload = payloads[i]
+            value = stored.get((payload["document_id"], payload["product_name"]))
+            if value is None:
+                value = stored.get((payload["document_id"], None))
+            if value is None:
+                continue
+            vector = decode_embedding(value)
+            query = query_vector
+            if len(vector) != len(query):
+                vector, query = truncate_embedding(vector, self.dim), truncate_embedding(query, self.dim)
+            norm = np.linalg.norm(vector)
+            if len(vector) == len(query) and norm > 0:
+                exact[k] = float(vector @ query) / norm
+        return exact
+
+    def search(
+        self,
+        query_vector,
+        query: str,
+        limit: int,
+        min_score: float,
+        filters: Optional[SearchFilters] = None
+    ) -> Tuple[List[Dict], int]:
+        """
+        Score every indexed product against a query and return the best.
+
+        Args:
+            query_vector: Embedding of the query, or None to rank by BM25 alone
+            query: Raw query text, scored by the lexical index
+            limit: Maximum number of results to return
+            min_score: Minimum score threshold (see rank())
+            filters: Structured filters
+
+        Returns:
+            (results, total_found) where results are sorted best-first and each
+            carries the product payload plus similarity_score (the fused
+            score), vector_score, lexical_score and keyword_match
+        """
+        ranking = self.rank(query_vector, query, min_score, filters, page_size=limit)
+        results, _ = ranking.page(limit)
+        return results, ranking.total_found
+
+    def rank(
+        self,
+        query_vector,
+        query: str,
+        min_score: float,
+        filters: Optional[SearchFilters] = None,
+        page_size: int = RERANK_DEPTH
+    ) -> Ranking:
+        """
+        Score every indexed product against a query, for reading out in pages.
+
+        With a trained ANN quantizer only products in the query's probed IVF
+        lists (and lexical matches) are candidates, so total_found is approximate.
+        An int8 index re-ranks its best candidates at stored precision (at
+        least `page_size` of them); deeper pages keep the quantized scores.
+
+        Args:
+            query_vector: Embedding of the query, or None to rank by BM25 alone
+            query: Raw query text, scored by the lexical index
+            min_score: Minimum score threshold: on the fused score for
+                "weighted", on the vector similarity for "rrf", and on BM25
+                scaled to the best match (0-1] when there is no query vector
+            filters: Structured filters; when they leave few candidates only
+                those rows are scored
+            page_size: Results per page the caller will read
+
+        Returns:
+            A Ranking over the products passing `min_score` and the filters
+        """
+        return self.rank_many([(query_vector, query, min_score, page_size)], filters)[0]
+
+    def rank_many(
+        self,
+        queries: List[Tuple],
+        filters: Optional[SearchFilters] = None
+    ) -> List[Ranking]:
+        """
+        rank() for several queries at once, over one consistent view of the index.
+
+        The vectors of every query that scans the whole matrix are scored
+        together in one matrix-matrix product, so the matrix is read once
+        for the batch rather than once per query. Queries whose filters or
+        IVF probes leave few candidates score just those rows, as in rank().
+
+        Args:
+            queries: (query_vector, query, min_score, page_size) per query, as for rank()
+            filters: Structured filters applied to every query
+
+        Returns:
+            A Ranking per query, in order
+        """
+        # Take a consistent view; appends never touch entries below the counts
+        with self._lock:
+            rows, products = self._rows, self._products
+            matrix = self._matrix[:rows]
+            scales = self._row_scales[:rows]
+            product_rows = self._product_rows[:products]
+            product_alive = self._product_alive[:products]
+            uids = self._columns["uid"][:products]
+            row_lists = self._row_lists[:rows]
+            centroids = self.ann.centroids if self.ann is not None and self.ann.matches(self.dim) else None
+            payloads = self._product_payloads
+            if filters is not None and not filters.is_empty():
+                columns = {name: column[:products] for name, column in self._columns.items()}
+                codes = self._codes
+            else:
+                filters = None
+
+        if products == 0:
+            return [Ranking.empty() for _ in queries]
+
+        base_allowed = product_alive
+        if filters is not None:
+            base_allowed = product_alive & self._filter_mask(filters, columns, codes)
+
+        # Per query: lexical scores, candidates and the normalized vector
+        rankings: List[Optional[Ranking]] = [None] * len(queries)
+        prepared, scans = [], []
+        for k, (query_vector, query, min_score, page_size) in enumerate(queries):
+            lexical = self.lexical.scores(tokenize(query), uids)
+            allowed = base_allowed
+            full_query = similarities = None
+            if query_vector is not None:
+                # Full-length query for re-ranking, shortened one for the scan
+                full_query = np.asarray(query_vector, dtype=np.float32)
+                full_query = full_query / max(float(np.linalg.norm(full_query)), 1e-12)
+                query_vector = truncate_embedding(full_query, self.dim)
+                if len(query_vector) != self.dim:
+                    logger.warning("Query vector dimension mismatch",
+                                   extra={"dimensions": len(query_vector), "index_dimensions": self.dim})
+                    rankings[k] = Ranking.empty()
+                    continue
+                query_norm = np.linalg.norm(query_vector)
+                if query_norm == 0:
+                    rankings[k] = Ranking.empty()
+                    continue
+                query_vector = query_vector / query_norm
+                if centroids is not None:
+                    # Approximate: rows in the probed IVF lists, plus every lexical match
+                    probed = self.ann.probe(query_vector, centroids)
+                    allowed = allowed & (probed[row_lists[product_rows]] | (lexical > 0))
+                if (filters is not None or centroids is not None) and \
+                        np.count_nonzero(allowed) < _PREFILTER_FRACTION * products:
+                    # Few candidates: score just their rows instead of the whole matrix
+                    similarities = np.full(products, -np.inf)
+                    allowed_products = np.flatnonzero(allowed)
+                    similarities[allowed_products] = _similarities(
+                        matrix, scales, query_vector, product_rows[allowed_products]
+                    )
+                else:
+                    scans.append(k)
+            prepared.append((k, query_vector, full_query, similarities, lexical, allowed, min_score, page_size))
+
+        # One pass over the matrix for every full scan
+        scanned = {}
+        if scans:
+            vectors = {k: query_vector for k, query_vector, *_ in prepared}
+            dots = _similarities(matrix, scales, np.stack([vectors[k] for k in scans], axis=1))
+            scanned = {k: dots[:, j] for j, k in enumerate(scans)}
+
+        for k, query_vector, full_query, similarities, lexical, allowed, min_score, page_size in prepared:
+            if query_vector is None:
+                # Lexical only: BM25 scaled to the best match
+                allowed = allowed & (lexical > 0)
+                best = lexical[allowed].max(initial=0.0)
+                scores = lexical / best if best > 0 else lexical
+                threshold = scores
+            else:
+                if similarities is None:
+                    similarities = scanned[k][product_rows].astype(np.float64)
+                scores = self._fuse(similarities, lexical, allowed)
+                threshold = similarities if self.fusion == "rrf" else scores
+                if self.fusion == "rrf":
+                    allowed = allowed & (scores > 0)
+
+            eligible = (threshold >= min_score) & allowed
+            if similarities is not None and eligible.any() and self.vector_source is not None and self.rerank_depth > 0 and \
+                    (self.precision != "float32" or len(full_query) > self.dim):
+                self._rerank(
+                    eligible, similarities, scores, threshold, uids, payloads, full_query,
+                    max(page_size, self.rerank_depth), min_score
+                )
+            # Counted after the re-rank, which can drop candidates below min_score
+            rankings[k] = Ranking(eligible, scores, similarities, lexical, uids, payloads)
+        return rankings
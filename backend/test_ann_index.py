@@ -0,0 +1,76 @@
+"""
+Tests for the IVF approximate search mode of the resident index
+"""
+
+import numpy as np
+from routes.ann_index import IVFIndex
+from routes.vector_index import SearchIndex
+from routes.embeddings import encode_embedding
+
+
+def clustered_vectors(count, dim=32, clusters=20, seed=0):
+    rng = np.random.default_rng(seed)
+    centers = rng.normal(size=(clusters, dim))
+    vectors = centers[rng.integers(clusters, size=count)] + 0.3 * rng.normal(size=(count, dim))
+    return (vectors / np.linalg.norm(vectors, axis=1, keepdims=True)).astype(np.float32)
+
+
+def build(vectors, ann, per_receipt=4, first=0):
+    index = SearchIndex(ann=ann)
+    vectors = np.concatenate([np.zeros((first, vectors.shape[1]), dtype=np.float32), vectors])
+    for start in range(first, len(vectors), per_receipt):
+        names = [f"item{i}" for i in range(start, min(start + per_receipt, len(vectors)))]
+        index.add_document({
+            "_id": f"r{start}",
+            "structured_data": {"products": {name: {"quantity": 1} for name in names}},
+            "embedding": encode_embedding(vectors[start]),
+            "product_embeddings": [
+                {"product_name": name, "embedding": encode_embedding(vectors[start + j])}
+                for j, name in enumerate(names)
+            ]
+        })
+    return index
+
+
+def top_names(index, query_vector, k=10):
+    results, _ = index.search(query_vector, "", k, -1.0)
+    return [r["product_name"] for r in results]
+
+
+def test_ivf_recall_and_exact_when_probing_every_list():
+    vectors = clustered_vectors(4000)
+    ann = IVFIndex(nlist=32, nprobe=4, min_rows=1000)
+    index = build(vectors, ann)
+    queries = clustered_vectors(50, seed=1)
+    exact = [top_names(index, q) for q in queries]
+
+    assert index.maybe_train_ann()
+    assert not index.maybe_train_ann()      # only retrains once rows double
+    approximate = [top_names(index, q) for q in queries]
+    recall = np.mean([len(set(a) & set(e)) / 10 for a, e in zip(approximate, exact)])
+    assert recall >= 0.9
+
+    ann.nprobe = ann.list_count
+    assert [top_names(index, q) for q in queries] == exact
+
+
+def test_assignments_survive_compaction_and_restart(tmp_path):
+    vectors = clustered_vectors(2000)
+    path = str(tmp_path / "ann.npz")
+    index = build(vectors, IVFIndex(nlist=16, nprobe=16, min_rows=100, path=path))
+    index.train_ann()
+    for start in range(0, 800, 4):
+        index.remove_document(f"r{start}")
+    index.compact()
+    queries = clustered_vectors(20, seed=2)
+    assert all(set(top_names(index, q)) <= {f"item{i}" for i in range(800, 2000)} for q in queries)
+    index.save_ann()
+
+    # A new process reuses the saved quantizer and assignments instead of retraining
+    ann = IVFIndex(nprobe=16, min_rows=100, path=path)
+    ann.load(path)
+    restarted = build(vectors[800:], ann, first=800)
+    assert not restarted.maybe_train_ann()
+    saved_rows = restarted._row_lists[:restarted._rows]
+    assert (saved_rows >= 0).all()
+    assert np.array_equal(saved_rows, index._row_lists[:index._rows])
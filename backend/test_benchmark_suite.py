@@ -0,0 +1,36 @@
+"""
+Tests for the offline benchmark suite and its synthetic corpus
+"""
+
+import json
+import argparse
+import routes.ocr as ocr
+from benchmarks.corpus import synthetic_receipts
+from benchmarks.suite import compare, run_suite
+
+
+def test_corpus_is_deterministic_and_shaped_like_formatted_output():
+    first = list(synthetic_receipts(500, seed=3))
+    assert first == list(synthetic_receipts(500, seed=3))
+    assert sum(len(doc["structured_data"]["products"]) for doc in first) == 500
+    with open("formatted_output.json") as f:
+        expected_fields = set(next(iter(json.load(f)["products"].values())))
+    for doc in first[:20]:
+        for fields in doc["structured_data"]["products"].values():
+            assert set(fields) == expected_fields
+
+
+def test_suite_measures_every_scenario_and_flags_regressions():
+    original_ocr = ocr.pytesseract.image_to_string
+    args = argparse.Namespace(
+        products=[300], dim=32, searches=12, uploads=4, concurrency=4, queries=5, limit=5, embed_latency=0.0,
+        llm_latency=0.0, cpu_workers=2, result_cache=False, seed=0
+    )
+    report = run_suite(args)
+    assert ocr.pytesseract.image_to_string is original_ocr
+    assert [row["scenario"] for row in report["results"]] == ["search", "search_filtered", "ingest"]
+    assert all(row["errors"] == 0 and row["indexed_products"] == 300 for row in report["results"])
+
+    assert compare(report, report, 0.2) == []
+    slower = {"results": [{**row, "p99_ms": row["p99_ms"] * 2} for row in report["results"]]}
+    assert len(compare(slower, report, 0.2)) == 3
@@ -0,0 +1,74 @@
+"""
+Tests for the resumable embedding backfill
+"""
+
+import json
+import asyncio
+from routes.embedding_backfill import BackfillFailed, backfill, load_checkpoint
+from routes.embeddings import decode_embedding
+from benchmarks.corpus import synthetic_receipts
+from benchmarks.fakes import FakeCollection, SlowEmbedder
+
+
+class FlakyEmbedder(SlowEmbedder):
+    """Fails every call after the first `working` ones."""
+
+    def __init__(self, working: int):
+        super().__init__(dim=32)
+        self.working = working
+
+    async def aembed(self, texts):
+        if self.calls >= self.working:
+            self.calls += 1
+            raise RuntimeError("embeddings API down")
+        return await super().aembed(texts)
+
+
+def unembedded_collection(receipts=40):
+    collection = FakeCollection()
+    collection.insert_many(list(synthetic_receipts(400, seed=2))[:receipts])
+    collection.insert_one({"structured_data": {"products": {}}})         # nothing to embed
+    return collection
+
+
+def test_backfill_batches_inputs_and_skips_embedded_documents(tmp_path):
+    collection = unembedded_collection()
+    already = collection.docs[0]
+    already["embedding"] = b"keep"
+    embedder = SlowEmbedder(dim=32)
+
+    stats = asyncio.run(backfill(collection, embedder, read_batch=16, inputs_per_call=64,
+                                 checkpoint=str(tmp_path / "progress.json")))
+
+    receipts = collection.docs[1:-1]
+    assert stats["embedded"] == len(receipts) and stats["skipped"] == 1
+    assert already["embedding"] == b"keep" and "embedding" not in collection.docs[-1]
+    texts = sum(1 + len(doc["structured_data"]["products"]) for doc in receipts)
+    assert embedder.calls == stats["calls"] < len(receipts) and stats["calls"] >= texts / 64
+    for doc in receipts:
+        assert len(decode_embedding(doc["embedding"])) == 32
+        assert [e["product_name"] for e in doc["product_embeddings"]] == list(doc["structured_data"]["products"])
+        assert doc["embedding_model"] == embedder.model
+    saved = load_checkpoint(str(tmp_path / "progress.json"))
+    assert saved["last_id"] == collection.docs[-1]["_id"] and saved["embedded"] == len(receipts)
+
+
+def test_failed_run_resumes_from_its_checkpoint(tmp_path):
+    collection = unembedded_collection()
+    checkpoint = str(tmp_path / "progress.json")
+    try:
+        asyncio.run(backfill(collection, FlakyEmbedder(working=2), read_batch=10, inputs_per_call=20,
+                             concurrency=1, retries=2, checkpoint=checkpoint))
+        raise AssertionError("the backfill should have stopped")
+    except BackfillFailed:
+        pass
+    saved = load_checkpoint(checkpoint)
+    done = [doc for doc in collection.docs if "embedding" in doc]
+    assert 0 < saved["embedded"] == len(done) < 40
+    assert all(doc["_id"] <= saved["last_id"] for doc in done)
+    assert json.load(open(checkpoint))["last_id"] == {"$oid": str(saved["last_id"])}
+
+    embedder = SlowEmbedder(dim=32)
+    stats = asyncio.run(backfill(collection, embedder, read_batch=10, inputs_per_call=20, checkpoint=checkpoint))
+    assert stats["embedded"] == 40 and stats["read"] == 41 - len(done)
+    assert all("embedding" in doc for doc in collection.docs[:-1])
@@ -0,0 +1,113 @@
+"""
+Tests for compact embedding storage, its migration, and the quantized resident index
+"""
+
+import numpy as np
+from routes.embeddings import (
+    HashingEmbedder, decode_embedding, encode_embedding, get_embedder, storage_format, product_text, document_text
+)
+from routes.embedding_migration import migrate
+from routes.vector_index import SearchIndex
+from benchmarks.fakes import FakeCollection
+
+WORDS = ["brake", "cable", "pedal", "chain", "tube", "saddle", "bolt", "grease", "labor", "tire"]
+
+
+def populate(collection, receipts=60):
+    embedder = HashingEmbedder()
+    for i in range(receipts):
+        products = {f"{WORDS[i % 10]} {WORDS[(3 * i + 1) % 10]} {i}": {"quantity": 1, "price": i}}
+        names = list(products)
+        vectors = embedder.embed([document_text({"products": products})] + [product_text(n, products[n]) for n in names])
+        collection.insert_one({
+            "structured_data": {"products": products},
+            "embedding": encode_embedding(vectors[0]),
+            "product_embeddings": [{"product_name": n, "embedding": encode_embedding(v)} for n, v in zip(names, vectors[1:])],
+            "embedding_model": embedder.model,
+        })
+    return embedder
+
+
+def test_formats_round_trip():
+    vector = HashingEmbedder(1024).embed(["front brake cable"])[0]
+    sizes = {}
+    for storage, tolerance in (("float32", 0), ("float16", 1e-3), ("int8", 1e-2)):
+        stored = encode_embedding(vector, storage)
+        assert storage_format(stored) == storage
+        assert np.abs(decode_embedding(stored) - vector).max() <= tolerance
+        sizes[storage] = len(stored)
+    assert sizes["float16"] < sizes["float32"] / 1.9 and sizes["int8"] < sizes["float32"] / 3.9
+    assert storage_format(vector.tolist()) == "list"
+    dense = np.random.default_rng(0).normal(size=1024)
+    shortened = decode_embedding(encode_embedding(dense, "float32", dimensions=64))
+    assert len(shortened) == 64 and np.isclose(np.linalg.norm(shortened), 1.0)
+
+
+def test_migration_is_idempotent_and_resumable():
+    collection = FakeCollection()
+    populate(collection)
+    first = migrate(collection, "int8", dimensions=128, batch_size=25, limit=40)
+    assert (first["examined"], first["rewritten"]) == (40, 40)
+    rest = migrate(collection, "int8", dimensions=128, batch_size=25, after=first["last_id"])
+    assert (rest["examined"], rest["rewritten"]) == (20, 20)
+    assert migrate(collection, "int8", dimensions=128)["rewritten"] == 0
+
+    doc = collection.docs[0]
+    assert storage_format(doc["embedding"]) == "int8"
+    assert doc["embedding_model"] == "hashing-256@128"
+    assert first["bytes_after"] < first["bytes_before"] / 7
+    assert SearchIndex.from_collection(collection).dim == 128
+
+
+def test_int8_index_reranks_to_full_precision_scores():
+    collection = FakeCollection()
+    embedder = populate(collection)
+    exact = SearchIndex.from_collection(collection)
+    quantized = SearchIndex.from_collection(collection, precision="int8", rerank_depth=20)
+    assert quantized.matrix_bytes < exact.matrix_bytes / 3
+
+    for query in ("brake cable", "pedal chain", "grease"):
+        query_vector = embedder.embed([query])[0]
+        expected, _ = exact.search(query_vector, query, 10, 0.0)
+        results, _ = quantized.search(query_vector, query, 10, 0.0)
+        assert [(r["document_id"], r["similarity_score"]) for r in results] == \
+               [(r["document_id"], r["similarity_score"]) for r in expected]
+
+    # Re-ranking can drop candidates below min_score; the total counts what is left
+    query_vector = embedder.embed(["brake cable"])[0]
+    scores = sorted(r["similarity_score"] for r in exact.search(query_vector, "brake cable", 100, -1.0)[0])
+    for low, high in zip(scores, scores[1:]):
+        results, total_found = quantized.search(query_vector, "brake cable", 100, (low + high) / 2)
+        assert total_found == len(results)
+
+
+def test_index_shortens_longer_vectors():
+    rng = np.random.default_rng(0)
+    vectors = rng.normal(size=(5, 256)).astype(np.float32)
+    index = SearchIndex(dim=64)
+    for i, vector in enumerate(vectors):
+        index.add_document({"_id": i, "structured_data": {"products": {f"item {i}": {}}}, "embedding": encode_embedding(vector)})
+    results, _ = index.search(vectors[3], "", 1, -1.0)
+    assert results[0]["product_name"] == "item 3" and results[0]["similarity_score"] == 1.0
+
+
+def test_index_skips_documents_embedded_by_another_model(monkeypatch, caplog):
+    collection = FakeCollection()
+    embedder = populate(collection, receipts=10)
+    collection.docs[0]["embedding_model"] = "text-embedding-3-large"
+    collection.docs[1]["embedding_model"] = "hashing-256@128"
+    del collection.docs[2]["embedding_model"]
+
+    index = SearchIndex.from_collection(collection, model=embedder.model)
+    assert index.document_count == 9 and str(collection.docs[0]["_id"]) not in index
+    assert index.model_mismatches() == {"text-embedding-3-large": 1}
+    # Re-embedded into the index's space, it is indexed and no longer counted
+    collection.docs[0]["embedding_model"] = embedder.model
+    assert index.add_document(collection.docs[0]) and index.model_mismatches() == {}
+    assert SearchIndex.from_collection(collection).document_count == 10
+
+    # Without a key, hashing embeddings must be asked for
+    monkeypatch.delenv("EMBEDDER", raising=False)
+    assert get_embedder() is None and "lexical only" in caplog.text
+    monkeypatch.setenv("EMBEDDER", "hashing")
+    assert get_embedder().model == "hashing-256" and "not comparable" in caplog.text
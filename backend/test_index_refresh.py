@@ -0,0 +1,193 @@
+"""
+Tests for incremental search index maintenance against a local fake collection
+"""
+
+import time
+import numpy as np
+from bson import ObjectId
+from routes.vector_index import SearchIndex
+from routes.index_refresh import IndexMaintainer
+from benchmarks.fakes import FakeCollection, FakeCursor
+
+
+def make_receipt(vector, product_name):
+    return {
+        "user_info": {"user_id": "u1", "user_name": "Driver", "pick_up_location": "Dock 4"},
+        "structured_data": {"products": {product_name: {"quantity": 1, "price": 10.0}}},
+        "embedding": list(vector)
+    }
+
+
+def test_refresh_picks_up_new_document_with_o_new_work():
+    rng = np.random.default_rng(0)
+    collection = FakeCollection()
+    for i in range(50):
+        collection.insert_one(make_receipt(rng.normal(size=16), f"item {i}"))
+
+    index = SearchIndex.from_collection(collection)
+    # Without the overlap window, which re-reads the last few seconds
+    maintainer = IndexMaintainer(collection, index, poll_overlap=0)
+    assert index.document_count == 50
+
+    target = rng.normal(size=16)
+    collection.insert_one(make_receipt(target, "brake cable"))
+    results, _ = index.search(target, "brake cable", 5, 0.0)
+    assert all(r["product_name"] != "brake cable" for r in results)
+
+    collection.docs_returned = 0
+    assert maintainer.refresh_once() == 1
+    assert collection.docs_returned == 1
+
+    results, _ = index.search(target, "brake cable", 5, 0.0)
+    assert results[0]["product_name"] == "brake cable"
+    assert results[0]["keyword_match"] is True
+
+    # Nothing new: the next cycle fetches nothing
+    assert maintainer.refresh_once() == 0
+
+
+def test_direct_hook_and_refresh_do_not_duplicate():
+    collection = FakeCollection()
+    index = SearchIndex.from_collection(collection)
+    maintainer = IndexMaintainer(collection, index)
+
+    doc = make_receipt(np.ones(8), "pedal")
+    collection.insert_one(doc)
+    assert maintainer.on_insert(doc) is True
+    maintainer.refresh_once()
+    assert index.product_count == 1
+
+
+def test_delete_tombstones_then_compacts():
+    rng = np.random.default_rng(1)
+    collection = FakeCollection()
+    for i in range(10):
+        collection.insert_one(make_receipt(rng.normal(size=8), f"item {i}"))
+    index = SearchIndex.from_collection(collection)
+    maintainer = IndexMaintainer(collection, index, compact_ratio=0.2)
+
+    removed = [d["_id"] for d in collection.docs[:3]]
+    del collection.docs[:3]
+    for doc_id in removed:
+        maintainer.apply_change({"operationType": "delete", "documentKey": {"_id": doc_id}})
+    assert index.product_count == 7
+    assert index.tombstone_count == 3
+
+    query = collection.docs[0]["embedding"]
+    results, total = index.search(query, "", 10, -1.0)
+    assert total == 7
+    assert all(r["document_id"] not in {str(d) for d in removed} for r in results)
+
+    assert maintainer.maybe_compact() == 3
+    assert index.tombstone_count == 0
+    results_after, total_after = index.search(query, "", 10, -1.0)
+    assert total_after == 7
+    assert [r["document_id"] for r in results_after] == [r["document_id"] for r in results]
+
+    # Appends after compaction still land and remain removable
+    late = make_receipt(rng.normal(size=8), "late item")
+    collection.insert_one(late)
+    maintainer.refresh_once()
+    assert late["_id"] in index
+    assert index.remove_document(late["_id"]) is True
+    assert index.product_count == 7
+
+
+def test_polls_reach_back_for_inserts_that_land_below_the_mark():
+    collection = FakeCollection()
+    index = SearchIndex.from_collection(collection)
+    maintainer = IndexMaintainer(collection, index)
+
+    # Another worker takes an _id, then this one inserts (and indexes) a higher one
+    other = make_receipt(np.ones(8), "chain")
+    other["_id"] = ObjectId()
+    mine = make_receipt(np.full(8, 2.0), "pedal")
+    collection.insert_one(mine)
+    maintainer.on_insert(mine)
+    assert index.high_water_mark is None
+
+    maintainer.refresh_once()
+    assert index.high_water_mark == mine["_id"]
+    # The other insert lands after the poll, below the mark
+    collection.insert_one(other)
+    maintainer.refresh_once()
+    assert other["_id"] in index and index.product_count == 2
+
+
+def test_quiet_polls_read_the_overlap_window_by_id_only():
+    collection = FakeCollection()
+    for i in range(20):
+        collection.insert_one(make_receipt(np.full(8, float(i + 1)), f"item {i}"))
+    # One the index won't take, which must not be re-fetched either
+    collection.insert_one({"structured_data": {"products": {"note": {}}}})
+    index = SearchIndex.from_collection(collection)
+    maintainer = IndexMaintainer(collection, index)
+
+    full_reads = []
+    find = collection.find
+
+    def counting_find(query=None, projection=None):
+        docs = list(find(query, projection))
+        if projection != {"_id": 1}:
+            full_reads.extend(doc["_id"] for doc in docs)
+        return FakeCursor(collection, docs)
+
+    collection.find = counting_find
+    assert maintainer.refresh_once() == 1 and len(full_reads) == 1
+    for _ in range(3):
+        assert maintainer.refresh_once() == 0
+    assert len(full_reads) == 1
+
+
+class FlakyStream:
+    def __init__(self, changes):
+        self.changes = list(changes)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+    def try_next(self):
+        if not self.changes:
+            time.sleep(0.01)
+            return None
+        change = self.changes.pop(0)
+        if isinstance(change, Exception):
+            raise change
+        return change
+
+
+def test_change_stream_is_retried_with_backoff_and_resumed():
+    collection = FakeCollection()
+    index = SearchIndex.from_collection(collection)
+    first, second = make_receipt(np.ones(8), "chain"), make_receipt(np.full(8, 2.0), "pedal")
+    first["_id"], second["_id"] = ObjectId(), ObjectId()
+    attempts = []
+    streams = [
+        RuntimeError("not primary"),
+        FlakyStream([{"_id": "t1", "operationType": "insert", "documentKey": {"_id": first["_id"]},
+                      "fullDocument": first}, RuntimeError("dropped")]),
+        FlakyStream([{"_id": "t2", "operationType": "insert", "documentKey": {"_id": second["_id"]},
+                      "fullDocument": second}]),
+    ]
+
+    def watch(*args, resume_after=None, **kwargs):
+        attempts.append(resume_after)
+        stream = streams.pop(0) if streams else RuntimeError("exhausted")
+        if isinstance(stream, Exception):
+            raise stream
+        return stream
+
+    collection.watch = watch
+    maintainer = IndexMaintainer(collection, index, poll_interval=0.01, max_backoff=0.05)
+    maintainer.start()
+    deadline = time.monotonic() + 5
+    while second["_id"] not in index and time.monotonic() < deadline:
+        time.sleep(0.01)
+    maintainer.stop()
+    assert first["_id"] in index and second["_id"] in index
+    assert attempts == [None, None, "t1"] and maintainer.mode == "change_stream"
+    # Stream inserts move the mark a snapshot saves, so restarts don't re-read them
+    assert index.high_water_mark == second["_id"]
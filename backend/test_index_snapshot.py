@@ -0,0 +1,80 @@
+"""
+Tests for memory-mapped search index snapshots
+"""
+
+import numpy as np
+from bson import ObjectId
+from routes.vector_index import SearchIndex
+from routes.index_refresh import IndexMaintainer
+from routes.index_snapshot import SnapshotStore
+from routes.embeddings import HashingEmbedder
+from benchmarks.corpus import load_corpus
+from benchmarks.fakes import FakeCollection
+from test_vector_index import embedded_receipt
+
+
+def corpus(products=300):
+    collection = FakeCollection()
+    load_corpus(collection, products, HashingEmbedder(64), seed=3)
+    return collection
+
+
+def test_snapshot_round_trip_answers_like_the_scanned_index(tmp_path):
+    collection = corpus()
+    embedder = HashingEmbedder(64)
+    built = SearchIndex.from_collection(collection)
+    built.remove_document(collection.docs[0]["_id"])
+    built.save_snapshot(str(tmp_path / "snap"))
+
+    opened = SearchIndex.open_snapshot(str(tmp_path / "snap"))
+    assert isinstance(opened._matrix.base, np.memmap)
+    assert (opened.document_count, opened.product_count, opened.high_water_mark) == \
+        (built.document_count, built.product_count, built.high_water_mark)
+    for query in ("rear brake cable", "tune up", "shimano chain lube"):
+        vector = embedder.embed([query])[0]
+        assert opened.search(vector, query, 10, 0.0) == built.search(vector, query, 10, 0.0)
+        assert opened.search(None, query, 10, 0.0) == built.search(None, query, 10, 0.0)
+
+    # Changes after opening stay private to this process
+    receipt = embedded_receipt(embedder, ObjectId(), {"Valve core": {"quantity": 1, "price": 3}})
+    assert opened.add_document(receipt)
+    assert opened.remove_document(collection.docs[1]["_id"])
+    assert opened.search(None, "valve core", 5, 0.0)[0][0]["product_name"] == "Valve core"
+    assert opened.compact() > 0
+    again = SearchIndex.open_snapshot(str(tmp_path / "snap"))
+    assert receipt["_id"] not in again and collection.docs[1]["_id"] in again
+
+
+def test_workers_open_the_saved_snapshot_and_catch_up(tmp_path):
+    collection = corpus()
+    store = SnapshotStore(str(tmp_path))
+    first = store.open_or_build(collection)
+    scanned = collection.docs_returned
+
+    # After the snapshot: one receipt inserted, one deleted
+    embedder = HashingEmbedder(64)
+    deleted = collection.docs.pop(5)
+    collection.insert_one(embedded_receipt(embedder, ObjectId(), {"Saddle": {"quantity": 1, "price": 40}}))
+
+    second = store.open_or_build(collection)
+    assert collection.docs_returned == scanned
+    assert second.document_count == first.document_count
+    changes = IndexMaintainer(collection, second, poll_overlap=0).catch_up()
+    assert changes == {"fetched": 1, "removed": 1}
+    assert deleted["_id"] not in second and collection.docs[-1]["_id"] in second
+    assert second.document_count == len(collection.docs)
+
+
+def test_snapshots_are_versioned_and_checked_against_the_options(tmp_path):
+    collection = corpus(100)
+    store = SnapshotStore(str(tmp_path), keep=2)
+    index = store.open_or_build(collection)
+    for _ in range(2):
+        store.save(index)
+    assert sorted(p.name for p in tmp_path.iterdir() if p.name.startswith("v")) == ["v000002", "v000003"]
+    assert store.current().endswith("v000003")
+    assert store.save_if_stale(index, max_age=3600) is None
+
+    assert store.open(collection, precision="int8") is None
+    assert store.open(collection, dim=32) is None
+    assert store.open(collection).vector_source is collection
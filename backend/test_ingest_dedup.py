@@ -0,0 +1,70 @@
+"""
+Tests for the repeated-upload dedup cache in ImageDetection.reorganize
+"""
+
+import io
+import asyncio
+from starlette.datastructures import UploadFile
+import routes.ocr as ocr
+import routes.Image_detection as image_detection
+from routes.Image_detection import ImageDetection
+from routes.ingest_cache import IngestDedupCache
+from benchmarks.fakes import FakeCollection, SlowEmbedder, StubLLM, receipt_png
+
+
+def upload(contents):
+    return UploadFile(file=io.BytesIO(contents), filename="receipt.png")
+
+
+def test_repeated_upload_skips_ocr_llm_and_insert(monkeypatch):
+    ocr_calls = []
+    monkeypatch.setattr(ocr.pytesseract, "image_to_string", lambda image, lang="eng": ocr_calls.append(1) or "BRAKE CABLE 12.50")
+    monkeypatch.setattr(image_detection, "write_formatted_output", lambda parsed_json: None)
+
+    collection = FakeCollection()
+    llm = StubLLM()
+    detector = ImageDetection(collection, embedder=SlowEmbedder(), client=llm, dedup_cache=IngestDedupCache())
+    system_data = {"user_id": "u1", "user_name": "Driver", "pick_up_location": "Dock 4"}
+
+    first = asyncio.run(detector.reorganize(upload(receipt_png()), system_data))
+    second = asyncio.run(detector.reorganize(upload(receipt_png()), system_data))
+
+    assert first["dedup"] is None
+    assert second["dedup"] == "image_hash"
+    assert second["inserted_id"] == first["inserted_id"]
+    assert second["structured_data"] == first["structured_data"]
+    assert (len(ocr_calls), llm.calls, len(collection.docs)) == (1, 1, 1)
+
+
+def test_same_receipt_text_from_a_new_photo_hits_text_key(monkeypatch):
+    monkeypatch.setattr(ocr.pytesseract, "image_to_string", lambda image, lang="eng": "Brake  cable\n12.50")
+    monkeypatch.setattr(image_detection, "write_formatted_output", lambda parsed_json: None)
+
+    collection = FakeCollection()
+    llm = StubLLM()
+    detector = ImageDetection(collection, embedder=SlowEmbedder(), client=llm, dedup_cache=IngestDedupCache())
+    system_data = {"user_id": "u1", "user_name": "Driver", "pick_up_location": "Dock 4"}
+
+    first = asyncio.run(detector.reorganize(upload(receipt_png()), system_data))
+    retaken = receipt_png() + b"\x00"          # different bytes, same OCR text
+    second = asyncio.run(detector.reorganize(upload(retaken), system_data))
+
+    assert second["dedup"] == "ocr_text"
+    assert second["inserted_id"] == first["inserted_id"]
+    assert (llm.calls, len(collection.docs)) == (1, 1)
+
+
+def test_same_receipt_from_another_uploader_gets_its_own_record(monkeypatch):
+    monkeypatch.setattr(ocr.pytesseract, "image_to_string", lambda image, lang="eng": "BRAKE CABLE 12.50")
+    monkeypatch.setattr(image_detection, "write_formatted_output", lambda parsed_json: None)
+
+    collection = FakeCollection()
+    detector = ImageDetection(collection, embedder=SlowEmbedder(), client=StubLLM(), dedup_cache=IngestDedupCache())
+    ana = {"user_id": "u1", "user_name": "Ana", "pick_up_location": "Dock 4"}
+    first = asyncio.run(detector.reorganize(upload(receipt_png()), ana))
+    for system_data in ({"user_id": "u2", "user_name": "Sam", "pick_up_location": "Dock 4"}, {**ana, "pick_up_location": "Harbor"}):
+        other = asyncio.run(detector.reorganize(upload(receipt_png()), system_data))
+        assert other["dedup"] is None and other["inserted_id"] != first["inserted_id"]
+        assert collection.docs[-1]["user_info"] == system_data
+    assert asyncio.run(detector.reorganize(upload(receipt_png()), ana))["inserted_id"] == first["inserted_id"]
+    assert len(collection.docs) == 3
@@ -0,0 +1,50 @@
+"""
+Tests for the batch ingestion pipeline behind /process-images
+"""
+
+import io
+import asyncio
+from starlette.datastructures import UploadFile
+import routes.ocr as ocr
+from routes.Image_detection import ImageDetection
+from routes.ingest_pipeline import IngestPipeline
+from benchmarks.fakes import FakeCollection, SlowEmbedder, StubLLM, receipt_png
+
+
+class BrokenUpload:
+    filename = "broken.png"
+
+    async def read(self):
+        raise OSError("disk went away")
+
+
+def upload(contents, name):
+    return UploadFile(file=io.BytesIO(contents), filename=name)
+
+
+def test_batch_reports_each_file_in_order_and_bulk_inserts(monkeypatch):
+    monkeypatch.setattr(ocr.pytesseract, "image_to_string", lambda image, lang="eng": "BRAKE CABLE 12.50")
+    collection = FakeCollection()
+    embedder = SlowEmbedder(latency=0.01)
+    detector = ImageDetection(collection, embedder=embedder, client=StubLLM(latency=0.01))
+    pipeline = IngestPipeline(detector, embed_batch=8, insert_batch=8)
+
+    image = receipt_png()
+    uploads = [upload(image + bytes([i]), f"r{i}.png") for i in range(12)]
+    uploads.insert(3, BrokenUpload())
+    uploads.append(upload(image + bytes([0]), "again.png"))      # same bytes as r0.png
+
+    report = asyncio.run(pipeline.run(uploads, {"user_id": "u1", "pick_up_location": "Dock 4"}))
+    results = report["results"]
+
+    assert [r["filename"] for r in results] == [u.filename for u in uploads]
+    assert results[3]["status"] == "error" and "disk went away" in results[3]["error"]
+    assert results[-1]["dedup"] == "batch" and results[-1]["inserted_id"] == results[0]["inserted_id"]
+    ok = [r for r in results if r["status"] == "success" and r["dedup"] is None]
+    assert len(ok) == 12 and len({r["inserted_id"] for r in ok}) == 12
+    assert len(collection.docs) == 12
+    assert all("embedding" in doc and doc["product_embeddings"] for doc in collection.docs)
+    assert report["stats"]["failed"] == 1
+    assert collection.write_calls == report["stats"]["insert_many_calls"]
+    # Queued receipts share chat completions
+    assert report["stats"]["llm_calls"] < 12
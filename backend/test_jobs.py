@@ -0,0 +1,134 @@
+"""
+Tests for background ingest jobs: /process-image?background=true and /jobs/{id}
+"""
+
+import asyncio
+from functools import partial
+import httpx
+import pytest
+from fastapi import FastAPI
+import routes.ocr as ocr
+import routes.Image_detection as image_detection
+from routes.Image_detection import router as image_router, run_ingest_job
+from routes.jobs import router as jobs_router, JobQueue, JobQueueFull, JobStore
+from benchmarks.fakes import FakeDatabase, SlowEmbedder, StubLLM, receipt_png
+
+
+def build_app(tmp_path) -> FastAPI:
+    app = FastAPI()
+    app.include_router(image_router)
+    app.include_router(jobs_router)
+    app.state.db = FakeDatabase()
+    app.state.embedder = SlowEmbedder()
+    app.state.async_openai = StubLLM(latency=0.01)
+    app.state.job_queue = JobQueue(JobStore(str(tmp_path / "jobs.sqlite3")), partial(run_ingest_job, app.state))
+    return app
+
+
+def test_background_upload_returns_job_id_then_result(tmp_path, monkeypatch):
+    monkeypatch.setattr(ocr.pytesseract, "image_to_string", lambda image, lang="eng": "BRAKE CABLE 12.50")
+    monkeypatch.setattr(image_detection, "write_formatted_output", lambda parsed_json: None)
+    app = build_app(tmp_path)
+
+    async def scenario():
+        transport = httpx.ASGITransport(app=app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://test") as client:
+            response = await client.post(
+                "/process-image", params={"background": "true"},
+                files={"file": ("receipt.png", receipt_png(), "image/png")}
+            )
+            assert response.status_code == 202
+            job_id = response.json()["job_id"]
+            for _ in range(200):
+                job = (await client.get(f"/jobs/{job_id}")).json()
+                if job["status"] in ("succeeded", "failed"):
+                    break
+                await asyncio.sleep(0.01)
+            missing = await client.get("/jobs/nope")
+        await app.state.job_queue.stop()
+        return job, missing
+
+    job, missing = asyncio.run(scenario())
+    assert job["status"] == "succeeded"
+    assert job["result"]["inserted_id"] == str(app.state.db["chatbot"].docs[0]["_id"])
+    assert "Brake cable" in job["result"]["data"]["products"]
+    assert missing.status_code == 404
+
+
+def test_full_queue_rejects_and_restart_resumes(tmp_path):
+    path = str(tmp_path / "jobs.sqlite3")
+    release = asyncio.Event()
+    processed = []
+
+    async def slow(filename, contents, system_data, progress):
+        progress("ocr")
+        await release.wait()
+        processed.append(filename)
+        return {"filename": filename}
+
+    async def first_run():
+        queue = JobQueue(JobStore(path), slow, workers=1, max_pending=1)
+        running = await queue.submit("a.png", b"a", {})
+        await asyncio.sleep(0.05)                  # worker picks up a.png
+        waiting = await queue.submit("b.png", b"b", {})
+        with pytest.raises(JobQueueFull):
+            await queue.submit("c.png", b"c", {})
+        assert (await queue.get(running))["stage"] == "ocr"
+        await queue.stop()                         # "crash" with a.png running and b.png queued
+        return running, waiting
+
+    async def second_run(job_ids):
+        release.set()
+        queue = JobQueue(JobStore(path), slow, workers=1)
+        await queue.start()
+        for _ in range(200):
+            jobs = [await queue.get(job_id) for job_id in job_ids]
+            if all(job["status"] == "succeeded" for job in jobs):
+                break
+            await asyncio.sleep(0.01)
+        await queue.stop()
+        return jobs
+
+    job_ids = asyncio.run(first_run())
+    jobs = asyncio.run(second_run(job_ids))
+    assert [job["status"] for job in jobs] == ["succeeded", "succeeded"]
+    assert processed == ["a.png", "b.png"]
+
+
+def test_workers_sharing_the_store_claim_each_job_once(tmp_path):
+    path = str(tmp_path / "jobs.sqlite3")
+    first, second = JobStore(path, lease_seconds=60), JobStore(path, lease_seconds=60)
+    job_id = first.create("a.png", b"a", {})
+    assert first.claim(job_id) and not second.claim(job_id)
+    # A live worker's job is left alone; a dead one's is queued again once its lease runs out
+    assert second.requeue_expired() == 0 and second.unfinished() == []
+    with first._conn:
+        first._conn.execute("UPDATE jobs SET lease_until = 0")
+    assert second.requeue_expired() == 1 and second.claim(job_id)
+    assert not first.renew(job_id) and second.renew(job_id)
+    # The first worker finishing late can't overwrite the job it lost
+    assert not first.mark_succeeded(job_id, {"late": True}) and not first.mark_failed(job_id, "late")
+    assert first.get(job_id)["status"] == "running" and first.get(job_id)["result"] is None
+
+    processed = []
+
+    async def record(filename, contents, system_data, progress):
+        processed.append(filename)
+        await asyncio.sleep(0.01)
+        return {}
+
+    async def run():
+        queues = [JobQueue(JobStore(path), record, workers=2) for _ in range(3)]
+        for i in range(5):
+            first.create(f"{i}.png", b"x", {})
+        for queue in queues:
+            await queue.start()
+        await asyncio.sleep(0.2)
+        for queue in queues:
+            await queue.stop()
+
+    asyncio.run(run())
+    # Every worker saw all five queued jobs; each ran once. The job still
+    # held by `second` (alive, lease current) wasn't taken.
+    assert sorted(processed) == [f"{i}.png" for i in range(5)]
+    assert first.get(job_id)["status"] == "running"
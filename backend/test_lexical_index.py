@@ -0,0 +1,78 @@
+"""
+Tests for BM25 scoring and its fusion with vector similarity in the search index
+"""
+
+import asyncio
+import numpy as np
+from routes.lexical_index import LexicalIndex, term_weights, tokenize
+from routes.vector_index import SearchIndex
+from routes.search import ItemSearch
+from routes.embeddings import HashingEmbedder
+from test_vector_index import embedded_receipt
+
+
+class FailingEmbedder:
+    async def aembed(self, texts):
+        raise RuntimeError("embeddings API unavailable")
+
+
+def test_tokenize_keeps_skus_prices_and_units():
+    tokens = tokenize("Brake pads AB-1234 $1,299.50 100ml x2")
+    assert {"ab-1234", "ab", "1234", "ab1234"} <= set(tokens)
+    assert "1299.5" in tokens
+    assert {"100ml", "100", "ml"} <= set(tokens)
+    assert tokenize("12.00") == ["12"]
+
+
+def test_bm25_prefers_rare_terms_and_short_entries():
+    index = LexicalIndex()
+    index.add(0, term_weights([("brake cable", 1.0)]))
+    index.add(1, term_weights([("brake pads and brake fluid for the rear brake", 1.0)]))
+    index.add(2, term_weights([("chain", 1.0)]))
+    scores = index.scores(tokenize("brake cable"), np.array([0, 1, 2]))
+    assert scores[0] > scores[1] > scores[2] == 0
+
+
+def test_lexical_only_when_embedding_fails():
+    embedder = HashingEmbedder()
+    index = SearchIndex()
+    index.add_document(embedded_receipt(embedder, 1, {"Brake pads AB-1234": {"quantity": 1, "price": 30}}))
+    index.add_document(embedded_receipt(embedder, 2, {"Chain lube": {"quantity": 1, "price": 8}}))
+
+    response = asyncio.run(ItemSearch(None, index, FailingEmbedder()).search("ab1234", 5, 0.0))
+    assert response["mode"] == "lexical"
+    assert [r["product_name"] for r in response["results"]] == ["Brake pads AB-1234"]
+    assert response["results"][0]["similarity_score"] == 1.0
+    assert response["results"][0]["vector_score"] is None
+
+
+def test_rrf_fusion_ranks_agreeing_results_first():
+    embedder = HashingEmbedder()
+    index = SearchIndex(fusion="rrf")
+    names = ["brake cable", "brake lever", "gear cable", "saddle"]
+    index.add_document(embedded_receipt(embedder, 1, {n: {"quantity": 1} for n in names}))
+
+    results, total = index.search(embedder.embed(["brake cable"])[0], "brake cable", 4, -1.0)
+    assert total == 4
+    assert results[0]["product_name"] == "brake cable"
+    assert results[-1]["product_name"] == "saddle"
+    assert results[-1]["keyword_match"] is False
+    # One rank contribution per ranking the product made
+    assert results[0]["similarity_score"] == round(2 / (index.rrf_k + 1), 4)
+
+
+def test_compaction_prunes_postings_of_removed_documents():
+    embedder = HashingEmbedder()
+    index = SearchIndex()
+    for i in range(10):
+        index.add_document(embedded_receipt(embedder, i, {f"widget {i}": {"quantity": 1}, "bolt": {"quantity": 1}}))
+    for i in range(0, 10, 2):
+        index.remove_document(i)
+    index.compact()
+    index.add_document(embedded_receipt(embedder, 10, {"widget 10": {"quantity": 1}}))
+
+    assert index.lexical.term_count == len({"widget", "bolt"} | {str(i) for i in range(1, 11, 2)} | {"10"})
+    results, total = index.search(None, "widget", 20, 0.0)
+    assert sorted(r["document_id"] for r in results) == ["1", "10", "3", "5", "7", "9"]
+    results, total = index.search(None, "widget 10", 20, 0.0)
+    assert results[0]["product_name"] == "widget 10"
@@ -0,0 +1,30 @@
+"""
+Tests for the app lifespan: shared singletons and clean teardown
+"""
+
+from fastapi.testclient import TestClient
+import config.settings as settings
+import main
+from benchmarks.fakes import FakeDatabase
+
+
+def test_lifespan_builds_singletons_once_and_tears_down(tmp_path, monkeypatch):
+    database = FakeDatabase()
+    monkeypatch.setattr(settings, "get_database", lambda: database)
+    monkeypatch.setenv("JOB_DB_PATH", str(tmp_path / "jobs.sqlite3"))
+    monkeypatch.setenv("EMBEDDER", "hashing")
+    monkeypatch.setenv("SEARCH_INDEX_POLL_SECONDS", "60")
+
+    with TestClient(main.app) as client:
+        state = main.app.state
+        item_search, image_detection = state.item_search, state.image_detection
+        assert item_search.index is state.search_index
+        assert image_detection.collection is database["chatbot"]
+        assert client.get("/search", params={"q": "brake"}).status_code == 200
+        assert client.get("/search", params={"q": "pedal"}).status_code == 200
+        assert state.item_search is item_search
+        executor, maintainer = state.cpu_executor, state.index_maintainer
+
+    assert main.app.state.db is None
+    assert executor._shutdown
+    assert maintainer._threads == []
@@ -0,0 +1,110 @@
+"""
+Tests for the line_items fan-out, its migration and filtered reads through it
+"""
+
+import io
+import asyncio
+from datetime import timedelta
+from bson import ObjectId
+from starlette.datastructures import UploadFile
+import routes.ocr as ocr
+import routes.Image_detection as image_detection
+from routes.Image_detection import ImageDetection
+from routes.line_items import LINE_ITEM_INDEXES, ensure_line_item_indexes, line_item_documents, migrate
+from routes.search import ItemSearch
+from routes.search_filters import SearchFilters
+from routes.vector_index import SearchIndex
+from routes.embeddings import HashingEmbedder
+from benchmarks.fakes import FakeDatabase, SlowEmbedder, StubLLM, receipt_png
+from test_search_filters import START, populate
+
+
+def test_products_are_typed_like_the_search_index_reads_them():
+    receipt = {
+        "_id": ObjectId(),
+        "user_info": {"user_id": "u1", "user_name": "Driver", "pick_up_location": "Dock 4"},
+        "structured_data": {"products": {
+            "Brake  Cable": {"quantity": "2", "price": "$1,212.50", "pick_up_time": "tomorrow at 9"},
+            "Tune up": {"quantity": "a few", "price": None, "pick_up_location": "Dock 9",
+                        "drop_off_time": "2025-03-01T10:00:00Z"},
+        }},
+    }
+    cable, tune_up = line_item_documents(receipt)
+    assert (cable["line"], cable["name"], cable["name_key"]) == (0, "Brake  Cable", "brake cable")
+    assert (cable["quantity"], cable["price"], cable["pick_up_time"]) == (2, 1212.5, None)
+    assert cable["pick_up_location"] == "Dock 4" and cable["receipt_id"] == receipt["_id"]
+    assert (tune_up["quantity"], tune_up["has_quantity"], tune_up["price"]) == (None, True, None)
+    assert tune_up["pick_up_location"] == "Dock 9" and tune_up["drop_off_time"].year == 2025
+    assert line_item_documents({"_id": 1, "structured_data": {}}) == []
+
+
+def test_uploads_fan_out_their_line_items(monkeypatch):
+    monkeypatch.setattr(ocr.pytesseract, "image_to_string", lambda image, lang="eng": "BRAKE CABLE 12.50")
+    monkeypatch.setattr(image_detection, "write_formatted_output", lambda parsed_json: None)
+    database = FakeDatabase()
+    detector = ImageDetection(database["chatbot"], embedder=SlowEmbedder(), client=StubLLM(),
+                              line_items=database["line_items"])
+    system_data = {"user_id": "u1", "user_name": "Driver", "pick_up_location": "Dock 4"}
+
+    result = asyncio.run(detector.reorganize(UploadFile(file=io.BytesIO(receipt_png()), filename="r.png"), system_data))
+    items = database["line_items"].docs
+    assert [str(item["receipt_id"]) for item in items] == [result["inserted_id"]] * len(items)
+    assert [item["name"] for item in items] == list(result["structured_data"]["products"])
+
+    # Batched inserts fan out in one more write
+    docs = [{"user_info": system_data, "structured_data": {"products": {f"Tube {i}": {"price": i}}}} for i in range(3)]
+    writes = database["line_items"].write_calls
+    asyncio.run(detector.insert_many(docs))
+    assert database["line_items"].write_calls == writes + 1
+    assert [item["price"] for item in database["line_items"].docs[-3:]] == [0.0, 1.0, 2.0]
+
+
+def test_migration_is_resumable_and_can_be_rerun():
+    database = FakeDatabase()
+    populate(database["chatbot"], HashingEmbedder(), receipts=12)
+    line_items = database["line_items"]
+    ensure_line_item_indexes(line_items)
+    assert set(line_items.indexes) == {name for name, _, _ in LINE_ITEM_INDEXES}
+
+    first = migrate(database["chatbot"], line_items, batch_size=5, limit=7)
+    assert (first["examined"], first["line_items"], len(line_items.docs)) == (7, 14, 14)
+    rest = migrate(database["chatbot"], line_items, batch_size=5, after=first["last_id"])
+    assert rest["examined"] == 5 and len(line_items.docs) == 24
+    # Running again replaces, rather than duplicates, every receipt's line items
+    database["chatbot"].docs[0]["structured_data"]["products"].pop("pedal 0")
+    migrate(database["chatbot"], line_items, batch_size=5)
+    assert len(line_items.docs) == 23
+    assert len({(item["receipt_id"], item["line"]) for item in line_items.docs}) == 23
+    assert migrate(database["chatbot"], line_items, dry_run=True)["line_items"] == 23
+
+
+def test_filtered_search_without_index_reads_only_matching_receipts():
+    database, embedder = FakeDatabase(), HashingEmbedder()
+    collection = database["chatbot"]
+    populate(collection, embedder)
+    migrate(collection, database["line_items"])
+    resident = ItemSearch(database, SearchIndex.from_collection(collection), embedder)
+
+    for filters in (
+        SearchFilters(min_price=10, max_price=30),
+        SearchFilters(user_id="u1", has_quantity=False),
+        SearchFilters(max_price=20, date_from=START + timedelta(days=5)),
+    ):
+        collection.docs_returned = 0
+        narrowed = asyncio.run(ItemSearch(database, embedder=embedder, line_items=database["line_items"])
+                               .search("brake cable", 50, 0.0, filters))
+        # The high-water-mark lookup plus only receipts with a matching product
+        assert collection.docs_returned - 1 == len({r["document_id"] for r in narrowed["results"]})
+        expected = asyncio.run(resident.search("brake cable", 50, 0.0, filters))
+        assert [r["product_name"] for r in narrowed["results"]] == [r["product_name"] for r in expected["results"]]
+
+    # The matching receipts' _ids are sent batch_size at a time
+    filters = SearchFilters(min_price=10, max_price=30)
+    whole = SearchIndex.from_collection(collection, filters, database["line_items"])
+    queries = []
+    find = collection.find
+    collection.find = lambda query=None, projection=None: queries.append(query) or find(query, projection)
+    paged = SearchIndex.from_collection(collection, filters, database["line_items"], batch_size=3)
+    in_lists = [query["_id"]["$in"] for query in queries if "$in" in query.get("_id", {})]
+    assert len(in_lists) > 1 and all(len(ids) <= 3 for ids in in_lists)
+    assert sorted(paged.document_ids()) == sorted(whole.document_ids()) and paged.document_count > 3
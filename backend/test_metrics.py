@@ -0,0 +1,79 @@
+"""
+Tests for the Prometheus /metrics endpoint and structured logging
+"""
+
+import json
+import asyncio
+import logging
+from fastapi import FastAPI
+from fastapi.testclient import TestClient
+from routes.metrics import Counter, Histogram, Registry, router
+from routes.search import ItemSearch
+from routes.vector_index import SearchIndex
+from routes.query_cache import SearchResultCache
+from routes.embeddings import HashingEmbedder
+from config.logging_config import StructuredFormatter, parse_levels
+from benchmarks.fakes import FakeCollection
+from test_vector_index import embedded_receipt
+
+
+def test_text_format_of_counters_and_histograms():
+    registry = Registry()
+    requests = Counter("requests_total", "Requests", ("route",), registry=registry)
+    latency = Histogram("latency_seconds", "Latency", ("stage",), buckets=(0.1, 1.0), registry=registry)
+    requests.labels("/search").inc()
+    requests.labels("/search").inc(2)
+    for value in (0.05, 0.5, 5.0):
+        latency.labels("embed").observe(value)
+
+    text = registry.render()
+    assert '# TYPE requests_total counter\nrequests_total{route="/search"} 3\n' in text
+    assert 'latency_seconds_bucket{stage="embed",le="0.1"} 1' in text
+    assert 'latency_seconds_bucket{stage="embed",le="1"} 2' in text
+    assert 'latency_seconds_bucket{stage="embed",le="+Inf"} 3' in text
+    assert 'latency_seconds_sum{stage="embed"} 5.55' in text
+    assert 'latency_seconds_count{stage="embed"} 3' in text
+
+
+def test_metrics_endpoint_reports_search_stages_and_caches():
+    embedder = HashingEmbedder()
+    index = SearchIndex()
+    index.add_document(embedded_receipt(embedder, 1, {"Brake cable": {"quantity": 1, "price": 12}}))
+    cache = SearchResultCache()
+    app = FastAPI()
+    app.include_router(router)
+    app.state.search_index = index
+    app.state.search_result_cache = cache
+    search = ItemSearch(None, index, embedder, cache)
+    for _ in range(2):
+        asyncio.run(search.search("brake", 5, 0.0))
+
+    response = TestClient(app).get("/metrics")
+    assert response.headers["content-type"].startswith("text/plain; version=0.0.4")
+    lines = response.text.splitlines()
+    assert any(line.startswith('bfb_stage_duration_seconds_count{pipeline="search",stage="embed"}') for line in lines)
+    assert any(line.startswith('bfb_searches_total{mode="hybrid",cached="true"}') for line in lines)
+    assert 'bfb_cache_hits_total{cache="search_result"} 1' in lines
+    assert "bfb_index_products 1" in lines
+
+
+def test_structured_formatter_keeps_extra_fields():
+    record = logging.LogRecord("routes.search", logging.DEBUG, __file__, 1, "Ranked %s", ("products",), None)
+    record.total_found = 3
+    entry = json.loads(StructuredFormatter(json_lines=True).format(record))
+    assert (entry["level"], entry["message"], entry["total_found"]) == ("DEBUG", "Ranked products", 3)
+    assert StructuredFormatter().format(record).endswith("routes.search: Ranked products total_found=3")
+    assert parse_levels("routes.search=warning, bad ,x=") == {"routes.search": "WARNING"}
+
+
+def test_index_maintenance_logs_by_level_instead_of_printing(capsys, caplog):
+    embedder = HashingEmbedder()
+    collection = FakeCollection()
+    collection.insert_one(embedded_receipt(embedder, 1, {"Brake cable": {"price": 12.5}}))
+    with caplog.at_level(logging.INFO, logger="routes.vector_index"):
+        index = SearchIndex.from_collection(collection)
+        index.search(embedder.embed(["brake"])[0][:8], "brake", 5, 0.0)
+    assert capsys.readouterr().out == ""
+    built, mismatch = caplog.records
+    assert (built.levelname, built.getMessage(), built.documents) == ("INFO", "Search index built", 1)
+    assert mismatch.levelname == "WARNING" and mismatch.index_dimensions == index.dim
@@ -0,0 +1,30 @@
+"""
+Tests for OCR pre-processing and engine limits
+"""
+
+import asyncio
+import pytest
+from routes.ocr import OCREngine, preprocess_image
+from benchmarks.bench_ocr import synthetic_receipt
+
+
+def test_preprocess_fixes_orientation_and_downscales():
+    # Stored landscape with EXIF orientation 6, i.e. a portrait receipt
+    contents = synthetic_receipt(1200, 1600, "JPEG", rotate_exif=True)
+    image = preprocess_image(contents, max_side=800)
+    assert image.mode == "L"
+    assert image.size == (600, 800)
+    assert set(image.getdata()) <= {0, 255}
+
+
+def test_preprocess_refuses_images_over_the_pixel_limit():
+    contents = synthetic_receipt(1200, 1600, "PNG", rotate_exif=False)
+    with pytest.raises(ValueError):
+        preprocess_image(contents, max_pixels=1200 * 1600 - 1)
+    assert preprocess_image(contents, max_pixels=1200 * 1600, max_side=400).size == (300, 400)
+
+
+def test_engine_rejects_oversized_images():
+    engine = OCREngine(workers=1, max_bytes=10)
+    with pytest.raises(ValueError):
+        asyncio.run(engine.recognize(b"x" * 11))
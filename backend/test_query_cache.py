@@ -0,0 +1,57 @@
+"""
+Tests for the query-embedding cache
+"""
+
+import numpy as np
+from routes.embeddings import Embedder, HashingEmbedder
+from routes.query_cache import QueryEmbeddingCache, CachedEmbedder
+
+
+class CountingEmbedder(Embedder):
+    def __init__(self):
+        self.inner = HashingEmbedder(16)
+        self.model = self.inner.model
+        self.calls = 0
+
+    def embed(self, texts):
+        self.calls += 1
+        return self.inner.embed(texts)
+
+
+def test_hit_skips_the_embedder():
+    backend = CountingEmbedder()
+    cache = QueryEmbeddingCache()
+    embedder = CachedEmbedder(backend, cache)
+
+    first = embedder.embed(["Brake  Cable"])
+    second = embedder.embed(["brake cable"])
+    assert backend.calls == 1
+    assert np.array_equal(first, second)
+    assert cache.stats()["hits"] == 1
+    assert cache.stats()["misses"] == 1
+
+
+def test_lru_and_ttl_eviction():
+    cache = QueryEmbeddingCache(max_entries=2, ttl_seconds=60)
+    cache.put("pedal", "m", np.ones(4))
+    cache.put("labor", "m", np.ones(4))
+    cache.get("pedal", "m")
+    cache.put("brake cable", "m", np.ones(4))
+    assert cache.get("labor", "m") is None
+    assert cache.get("pedal", "m") is not None
+
+    cache.put("old", "m", np.ones(4), created_at=0.0)
+    assert cache.get("old", "m") is None
+
+
+def test_persists_across_restarts(tmp_path):
+    path = str(tmp_path / "query_cache.npz")
+    cache = QueryEmbeddingCache(path=path)
+    cache.put("pedal", "m", np.arange(4))
+    cache.put("labor", "other", np.arange(8))
+    cache.save()
+
+    restored = QueryEmbeddingCache(path=path)
+    assert np.array_equal(restored.get("pedal", "m"), np.arange(4))
+    assert np.array_equal(restored.get("labor", "other"), np.arange(8))
+    assert restored.get("pedal", "other") is None
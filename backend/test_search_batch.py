@@ -0,0 +1,86 @@
+"""
+Tests for multi-query ranking and the /search/batch endpoint
+"""
+
+import asyncio
+from fastapi import FastAPI
+from fastapi.testclient import TestClient
+from routes.search import ItemSearch, router
+from routes.search_filters import SearchFilters
+from routes.query_cache import SearchResultCache
+from routes.vector_index import SearchIndex
+from benchmarks.corpus import load_corpus, synthetic_queries
+from benchmarks.fakes import FakeDatabase, SlowEmbedder
+
+QUERIES = ["rear brake cable", "tune up", "shimano chain lube", "inner tube 700c", "brake cable"]
+
+
+def corpus(products=400):
+    database = FakeDatabase()
+    load_corpus(database["chatbot"], products, SlowEmbedder(dim=64).inner, seed=5)
+    return database
+
+
+def test_rank_many_matches_ranking_each_query():
+    collection = corpus()["chatbot"]
+    embedder = SlowEmbedder(dim=64)
+    vectors = embedder.embed(QUERIES)
+    for options in ({}, {"precision": "int8"}, {"fusion": "rrf"}):
+        index = SearchIndex.from_collection(collection, **options)
+        for filters in (None, SearchFilters(min_price=20)):
+            requests = [(vector, query, 0.1, 10) for vector, query in zip(vectors, QUERIES)]
+            requests.append((None, "chain", 0.0, 10))          # no vector: BM25 alone
+            rankings = index.rank_many(requests, filters)
+            for request, ranking in zip(requests, rankings):
+                single = index.rank(*request[:3], filters, request[3])
+                # Equal up to rounding: the batched product may differ in the last bit
+                assert ranking.page(10)[0] == single.page(10)[0]
+                assert ranking.total_found == single.total_found
+
+
+def test_batch_embeds_once_and_answers_like_single_searches():
+    database = corpus()
+    embedder = SlowEmbedder(dim=64)
+    index = SearchIndex.from_collection(database["chatbot"])
+    cache = SearchResultCache()
+    batch = [{"q": query, "limit": 3 + i, "min_score": 0.0} for i, query in enumerate(QUERIES)]
+    batch.append({"q": "tune up", "limit": 4, "min_score": 0.0})          # repeated query text
+
+    responses = asyncio.run(ItemSearch(database, index, embedder, cache).search_many(batch))
+    assert embedder.calls == 1
+    single = ItemSearch(database, index, SlowEmbedder(dim=64))
+    for item, response in zip(batch, responses):
+        expected = asyncio.run(single.search(item["q"], item["limit"], item["min_score"]))
+        assert response == {**expected, "next_cursor": None}
+        assert response["total_found"] > response["returned"]
+
+    # A repeat is answered from the result cache without embedding again,
+    # and batch entries (which have no cursor) don't answer /search
+    search = ItemSearch(database, index, embedder, cache)
+    again = asyncio.run(search.search_many(batch[:2]))
+    assert [r["cached"] for r in again] == [True, True] and embedder.calls == 1
+    first_page = asyncio.run(search.search(batch[0]["q"], batch[0]["limit"], 0.0))
+    assert first_page["cached"] is False and first_page["next_cursor"] is not None
+
+
+def test_batch_endpoint_validates_and_groups_results_per_query():
+    app = FastAPI()
+    app.include_router(router)
+    app.state.db = corpus()
+    app.state.query_embedder = SlowEmbedder(dim=64)
+    app.state.search_index = SearchIndex.from_collection(app.state.db["chatbot"])
+    client = TestClient(app)
+
+    queries = synthetic_queries(8)
+    response = client.post("/search/batch", json={
+        "queries": [{"q": q, "limit": 2} for q in queries], "min_price": 5
+    })
+    assert response.status_code == 200
+    body = response.json()
+    assert [search["query"] for search in body["searches"]] == queries
+    assert all(search["returned"] <= 2 and search["mode"] == "hybrid" for search in body["searches"])
+    assert body["filters"]["min_price"] == 5
+    assert app.state.query_embedder.calls == 1
+
+    assert client.post("/search/batch", json={"queries": []}).status_code == 422
+    assert client.post("/search/batch", json={"queries": [{"q": "chain", "limit": 500}]}).status_code == 422
@@ -0,0 +1,85 @@
+"""
+Tests for the /search result cache and its invalidation on ingest
+"""
+
+import io
+import asyncio
+from starlette.datastructures import UploadFile
+import routes.ocr as ocr
+import routes.Image_detection as image_detection
+from routes.Image_detection import ImageDetection
+from routes.index_refresh import IndexMaintainer
+from routes.query_cache import Generation, SearchResultCache
+from routes.search import ItemSearch
+from routes.search_filters import SearchFilters
+from routes.vector_index import SearchIndex
+from benchmarks.fakes import FakeDatabase, SlowEmbedder, StubLLM, receipt_png
+
+
+class FlakyEmbedder(SlowEmbedder):
+    down = False
+
+    async def aembed(self, texts):
+        if self.down:
+            raise RuntimeError("embeddings API unavailable")
+        return await super().aembed(texts)
+
+
+def test_repeated_search_is_cached_until_an_upload(monkeypatch):
+    monkeypatch.setattr(ocr.pytesseract, "image_to_string", lambda image, lang="eng": "BRAKE CABLE 12.50")
+    monkeypatch.setattr(image_detection, "write_formatted_output", lambda parsed_json: None)
+    database, embedder, generation = FakeDatabase(), SlowEmbedder(), Generation()
+    collection = database["chatbot"]
+    collection.insert_one({
+        "structured_data": {"products": {"Inner tube": {"quantity": 1}}},
+        "embedding": embedder.embed(["Inner tube"])[0].tolist()
+    })
+    index = SearchIndex.from_collection(collection)
+    cache = SearchResultCache()
+    search = ItemSearch(database, index, embedder, cache, generation)
+    detector = ImageDetection(collection, IndexMaintainer(collection, index), embedder, StubLLM(), generation=generation)
+
+    first = asyncio.run(search.search("brake cable", 10, 0.0))
+    second = asyncio.run(search.search("  Brake CABLE ", 10, 0.0))
+    assert (first["cached"], second["cached"]) == (False, True)
+    assert second["query"] == "  Brake CABLE " and second["results"] == first["results"]
+    assert embedder.calls == 2
+
+    # Different parameters are different entries
+    asyncio.run(search.search("brake cable", 5, 0.0))
+    asyncio.run(search.search("brake cable", 10, 0.0, SearchFilters(user_id="u1")))
+    assert cache.stats()["entries"] == 3
+
+    system_data = {"user_id": "u1", "user_name": "Driver", "pick_up_location": "Dock 4"}
+    asyncio.run(detector.reorganize(UploadFile(file=io.BytesIO(receipt_png()), filename="r.png"), system_data))
+    fresh = asyncio.run(search.search("brake cable", 10, 0.0))
+    assert fresh["cached"] is False
+    assert fresh["results"][0]["product_name"] == "Brake cable"
+    assert cache.stats()["invalidations"] == 1
+    assert asyncio.run(search.search("brake cable", 10, 0.0))["cached"] is True
+
+
+def test_lexical_fallbacks_are_not_cached():
+    database, embedder = FakeDatabase(), FlakyEmbedder()
+    index = SearchIndex()
+    search = ItemSearch(database, index, embedder, SearchResultCache(), Generation())
+    index.add_document({
+        "_id": "r1",
+        "structured_data": {"products": {"Brake cable": {"quantity": 1}}},
+        "embedding": embedder.embed(["Brake cable"])[0].tolist()
+    })
+
+    embedder.down = True
+    assert asyncio.run(search.search("brake", 5, 0.0))["mode"] == "lexical"
+    embedder.down = False
+    response = asyncio.run(search.search("brake", 5, 0.0))
+    assert (response["mode"], response["cached"]) == ("hybrid", False)
+
+
+def test_cache_is_bounded_by_rows():
+    cache = SearchResultCache(max_entries=100, max_rows=25)
+    for i in range(5):
+        cache.put(SearchResultCache.key(f"q{i}", 10, 0.0), 0, {"results": [{}] * 9})
+    assert cache.stats()["entries"] == 2 and cache.stats()["rows"] == 20
+    assert cache.get(SearchResultCache.key("q4", 10, 0.0), 0) is not None
+    assert cache.get(SearchResultCache.key("q0", 10, 0.0), 0) is None
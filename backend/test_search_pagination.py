@@ -0,0 +1,86 @@
+"""
+Tests for cursor pagination, NDJSON streaming and bounded top-k selection
+"""
+
+import asyncio
+import numpy as np
+import pytest
+from fastapi import HTTPException
+import routes.vector_index as vector_index
+from routes.vector_index import SearchIndex, _top_k
+from routes.search import ItemSearch
+from routes.embeddings import HashingEmbedder
+from test_vector_index import embedded_receipt
+
+WORDS = ["brake", "cable", "pedal", "chain", "tube"]
+
+
+def build_index(embedder, receipts=30):
+    index = SearchIndex()
+    for i in range(receipts):
+        # Repeated names give exactly tied scores across receipts
+        products = {f"{WORDS[i % 5]} {WORDS[(i + 1) % 5]} {j}": {"quantity": 1, "price": j} for j in range(3)}
+        index.add_document(embedded_receipt(embedder, i, products))
+    return index
+
+
+def collect(stream):
+    async def run():
+        return [record async for record in await stream]
+    return asyncio.run(run())
+
+
+def test_top_k_is_exact_across_blocks(monkeypatch):
+    monkeypatch.setattr(vector_index, "_TOP_K_BLOCK", 7)
+    rng = np.random.default_rng(0)
+    scores = rng.integers(0, 5, size=100).astype(float)
+    uids = np.arange(100) * 3
+    eligible = rng.random(100) > 0.3
+    entries, count = _top_k(eligible, scores, uids, 12)
+    expected = np.flatnonzero(eligible)
+    expected = expected[np.lexsort((uids[expected], -scores[expected]))][:12]
+    assert count == np.count_nonzero(eligible)
+    assert entries.tolist() == expected.tolist()
+
+
+def test_cursor_pages_cover_every_result_once():
+    embedder = HashingEmbedder()
+    index = build_index(embedder)
+    search = ItemSearch(None, index, embedder)
+    everything, total = index.search(embedder.embed(["brake cable"])[0], "brake cable", 1000, 0.0)
+
+    pages, cursor = [], None
+    while True:
+        response = asyncio.run(search.search("brake cable", 7, 0.0, cursor=cursor))
+        pages.extend(response["results"])
+        cursor = response["next_cursor"]
+        assert response["total_found"] == total
+        if cursor is None:
+            break
+    assert len(pages) == total
+    assert [(r["document_id"], r["product_name"]) for r in pages] == \
+           [(r["document_id"], r["product_name"]) for r in everything]
+
+
+def test_stream_emits_pages_and_resumes_from_its_cursor():
+    embedder = HashingEmbedder()
+    index = build_index(embedder)
+    search = ItemSearch(None, index, embedder)
+    expected = asyncio.run(search.search("pedal", 25, 0.0))["results"]
+
+    records = collect(search.stream("pedal", 15, 0.0, page_size=4))
+    assert records[0]["type"] == "meta" and records[0]["mode"] == "hybrid"
+    assert records[-1]["type"] == "end" and records[-1]["returned"] == 15
+    streamed = [r for r in records if r["type"] == "result"]
+    rest = asyncio.run(search.search("pedal", 10, 0.0, cursor=records[-1]["next_cursor"]))["results"]
+    assert [r["product_name"] for r in streamed + rest] == [r["product_name"] for r in expected]
+
+
+def test_cursor_is_tied_to_its_query():
+    embedder = HashingEmbedder()
+    search = ItemSearch(None, build_index(embedder), embedder)
+    cursor = asyncio.run(search.search("chain", 3, 0.0))["next_cursor"]
+    for bad in ("not-a-cursor", cursor):
+        with pytest.raises(HTTPException) as error:
+            asyncio.run(search.search("tube", 3, 0.0, cursor=bad))
+        assert error.value.status_code == 400
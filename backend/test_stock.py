@@ -0,0 +1,158 @@
+"""
+Tests for the stock rollups: incremental updates, the summary, drift repair and /stock/summary
+"""
+
+import io
+import asyncio
+import itertools
+from datetime import datetime, timedelta, timezone
+from bson import ObjectId
+from fastapi import FastAPI
+from fastapi.testclient import TestClient
+from starlette.datastructures import UploadFile
+import routes.ocr as ocr
+import routes.Image_detection as image_detection
+from routes.Image_detection import ImageDetection
+from pymongo.errors import ServerSelectionTimeoutError
+from routes.home import router as home_router
+from routes.stock import STOCK_INDEXES, StockRollups, router as stock_router
+from benchmarks.corpus import synthetic_receipts
+from benchmarks.fakes import FakeDatabase, SlowEmbedder, StubLLM, receipt_png
+
+
+_MINUTES = itertools.count()
+
+
+def _receipt(day: int, user: str, location: str, products: dict) -> dict:
+    # A minute apart so every _id differs
+    moment = datetime(2025, 3, day, 12, tzinfo=timezone.utc) + timedelta(minutes=next(_MINUTES))
+    return {
+        "_id": ObjectId.from_datetime(moment),
+        "user_info": {"user_id": user, "user_name": user.upper(), "pick_up_location": location},
+        "structured_data": {"products": products},
+    }
+
+
+def _stored(rollups: StockRollups) -> dict:
+    return {doc["_id"]: {key: doc[key] for key in doc if key != "_id"} for doc in rollups.collection.docs}
+
+
+def test_incremental_updates_match_a_full_recompute():
+    database = FakeDatabase()
+    receipts = database["chatbot"]
+    for doc in synthetic_receipts(300, seed=4):
+        receipts.insert_one(doc)
+    rollups = StockRollups(database["stock_rollups"])
+    rollups.ensure_indexes()
+    assert set(rollups.collection.indexes) == {name for name, _ in STOCK_INDEXES}
+
+    # One bulk_write per call, however many receipts and rollups it touches
+    for start in range(0, len(receipts.docs), 7):
+        writes = rollups.collection.write_calls
+        rollups.apply(receipts.docs[start:start + 7])
+        assert rollups.collection.write_calls == writes + 1
+    report = rollups.check(receipts)
+    assert report["drifted"] == 0 and report["stored"] == report["recomputed"]
+    assert rollups.totals()["receipts"] == len(receipts.docs)
+
+
+def test_summary_reads_totals_top_products_users_and_days():
+    rollups = StockRollups(FakeDatabase()["stock_rollups"])
+    rollups.apply([
+        _receipt(1, "u1", "Dock 4", {"Brake cable": {"quantity": 2, "price": "12.50"}, "Labor": {"price": 40}}),
+        _receipt(2, "u1", "Dock 4", {"brake  CABLE": {"quantity": 1, "price": 12.5}}),
+        _receipt(2, "u2", "Main St", {"Brake cable": {"quantity": 3, "price": 10},
+                                      "Tube": {"quantity": 4, "price": None, "pick_up_location": "Dock 4"}}),
+    ])
+    summary = rollups.summary()
+    assert summary["totals"] == {"receipts": 3, "line_items": 5, "quantity": 10, "spend": 107.5}
+    assert [(p["name_key"], p["pick_up_location"], p["quantity"], p["spend"]) for p in summary["products"]] == [
+        ("labor", "Dock 4", 0, 40.0), ("brake cable", "Dock 4", 3, 37.5),
+        ("brake cable", "Main St", 3, 30.0), ("tube", "Dock 4", 4, 0.0),
+    ]
+    assert [(u["user_id"], u["receipts"], u["spend"]) for u in summary["users"]] == [("u1", 2, 77.5), ("u2", 1, 30.0)]
+    assert [(d["day"], d["receipts"]) for d in summary["days"]] == [("2025-03-02", 2), ("2025-03-01", 1)]
+
+    docked = rollups.summary(pick_up_location="Dock 4", limit=2, days=1)
+    assert [p["name_key"] for p in docked["products"]] == ["labor", "brake cable"]
+    assert len(docked["users"]) == 2 and len(docked["days"]) == 1
+
+
+def test_check_finds_and_repairs_drift():
+    database = FakeDatabase()
+    receipts, rollups = database["chatbot"], StockRollups(database["stock_rollups"])
+    docs = [_receipt(1, "u1", "Dock 4", {"Chain": {"quantity": 1, "price": 30}}),
+            _receipt(1, "u2", "Dock 1", {"Tire": {"quantity": 2, "price": 25}})]
+    receipts.insert_many(docs)
+    rollups.apply(docs)
+    expected = _stored(rollups)
+
+    # A lost update, a receipt deleted by hand and a rollup nothing backs any more
+    rollups.collection.find_one({"_id": "total"})["spend"] += 5
+    receipts.docs.pop()
+    rollups.apply([_receipt(2, "u3", "Harbor", {"Bell": {"price": 8}})])
+    report = rollups.check(receipts)
+    assert report["drifted"] > 0 and not report["repaired"]
+    assert rollups.check(receipts)["examples"] == report["examples"]
+
+    assert rollups.check(receipts, repair=True)["repaired"]
+    assert rollups.check(receipts)["drifted"] == 0
+    fresh = StockRollups(FakeDatabase()["stock_rollups"])
+    fresh.apply(receipts.docs)
+    assert _stored(rollups) == _stored(fresh) != expected
+
+
+def test_stock_summary_endpoint_and_uploads(monkeypatch):
+    monkeypatch.setattr(ocr.pytesseract, "image_to_string", lambda image, lang="eng": "BRAKE CABLE 12.50")
+    monkeypatch.setattr(image_detection, "write_formatted_output", lambda parsed_json: None)
+    database = FakeDatabase()
+    rollups = StockRollups(database["stock_rollups"])
+    detector = ImageDetection(database["chatbot"], embedder=SlowEmbedder(), client=StubLLM(), stock_rollups=rollups)
+    system_data = {"user_id": "u1", "user_name": "Driver", "pick_up_location": "Dock 1"}
+    asyncio.run(detector.reorganize(UploadFile(file=io.BytesIO(receipt_png()), filename="r.png"), system_data))
+    asyncio.run(detector.insert_many([{"user_info": system_data, "structured_data": {"products": {"Bell": {"price": 8}}}}]))
+
+    app = FastAPI()
+    app.include_router(stock_router)
+    client = TestClient(app)
+    assert client.get("/stock/summary").status_code == 500
+    app.state.stock_rollups = rollups
+
+    body = client.get("/stock/summary", params={"pick_up_location": "Dock 4"}).json()
+    assert body["totals"] == {"receipts": 2, "line_items": 2, "quantity": 2, "spend": 33.0}
+    assert [(p["name"], p["spend"]) for p in body["products"]] == [("Brake cable", 25.0)]
+    assert body["users"][0]["receipts"] == 2 and len(body["days"]) == 1
+    assert client.get("/stock/summary", params={"limit": 0}).status_code == 422
+
+
+def test_repair_waits_for_uploads_to_settle():
+    database = FakeDatabase()
+    receipts, rollups = database["chatbot"], StockRollups(database["stock_rollups"])
+    settled = _receipt(1, "u1", "Dock 4", {"Chain": {"quantity": 1, "price": 30}})
+    receipts.insert_one(settled)
+    rollups.apply([settled])
+
+    # Just inserted, its rollup update still on the way: drift, but left alone
+    fresh = {"user_info": {"user_id": "u2"}, "structured_data": {"products": {"Tire": {"price": 25}}}}
+    receipts.insert_one(fresh)
+    report = rollups.check(receipts, repair=True)
+    assert report["drifted"] > 0 and not report["quiet"] and not report["repaired"]
+    rollups.apply([fresh])
+    assert rollups.check(receipts, repair=True)["drifted"] == 0
+    assert rollups.check(receipts, repair=True, settle_seconds=0)["quiet"]
+
+
+def test_home_page_leaves_totals_out_while_the_database_is_down():
+    rollups = StockRollups(FakeDatabase()["stock_rollups"])
+    rollups.apply([_receipt(3, "u1", "Dock 4", {"Bell": {"price": 8}})])
+    app = FastAPI()
+    app.include_router(home_router)
+    app.state.stock_rollups = rollups
+    client = TestClient(app)
+    assert client.get("/").json()["totals"]["receipts"] == 1
+
+    def unreachable(*args, **kwargs):
+        raise ServerSelectionTimeoutError("no servers")
+    rollups.collection.find_one = unreachable
+    response = client.get("/")
+    assert response.status_code == 200 and "totals" not in response.json()
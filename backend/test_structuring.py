@@ -0,0 +1,94 @@
+"""
+Tests for LLM structuring: validation, retry, caching and batching
+"""
+
+import json
+import asyncio
+from types import SimpleNamespace
+from routes.structuring import ReceiptStructurer, StructuringCache, validate_products
+from benchmarks.fakes import StubLLM
+
+SYSTEM_DATA = {"user_id": "u1", "user_name": "Ana", "pick_up_location": "Dock 4"}
+
+
+class ScriptedLLM:
+    """Chat completions answering with the given contents in turn."""
+
+    def __init__(self, *contents):
+        self.contents = list(contents)
+        self.prompts = []
+        self.chat = SimpleNamespace(completions=SimpleNamespace(create=self._create))
+
+    async def _create(self, **kwargs):
+        self.prompts.append(kwargs["messages"][-1]["content"])
+        content = self.contents.pop(0)
+        if isinstance(content, Exception):
+            raise content
+        return SimpleNamespace(choices=[SimpleNamespace(message=SimpleNamespace(content=content))])
+
+
+def test_validation_coerces_fields_and_drops_unknown_ones():
+    products = validate_products(
+        {"products": {"Brake cable": {"quantity": "2", "price": "12.50", "colour": "red"}}}, SYSTEM_DATA
+    )
+    assert products == {"Brake cable": {
+        "pick_up_time": None, "drop_off_location": None, "drop_off_time": None,
+        "pick_up_location": None, "quantity": 2, "price": 12.5
+    }}
+    # Fields that won't coerce are nulled; the product and its other fields stay
+    products = validate_products({"products": {
+        "Chain": {"price": "$1,212.50", "quantity": "2 pcs", "pick_up_time": "10:30 AM", "drop_off_location": "Dock 1"},
+        "Tube": {"price": "a lot", "quantity": 1.5, "pick_up_time": "01/05/2024"},
+    }}, SYSTEM_DATA)
+    assert (products["Chain"]["price"], products["Chain"]["quantity"], products["Chain"]["pick_up_time"]) == (1212.5, 2, None)
+    assert products["Chain"]["drop_off_location"] == "Dock 1"
+    assert products["Tube"] == dict.fromkeys(products["Tube"])
+    for bad in ({"items": {}}, {"products": {"Chain": "one"}}, {"products": 3}):
+        try:
+            validate_products(bad, SYSTEM_DATA)
+        except ValueError:
+            continue
+        raise AssertionError(f"{bad} validated")
+
+
+def test_invalid_answer_is_retried_once_with_the_error():
+    valid = json.dumps({"products": {"Chain": {"quantity": 1, "price": 20}}})
+    client = ScriptedLLM("not json at all", valid)
+    result = asyncio.run(ReceiptStructurer(client).structure("CHAIN 20.00", SYSTEM_DATA))
+
+    assert result == {"products": {"Chain": {
+        "pick_up_time": None, "drop_off_location": None, "drop_off_time": None,
+        "pick_up_location": None, "quantity": 1, "price": 20.0
+    }}, "raw_ocr_text": "CHAIN 20.00"}
+    assert len(client.prompts) == 2 and "not valid JSON" in client.prompts[1]
+
+    # Two bad answers, or a failed request, leave the receipt without products
+    client = ScriptedLLM("[]", '{"products": 3}')
+    assert asyncio.run(ReceiptStructurer(client).structure("CHAIN 20.00", SYSTEM_DATA))["products"] == {}
+    client = ScriptedLLM(RuntimeError("rate limited"))
+    assert asyncio.run(ReceiptStructurer(client).structure("CHAIN 20.00", SYSTEM_DATA))["products"] == {}
+    assert asyncio.run(ReceiptStructurer(None).structure("CHAIN 20.00", SYSTEM_DATA))["products"] == {}
+
+
+def test_cache_answers_the_same_text_at_the_same_location():
+    client = StubLLM()
+    structurer = ReceiptStructurer(client, StructuringCache())
+    first = asyncio.run(structurer.structure("BRAKE CABLE  12.50\n", SYSTEM_DATA))
+    again = asyncio.run(structurer.structure("brake cable 12.50", SYSTEM_DATA))
+    assert again["products"] == first["products"] and client.calls == 1
+
+    asyncio.run(structurer.structure("brake cable 12.50", {**SYSTEM_DATA, "pick_up_location": "Harbor"}))
+    assert client.calls == 2
+    assert structurer.cache.stats()["hits"] == 1
+
+
+def test_receipts_share_completions_and_duplicates_are_asked_once():
+    client = StubLLM()
+    structurer = ReceiptStructurer(client, batch_size=4)
+    texts = [f"RECEIPT {i}\nBRAKE CABLE 12.50" for i in range(6)] + ["RECEIPT 0\nBRAKE CABLE 12.50", ""]
+    results = asyncio.run(structurer.structure_many(texts, SYSTEM_DATA))
+
+    assert client.batch_sizes == [4, 2]
+    assert all(r["products"] == {"Brake cable": client.products["Brake cable"]} for r in results[:7])
+    assert results[7] == {"products": {}, "raw_ocr_text": None}
+    assert [r["raw_ocr_text"] for r in results[:7]] == texts[:7]
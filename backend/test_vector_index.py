@@ -0,0 +1,49 @@
+"""
+Tests for the resident search index
+"""
+
+import numpy as np
+from routes.vector_index import SearchIndex
+from routes.embeddings import HashingEmbedder, encode_embedding, product_text, document_text
+
+
+def embedded_receipt(embedder, doc_id, products):
+    structured = {"products": products}
+    vectors = embedder.embed([document_text(structured)] + [product_text(n, d) for n, d in products.items()])
+    return {
+        "_id": doc_id,
+        "user_info": {"user_id": "u1", "user_name": "Driver", "pick_up_location": "Dock 4"},
+        "structured_data": structured,
+        "embedding": encode_embedding(vectors[0]),
+        "product_embeddings": [
+            {"product_name": name, "embedding": encode_embedding(v)}
+            for name, v in zip(products, vectors[1:])
+        ]
+    }
+
+
+def test_line_items_are_ranked_independently():
+    embedder = HashingEmbedder()
+    index = SearchIndex()
+    products = {f"part {i}": {"quantity": 1, "price": float(i)} for i in range(40)}
+    products["front brake cable"] = {"quantity": 2, "price": 12.5}
+    index.add_document(embedded_receipt(embedder, 1, products))
+
+    results, total = index.search(embedder.embed(["brake cable"])[0], "brake cable", 5, -1.0)
+    assert total == 41
+    assert results[0]["product_name"] == "front brake cable"
+    assert results[0]["keyword_match"] is True
+    # Scores differ per line item instead of one score for the whole receipt
+    assert results[0]["similarity_score"] - results[1]["similarity_score"] > 0.15
+
+
+def test_products_without_vectors_share_the_receipt_row():
+    index = SearchIndex()
+    index.add_document({
+        "_id": 1,
+        "structured_data": {"products": {"pedal": {}, "labor": {"price": 40}}},
+        "embedding": [1.0, 0.0, 0.0],
+    })
+    results, _ = index.search(np.array([1.0, 0.0, 0.0]), "labor", 5, 0.0)
+    assert [r["product_name"] for r in results] == ["labor", "pedal"]
+    assert [r["similarity_score"] for r in results] == [1.15, 1.0]